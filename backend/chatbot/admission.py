@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from redis.commands.core import AsyncScript
+
+from .metrics import track_admission_wait, update_admission_queue
+
+logger = logging.getLogger(__name__)
+
+OVERLOAD_POLICIES = ("queue", "degrade", "busy")
+
+# Tenta admitir um turno do agente. Os turnos esperam num sorted set por
+# prioridade (menor primeiro); entra quem está entre as primeiras vagas
+# livres. Vagas e esperas têm prazo no relógio do Redis, então um worker que
+# caiu não prende nada por muito tempo e o relógio de cada host não importa.
+# KEYS: vagas, espera, prazos da espera
+# ARGV: token, prioridade, limite, tamanho da fila, prazo da vaga, prazo da
+# espera
+# Retorna {posição, na fila, em andamento}: posição 0 é admitido, -1 é fila
+# cheia e n > 0 é o n-ésimo da fila.
+ACQUIRE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+for _, token in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)) do
+    redis.call('ZREM', KEYS[2], token)
+    redis.call('ZREM', KEYS[3], token)
+end
+local added = redis.call('ZADD', KEYS[2], 'NX', ARGV[2], ARGV[1])
+local rank = redis.call('ZRANK', KEYS[2], ARGV[1])
+local free = tonumber(ARGV[3]) - redis.call('ZCARD', KEYS[1])
+if rank < free then
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[5]), ARGV[1])
+    return {0, redis.call('ZCARD', KEYS[2]), redis.call('ZCARD', KEYS[1])}
+end
+if added == 1 and redis.call('ZCARD', KEYS[2]) > tonumber(ARGV[4]) then
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    return {-1, redis.call('ZCARD', KEYS[2]), redis.call('ZCARD', KEYS[1])}
+end
+redis.call('ZADD', KEYS[3], now + tonumber(ARGV[6]), ARGV[1])
+return {rank + 1, redis.call('ZCARD', KEYS[2]), redis.call('ZCARD', KEYS[1])}
+"""
+
+# Estende o prazo da vaga enquanto o turno roda
+# KEYS: vagas; ARGV: token, prazo da vaga
+RENEW_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+return redis.call('ZADD', KEYS[1], 'XX', 'CH', now + tonumber(ARGV[2]), ARGV[1])
+"""
+
+# Tira o turno da fila e das vagas
+# KEYS: vagas, espera, prazos da espera; ARGV: token
+# Retorna {na fila, em andamento}
+LEAVE_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('ZREM', KEYS[1], ARGV[1])
+return {redis.call('ZCARD', KEYS[2]), redis.call('ZCARD', KEYS[1])}
+"""
+
+# Sem client próprio: cada AdmissionControl roda os scripts no seu, e o SHA1
+# sai dos bytes do script, igual ao que o Redis calcula no SCRIPT LOAD
+acquire_script = AsyncScript(None, ACQUIRE_SCRIPT.encode())
+renew_script = AsyncScript(None, RENEW_SCRIPT.encode())
+leave_script = AsyncScript(None, LEAVE_SCRIPT.encode())
+
+
+class Overloaded(RuntimeError):
+    """O turno não foi admitido: a fila de espera está cheia ou demorou demais"""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+class AdmissionControl:
+    """Limite global de turnos do agente em andamento, entre todos os workers.
+
+    Os turnos que passam do limite esperam numa fila no Redis de até
+    queue_size lugares, por ordem de prioridade, e desistem com Overloaded
+    depois de timeout segundos. A prioridade é um horário: quem tem bônus
+    entra na fila como se tivesse chegado antes, então ninguém espera para
+    sempre atrás dos turnos com bônus. Com limit 0 não há limite.
+    """
+
+    def __init__(
+        self,
+        client,
+        key,
+        limit,
+        queue_size=100,
+        timeout=30.0,
+        slot_ttl=120,
+        poll_interval=0.2,
+    ):
+        self.client = client
+        self.key = key
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.slot_ttl = slot_ttl
+        self.poll_interval = poll_interval
+
+    @property
+    def keys(self):
+        return [f"{self.key}:slots", f"{self.key}:waiting", f"{self.key}:expires"]
+
+    async def acquire(self, token: str, priority: float) -> int:
+        """Uma tentativa de admissão; devolve a posição na fila (0 é admitido)"""
+        position, waiting, in_flight = await acquire_script(
+            keys=self.keys,
+            args=[
+                token,
+                repr(priority),
+                self.limit,
+                self.queue_size,
+                self.slot_ttl,
+                # Quem parou de tentar sai da fila depois de alguns intervalos
+                max(self.poll_interval * 5, 1.0),
+            ],
+            client=self.client,
+        )
+        update_admission_queue(int(waiting), int(in_flight))
+        return int(position)
+
+    async def leave(self, token: str):
+        waiting, in_flight = await leave_script(
+            keys=self.keys, args=[token], client=self.client
+        )
+        update_admission_queue(int(waiting), int(in_flight))
+
+    async def renew(self, token: str):
+        while True:
+            await asyncio.sleep(self.slot_ttl / 3)
+            try:
+                await renew_script(
+                    keys=self.keys[:1],
+                    args=[token, self.slot_ttl],
+                    client=self.client,
+                )
+            except Exception as e:
+                logger.warning(f"Erro ao renovar a vaga do turno {token}: {e}")
+
+    async def wait(self, token: str, priority: float):
+        start_time = time.monotonic()
+        while True:
+            position = await self.acquire(token, priority)
+            waited = time.monotonic() - start_time
+            if position == 0:
+                return waited
+            if position < 0:
+                raise Overloaded("Fila de espera do agente cheia", "queue_full")
+            if waited >= self.timeout:
+                raise Overloaded(
+                    f"Turno esperou {waited:.1f}s na posição {position}", "timeout"
+                )
+            await asyncio.sleep(self.poll_interval)
+
+    @asynccontextmanager
+    async def turn(self, priority: float = None):
+        """Espera uma vaga, segura durante o bloco e devolve no fim"""
+        if self.limit <= 0:
+            yield
+            return
+
+        token = uuid.uuid4().hex
+        priority = time.time() if priority is None else priority
+        try:
+            waited = await self.wait(token, priority)
+        except BaseException:
+            await self.leave(token)
+            raise
+        track_admission_wait(waited)
+
+        renewer = asyncio.create_task(self.renew(token))
+        try:
+            yield
+        finally:
+            renewer.cancel()
+            await asyncio.gather(renewer, return_exceptions=True)
+            await self.leave(token)
@@ -1,8 +1,16 @@
 from langchain.agents import AgentExecutor, create_tool_calling_agent
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableParallel
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_openai import ChatOpenAI
 
-from .config import OPENAI_API_KEY, OPENAI_MODEL_NAME, OPENAI_MODEL_TEMPERATURE
+from .config import (
+    AGENT_DEGRADED_MAX_TOKENS,
+    AGENT_DEGRADED_MODEL_NAME,
+    OPENAI_API_KEY,
+    OPENAI_MODEL_NAME,
+    OPENAI_MODEL_TEMPERATURE,
+)
 from .memory import get_session_history
 from .prompts import get_agent_prompt
 from .tools import get_tools
@@ -32,3 +40,22 @@ def get_conversational_agent():
         history_messages_key="chat_history",
         output_messages_key="output",
     )
+
+
+def get_degraded_agent():
+    """Agente reduzido para sobrecarga: sem ferramentas, resposta curta e
+    modelo próprio (AGENT_DEGRADED_MODEL_NAME), com o mesmo histórico."""
+    llm = ChatOpenAI(
+        model=AGENT_DEGRADED_MODEL_NAME or OPENAI_MODEL_NAME,
+        temperature=OPENAI_MODEL_TEMPERATURE,
+        api_key=OPENAI_API_KEY,
+        max_tokens=AGENT_DEGRADED_MAX_TOKENS,
+    )
+    prompt = get_agent_prompt().partial(agent_scratchpad=[])
+    return RunnableWithMessageHistory(
+        runnable=RunnableParallel(output=prompt | llm | StrOutputParser()),
+        get_session_history=get_session_history,
+        input_messages_key="input",
+        history_messages_key="chat_history",
+        output_messages_key="output",
+    )
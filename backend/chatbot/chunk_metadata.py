@@ -0,0 +1,105 @@
+import logging
+import os
+import re
+from typing import Optional
+
+from .lexical import fold_text
+
+logger = logging.getLogger(__name__)
+
+# Culturas reconhecidas nos chunks e nos nomes dos arquivos, sem acentos
+CROP_KEYWORDS = {
+    "milho": ("milho",),
+    "soja": ("soja",),
+    "feijao": ("feijao",),
+    "cafe": ("cafe", "cafeeiro"),
+    "trigo": ("trigo",),
+    "arroz": ("arroz",),
+    "algodao": ("algodao", "algodoeiro"),
+    "cana": ("cana-de-acucar", "cana de acucar", "canavial"),
+    "mandioca": ("mandioca", "aipim"),
+    "sorgo": ("sorgo",),
+    "hortalicas": ("hortalica", "hortalicas", "horticultura", "olericultura"),
+    "citros": ("citros", "laranja", "laranjeira", "limao"),
+}
+
+_CROP_PATTERNS = {
+    crop: re.compile(r"\b(?:" + "|".join(map(re.escape, keywords)) + r")\b")
+    for crop, keywords in CROP_KEYWORDS.items()
+}
+
+# Prefixo das flags de cultura: "crop_milho": True permite filtrar por igualdade
+CROP_FIELD_PREFIX = "crop_"
+
+
+def detect_crops(text: str):
+    """Culturas citadas no texto, em ordem alfabética"""
+    folded = fold_text(text).replace("_", " ")
+    return sorted(
+        crop for crop, pattern in _CROP_PATTERNS.items() if pattern.search(folded)
+    )
+
+
+def enrich_metadata(doc):
+    """Acrescenta ao chunk os metadados estruturados usados nos filtros.
+
+    file_name e doc_type vêm do arquivo de origem; as culturas são as
+    citadas no chunk ou no nome do arquivo, já que um trecho de um manual
+    de milho nem sempre repete o nome da cultura. A página (PDF) e a linha
+    (CSV) já vêm dos loaders.
+    """
+    source = str(doc.metadata.get("source", ""))
+    file_name = os.path.basename(source)
+    doc.metadata["file_name"] = file_name
+    doc.metadata["doc_type"] = os.path.splitext(file_name)[1].lstrip(".").lower()
+
+    crops = sorted(set(detect_crops(doc.page_content)) | set(detect_crops(file_name)))
+    doc.metadata["crops"] = ",".join(crops)
+    for crop in crops:
+        doc.metadata[f"{CROP_FIELD_PREFIX}{crop}"] = True
+    return doc
+
+
+def build_filter(
+    crop: Optional[str] = None,
+    source: Optional[str] = None,
+    doc_type: Optional[str] = None,
+):
+    """Monta o filtro de metadados da busca; None se não houver filtro.
+
+    Culturas fora de CROP_KEYWORDS nunca são marcadas nos chunks, então
+    ficam de fora do filtro em vez de zerar a busca.
+    """
+    conditions = {}
+    if crop:
+        folded = fold_text(crop.strip())
+        canonical = next(
+            (
+                name
+                for name, keywords in CROP_KEYWORDS.items()
+                if folded == name or folded in keywords
+            ),
+            None,
+        )
+        if canonical:
+            conditions[f"{CROP_FIELD_PREFIX}{canonical}"] = True
+        else:
+            logger.info(f"Cultura desconhecida no filtro, ignorada: {crop}")
+    if source:
+        conditions["file_name"] = os.path.basename(source.strip())
+    if doc_type:
+        conditions["doc_type"] = doc_type.strip().lstrip(".").lower()
+    return conditions or None
+
+
+def matches_filter(metadata: dict, filter: Optional[dict]) -> bool:
+    return not filter or all(
+        metadata.get(key) == value for key, value in filter.items()
+    )
+
+
+def chroma_where(filter: Optional[dict]):
+    """Converte o filtro de igualdades para a sintaxe where do Chroma"""
+    if not filter or len(filter) == 1:
+        return filter
+    return {"$and": [{key: value} for key, value in filter.items()]}
@@ -0,0 +1,295 @@
+import itertools
+import os
+import re
+
+from langchain_core.documents import Document
+
+from .embeddings import count_tokens
+
+# Linhas tratadas como título de seção: markdown, numeração ("3.2 Adubação"),
+# caixa alta curta ou uma linha curta isolada que abre um parágrafo
+_MARKDOWN_HEADING = re.compile(r"^#{1,6}\s+\S")
+_NUMBERED_HEADING = re.compile(r"^(?:\d+\.)*\d+\.?\s+[A-ZÀ-Ý][^.:;]*$")
+MAX_HEADING_CHARS = 80
+MAX_TITLE_WORDS = 8
+# Linhas de tabela: colunas separadas por |, tabulação ou 3+ espaços
+_TABLE_ROW = re.compile(r"\|.*\||\t\S|\S {3,}\S")
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+(?=\S)")
+
+
+def is_heading(line: str, starts_block: bool = False) -> bool:
+    """Indica se a linha é um título de seção.
+
+    starts_block diz se a linha vem depois de uma linha em branco (ou abre o
+    texto): nessa posição, uma linha curta sem pontuação final ("Sintomas",
+    "Controle químico") também conta como título.
+    """
+    line = line.strip()
+    if not line or len(line) > MAX_HEADING_CHARS:
+        return False
+    if _MARKDOWN_HEADING.match(line) or _NUMBERED_HEADING.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) >= 4 and all(c.isupper() for c in letters):
+        return True
+    return (
+        starts_block
+        and line[0].isupper()
+        and line[-1] not in ".,:;!?"
+        and len(line.split()) <= MAX_TITLE_WORDS
+    )
+
+
+def document_type(doc) -> str:
+    source = str(doc.metadata.get("source", ""))
+    return os.path.splitext(source)[1].lstrip(".").lower()
+
+
+def split_blocks(text: str):
+    """Divide o texto em blocos (tipo, texto): títulos, tabelas e parágrafos.
+
+    Parágrafos terminam em linhas em branco; linhas quebradas pelo PDF no
+    meio do parágrafo são unidas. Linhas de tabela seguidas formam um bloco
+    de tabela, que só é dividido entre linhas.
+    """
+    blocks = []
+    kind, lines = None, []
+
+    def close():
+        if lines:
+            separator = "\n" if kind == "table" else " "
+            blocks.append((kind, separator.join(lines)))
+        lines.clear()
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            close()
+            kind = None
+            continue
+        line_kind = "table" if _TABLE_ROW.search(raw_line) else "text"
+        if line_kind == "text" and is_heading(line, starts_block=kind is None):
+            close()
+            blocks.append(("heading", line.lstrip("#").strip()))
+            # A linha logo depois do título é texto, mesmo que curta
+            kind = "heading"
+            continue
+        if line_kind != kind:
+            close()
+            kind = line_kind
+        lines.append(line if line_kind == "text" else raw_line.rstrip())
+    close()
+    return blocks
+
+
+def split_sentences(text: str):
+    return [s for s in _SENTENCE_END.split(text) if s.strip()]
+
+
+def split_to_budget(text: str, max_tokens: int):
+    """Corta um texto maior que o orçamento em frases e, se preciso, em palavras"""
+    pieces = []
+    for sentence in split_sentences(text):
+        if count_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        words = []
+        for word in sentence.split():
+            if words and count_tokens(" ".join([*words, word])) > max_tokens:
+                pieces.append(" ".join(words))
+                words = []
+            words.append(word)
+        if words:
+            pieces.append(" ".join(words))
+    return pieces
+
+
+class TokenChunker:
+    """Divide documentos em chunks por orçamento de tokens respeitando a estrutura.
+
+    A política depende do tipo do arquivo: linhas de CSV são agrupadas até o
+    orçamento, sem sobreposição; PDFs e textos são divididos por seção, com
+    os parágrafos (e as linhas de tabela) inteiros sempre que couberem. As
+    páginas de um mesmo PDF são tratadas como um texto contínuo, então uma
+    seção que atravessa a página não é cortada; a página inicial fica em
+    "page" e a final em "page_end". Entre chunks da mesma seção, as últimas
+    frases se repetem até overlap_tokens.
+    """
+
+    def __init__(self, max_tokens=300, overlap_tokens=30, min_tokens=50):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("A sobreposição precisa ser menor que o chunk")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min(min_tokens, max_tokens)
+
+    def split_documents(self, docs):
+        """Gera os chunks dos documentos na ordem, um arquivo de cada vez"""
+        # Os documentos são consumidos sob demanda: uma página (ou linha) por vez
+        for _, file_docs in itertools.groupby(
+            docs, key=lambda doc: doc.metadata.get("source")
+        ):
+            first = next(file_docs)
+            file_docs = itertools.chain([first], file_docs)
+            if document_type(first) == "csv":
+                yield from self._group_rows(file_docs)
+            else:
+                yield from self._split_sections(file_docs)
+
+    def _group_rows(self, rows):
+        """Agrupa linhas de CSV seguidas até o orçamento de tokens"""
+        group, tokens = [], 0
+        for row in rows:
+            text = row.page_content.strip()
+            row_tokens = count_tokens(text)
+            if group and tokens + row_tokens > self.max_tokens:
+                yield self._row_chunk(group, tokens)
+                group, tokens = [], 0
+            group.append((row, text))
+            tokens += row_tokens
+        if group:
+            yield self._row_chunk(group, tokens)
+
+    def _row_chunk(self, group, tokens):
+        first, last = group[0][0], group[-1][0]
+        metadata = {**first.metadata, "tokens": tokens}
+        if "row" in last.metadata and len(group) > 1:
+            metadata["row_end"] = last.metadata["row"]
+        return Document(
+            page_content="\n\n".join(text for _, text in group), metadata=metadata
+        )
+
+    def _split_sections(self, docs):
+        """Empacota os blocos das páginas em chunks, quebrando nos títulos"""
+        # Partes do chunk em montagem: (texto, tokens, separador, documento, tipo).
+        # As da sobreposição não têm documento: não definem a página do chunk.
+        parts = []
+        tokens = 0
+        # Seção atual e a do início do chunk, que pode juntar seções curtas
+        section = chunk_section = None
+
+        def has_content():
+            return any(part[3] is not None for part in parts)
+
+        def flush(carry_overlap):
+            nonlocal parts, tokens
+            chunk = self._section_chunk(parts, tokens, chunk_section)
+            parts = self._overlap(parts) if carry_overlap else []
+            tokens = sum(part[1] for part in parts)
+            return chunk
+
+        for doc in docs:
+            for position, (kind, text) in enumerate(split_blocks(doc.page_content)):
+                if kind == "heading":
+                    heading_tokens = count_tokens(text)
+                    # Seções curtas seguem junto com a próxima, se couberem
+                    if has_content() and (
+                        tokens >= self.min_tokens
+                        or tokens + heading_tokens > self.max_tokens
+                    ):
+                        yield flush(carry_overlap=False)
+                    elif not has_content():
+                        parts, tokens = [], 0
+                    section = text
+                    if not has_content():
+                        chunk_section = section
+                    parts.append((text, heading_tokens, "\n\n", doc, kind))
+                    tokens += heading_tokens
+                    continue
+
+                for index, piece in enumerate(self._pieces(kind, text)):
+                    piece_tokens = count_tokens(piece)
+                    if has_content() and tokens + piece_tokens > self.max_tokens:
+                        yield flush(carry_overlap=True)
+                    if not has_content():
+                        chunk_section = section
+                    if index:
+                        joiner = "\n" if kind == "table" else " "
+                    elif position == 0 and self._continues(parts, kind):
+                        # Frase que continua na página seguinte
+                        joiner = " "
+                    else:
+                        joiner = "\n\n"
+                    parts.append((piece, piece_tokens, joiner, doc, kind))
+                    tokens += piece_tokens
+
+        if has_content():
+            yield flush(carry_overlap=False)
+
+    @staticmethod
+    def _continues(parts, kind):
+        return (
+            kind == "text"
+            and bool(parts)
+            and parts[-1][4] == "text"
+            and parts[-1][0][-1] not in ".!?:;"
+        )
+
+    def _pieces(self, kind, text):
+        """O bloco inteiro se couber; senão linhas de tabela ou frases"""
+        if count_tokens(text) <= self.max_tokens:
+            return [text]
+        if kind != "table":
+            return split_to_budget(text, self.max_tokens)
+        return [
+            piece
+            for line in text.splitlines()
+            for piece in (
+                [line]
+                if count_tokens(line) <= self.max_tokens
+                else split_to_budget(line, self.max_tokens)
+            )
+        ]
+
+    def _section_chunk(self, parts, tokens, section):
+        first = next(part[3] for part in parts if part[3] is not None)
+        last = parts[-1][3] or first
+        text = parts[0][0]
+        for piece, _, joiner, _, _ in parts[1:]:
+            text += joiner + piece
+        metadata = {**first.metadata, "tokens": tokens}
+        if section:
+            metadata["section"] = section
+        if "page" in first.metadata and last.metadata.get("page") != first.metadata.get(
+            "page"
+        ):
+            metadata["page_end"] = last.metadata["page"]
+        return Document(page_content=text, metadata=metadata)
+
+    def _overlap(self, parts):
+        """Últimas frases do chunk, até overlap_tokens, para abrir o próximo.
+
+        Linhas de tabela e títulos não se repetem: só o texto corrido.
+        """
+        if not self.overlap_tokens or not parts or parts[-1][4] != "text":
+            return []
+        carried, tokens = [], 0
+        for sentence in reversed(split_sentences(parts[-1][0])):
+            sentence_tokens = count_tokens(sentence)
+            if tokens + sentence_tokens > self.overlap_tokens:
+                break
+            carried.insert(0, sentence)
+            tokens += sentence_tokens
+        if not carried:
+            return []
+        return [(" ".join(carried), tokens, "\n\n", None, "text")]
+
+
+def chunk_stats(chunks):
+    """Número de chunks e tokens por chunk (média, p95, máximo e total)"""
+    tokens = sorted(count_tokens(chunk.page_content) for chunk in chunks)
+    if not tokens:
+        return {
+            "chunks": 0,
+            "avg_tokens": 0.0,
+            "p95_tokens": 0,
+            "max_tokens": 0,
+            "total_tokens": 0,
+        }
+    return {
+        "chunks": len(tokens),
+        "avg_tokens": sum(tokens) / len(tokens),
+        "p95_tokens": tokens[min(len(tokens) - 1, int(len(tokens) * 0.95))],
+        "max_tokens": tokens[-1],
+        "total_tokens": sum(tokens),
+    }
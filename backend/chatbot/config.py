@@ -14,3 +14,108 @@ BUFFER_KEY_SUFIX = config("BUFFER_KEY_SUFIX")
 DEBOUNCE_SECONDS = config("DEBOUNCE_SECONDS")
 BUFFER_TTL = config("BUFFER_TTL")
 OPENWEATHER_API_KEY = config("OPENWEATHER_API_KEY")
+RAG_COLLECTION_NAME = config("RAG_COLLECTION_NAME", default="langchain")
+RAG_WARM_UP = config("RAG_WARM_UP", default=True, cast=bool)
+RAG_INGESTION_MODE = config("RAG_INGESTION_MODE", default="incremental")
+EMBEDDING_CACHE_ENABLED = config("EMBEDDING_CACHE_ENABLED", default=True, cast=bool)
+EMBEDDING_CACHE_PATH = config(
+    "EMBEDDING_CACHE_PATH", default="embedding_cache/embeddings.sqlite3"
+)
+RAG_LOADER_WORKERS = config("RAG_LOADER_WORKERS", default=0, cast=int)
+RAG_EMBEDDING_CONCURRENCY = config("RAG_EMBEDDING_CONCURRENCY", default=4, cast=int)
+RAG_EMBEDDING_RPM = config("RAG_EMBEDDING_RPM", default=3000, cast=int)
+RAG_EMBEDDING_TPM = config("RAG_EMBEDDING_TPM", default=1000000, cast=int)
+RAG_EMBEDDING_BATCH_TOKENS = config(
+    "RAG_EMBEDDING_BATCH_TOKENS", default=8000, cast=int
+)
+RAG_EMBEDDING_BATCH_SIZE = config("RAG_EMBEDDING_BATCH_SIZE", default=256, cast=int)
+RAG_EMBEDDING_MAX_RETRIES = config("RAG_EMBEDDING_MAX_RETRIES", default=5, cast=int)
+RAG_EMBEDDING_RETRY_BACKOFF = config(
+    "RAG_EMBEDDING_RETRY_BACKOFF", default=1.0, cast=float
+)
+RAG_VECTOR_BACKEND = config("RAG_VECTOR_BACKEND", default="chroma")
+RAG_FAISS_INDEX_TYPE = config("RAG_FAISS_INDEX_TYPE", default="flat")
+RAG_FAISS_HNSW_M = config("RAG_FAISS_HNSW_M", default=32, cast=int)
+RAG_CACHE_ENABLED = config("RAG_CACHE_ENABLED", default=True, cast=bool)
+RAG_CACHE_LRU_SIZE = config("RAG_CACHE_LRU_SIZE", default=1024, cast=int)
+RAG_CACHE_TTL = config("RAG_CACHE_TTL", default=86400, cast=int)
+RAG_SEARCH_MODE = config("RAG_SEARCH_MODE", default="hybrid")
+RAG_HYBRID_LEXICAL_WEIGHT = config("RAG_HYBRID_LEXICAL_WEIGHT", default=0.5, cast=float)
+RAG_EMBEDDING_PROVIDER = config("RAG_EMBEDDING_PROVIDER", default="openai")
+OPENAI_EMBEDDING_MODEL = config(
+    "OPENAI_EMBEDDING_MODEL", default="text-embedding-ada-002"
+)
+RAG_LOCAL_EMBEDDING_MODEL_PATH = config(
+    "RAG_LOCAL_EMBEDDING_MODEL_PATH", default="models/all-MiniLM-L6-v2"
+)
+RAG_LOCAL_EMBEDDING_THREADS = config("RAG_LOCAL_EMBEDDING_THREADS", default=0, cast=int)
+RAG_LOCAL_EMBEDDING_BATCH_SIZE = config(
+    "RAG_LOCAL_EMBEDDING_BATCH_SIZE", default=32, cast=int
+)
+RAG_LOCAL_EMBEDDING_MAX_LENGTH = config(
+    "RAG_LOCAL_EMBEDDING_MAX_LENGTH", default=256, cast=int
+)
+RAG_CONTEXT_TOKEN_BUDGET = config("RAG_CONTEXT_TOKEN_BUDGET", default=1500, cast=int)
+RAG_DEDUP_ENABLED = config("RAG_DEDUP_ENABLED", default=True, cast=bool)
+RAG_DEDUP_THRESHOLD = config("RAG_DEDUP_THRESHOLD", default=0.85, cast=float)
+RAG_WATCH_INTERVAL = config("RAG_WATCH_INTERVAL", default=2.0, cast=float)
+RAG_WATCH_DEBOUNCE = config("RAG_WATCH_DEBOUNCE", default=5.0, cast=float)
+RAG_WATCH_RETRY_SECONDS = config("RAG_WATCH_RETRY_SECONDS", default=300, cast=int)
+RAG_PIPELINE_SEGMENT_SIZE = config("RAG_PIPELINE_SEGMENT_SIZE", default=128, cast=int)
+RAG_PIPELINE_QUEUE_SIZE = config("RAG_PIPELINE_QUEUE_SIZE", default=8, cast=int)
+RAG_FAISS_QUANTIZATION = config("RAG_FAISS_QUANTIZATION", default="none")
+RAG_FAISS_RERANK_FACTOR = config("RAG_FAISS_RERANK_FACTOR", default=4, cast=int)
+RAG_CHUNK_SIZE = config("RAG_CHUNK_SIZE", default=500, cast=int)
+RAG_CHUNK_OVERLAP = config("RAG_CHUNK_OVERLAP", default=100, cast=int)
+RAG_SNAPSHOT_PATH = config("RAG_SNAPSHOT_PATH", default="")
+RAG_SNAPSHOT_VERIFY = config("RAG_SNAPSHOT_VERIFY", default="size")
+RAG_CHUNKING = config("RAG_CHUNKING", default="tokens")
+RAG_CHUNK_TOKENS = config("RAG_CHUNK_TOKENS", default=300, cast=int)
+RAG_CHUNK_OVERLAP_TOKENS = config("RAG_CHUNK_OVERLAP_TOKENS", default=30, cast=int)
+RAG_CHUNK_MIN_TOKENS = config("RAG_CHUNK_MIN_TOKENS", default=50, cast=int)
+HTTP_CLIENT_TIMEOUT = config("HTTP_CLIENT_TIMEOUT", default=15.0, cast=float)
+HTTP_CLIENT_MAX_CONNECTIONS = config(
+    "HTTP_CLIENT_MAX_CONNECTIONS", default=100, cast=int
+)
+DEBOUNCE_SCHEDULE_KEY = config("DEBOUNCE_SCHEDULE_KEY", default="chatbot:debounce")
+DEBOUNCE_LEASE_SECONDS = config("DEBOUNCE_LEASE_SECONDS", default=120, cast=int)
+DEBOUNCE_POLL_INTERVAL = config("DEBOUNCE_POLL_INTERVAL", default=0.5, cast=float)
+DEBOUNCE_BATCH_SIZE = config("DEBOUNCE_BATCH_SIZE", default=50, cast=int)
+CHATBOT_STREAM_KEY = config("CHATBOT_STREAM_KEY", default="chatbot:jobs")
+CHATBOT_STREAM_GROUP = config("CHATBOT_STREAM_GROUP", default="chatbot-workers")
+CHATBOT_STREAM_MAXLEN = config("CHATBOT_STREAM_MAXLEN", default=10000, cast=int)
+CHATBOT_WORKER_CONCURRENCY = config("CHATBOT_WORKER_CONCURRENCY", default=8, cast=int)
+CHATBOT_JOB_TIMEOUT = config("CHATBOT_JOB_TIMEOUT", default=180, cast=int)
+CHATBOT_JOB_MAX_DELIVERIES = config("CHATBOT_JOB_MAX_DELIVERIES", default=5, cast=int)
+CHATBOT_INLINE_WORKER = config("CHATBOT_INLINE_WORKER", default=False, cast=bool)
+AGENT_MAX_CONCURRENT_TURNS = config("AGENT_MAX_CONCURRENT_TURNS", default=16, cast=int)
+AGENT_ADMISSION_KEY = config("AGENT_ADMISSION_KEY", default="chatbot:admission")
+AGENT_ADMISSION_QUEUE_SIZE = config("AGENT_ADMISSION_QUEUE_SIZE", default=100, cast=int)
+AGENT_ADMISSION_TIMEOUT = config("AGENT_ADMISSION_TIMEOUT", default=30.0, cast=float)
+AGENT_ADMISSION_POLL_INTERVAL = config(
+    "AGENT_ADMISSION_POLL_INTERVAL", default=0.2, cast=float
+)
+AGENT_ADMISSION_RETRY_SECONDS = config(
+    "AGENT_ADMISSION_RETRY_SECONDS", default=15.0, cast=float
+)
+AGENT_OVERLOAD_POLICY = config("AGENT_OVERLOAD_POLICY", default="queue")
+AGENT_PRIORITY_BOOST_SECONDS = config(
+    "AGENT_PRIORITY_BOOST_SECONDS", default=30.0, cast=float
+)
+AGENT_SHORT_MESSAGE_CHARS = config("AGENT_SHORT_MESSAGE_CHARS", default=160, cast=int)
+AGENT_BUSY_MESSAGE = config(
+    "AGENT_BUSY_MESSAGE",
+    default=(
+        "Estou atendendo muitas pessoas agora 🙏 Por favor, mande sua pergunta "
+        "de novo em alguns minutos."
+    ),
+)
+AGENT_DEGRADED_MODEL_NAME = config("AGENT_DEGRADED_MODEL_NAME", default="")
+AGENT_DEGRADED_MAX_CONCURRENT_TURNS = config(
+    "AGENT_DEGRADED_MAX_CONCURRENT_TURNS", default=4, cast=int
+)
+AGENT_DEGRADED_MAX_TOKENS = config("AGENT_DEGRADED_MAX_TOKENS", default=300, cast=int)
+CHATBOT_WORKER_METRICS_PORT = config(
+    "CHATBOT_WORKER_METRICS_PORT", default=9100, cast=int
+)
+RAG_CHECKPOINT_INTERVAL = config("RAG_CHECKPOINT_INTERVAL", default=30.0, cast=float)
@@ -0,0 +1,104 @@
+import logging
+
+from .embeddings import count_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+# Sobreposição mínima para considerar dois chunks vizinhos no documento
+MIN_OVERLAP_CHARS = 20
+# Trechos que sobrariam menores que isso após o corte são descartados
+MIN_TRIMMED_TOKENS = 30
+TRIM_MARKER = " [...]"
+
+
+def _overlap(left: str, right: str) -> int:
+    """Tamanho do maior sufixo de left que também é prefixo de right"""
+    for size in range(min(len(left), len(right)), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _source_key(doc):
+    metadata = doc.metadata or {}
+    return metadata.get("source"), metadata.get("page")
+
+
+def pack_documents(docs, token_budget: int = 0):
+    """Monta o contexto da busca gastando o mínimo de tokens.
+
+    Os documentos chegam em ordem de relevância. Chunks repetidos ou contidos
+    em outro são descartados, chunks vizinhos da mesma fonte/página (que
+    compartilham a sobreposição do splitter) são unidos num só trecho e, com
+    token_budget > 0, os trechos mais relevantes ocupam o orçamento primeiro;
+    o último que não couber inteiro é cortado.
+
+    Retorna a lista de trechos e as estatísticas de tokens.
+    """
+    stats = {
+        "retrieved_tokens": 0,
+        "packed_tokens": 0,
+        "duplicates": 0,
+        "merged": 0,
+        "trimmed": 0,
+        "dropped": 0,
+    }
+
+    # Cada trecho: [melhor posição no ranking, chave da fonte, texto]
+    spans = []
+    for rank, doc in enumerate(docs):
+        text = doc.page_content.strip()
+        stats["retrieved_tokens"] += count_tokens(text)
+        if not text:
+            continue
+        if any(text in span[2] for span in spans):
+            stats["duplicates"] += 1
+            continue
+
+        key = _source_key(doc)
+        # Remove trechos que o novo chunk contém por inteiro
+        contained = [span for span in spans if span[2] in text]
+        for span in contained:
+            spans.remove(span)
+            rank = min(rank, span[0])
+            stats["duplicates"] += 1
+        spans.append([rank, key, text])
+
+    # Une vizinhos até não haver mais sobreposições na mesma fonte
+    merged_any = True
+    while merged_any:
+        merged_any = False
+        for left in spans:
+            for right in spans:
+                if left is right or left[1] != right[1]:
+                    continue
+                size = _overlap(left[2], right[2])
+                if size:
+                    left[0] = min(left[0], right[0])
+                    left[2] += right[2][size:]
+                    spans.remove(right)
+                    stats["merged"] += 1
+                    merged_any = True
+                    break
+            if merged_any:
+                break
+
+    spans.sort(key=lambda span: span[0])
+
+    packed = []
+    remaining = token_budget
+    for _, _, text in spans:
+        tokens = count_tokens(text)
+        if token_budget and tokens > remaining:
+            if remaining >= MIN_TRIMMED_TOKENS:
+                text = truncate_to_tokens(text, remaining) + TRIM_MARKER
+                tokens = count_tokens(text)
+                stats["trimmed"] += 1
+            else:
+                stats["dropped"] += 1
+                continue
+        packed.append(text)
+        stats["packed_tokens"] += tokens
+        remaining -= tokens
+
+    return packed, stats
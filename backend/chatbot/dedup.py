@@ -0,0 +1,346 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from .embeddings import normalize_text
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 64
+# 16 bandas de 4 linhas: pares com similaridade acima de ~0,5 viram candidatos
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+
+# Permutações (a * x + b) mod p fixas, para assinaturas estáveis entre execuções
+_PRIME = np.uint64(4294967311)
+_random = np.random.RandomState(20240501)
+_PERMUTATION_A = _random.randint(1, 2**31, NUM_PERMUTATIONS).astype(np.uint64)
+_PERMUTATION_B = _random.randint(0, 2**31, NUM_PERMUTATIONS).astype(np.uint64)
+
+
+def exact_hash(text: str) -> str:
+    """Hash do texto normalizado: iguais a menos de espaços e caixa"""
+    return hashlib.sha256(normalize_text(text).lower().encode()).hexdigest()
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """Assinatura MinHash dos trigramas de palavras do texto"""
+    words = normalize_text(text).lower().split() or [""]
+    shingles = {
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    }
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode()) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    permuted = (
+        _PERMUTATION_A[:, None] * hashes[None, :] + _PERMUTATION_B[:, None]
+    ) % _PRIME
+    return permuted.min(axis=1)
+
+
+def estimate_similarity(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+    """Estimativa da similaridade de Jaccard entre duas assinaturas"""
+    return float(np.mean(signature_a == signature_b))
+
+
+def _band_buckets(signature: np.ndarray):
+    for band in range(LSH_BANDS):
+        yield band, signature[band * LSH_ROWS : (band + 1) * LSH_ROWS].tobytes()
+
+
+class ChunkDeduplicator:
+    """Elimina chunks repetidos ou quase repetidos antes do embedding.
+
+    Guarda, por coleção, as assinaturas dos chunks indexados (os canônicos)
+    e o mapeamento de cada chunk descartado para o canônico equivalente,
+    com os metadados de origem do descartado. Quando um canônico sai do
+    índice, os arquivos que dependiam dele precisam ser reprocessados.
+    """
+
+    def __init__(self, path: str = None, threshold: float = 0.85):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # Chunks aceitos nesta execução e ainda não gravados
+        self._pending = {}
+        self._pending_exact = {}
+        self._pending_buckets = defaultdict(list)
+
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                file_key TEXT NOT NULL,
+                exact_hash TEXT NOT NULL,
+                signature BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_exact ON chunks (exact_hash);
+            CREATE INDEX IF NOT EXISTS chunks_file ON chunks (file_key);
+            CREATE TABLE IF NOT EXISTS buckets (
+                band INTEGER NOT NULL,
+                bucket BLOB NOT NULL,
+                chunk_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (band, bucket);
+            CREATE INDEX IF NOT EXISTS buckets_chunk ON buckets (chunk_id);
+            CREATE TABLE IF NOT EXISTS duplicates (
+                chunk_id TEXT PRIMARY KEY,
+                file_key TEXT NOT NULL,
+                canonical_id TEXT NOT NULL,
+                similarity REAL NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates (canonical_id);
+            CREATE INDEX IF NOT EXISTS duplicates_file ON duplicates (file_key);
+            """
+        )
+        self._db.commit()
+
+    def _signature(self, chunk_id):
+        if chunk_id in self._pending:
+            return self._pending[chunk_id][2]
+        row = self._db.execute(
+            "SELECT signature FROM chunks WHERE chunk_id = ?", (chunk_id,)
+        ).fetchone()
+        return np.frombuffer(row[0], dtype=np.uint64) if row else None
+
+    def _find_canonical(self, file_key, text_hash, signature):
+        # Chunks já gravados do próprio arquivo serão substituídos, não contam
+        row = self._db.execute(
+            "SELECT chunk_id FROM chunks WHERE exact_hash = ? AND file_key != ? LIMIT 1",
+            (text_hash, file_key),
+        ).fetchone()
+        if row:
+            return row[0], 1.0
+        if text_hash in self._pending_exact:
+            return self._pending_exact[text_hash], 1.0
+
+        candidates = set()
+        for band, bucket in _band_buckets(signature):
+            candidates.update(self._pending_buckets.get((band, bucket), ()))
+            candidates.update(
+                row[0]
+                for row in self._db.execute(
+                    "SELECT buckets.chunk_id FROM buckets JOIN chunks "
+                    "ON chunks.chunk_id = buckets.chunk_id "
+                    "WHERE band = ? AND bucket = ? AND chunks.file_key != ?",
+                    (band, bucket, file_key),
+                )
+            )
+
+        best_id, best_similarity = None, 0.0
+        for candidate in candidates:
+            similarity = estimate_similarity(signature, self._signature(candidate))
+            if similarity > best_similarity:
+                best_id, best_similarity = candidate, similarity
+        if best_similarity >= self.threshold:
+            return best_id, best_similarity
+        return None, 0.0
+
+    def filter(self, file_key, splits, chunk_ids):
+        """Separa os chunks de um arquivo em novos e duplicados.
+
+        Retorna (chunks mantidos, ids mantidos, duplicados); cada duplicado
+        aponta para o chunk canônico e guarda os metadados de origem.
+        """
+        kept, kept_ids, duplicates = [], [], []
+        with self._lock:
+            for doc, chunk_id in zip(splits, chunk_ids):
+                text_hash = exact_hash(doc.page_content)
+                signature = minhash_signature(doc.page_content)
+                canonical_id, similarity = self._find_canonical(
+                    file_key, text_hash, signature
+                )
+                if canonical_id is not None:
+                    duplicates.append(
+                        {
+                            "chunk_id": chunk_id,
+                            "canonical_id": canonical_id,
+                            "similarity": similarity,
+                            "metadata": doc.metadata,
+                        }
+                    )
+                    continue
+
+                self._pending[chunk_id] = (file_key, text_hash, signature)
+                self._pending_exact.setdefault(text_hash, chunk_id)
+                for band_bucket in _band_buckets(signature):
+                    self._pending_buckets[band_bucket].append(chunk_id)
+                kept.append(doc)
+                kept_ids.append(chunk_id)
+        return kept, kept_ids, duplicates
+
+    def _pop_pending(self, chunk_id):
+        pending = self._pending.pop(chunk_id)
+        _, text_hash, signature = pending
+        if self._pending_exact.get(text_hash) == chunk_id:
+            del self._pending_exact[text_hash]
+        for band_bucket in _band_buckets(signature):
+            bucket = self._pending_buckets.get(band_bucket)
+            if bucket and chunk_id in bucket:
+                bucket.remove(chunk_id)
+                if not bucket:
+                    del self._pending_buckets[band_bucket]
+        return pending
+
+    def _dependents(self, chunk_ids, file_key):
+        dependents = set()
+        chunk_ids = list(chunk_ids)
+        for i in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[i : i + 500]
+            placeholders = ",".join("?" * len(batch))
+            dependents.update(
+                row[0]
+                for row in self._db.execute(
+                    "SELECT DISTINCT file_key FROM duplicates "
+                    f"WHERE canonical_id IN ({placeholders}) AND file_key != ?",
+                    [*batch, file_key],
+                )
+            )
+        return dependents
+
+    def _forget_file(self, file_key):
+        self._db.execute(
+            "DELETE FROM buckets WHERE chunk_id IN "
+            "(SELECT chunk_id FROM chunks WHERE file_key = ?)",
+            (file_key,),
+        )
+        self._db.execute("DELETE FROM chunks WHERE file_key = ?", (file_key,))
+        self._db.execute("DELETE FROM duplicates WHERE file_key = ?", (file_key,))
+
+    def record(self, file_key, chunk_ids, duplicates):
+        """Grava o resultado de um arquivo indexado, substituindo o anterior.
+
+        Retorna os arquivos que tinham duplicados de chunks que deixaram de
+        existir e por isso precisam ser reprocessados, incluindo o próprio
+        arquivo se algum duplicado dele aponta para um chunk descartado.
+        """
+        with self._lock:
+            previous = {
+                row[0]
+                for row in self._db.execute(
+                    "SELECT chunk_id FROM chunks WHERE file_key = ?", (file_key,)
+                )
+            }
+            dependents = self._dependents(previous - set(chunk_ids), file_key)
+            self._forget_file(file_key)
+
+            rows, buckets = [], []
+            for chunk_id in chunk_ids:
+                _, text_hash, signature = self._pop_pending(chunk_id)
+                rows.append((chunk_id, file_key, text_hash, signature.tobytes()))
+                buckets.extend(
+                    (band, bucket, chunk_id)
+                    for band, bucket in _band_buckets(signature)
+                )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, file_key, exact_hash, signature) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._db.executemany(
+                "INSERT INTO buckets (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                buckets,
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO duplicates "
+                "(chunk_id, file_key, canonical_id, similarity, metadata) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        duplicate["chunk_id"],
+                        file_key,
+                        duplicate["canonical_id"],
+                        duplicate["similarity"],
+                        json.dumps(duplicate["metadata"], ensure_ascii=False),
+                    )
+                    for duplicate in duplicates
+                ],
+            )
+            self._db.commit()
+            if any(
+                not self._is_canonical(duplicate["canonical_id"])
+                for duplicate in duplicates
+            ):
+                dependents.add(file_key)
+        return dependents
+
+    def _is_canonical(self, chunk_id):
+        return chunk_id in self._pending or bool(
+            self._db.execute(
+                "SELECT 1 FROM chunks WHERE chunk_id = ?", (chunk_id,)
+            ).fetchone()
+        )
+
+    def discard(self, file_key):
+        """Esquece os chunks aceitos de um arquivo que não chegou ao índice.
+
+        Retorna os arquivos já gravados com duplicados desses chunks, que
+        precisam ser reprocessados para não ficarem sem o conteúdo.
+        """
+        with self._lock:
+            chunk_ids = [
+                chunk_id
+                for chunk_id, (pending_file, _, _) in self._pending.items()
+                if pending_file == file_key
+            ]
+            for chunk_id in chunk_ids:
+                self._pop_pending(chunk_id)
+            return self._dependents(chunk_ids, file_key)
+
+    def remove_file(self, file_key):
+        """Esquece um arquivo removido e retorna os arquivos que dependiam dele"""
+        return self.record(file_key, [], [])
+
+    def rename_file(self, old_key, new_key):
+        with self._lock:
+            for table in ("chunks", "duplicates"):
+                self._db.execute(
+                    f"UPDATE {table} SET file_key = ? WHERE file_key = ?",
+                    (new_key, old_key),
+                )
+            self._db.commit()
+
+    def provenance(self, chunk_ids):
+        """Metadados de origem dos duplicados de cada chunk canônico"""
+        result = defaultdict(list)
+        chunk_ids = list(chunk_ids)
+        with self._lock:
+            for i in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[i : i + 500]
+                placeholders = ",".join("?" * len(batch))
+                for canonical_id, metadata in self._db.execute(
+                    "SELECT canonical_id, metadata FROM duplicates "
+                    f"WHERE canonical_id IN ({placeholders})",
+                    batch,
+                ):
+                    result[canonical_id].append(json.loads(metadata))
+        return dict(result)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._pending_exact.clear()
+            self._pending_buckets.clear()
+            self._db.executescript(
+                "DELETE FROM chunks; DELETE FROM buckets; DELETE FROM duplicates;"
+            )
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
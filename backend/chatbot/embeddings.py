@@ -0,0 +1,402 @@
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from .config import (
+    RAG_EMBEDDING_BATCH_SIZE,
+    RAG_EMBEDDING_BATCH_TOKENS,
+    RAG_EMBEDDING_CONCURRENCY,
+    RAG_EMBEDDING_MAX_RETRIES,
+    RAG_EMBEDDING_RETRY_BACKOFF,
+    RAG_EMBEDDING_RPM,
+    RAG_EMBEDDING_TPM,
+    RAG_PIPELINE_QUEUE_SIZE,
+)
+from .metrics import track_embedding_cache
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza o texto do chunk para compor a chave do cache"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def normalize_query(query: str) -> str:
+    """Normaliza a pergunta para que variações de caixa e espaços reusem o cache"""
+    return normalize_text(query).lower()
+
+
+def embedding_key(model: str, text: str) -> str:
+    """Chave do cache: hash do nome do modelo mais o texto normalizado"""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """Cache persistente de embeddings em SQLite, compartilhado entre processos."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def get_many(self, keys: List[str]) -> dict:
+        """Busca os vetores das chaves informadas; retorna apenas os encontrados"""
+        found = {}
+        with self._lock:
+            connection = self._connect()
+            # SQLite limita o número de parâmetros por consulta
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                )
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def set_many(self, model: str, items: dict):
+        """Grava os vetores no cache"""
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (key, model, array("f", vector).tobytes(), now)
+                    for key, vector in items.items()
+                ],
+            )
+            connection.commit()
+
+    def record(self, hits: int, misses: int):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+        track_embedding_cache(hits, misses)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings que consultam caches antes de chamar o modelo.
+
+    Chunks passam pelo cache persistente em SQLite: apenas os textos nunca
+    vistos para o mesmo modelo são enviados à API. Perguntas passam pelo
+    cache de consultas (LRU + Redis), quando informado.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        cache: EmbeddingCache = None,
+        model=None,
+        query_cache=None,
+    ):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.query_cache = query_cache
+        self.model = model or getattr(embeddings, "model", type(embeddings).__name__)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            return self.embeddings.embed_documents(texts)
+
+        keys = [embedding_key(self.model, text) for text in texts]
+        try:
+            cached = self.cache.get_many(list(set(keys)))
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao ler cache de embeddings: {e}")
+            cached = {}
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            try:
+                self.cache.set_many(self.model, computed)
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao gravar cache de embeddings: {e}")
+            cached.update(computed)
+
+        self.cache.record(hits=len(texts) - len(missing), misses=len(missing))
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.query_cache is None:
+            return self.embeddings.embed_query(text)
+
+        key = f"{self.model}|{normalize_query(text)}"
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.query_cache.set(key, vector)
+        return vector
+
+
+_embedding_caches = {}
+_embedding_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path: str) -> EmbeddingCache:
+    """Retorna o cache de embeddings do processo para o caminho informado"""
+    with _embedding_caches_lock:
+        if path not in _embedding_caches:
+            _embedding_caches[path] = EmbeddingCache(path)
+        return _embedding_caches[path]
+
+
+_encoding = None
+_encoding_failed = False
+
+
+def count_tokens(text: str) -> int:
+    """Conta os tokens do texto com o tokenizer da OpenAI, estimando se indisponível"""
+    global _encoding, _encoding_failed
+
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"Tokenizer indisponível, estimando tokens: {e}")
+            _encoding_failed = True
+
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Aproximação usual de ~4 caracteres por token
+    return max(1, len(text) // 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Corta o texto em até max_tokens tokens, terminando numa palavra inteira"""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    if _encoding is not None:
+        truncated = _encoding.decode(
+            _encoding.encode(text, disallowed_special=())[:max_tokens]
+        )
+    else:
+        truncated = text[: max_tokens * 4]
+
+    # Evita terminar no meio de uma palavra
+    if " " in truncated:
+        truncated = truncated.rsplit(" ", 1)[0]
+    return truncated.rstrip()
+
+
+class RateLimiter:
+    """Limita requisições e tokens por minuto numa janela deslizante de 60s."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._window = deque()
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        """Bloqueia até que a requisição caiba no orçamento do último minuto"""
+        # Um lote maior que o orçamento inteiro nunca caberia na janela
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._window and now - self._window[0][0] >= 60:
+                    self._tokens_in_window -= self._window.popleft()[1]
+
+                if (
+                    len(self._window) < self.requests_per_minute
+                    and self._tokens_in_window + tokens <= self.tokens_per_minute
+                ):
+                    self._window.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+
+                wait = 60 - (now - self._window[0][0])
+            time.sleep(max(wait, 0.01))
+
+
+class EmbeddingBatchScheduler:
+    """Envia chunks ao vectorstore em lotes por tokens, com vários lotes em paralelo.
+
+    Os lotes respeitam o orçamento de requisições e tokens por minuto; lotes
+    com erro são tentados de novo com backoff exponencial e, esgotadas as
+    tentativas, vão para a lista de dead letters em vez de sumir do índice.
+    No máximo max_pending lotes ficam em andamento ou na fila: além disso,
+    submit espera, e quem gera os chunks não acumula o acervo na memória.
+    """
+
+    def __init__(
+        self,
+        vectorstore,
+        concurrency=None,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        batch_tokens=None,
+        batch_size=None,
+        max_retries=None,
+        retry_backoff=None,
+        max_pending=None,
+    ):
+        self.vectorstore = vectorstore
+        concurrency = concurrency or RAG_EMBEDDING_CONCURRENCY
+        self.batch_tokens = batch_tokens or RAG_EMBEDDING_BATCH_TOKENS
+        self.batch_size = batch_size or RAG_EMBEDDING_BATCH_SIZE
+        self.max_retries = (
+            RAG_EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        )
+        self.retry_backoff = (
+            RAG_EMBEDDING_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        )
+        self.limiter = RateLimiter(
+            requests_per_minute or RAG_EMBEDDING_RPM,
+            tokens_per_minute or RAG_EMBEDDING_TPM,
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="embedding-batch"
+        )
+        self._slots = threading.BoundedSemaphore(
+            max_pending or concurrency + RAG_PIPELINE_QUEUE_SIZE
+        )
+        self.dead_letters = []
+        self._dead_letters_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def pack(self, splits, ids=None):
+        """Agrupa os chunks em lotes limitados por tokens e por quantidade"""
+        batches = []
+        current, current_tokens = [], 0
+
+        for index, doc in enumerate(splits):
+            tokens = count_tokens(doc.page_content)
+            if current and (
+                current_tokens + tokens > self.batch_tokens
+                or len(current) >= self.batch_size
+            ):
+                batches.append((current, current_tokens))
+                current, current_tokens = [], 0
+            current.append((doc, ids[index] if ids is not None else None))
+            current_tokens += tokens
+
+        if current:
+            batches.append((current, current_tokens))
+        return batches
+
+    def submit(self, splits, ids=None, on_batch=None):
+        """Agenda os chunks e retorna um future por lote (True quando gravado).
+
+        on_batch(docs, ids, tokens), se informado, é chamado na thread do lote
+        logo após cada lote gravado com sucesso.
+        """
+        futures = []
+        for batch, tokens in self.pack(splits, ids):
+            self._slots.acquire()
+            future = self.executor.submit(self._run_batch, batch, tokens, on_batch)
+            future.add_done_callback(lambda _: self._slots.release())
+            futures.append(future)
+        return futures
+
+    def _run_batch(self, batch, tokens, on_batch=None):
+        texts = [doc.page_content for doc, _ in batch]
+        metadatas = [doc.metadata for doc, _ in batch]
+        ids = [chunk_id for _, chunk_id in batch]
+
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(tokens)
+            try:
+                if ids[0] is None:
+                    self.vectorstore.add_texts(texts=texts, metadatas=metadatas)
+                else:
+                    self.vectorstore.add_texts(
+                        texts=texts, metadatas=metadatas, ids=ids
+                    )
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(
+                        f"Lote com {len(batch)} chunks ({tokens} tokens) falhou "
+                        f"após {attempt + 1} tentativas: {e}"
+                    )
+                    self._dead_letter(batch, tokens, e)
+                    return False
+
+                delay = self.retry_backoff * 2**attempt
+                delay += random.uniform(0, delay / 2)
+                logger.warning(
+                    f"Erro no lote de {len(batch)} chunks, nova tentativa "
+                    f"em {delay:.1f}s: {e}"
+                )
+                time.sleep(delay)
+            else:
+                if on_batch is not None:
+                    on_batch([doc for doc, _ in batch], ids, tokens)
+                return True
+
+    def _dead_letter(self, batch, tokens, error):
+        with self._dead_letters_lock:
+            self.dead_letters.append(
+                {
+                    "ids": [chunk_id for _, chunk_id in batch],
+                    "sources": sorted(
+                        {str(doc.metadata.get("source")) for doc, _ in batch}
+                    ),
+                    "chunks": len(batch),
+                    "tokens": tokens,
+                    "error": str(error),
+                }
+            )
@@ -1,3 +1,5 @@
+import logging
+
 import requests
 
 from .config import (
@@ -5,9 +7,12 @@ from .config import (
     EVOLUTION_AUTHENTICATION_API_KEY,
     EVOLUTION_INSTANCE_NAME,
 )
+from .http_client import get_async_http_client
 
+logger = logging.getLogger(__name__)
 
-def send_whatsapp_message(number, text):
+
+def _send_text_request(number, text):
     url = f"{EVOLUTION_API_URL}/message/sendText/{EVOLUTION_INSTANCE_NAME}"
     headers = {
         "apikey": EVOLUTION_AUTHENTICATION_API_KEY,
@@ -18,8 +23,29 @@ def send_whatsapp_message(number, text):
         "text": text,
         "delay": 2000,
     }
+    return url, headers, payload
+
+
+def send_whatsapp_message(number, text):
+    url, headers, payload = _send_text_request(number, text)
     requests.post(
         url=url,
         json=payload,
         headers=headers,
     )
+
+
+async def asend_whatsapp_message(number, text):
+    """Versão assíncrona do envio, sem bloquear o event loop do worker"""
+    url, headers, payload = _send_text_request(number, text)
+    response = await get_async_http_client().post(
+        url=url,
+        json=payload,
+        headers=headers,
+    )
+    if response.is_error:
+        logger.error(
+            f"Evolution API respondeu {response.status_code} ao enviar para "
+            f"{number}: {response.text[:200]}"
+        )
+    return response
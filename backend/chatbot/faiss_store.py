@@ -0,0 +1,479 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+from typing import Iterable, List, Optional
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.faiss"
+METADATA_FILE = "metadata.sqlite3"
+
+# Versões mais novas do FAISS mapeiam também os vetores de índices flat/HNSW
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+QUANTIZATION_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def index_quantization(index) -> str:
+    """Tipo de quantização de um índice gravado: none, fp16 ou int8"""
+    base = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    if isinstance(base, faiss.IndexHNSW):
+        base = faiss.downcast_index(base.storage)
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        for name, qtype in QUANTIZATION_TYPES.items():
+            if base.sq.qtype == qtype:
+                return name
+    return "none"
+
+
+def _metadata_fields(faiss_id, metadata):
+    # Valores em JSON, para que True e "True" continuem diferentes no filtro
+    for key, value in metadata.items():
+        if isinstance(value, (str, int, float, bool)):
+            yield faiss_id, key, json.dumps(value, ensure_ascii=False)
+
+
+class FaissVectorStore(VectorStore):
+    """Vectorstore em processo com FAISS, persistido em um diretório.
+
+    Os vetores (normalizados, busca por similaridade de cosseno) ficam no
+    arquivo do índice, que é mapeado em memória na abertura; textos e
+    metadados ficam numa tabela SQLite ao lado, indexada pelo id do FAISS.
+    Índices HNSW não suportam remoção: os vetores removidos continuam no
+    índice e são descartados na busca por não terem mais linha na tabela.
+
+    Com quantization fp16 ou int8 o índice guarda os vetores com 2 ou 1 byte
+    por dimensão, o que reduz a memória de cada worker na mesma proporção.
+    Os vetores float32 ficam na tabela SQLite, lidos do disco só para
+    reordenar com o score exato os k * rerank_factor melhores candidatos.
+
+    Os metadados escalares de cada chunk também vão para a tabela fields,
+    indexada por (chave, valor): uma busca com filtro primeiro seleciona
+    ali os ids que combinam e só então compara os vetores desse subconjunto.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embedding: Embeddings,
+        index_type: str = "flat",
+        hnsw_m: int = 32,
+        mmap: bool = True,
+        quantization: str = "none",
+        rerank_factor: int = 4,
+    ):
+        if index_type not in ("flat", "hnsw"):
+            raise ValueError(f"Tipo de índice FAISS inválido: {index_type}")
+        if quantization != "none" and quantization not in QUANTIZATION_TYPES:
+            raise ValueError(f"Quantização FAISS inválida: {quantization}")
+
+        self.path = path
+        self.index_type = index_type
+        self.hnsw_m = hnsw_m
+        self.quantization = quantization
+        self.rerank_factor = max(1, rerank_factor)
+        self._embedding = embedding
+        self._lock = threading.RLock()
+        self._dirty = False
+
+        os.makedirs(path, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(path, METADATA_FILE), check_same_thread=False
+        )
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                faiss_id INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL UNIQUE,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                vector BLOB
+            )
+            """
+        )
+        # Tabelas criadas antes da quantização não têm a coluna dos vetores
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(chunks)")}
+        if "vector" not in columns:
+            self._db.execute("ALTER TABLE chunks ADD COLUMN vector BLOB")
+        has_fields = self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'fields'"
+        ).fetchone()
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS fields (
+                faiss_id INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS fields_lookup ON fields (key, value, faiss_id);
+            CREATE INDEX IF NOT EXISTS fields_chunk ON fields (faiss_id);
+            """
+        )
+        if not has_fields:
+            # Índices anteriores aos filtros: monta a tabela a partir dos metadados
+            self._db.executemany(
+                "INSERT INTO fields (faiss_id, key, value) VALUES (?, ?, ?)",
+                (
+                    field
+                    for faiss_id, metadata in self._db.execute(
+                        "SELECT faiss_id, metadata FROM chunks"
+                    ).fetchall()
+                    for field in _metadata_fields(faiss_id, json.loads(metadata))
+                ),
+            )
+        self._db.commit()
+
+        self.index = None
+        self._mmapped = False
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            if mmap:
+                self.index = faiss.read_index(index_path, MMAP_FLAGS)
+                self._mmapped = True
+            else:
+                self.index = faiss.read_index(index_path)
+
+            stored = index_quantization(self.index)
+            if stored != quantization:
+                logger.warning(
+                    f"Índice FAISS em {path} foi criado com quantização {stored}, "
+                    f"não {quantization}; recrie-o com "
+                    "`manage.py ingest_rag --rebuild` para trocar o formato"
+                )
+                self.quantization = stored
+
+        (max_id,) = self._db.execute("SELECT MAX(faiss_id) FROM chunks").fetchone()
+        self._next_id = max(
+            (max_id or 0) + 1, self.index.ntotal if self.index is not None else 0
+        )
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def count(self) -> int:
+        """Número de chunks ativos no índice"""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def iter_chunks(self, batch_size: int = 1000):
+        """Percorre os chunks ativos em lotes de tuplas (id, texto, metadados)"""
+        last_id = -1
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT faiss_id, chunk_id, text, metadata FROM chunks "
+                    "WHERE faiss_id > ? ORDER BY faiss_id LIMIT ?",
+                    (last_id, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [
+                (chunk_id, text, json.loads(metadata))
+                for _, chunk_id, text, metadata in rows
+            ]
+
+    def _new_index(self, dimension: int):
+        qtype = QUANTIZATION_TYPES.get(self.quantization)
+        if self.index_type == "hnsw" and qtype is not None:
+            base = faiss.IndexHNSWSQ(
+                dimension, qtype, self.hnsw_m, faiss.METRIC_INNER_PRODUCT
+            )
+        elif self.index_type == "hnsw":
+            base = faiss.IndexHNSWFlat(
+                dimension, self.hnsw_m, faiss.METRIC_INNER_PRODUCT
+            )
+        elif qtype is not None:
+            base = faiss.IndexScalarQuantizer(
+                dimension, qtype, faiss.METRIC_INNER_PRODUCT
+            )
+        else:
+            base = faiss.IndexFlatIP(dimension)
+        return faiss.IndexIDMap2(base)
+
+    def _train(self, matrix):
+        # O int8 aprende a faixa de cada dimensão com o primeiro lote; o lote
+        # espelhado deixa a faixa simétrica, como nos embeddings normalizados.
+        # Valores fora dela saturam e a reordenação exata corrige a ordem.
+        self.index.train(np.vstack([matrix, -matrix]))
+
+    def _ensure_writable(self):
+        # O índice mapeado em memória é somente leitura: carrega uma cópia para escrita
+        if self._mmapped:
+            self.index = faiss.read_index(os.path.join(self.path, INDEX_FILE))
+            self._mmapped = False
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_embeddings(texts, vectors, metadatas=metadatas, ids=ids)
+
+    def add_embeddings(self, texts, vectors, metadatas=None, ids=None) -> List[str]:
+        """Adiciona vetores já calculados; ids existentes são substituídos"""
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        matrix = np.asarray(vectors, dtype="float32")
+        faiss.normalize_L2(matrix)
+
+        with self._lock:
+            self._delete_locked(ids)
+            if self.index is None:
+                self.index = self._new_index(matrix.shape[1])
+            self._ensure_writable()
+            if not self.index.is_trained:
+                self._train(matrix)
+
+            faiss_ids = np.arange(
+                self._next_id, self._next_id + len(texts), dtype="int64"
+            )
+            self.index.add_with_ids(matrix, faiss_ids)
+            # Sem quantização o próprio índice tem os vetores exatos
+            exact = matrix if self.quantization != "none" else [None] * len(texts)
+            self._db.executemany(
+                "INSERT INTO chunks (faiss_id, chunk_id, text, metadata, vector) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        int(faiss_id),
+                        chunk_id,
+                        text,
+                        json.dumps(metadata, ensure_ascii=False),
+                        vector.tobytes() if vector is not None else None,
+                    )
+                    for faiss_id, chunk_id, text, metadata, vector in zip(
+                        faiss_ids, ids, texts, metadatas, exact
+                    )
+                ],
+            )
+            self._db.executemany(
+                "INSERT INTO fields (faiss_id, key, value) VALUES (?, ?, ?)",
+                (
+                    field
+                    for faiss_id, metadata in zip(faiss_ids, metadatas)
+                    for field in _metadata_fields(int(faiss_id), metadata)
+                ),
+            )
+            self._db.commit()
+            self._next_id += len(texts)
+            self._dirty = True
+
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            removed = self._delete_locked(list(ids))
+            self._db.commit()
+        return bool(removed)
+
+    def _delete_locked(self, ids):
+        faiss_ids = []
+        for i in range(0, len(ids), 500):
+            batch = ids[i : i + 500]
+            placeholders = ",".join("?" * len(batch))
+            faiss_ids.extend(
+                row[0]
+                for row in self._db.execute(
+                    f"SELECT faiss_id FROM chunks WHERE chunk_id IN ({placeholders})",
+                    batch,
+                )
+            )
+        if not faiss_ids:
+            return 0
+
+        for table in ("chunks", "fields"):
+            self._db.executemany(
+                f"DELETE FROM {table} WHERE faiss_id = ?", [(fid,) for fid in faiss_ids]
+            )
+        if self.index_type == "flat":
+            self._ensure_writable()
+            self.index.remove_ids(np.asarray(faiss_ids, dtype="int64"))
+        self._dirty = True
+        return len(faiss_ids)
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[dict] = None,
+        **kwargs,
+    ):
+        query = np.asarray([embedding], dtype="float32")
+        faiss.normalize_L2(query)
+
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                return []
+
+            if filter:
+                scores, faiss_ids = self._filtered_search(query, k, filter)
+            else:
+                # Vetores removidos de um HNSW continuam no índice e ocupam
+                # posições. Só contam os chunks que este índice carregou: outro
+                # processo pode estar gravando chunks novos na mesma tabela.
+                (live,) = self._db.execute(
+                    "SELECT COUNT(*) FROM chunks WHERE faiss_id < ?", (self._next_id,)
+                ).fetchone()
+                stale = max(0, self.index.ntotal - live)
+                fetch_k = k + stale
+                if self.quantization != "none":
+                    fetch_k = max(fetch_k, k * self.rerank_factor + stale)
+                scores, faiss_ids = self.index.search(
+                    query, min(fetch_k, self.index.ntotal)
+                )
+
+            found = [int(fid) for fid in faiss_ids[0] if fid != -1]
+            rows = {}
+            if found:
+                placeholders = ",".join("?" * len(found))
+                for faiss_id, chunk_id, text, metadata, vector in self._db.execute(
+                    "SELECT faiss_id, chunk_id, text, metadata, vector FROM chunks "
+                    f"WHERE faiss_id IN ({placeholders})",
+                    found,
+                ):
+                    rows[faiss_id] = (chunk_id, text, json.loads(metadata), vector)
+
+        candidates = [
+            (float(score), int(faiss_id))
+            for score, faiss_id in zip(scores[0], faiss_ids[0])
+            if int(faiss_id) in rows
+        ]
+        if self.quantization != "none":
+            candidates = self._rerank(query[0], candidates, rows)
+
+        results = []
+        for score, faiss_id in candidates:
+            chunk_id, text, metadata, _ = rows[faiss_id]
+            if filter and any(
+                metadata.get(key) != value for key, value in filter.items()
+            ):
+                continue
+            results.append(
+                (
+                    Document(id=chunk_id, page_content=text, metadata=metadata),
+                    score,
+                )
+            )
+            if len(results) == k:
+                break
+        return results
+
+    def filtered_ids(self, filter: dict) -> np.ndarray:
+        """Ids do FAISS dos chunks cujos metadados combinam com o filtro"""
+        conditions = " INTERSECT ".join(
+            "SELECT faiss_id FROM fields WHERE key = ? AND value = ?" for _ in filter
+        )
+        params = [
+            param
+            for key, value in filter.items()
+            for param in (key, json.dumps(value, ensure_ascii=False))
+        ]
+        with self._lock:
+            rows = self._db.execute(conditions, params).fetchall()
+        return np.fromiter((row[0] for row in rows), dtype="int64", count=len(rows))
+
+    def _filtered_search(self, query, k, filter):
+        """Busca só entre os chunks selecionados pelo índice de metadados"""
+        allowed = self.filtered_ids(filter)
+        if not len(allowed):
+            return np.empty((1, 0), dtype="float32"), np.empty((1, 0), dtype="int64")
+
+        fetch_k = min(len(allowed), k * self.rerank_factor)
+        if self.index_type == "hnsw":
+            # O grafo do HNSW perde vizinhos quando o filtro é seletivo:
+            # compara direto os vetores do subconjunto
+            scores = self.index.reconstruct_batch(allowed) @ query[0]
+            top = np.argsort(-scores)[:fetch_k]
+            return scores[top][None, :], allowed[top][None, :]
+
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(allowed))
+        return self.index.search(query, fetch_k, params=params)
+
+    @staticmethod
+    def _rerank(query, candidates, rows):
+        """Reordena os candidatos pelo score com os vetores float32"""
+        reranked = []
+        for score, faiss_id in candidates:
+            vector = rows[faiss_id][3]
+            if vector is not None:
+                score = float(np.frombuffer(vector, dtype="float32") @ query)
+            reranked.append((score, faiss_id))
+        reranked.sort(key=lambda candidate: candidate[0], reverse=True)
+        return reranked
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs):
+        embedding = self._embedding.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs):
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, k=k, **kwargs
+            )
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        return [
+            doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)
+        ]
+
+    def _select_relevance_score_fn(self):
+        # Os scores já são similaridade de cosseno
+        return lambda score: score
+
+    def persist(self):
+        """Grava o índice no disco de forma atômica, se houve alterações"""
+        with self._lock:
+            if not self._dirty or self.index is None:
+                return
+            index_path = os.path.join(self.path, INDEX_FILE)
+            tmp_path = f"{index_path}.tmp"
+            faiss.write_index(self.index, tmp_path)
+            os.replace(tmp_path, index_path)
+            self._dirty = False
+
+    def delete_collection(self):
+        """Remove o índice e a tabela de metadados do disco"""
+        with self._lock:
+            self._db.close()
+            self.index = None
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        path: str = None,
+        **kwargs,
+    ) -> "FaissVectorStore":
+        store = cls(path, embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        store.persist()
+        return store
@@ -0,0 +1,27 @@
+import asyncio
+
+import httpx
+
+from .config import HTTP_CLIENT_MAX_CONNECTIONS, HTTP_CLIENT_TIMEOUT
+
+# Um cliente por event loop: as conexões do pool ficam presas ao loop que as abriu
+_clients = {}
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Cliente HTTP assíncrono compartilhado pelas chamadas do event loop atual.
+
+    Reaproveita as conexões (keep-alive) entre as mensagens em vez de abrir
+    uma nova a cada envio ou consulta.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        # Loops já encerrados (ex.: testes) não voltam a ser usados
+        for other in [other for other in _clients if other.is_closed()]:
+            del _clients[other]
+        client = _clients[loop] = httpx.AsyncClient(
+            timeout=HTTP_CLIENT_TIMEOUT,
+            limits=httpx.Limits(max_connections=HTTP_CLIENT_MAX_CONNECTIONS),
+        )
+    return client
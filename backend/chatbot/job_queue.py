@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+
+from redis.exceptions import ResponseError
+
+logger = logging.getLogger(__name__)
+
+
+def default_consumer_name() -> str:
+    """Nome do consumidor no grupo: um por processo"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class StreamWorker:
+    """Consome os jobs de um Redis Stream num consumer group.
+
+    Cada job roda na sua tarefa, até concurrency ao mesmo tempo, e só recebe
+    XACK depois que o handler termina sem erro. Enquanto o handler roda, o
+    job é reivindicado de novo a cada terço de claim_idle_seconds, para um
+    job demorado não parecer parado. Jobs que ficam pendentes por mais de
+    claim_idle_seconds (worker que caiu ou travou, ou handler que falhou)
+    são reclamados com XAUTOCLAIM e rodam de novo; depois de max_deliveries
+    entregas vão para o dead_letter_stream.
+    """
+
+    def __init__(
+        self,
+        client,
+        stream,
+        group,
+        handler,
+        consumer=None,
+        concurrency=4,
+        claim_idle_seconds=180,
+        max_deliveries=5,
+        block_seconds=1.0,
+        dead_letter_stream=None,
+    ):
+        if concurrency < 1:
+            raise ValueError("A concorrência do worker precisa ser positiva")
+        self.client = client
+        self.stream = stream
+        self.group = group
+        self.handler = handler
+        self.consumer = consumer or default_consumer_name()
+        self.concurrency = concurrency
+        self.claim_idle_seconds = claim_idle_seconds
+        self.max_deliveries = max_deliveries
+        self.block_seconds = block_seconds
+        self.dead_letter_stream = dead_letter_stream or f"{stream}:dead"
+        self.tasks = set()
+
+    async def ensure_group(self):
+        """Cria o stream e o consumer group, se ainda não existirem"""
+        try:
+            await self.client.xgroup_create(
+                self.stream, self.group, id="0", mkstream=True
+            )
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def read(self, count):
+        """Jobs novos para este consumidor, esperando até block_seconds"""
+        response = await self.client.xreadgroup(
+            self.group,
+            self.consumer,
+            {self.stream: ">"},
+            count=count,
+            block=int(self.block_seconds * 1000),
+        )
+        if isinstance(response, dict):
+            # RESP3 responde um dicionário por stream
+            response = response.items()
+        return [entry for _, entries in response or [] for entry in entries]
+
+    async def reclaim(self, count):
+        """Assume jobs parados há mais de claim_idle_seconds em outro consumidor"""
+        _, entries, *_ = await self.client.xautoclaim(
+            self.stream,
+            self.group,
+            self.consumer,
+            min_idle_time=int(self.claim_idle_seconds * 1000),
+            start_id="0-0",
+            count=count,
+        )
+        jobs = []
+        for entry_id, fields in entries:
+            if fields is None:
+                # Removido do stream (MAXLEN) enquanto estava pendente
+                await self.client.xack(self.stream, self.group, entry_id)
+                continue
+            pending = await self.client.xpending_range(
+                self.stream, self.group, min=entry_id, max=entry_id, count=1
+            )
+            if pending and pending[0]["times_delivered"] > self.max_deliveries:
+                await self.dead_letter(entry_id, fields)
+                continue
+            logger.warning(f"Job {entry_id} reclamado por {self.consumer}: {fields}")
+            jobs.append((entry_id, fields))
+        return jobs
+
+    async def dead_letter(self, entry_id, fields):
+        logger.error(
+            f"Job {entry_id} falhou {self.max_deliveries} vezes, movido para "
+            f"{self.dead_letter_stream}: {fields}"
+        )
+        await self.client.xadd(self.dead_letter_stream, {**fields, "job_id": entry_id})
+        await self.client.xack(self.stream, self.group, entry_id)
+
+    async def keep_alive(self, entry_id):
+        """Zera o tempo ocioso do job pendente com XCLAIM para este consumidor"""
+        while True:
+            await asyncio.sleep(self.claim_idle_seconds / 3)
+            try:
+                await self.client.xclaim(
+                    self.stream,
+                    self.group,
+                    self.consumer,
+                    min_idle_time=0,
+                    message_ids=[entry_id],
+                    justid=True,
+                )
+            except Exception as e:
+                logger.warning(f"Erro ao renovar o job {entry_id}: {e}")
+
+    async def handle(self, entry_id, fields):
+        keep_alive = asyncio.create_task(self.keep_alive(entry_id))
+        try:
+            await self.handler(fields)
+        except Exception as e:
+            # Sem XACK: o job fica pendente e volta no reclaim
+            logger.error(f"Erro no job {entry_id} ({fields}): {e}", exc_info=True)
+            return False
+        finally:
+            keep_alive.cancel()
+        await self.client.xack(self.stream, self.group, entry_id)
+        return True
+
+    def start(self, entry_id, fields):
+        task = asyncio.create_task(self.handle(entry_id, fields))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def run(self, stop: asyncio.Event, shutdown_timeout=None):
+        """Consome até stop ser sinalizado e espera os jobs em andamento.
+
+        Os jobs que não terminarem em shutdown_timeout continuam pendentes
+        e são reclamados por outro worker.
+        """
+        await self.ensure_group()
+        logger.info(
+            f"Worker {self.consumer} consumindo {self.stream} "
+            f"(grupo {self.group}, concorrência {self.concurrency})"
+        )
+        next_reclaim = 0.0
+        while not stop.is_set():
+            free = self.concurrency - len(self.tasks)
+            if free <= 0:
+                await asyncio.wait(self.tasks, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            try:
+                jobs = []
+                if time.monotonic() >= next_reclaim:
+                    jobs = await self.reclaim(free)
+                    next_reclaim = time.monotonic() + self.claim_idle_seconds / 2
+                if not jobs:
+                    jobs = await self.read(free)
+            except Exception as e:
+                logger.error(f"Erro ao ler {self.stream}: {e}")
+                await asyncio.sleep(self.block_seconds)
+                continue
+            for entry_id, fields in jobs:
+                self.start(entry_id, fields)
+
+        if self.tasks:
+            await asyncio.wait(self.tasks, timeout=shutdown_timeout)
+        logger.info(f"Worker {self.consumer} encerrado")
@@ -0,0 +1,269 @@
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import List, Optional
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Palavras muito frequentes que não ajudam a separar os chunks
+STOPWORDS = frozenset(
+    """
+    a ao aos as com como da das de do dos e em entre na nas no nos o os ou para
+    pela pelas pelo pelos por qual quais que se sem sobre um uma umas uns
+    """.split()
+)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+
+
+def fold_text(text: str) -> str:
+    """Remove acentos e caixa para comparar termos em português"""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> List[str]:
+    """Quebra o texto em termos para o índice invertido.
+
+    Códigos com hífen, ponto ou barra (cultivares como "BRS-7280", formulações
+    como "04-14-08") geram o termo composto e também cada parte.
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.findall(fold_text(text)):
+        parts = re.split(r"[-./]", match)
+        if len(parts) > 1:
+            tokens.append("".join(parts))
+        for part in parts:
+            if part not in STOPWORDS and (len(part) > 1 or part.isdigit()):
+                tokens.append(part)
+    return tokens
+
+
+class BM25Index:
+    """Índice invertido em memória com ranqueamento BM25.
+
+    Os chunks ficam numa tabela SQLite ao lado do índice vetorial e as
+    listas de postings são montadas em memória na abertura. Sem caminho,
+    o índice existe apenas em memória. Os metadados escalares ganham um
+    índice secundário (chave, valor) -> chunks, usado para restringir a
+    busca com filtro antes de pontuar.
+    """
+
+    def __init__(self, path: str = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)
+        self._docs = {}
+        self._doc_by_chunk_id = {}
+        self._fields = defaultdict(set)
+        self._next_doc = 0
+        self._total_length = 0
+        self._db = None
+
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunks (
+                    chunk_id TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    metadata TEXT NOT NULL
+                )
+                """
+            )
+            self._db.commit()
+            for chunk_id, text, metadata in self._db.execute(
+                "SELECT chunk_id, text, metadata FROM chunks"
+            ):
+                self._index(chunk_id, text, json.loads(metadata))
+
+    def count(self) -> int:
+        return len(self._docs)
+
+    def _index(self, chunk_id, text, metadata):
+        terms = Counter(tokenize(text))
+        doc = self._next_doc
+        self._next_doc += 1
+        self._docs[doc] = (chunk_id, text, metadata, sum(terms.values()))
+        self._doc_by_chunk_id[chunk_id] = doc
+        self._total_length += sum(terms.values())
+        for term, frequency in terms.items():
+            self._postings[term][doc] = frequency
+        for field in _metadata_fields(metadata):
+            self._fields[field].add(doc)
+
+    def _unindex(self, chunk_id):
+        doc = self._doc_by_chunk_id.pop(chunk_id, None)
+        if doc is None:
+            return False
+        _, text, metadata, length = self._docs.pop(doc)
+        self._total_length -= length
+        for field in _metadata_fields(metadata):
+            docs = self._fields.get(field)
+            if docs is not None:
+                docs.discard(doc)
+                if not docs:
+                    del self._fields[field]
+        for term in set(tokenize(text)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc, None)
+                if not postings:
+                    del self._postings[term]
+        return True
+
+    def add(self, ids, texts, metadatas=None):
+        """Adiciona chunks ao índice; ids existentes são substituídos"""
+        metadatas = metadatas or [{} for _ in texts]
+        rows = [
+            (chunk_id, text, metadata or {})
+            for chunk_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        with self._lock:
+            for chunk_id, text, metadata in rows:
+                self._unindex(chunk_id)
+                self._index(chunk_id, text, metadata)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO chunks (chunk_id, text, metadata) "
+                    "VALUES (?, ?, ?)",
+                    [
+                        (chunk_id, text, json.dumps(metadata, ensure_ascii=False))
+                        for chunk_id, text, metadata in rows
+                    ],
+                )
+                self._db.commit()
+
+    def add_documents(self, documents: List[Document], ids: List[str]):
+        self.add(
+            ids,
+            [doc.page_content for doc in documents],
+            [doc.metadata for doc in documents],
+        )
+
+    def delete(self, ids) -> int:
+        """Remove os chunks informados e retorna quantos existiam"""
+        ids = list(ids)
+        with self._lock:
+            removed = sum(1 for chunk_id in ids if self._unindex(chunk_id))
+            if self._db is not None and ids:
+                self._db.executemany(
+                    "DELETE FROM chunks WHERE chunk_id = ?",
+                    [(chunk_id,) for chunk_id in ids],
+                )
+                self._db.commit()
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._docs.clear()
+            self._doc_by_chunk_id.clear()
+            self._fields.clear()
+            self._total_length = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM chunks")
+                self._db.commit()
+
+    def search(self, query: str, k: int = 4, filter: Optional[dict] = None):
+        """Retorna até k tuplas (documento, score BM25) em ordem decrescente"""
+        with self._lock:
+            total_docs = len(self._docs)
+            if not total_docs:
+                return []
+            average_length = self._total_length / total_docs or 1
+
+            allowed = None
+            if filter:
+                allowed = self._filtered_docs(filter)
+                if not allowed:
+                    return []
+
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(
+                    1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for doc, frequency in postings.items():
+                    if allowed is not None and doc not in allowed:
+                        continue
+                    length = self._docs[doc][3]
+                    scores[doc] += (
+                        idf
+                        * frequency
+                        * (self.k1 + 1)
+                        / (
+                            frequency
+                            + self.k1 * (1 - self.b + self.b * length / average_length)
+                        )
+                    )
+
+            results = []
+            for doc, score in heapq.nlargest(k, scores.items(), key=lambda x: x[1]):
+                chunk_id, text, metadata, _ = self._docs[doc]
+                results.append(
+                    (
+                        Document(
+                            id=chunk_id, page_content=text, metadata=dict(metadata)
+                        ),
+                        score,
+                    )
+                )
+            return results
+
+    def _filtered_docs(self, filter: dict):
+        """Chunks cujos metadados têm todos os pares do filtro"""
+        allowed = None
+        for field in _metadata_fields(filter):
+            docs = self._fields.get(field, set())
+            allowed = set(docs) if allowed is None else allowed & docs
+            if not allowed:
+                return set()
+        return allowed
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def _metadata_fields(metadata):
+    # Valores em JSON, para que True e 1 continuem diferentes no filtro
+    for key, value in metadata.items():
+        if isinstance(value, (str, int, float, bool)):
+            yield key, json.dumps(value, ensure_ascii=False)
+
+
+def fuse_rankings(rankings, weights, k: int, rank_constant: int = 60):
+    """Combina listas de documentos ranqueados com Reciprocal Rank Fusion.
+
+    Não depende da escala dos scores de cada busca, o que permite misturar
+    similaridade de cosseno e BM25. Documentos são identificados pelo id do
+    chunk, ou pelo conteúdo quando o backend não devolve ids.
+    """
+    scores = {}
+    documents = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc in enumerate(ranking):
+            key = doc.id or doc.page_content
+            documents.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + weight / (rank_constant + rank + 1)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in ranked]
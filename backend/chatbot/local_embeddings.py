@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import zlib
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .lexical import tokenize
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = "model.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+
+
+class LocalEmbeddings(Embeddings):
+    """Embeddings calculados na CPU com um modelo ONNX local, sem rede.
+
+    O diretório do modelo precisa ter o model.onnx e o tokenizer.json
+    (formato do Hugging Face, ex.: sentence-transformers/all-MiniLM-L6-v2
+    exportado para ONNX). Os textos são ordenados por tamanho e processados
+    em lotes com padding mínimo; o vetor final é a média dos tokens
+    ponderada pela máscara de atenção, normalizada.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        threads: int = 0,
+        batch_size: int = 32,
+        max_length: int = 256,
+    ):
+        self.model_path = model_path
+        self.model = os.path.basename(os.path.normpath(model_path))
+        self.threads = threads
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._session = None
+        self._tokenizer = None
+        self._input_names = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # onnxruntime e tokenizers só são importados quando o provider local é usado
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError(
+                "RAG_EMBEDDING_PROVIDER=local precisa do extra local-embeddings "
+                "(poetry install -E local-embeddings)"
+            ) from e
+
+        with self._lock:
+            if self._session is not None:
+                return
+
+            tokenizer = Tokenizer.from_file(
+                os.path.join(self.model_path, TOKENIZER_FILE)
+            )
+            tokenizer.no_padding()
+            tokenizer.enable_truncation(max_length=self.max_length)
+
+            options = onnxruntime.SessionOptions()
+            if self.threads:
+                options.intra_op_num_threads = self.threads
+            session = onnxruntime.InferenceSession(
+                os.path.join(self.model_path, MODEL_FILE),
+                sess_options=options,
+                providers=["CPUExecutionProvider"],
+            )
+
+            self._input_names = {
+                model_input.name for model_input in session.get_inputs()
+            }
+            self._tokenizer = tokenizer
+            self._session = session
+            logger.info(
+                f"Modelo de embeddings local carregado: {self.model} "
+                f"({self.threads or 'auto'} threads)"
+            )
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        length = max(len(encoding.ids) for encoding in encodings) or 1
+
+        input_ids = np.zeros((len(encodings), length), dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), length), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            input_ids[row, : len(encoding.ids)] = encoding.ids
+            attention_mask[row, : len(encoding.ids)] = 1
+
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            inputs["token_type_ids"] = np.zeros_like(input_ids)
+        inputs = {
+            name: value for name, value in inputs.items() if name in self._input_names
+        }
+
+        output = self._session.run(None, inputs)[0]
+        if output.ndim == 3:
+            # Mean pooling sobre os tokens reais (sem o padding)
+            mask = attention_mask[:, :, None].astype(output.dtype)
+            output = (output * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        norms = np.linalg.norm(output, axis=1, keepdims=True)
+        return output / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if self._session is None:
+            self._load()
+
+        # Lotes com textos de tamanho parecido desperdiçam menos padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            embedded = self._embed_batch([texts[i] for i in batch])
+            for i, vector in zip(batch, embedded):
+                vectors[i] = vector.astype(np.float32).tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class HashingEmbeddings(Embeddings):
+    """Embeddings determinísticos por hashing de termos, sem modelo nem rede.
+
+    Cada termo e cada par de termos vizinhos (os mesmos termos do índice
+    léxico) soma +1 ou -1 numa posição do vetor escolhida por crc32, que não
+    varia entre processos. Não captura sinônimos: serve para avaliações
+    offline reproduzíveis, em que importa comparar chunking, k e backends.
+    """
+
+    def __init__(self, dimension: int = 256):
+        self.dimension = dimension
+        self.model = f"hashing-{dimension}"
+
+    def _embed(self, text: str) -> List[float]:
+        terms = tokenize(text)
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature in terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]:
+            digest = zlib.crc32(feature.encode())
+            vector[digest % self.dimension] += 1.0 if digest & 1 << 31 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
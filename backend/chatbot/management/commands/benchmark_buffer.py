@@ -0,0 +1,222 @@
+import asyncio
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot import message_buffer
+
+MODES = ("separate", "script")
+
+
+class CountingClient:
+    """Repassa os comandos ao client do Redis contando as idas e voltas.
+
+    Cada comando, ou cada script Lua, é uma ida ao Redis.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            self.round_trips += 1
+            return await command(*args, **kwargs)
+
+        return call
+
+
+class BufferBenchmark:
+    """Produtores e um consumidor disputando o buffer das mesmas conversas.
+
+    separate é o buffer antigo: RPUSH, EXPIRE e ZADD em três idas e
+    LRANGE seguido de DEL para ler, o que apaga mensagens que chegam entre
+    as duas leituras. script é o atual: um script para guardar e
+    claim/ack para ler, que só tiram do buffer o que foi lido.
+    """
+
+    def __init__(self, producer, consumer, mode):
+        # Clients separados: as idas ao Redis de quem guarda são contadas à parte
+        self.producer = producer
+        self.consumer = consumer
+        self.mode = mode
+        self.schedule_key = f"{message_buffer.DEBOUNCE_SCHEDULE_KEY}:benchmark"
+        self.stream_key = f"{message_buffer.CHATBOT_STREAM_KEY}:benchmark"
+        self.processed = 0
+
+    def buffer_key(self, chat_id):
+        return f"{chat_id}{message_buffer.BUFFER_KEY_SUFIX}"
+
+    def lease_key(self, chat_id):
+        return f"{self.schedule_key}:lease:{chat_id}"
+
+    async def push(self, chat_id, message):
+        buffer_key = self.buffer_key(chat_id)
+        deadline = time.time() + float(message_buffer.DEBOUNCE_SECONDS)
+        if self.mode == "separate":
+            await self.producer.rpush(buffer_key, message)
+            await self.producer.expire(buffer_key, message_buffer.BUFFER_TTL)
+            await self.producer.zadd(self.schedule_key, {chat_id: deadline})
+            return
+        await message_buffer.buffer_script(
+            keys=[buffer_key, self.schedule_key],
+            args=[message, message_buffer.BUFFER_TTL, chat_id, repr(deadline)],
+            client=self.producer,
+        )
+
+    async def drain(self, chat_id):
+        """Lê e limpa o buffer da conversa; devolve quantas mensagens leu"""
+        buffer_key = self.buffer_key(chat_id)
+        if self.mode == "separate":
+            messages = await self.consumer.lrange(buffer_key, 0, -1)
+            await self.consumer.delete(buffer_key)
+            return len(messages)
+
+        token = uuid.uuid4().hex
+        messages = await message_buffer.claim_script(
+            keys=[buffer_key, self.lease_key(chat_id)],
+            args=[token, message_buffer.DEBOUNCE_LEASE_SECONDS * 1000],
+            client=self.consumer,
+        )
+        if messages is None:
+            return 0
+        await message_buffer.ack_script(
+            keys=[
+                buffer_key,
+                self.lease_key(chat_id),
+                self.schedule_key,
+                self.stream_key,
+            ],
+            args=[
+                len(messages),
+                token,
+                chat_id,
+                # Sem follow-up: o consumidor daqui lê o buffer sozinho
+                "0",
+                message_buffer.CHATBOT_STREAM_MAXLEN,
+            ],
+            client=self.consumer,
+        )
+        return len(messages)
+
+    async def consume(self, chats, stop):
+        while not stop.is_set():
+            for chat_id in chats:
+                self.processed += await self.drain(chat_id)
+            await asyncio.sleep(0)
+        for chat_id in chats:
+            self.processed += await self.drain(chat_id)
+
+    async def cleanup(self, chats):
+        await message_buffer.redis_client.delete(
+            self.schedule_key,
+            self.stream_key,
+            *(self.buffer_key(chat_id) for chat_id in chats),
+            *(self.lease_key(chat_id) for chat_id in chats),
+        )
+
+
+async def run_mode(mode, chats, messages, concurrency):
+    producer = CountingClient(message_buffer.redis_client)
+    consumer = CountingClient(message_buffer.redis_client)
+    benchmark = BufferBenchmark(producer, consumer, mode)
+    chat_ids = [f"benchmark-buffer-{index}" for index in range(chats)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(chat_id, index):
+        async with semaphore:
+            await benchmark.push(chat_id, f"mensagem {index}")
+
+    stop = asyncio.Event()
+    consumer = asyncio.create_task(benchmark.consume(chat_ids, stop))
+    try:
+        start_time = time.perf_counter()
+        await asyncio.gather(
+            *(send(chat_id, index) for index in range(messages) for chat_id in chat_ids)
+        )
+        elapsed = time.perf_counter() - start_time
+        push_round_trips = producer.round_trips
+        stop.set()
+        await consumer
+    finally:
+        stop.set()
+        await benchmark.cleanup(chat_ids)
+
+    sent = chats * messages
+    return {
+        "mode": mode,
+        "messages": sent,
+        "round_trips_per_message": push_round_trips / sent,
+        "messages_per_second": sent / max(elapsed, 1e-9),
+        "processed": benchmark.processed,
+        "lost": sent - benchmark.processed,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Teste do buffer de mensagens: idas ao Redis por mensagem, vazão e "
+        "mensagens perdidas com rajadas na mesma conversa"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chats", type=int, default=5, help="Conversas recebendo as rajadas"
+        )
+        parser.add_argument(
+            "--messages", type=int, default=500, help="Mensagens por conversa"
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=50,
+            help="Mensagens guardadas ao mesmo tempo",
+        )
+        parser.add_argument(
+            "--mode", choices=MODES, action="append", help="Padrão: os dois modos"
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Saída em JSON, uma linha por modo"
+        )
+
+    def handle(self, *args, **options):
+        if min(options["chats"], options["messages"], options["concurrency"]) < 1:
+            raise CommandError(
+                "--chats, --messages e --concurrency precisam ser positivos"
+            )
+        results = asyncio.run(self._run(options))
+
+        if options["json"]:
+            for result in results:
+                self.stdout.write(json.dumps(result))
+            return
+
+        self.stdout.write(
+            f"{options['chats']} conversas x {options['messages']} mensagens, "
+            f"concorrência {options['concurrency']}"
+        )
+        self.stdout.write(
+            f"{'modo':<10}{'idas/msg':>10}{'msgs/s':>12}{'lidas':>10}{'perdidas':>10}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:<10}{result['round_trips_per_message']:>10.2f}"
+                f"{result['messages_per_second']:>12.0f}"
+                f"{result['processed']:>10}{result['lost']:>10}"
+            )
+
+    async def _run(self, options):
+        try:
+            await message_buffer.redis_client.ping()
+        except Exception as e:
+            raise CommandError(f"Redis indisponível em REDIS_URL: {e}") from e
+        return [
+            await run_mode(
+                mode, options["chats"], options["messages"], options["concurrency"]
+            )
+            for mode in options["mode"] or MODES
+        ]
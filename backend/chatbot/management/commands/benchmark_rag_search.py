@@ -0,0 +1,143 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.tools import RAGSearchTool
+from chatbot.vectorstore import get_vectorstore, iter_indexed_chunks
+
+SEARCH_MODES = ("vector", "hybrid", "lexical")
+
+
+def load_queries(path):
+    """Lê perguntas de um arquivo JSONL.
+
+    Cada linha tem "query" e o que conta como acerto: "expected_source"
+    (final do caminho do arquivo) ou "expected_text" (trecho do chunk).
+    """
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                queries.append(json.loads(line))
+    return queries
+
+
+def sample_queries(vectorstore, size, seed, words=8):
+    """Gera perguntas a partir de trechos de chunks sorteados do índice.
+
+    O acerto esperado é o próprio chunk. Como os trechos são literais, a
+    amostra favorece a busca léxica; use --queries para perguntas reais.
+    """
+    chunks = [
+        (chunk_id, text)
+        for batch in iter_indexed_chunks(vectorstore)
+        for chunk_id, text, _ in batch
+        if len(text.split()) >= words
+    ]
+    rng = random.Random(seed)
+    queries = []
+    for chunk_id, text in rng.sample(chunks, min(size, len(chunks))):
+        tokens = text.split()
+        start = rng.randrange(len(tokens) - words + 1)
+        queries.append(
+            {"query": " ".join(tokens[start : start + words]), "chunk_id": chunk_id}
+        )
+    return queries
+
+
+def is_relevant(doc, expected):
+    if "chunk_id" in expected:
+        return doc.id == expected["chunk_id"]
+    if "expected_source" in expected:
+        return str(doc.metadata.get("source", "")).endswith(expected["expected_source"])
+    return expected["expected_text"].lower() in doc.page_content.lower()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def benchmark_mode(tool, queries, k, mode):
+    """Executa as perguntas num modo e mede recall@k, MRR e latência"""
+    hits = 0
+    reciprocal_ranks = 0.0
+    latencies = []
+
+    for expected in queries:
+        start_time = time.perf_counter()
+        # Chama a busca direto para não medir o cache de resultados
+        docs = tool._search(expected["query"], k, mode)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+
+        rank = next(
+            (i for i, doc in enumerate(docs, 1) if is_relevant(doc, expected)), None
+        )
+        if rank:
+            hits += 1
+            reciprocal_ranks += 1 / rank
+
+    return {
+        "mode": mode,
+        "queries": len(queries),
+        "recall": hits / len(queries),
+        "mrr": reciprocal_ranks / len(queries),
+        "latency_p50_ms": percentile(latencies, 0.5),
+        "latency_p95_ms": percentile(latencies, 0.95),
+        "latency_mean_ms": sum(latencies) / len(latencies),
+    }
+
+
+class Command(BaseCommand):
+    help = "Compara recall e latência da busca RAG nos modos vetorial, híbrido e léxico"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--queries", help="Arquivo JSONL com as perguntas e o acerto esperado"
+        )
+        parser.add_argument(
+            "--sample",
+            type=int,
+            default=50,
+            help="Perguntas geradas a partir do índice quando --queries não é usado",
+        )
+        parser.add_argument("--k", type=int, default=3)
+        parser.add_argument(
+            "--modes", nargs="+", choices=SEARCH_MODES, default=list(SEARCH_MODES)
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--json", action="store_true", help="Saída em JSON, uma linha por modo"
+        )
+
+    def handle(self, *args, **options):
+        if options["queries"]:
+            queries = load_queries(options["queries"])
+        else:
+            queries = sample_queries(
+                get_vectorstore(), options["sample"], options["seed"]
+            )
+        if not queries:
+            raise CommandError("Nenhuma pergunta para avaliar")
+
+        tool = RAGSearchTool()
+        k = options["k"]
+        results = [benchmark_mode(tool, queries, k, mode) for mode in options["modes"]]
+
+        if options["json"]:
+            for result in results:
+                self.stdout.write(json.dumps(result))
+            return
+
+        self.stdout.write(f"{len(queries)} perguntas, k={k}")
+        self.stdout.write(
+            f"{'modo':<10}{'recall@' + str(k):>10}{'mrr':>8}"
+            f"{'p50 (ms)':>11}{'p95 (ms)':>11}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:<10}{result['recall']:>10.3f}{result['mrr']:>8.3f}"
+                f"{result['latency_p50_ms']:>11.1f}{result['latency_p95_ms']:>11.1f}"
+            )
@@ -0,0 +1,245 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from chromadb.api.client import SharedSystemClient
+from django.core.management.base import BaseCommand, CommandError
+from langchain_chroma import Chroma
+from langchain_core.embeddings import FakeEmbeddings
+
+from chatbot.faiss_store import INDEX_FILE, FaissVectorStore
+from chatbot.vectorstore import get_vectorstore
+
+from .benchmark_rag_search import percentile
+
+# chroma é o armazenamento atual (float32 com HNSW); os demais são o backend FAISS
+STORES = ("chroma", "float32", "fp16", "int8")
+# Arquivos do HNSW do Chroma, carregados inteiros na memória de cada processo
+CHROMA_INDEX_FILES = ("data_level0.bin", "link_lists.bin", "length.bin", "header.bin")
+ADD_BATCH_SIZE = 1000
+
+
+def synthetic_vectors(size, dimension, seed, clusters=64):
+    """Vetores normalizados agrupados em tópicos, como os de chunks de manuais"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype("float32")
+    vectors = centers[rng.integers(0, clusters, size)]
+    vectors += 0.6 * rng.standard_normal((size, dimension)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def indexed_vectors(vectorstore, limit):
+    """Vetores float32 do índice atual, para medir com embeddings reais"""
+    if isinstance(vectorstore, FaissVectorStore):
+        rows = vectorstore._db.execute(
+            "SELECT faiss_id FROM chunks ORDER BY faiss_id LIMIT ?", (limit,)
+        ).fetchall()
+        return np.vstack(
+            [vectorstore.index.reconstruct(faiss_id) for (faiss_id,) in rows]
+        ).astype("float32")
+
+    batches = []
+    offset = 0
+    while offset < limit:
+        result = vectorstore._collection.get(
+            include=["embeddings"],
+            limit=min(ADD_BATCH_SIZE, limit - offset),
+            offset=offset,
+        )
+        if not len(result["embeddings"]):
+            break
+        batches.append(np.asarray(result["embeddings"], dtype="float32"))
+        offset += len(result["embeddings"])
+    vectors = np.vstack(batches)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def sample_queries(vectors, size, seed, noise=0.3):
+    """Perguntas próximas de chunks sorteados, com ruído"""
+    rng = np.random.default_rng(seed + 1)
+    queries = vectors[rng.integers(0, len(vectors), size)]
+    queries = queries + noise * rng.standard_normal(queries.shape).astype(
+        "float32"
+    ) / np.sqrt(vectors.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_neighbors(vectors, queries, k):
+    """Top-k exato por similaridade de cosseno, a referência do recall"""
+    scores = queries @ vectors.T
+    top = np.argpartition(-scores, k, axis=1)[:, :k]
+    return [set(int(i) for i in row) for row in top]
+
+
+def directory_size(path, names=None):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            if names is None or name in names:
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def build_store(store, path, vectors, index_type, rerank_factor):
+    """Cria o índice e o reabre como um worker da API o abriria"""
+    ids = [str(i) for i in range(len(vectors))]
+    texts = [f"chunk {i}" for i in ids]
+
+    if store == "chroma":
+        vectorstore = Chroma(collection_name="benchmark", persist_directory=path)
+        for i in range(0, len(vectors), ADD_BATCH_SIZE):
+            vectorstore._collection.add(
+                ids=ids[i : i + ADD_BATCH_SIZE],
+                embeddings=vectors[i : i + ADD_BATCH_SIZE],
+                documents=texts[i : i + ADD_BATCH_SIZE],
+            )
+        SharedSystemClient.clear_system_cache()
+        return Chroma(collection_name="benchmark", persist_directory=path)
+
+    options = {
+        "index_type": index_type,
+        "quantization": "none" if store == "float32" else store,
+        "rerank_factor": rerank_factor,
+    }
+    embedding = FakeEmbeddings(size=vectors.shape[1])
+    vectorstore = FaissVectorStore(path, embedding, **options)
+    for i in range(0, len(vectors), ADD_BATCH_SIZE):
+        vectorstore.add_embeddings(
+            texts[i : i + ADD_BATCH_SIZE],
+            vectors[i : i + ADD_BATCH_SIZE],
+            ids=ids[i : i + ADD_BATCH_SIZE],
+        )
+    vectorstore.persist()
+    return FaissVectorStore(path, embedding, **options)
+
+
+def search(vectorstore, query, k):
+    if isinstance(vectorstore, FaissVectorStore):
+        results = vectorstore.similarity_search_with_score_by_vector(query, k=k)
+    else:
+        results = vectorstore.similarity_search_by_vector_with_relevance_scores(
+            query, k=k
+        )
+    return [int(doc.id) for doc, _ in results]
+
+
+def benchmark_store(
+    store, vectors, queries, neighbors, k, index_type="flat", rerank_factor=4
+):
+    """Mede memória, disco, recall@k e latência de um tipo de armazenamento"""
+    path = tempfile.mkdtemp(prefix=f"benchmark_{store}_")
+    try:
+        start_time = time.perf_counter()
+        vectorstore = build_store(store, path, vectors, index_type, rerank_factor)
+        build_seconds = time.perf_counter() - start_time
+
+        recall = 0.0
+        latencies = []
+        for query, expected in zip(queries, neighbors):
+            start_time = time.perf_counter()
+            found = search(vectorstore, query.tolist(), k)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            recall += len(expected.intersection(found)) / k
+
+        if store == "chroma":
+            memory_bytes = directory_size(path, CHROMA_INDEX_FILES)
+        else:
+            memory_bytes = os.path.getsize(os.path.join(path, INDEX_FILE))
+            vectorstore._db.close()
+        return {
+            "store": store,
+            "vectors": len(vectors),
+            "dimension": vectors.shape[1],
+            "index_memory_bytes": memory_bytes,
+            "bytes_per_vector": memory_bytes / len(vectors),
+            "disk_bytes": directory_size(path),
+            "build_seconds": build_seconds,
+            "recall": recall / len(queries),
+            "latency_p50_ms": percentile(latencies, 0.5),
+            "latency_p95_ms": percentile(latencies, 0.95),
+        }
+    finally:
+        SharedSystemClient.clear_system_cache()
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara memória, disco, recall@k e latência do índice atual com o "
+        "FAISS em float32, fp16 e int8 com reordenação exata"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size", type=int, default=20000, help="Número de vetores indexados"
+        )
+        parser.add_argument(
+            "--dimension",
+            type=int,
+            default=1536,
+            help="Dimensão dos vetores sintéticos (a do text-embedding-3-small)",
+        )
+        parser.add_argument(
+            "--from-index",
+            action="store_true",
+            help="Usa os vetores do índice atual em vez de vetores sintéticos",
+        )
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=5)
+        parser.add_argument("--stores", nargs="+", choices=STORES, default=list(STORES))
+        parser.add_argument("--index-type", choices=("flat", "hnsw"), default="flat")
+        parser.add_argument("--rerank-factor", type=int, default=4)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--json", action="store_true", help="Saída em JSON, uma linha por tipo"
+        )
+
+    def handle(self, *args, **options):
+        if options["from_index"]:
+            vectors = indexed_vectors(get_vectorstore(), options["size"])
+        else:
+            vectors = synthetic_vectors(
+                options["size"], options["dimension"], options["seed"]
+            )
+        k = options["k"]
+        if len(vectors) <= k:
+            raise CommandError("O índice precisa ter mais vetores que o k avaliado")
+
+        queries = sample_queries(vectors, options["queries"], options["seed"])
+        neighbors = exact_neighbors(vectors, queries, k)
+        results = [
+            benchmark_store(
+                store,
+                vectors,
+                queries,
+                neighbors,
+                k,
+                index_type=options["index_type"],
+                rerank_factor=options["rerank_factor"],
+            )
+            for store in options["stores"]
+        ]
+
+        if options["json"]:
+            for result in results:
+                self.stdout.write(json.dumps(result))
+            return
+
+        self.stdout.write(
+            f"{len(vectors)} vetores de dimensão {vectors.shape[1]}, "
+            f"{len(queries)} perguntas, k={k}"
+        )
+        self.stdout.write(
+            f"{'armazenamento':<15}{'memória (MB)':>14}{'disco (MB)':>12}"
+            f"{'recall@' + str(k):>11}{'p50 (ms)':>11}{'p95 (ms)':>11}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['store']:<15}"
+                f"{result['index_memory_bytes'] / 2**20:>14.1f}"
+                f"{result['disk_bytes'] / 2**20:>12.1f}{result['recall']:>11.3f}"
+                f"{result['latency_p50_ms']:>11.1f}{result['latency_p95_ms']:>11.1f}"
+            )
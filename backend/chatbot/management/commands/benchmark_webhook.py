@@ -0,0 +1,320 @@
+import asyncio
+import json
+import time
+from contextlib import contextmanager
+from copy import copy
+
+import httpx
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot import message_buffer
+
+from .benchmark_rag_search import percentile
+
+WEBHOOK_PATH = "/api/chatbot/webhook/"
+
+
+class SimulatedAgent:
+    """Agente de mentira que só demora, como uma chamada ao LLM.
+
+    Só as conversas em slow_sessions demoram delay segundos; as outras
+    respondem na hora, para que a latência medida seja a do webhook. Com
+    blocking, o ainvoke dorme com time.sleep e trava o event loop, que é o
+    que acontecia com o invoke síncrono dentro do handle_debounce.
+    """
+
+    def __init__(self, delay, blocking=False):
+        self.delay = delay
+        self.blocking = blocking
+        self.slow_sessions = set()
+        self.in_flight = 0
+        self.completed = 0
+
+    async def ainvoke(self, input, config=None):
+        if config["configurable"]["session_id"] not in self.slow_sessions:
+            return {"output": "Resposta simulada"}
+        self.in_flight += 1
+        try:
+            if self.blocking:
+                time.sleep(self.delay)
+            else:
+                await asyncio.sleep(self.delay)
+            return {"output": "Resposta simulada"}
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+
+async def _send_nothing(number, text):
+    return None
+
+
+async def _allow_everyone(phone_number):
+    return True, ""
+
+
+def benchmark_admission(admission, limit, poll_interval):
+    """Limite de turnos do teste, com fila e vagas próprias no Redis"""
+    admission = copy(admission)
+    admission.key = f"{admission.key}:benchmark"
+    if limit is not None:
+        admission.limit = limit
+    admission.poll_interval = poll_interval
+    return admission
+
+
+@contextmanager
+def benchmark_settings(agent, debounce_seconds, poll_interval, max_agent_turns=None):
+    """Troca o agente, o envio ao WhatsApp e a permissão do message_buffer"""
+    overrides = {
+        "conversational_agent": agent,
+        "asend_whatsapp_message": _send_nothing,
+        "check_user_permission": _allow_everyone,
+        "DEBOUNCE_SECONDS": debounce_seconds,
+        "DEBOUNCE_POLL_INTERVAL": poll_interval,
+        # Agenda e fila próprias: os workers de verdade não pegam estes jobs
+        "DEBOUNCE_SCHEDULE_KEY": f"{message_buffer.DEBOUNCE_SCHEDULE_KEY}:benchmark",
+        "CHATBOT_STREAM_KEY": f"{message_buffer.CHATBOT_STREAM_KEY}:benchmark",
+        "agent_admission": benchmark_admission(
+            message_buffer.agent_admission, max_agent_turns, poll_interval
+        ),
+    }
+    previous = {name: getattr(message_buffer, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(message_buffer, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(message_buffer, name, value)
+
+
+def chat_id(index):
+    return f"5500{index:09d}@s.whatsapp.net"
+
+
+def webhook_payload(index, text="Mensagem de carga"):
+    return {
+        "data": {
+            "message": {"conversation": text},
+            "key": {"remoteJid": chat_id(index)},
+        }
+    }
+
+
+async def send_webhooks(client, chats, concurrency):
+    """Posta uma mensagem por chat, com até concurrency requisições ao mesmo tempo"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def send(index):
+        nonlocal errors
+        async with semaphore:
+            start_time = time.perf_counter()
+            response = await client.post(WEBHOOK_PATH, json=webhook_payload(index))
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            if response.status_code != 201:
+                errors += 1
+
+    await asyncio.gather(*(send(index) for index in chats))
+    return latencies, errors
+
+
+def phase_result(phase, latencies, errors, agent):
+    return {
+        "phase": phase,
+        "requests": len(latencies),
+        "errors": errors,
+        "pending_agent_calls": agent.in_flight,
+        "latency_p50_ms": percentile(latencies, 0.5),
+        "latency_p95_ms": percentile(latencies, 0.95),
+        "latency_p99_ms": percentile(latencies, 0.99),
+        "latency_max_ms": max(latencies),
+    }
+
+
+async def wait_for(condition, timeout, error):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise CommandError(error)
+        await asyncio.sleep(0.01)
+
+
+async def run_benchmark(
+    app, requests, concurrency, pending, agent, timeout, worker_concurrency
+):
+    """Mede o webhook sozinho e depois com pending chamadas ao agente em curso.
+
+    O worker da fila roda no mesmo event loop do webhook, como no
+    CHATBOT_INLINE_WORKER.
+    """
+    baseline_chats = range(requests)
+    load_chats = range(requests, 2 * requests)
+    pending_chats = range(2 * requests, 2 * requests + pending)
+    all_chats = [chat_id(index) for index in range(2 * requests + pending)]
+    agent.slow_sessions = {chat_id(index) for index in pending_chats}
+
+    stop = asyncio.Event()
+    worker = asyncio.create_task(
+        message_buffer.run_chatbot_worker(stop, concurrency=worker_concurrency)
+    )
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://localhost"
+    ) as client:
+        try:
+            latencies, errors = await send_webhooks(client, baseline_chats, concurrency)
+            results = [phase_result("baseline", latencies, errors, agent)]
+
+            # As mensagens das conversas lentas chegam junto com as medidas:
+            # as chamadas ao agente ficam pendentes durante a fase
+            load = asyncio.create_task(send_webhooks(client, load_chats, concurrency))
+            await asyncio.sleep(0)
+            await send_webhooks(client, pending_chats, concurrency)
+            latencies, errors = await load
+            results.append(phase_result("agent_pending", latencies, errors, agent))
+
+            # Espera o agente terminar para não deixar respostas para trás
+            await wait_for(
+                lambda: agent.completed >= pending,
+                timeout,
+                "As chamadas ao agente não terminaram dentro do --timeout",
+            )
+            return results
+        finally:
+            stop.set()
+            await worker
+            await message_buffer.redis_client.delete(
+                message_buffer.DEBOUNCE_SCHEDULE_KEY,
+                message_buffer.CHATBOT_STREAM_KEY,
+                *(f"{chat}{message_buffer.BUFFER_KEY_SUFIX}" for chat in all_chats),
+                *(message_buffer.lease_key(chat) for chat in all_chats),
+                *message_buffer.agent_admission.keys,
+            )
+
+
+class Command(BaseCommand):
+    help = (
+        "Teste de carga do webhook: latência (p50/p95/p99) sozinho e com "
+        "chamadas ao agente pendentes no mesmo event loop"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument(
+            "--pending",
+            type=int,
+            default=20,
+            help="Chamadas ao agente em curso durante a segunda fase",
+        )
+        parser.add_argument(
+            "--agent-delay",
+            type=float,
+            default=2.0,
+            help="Duração simulada de cada chamada ao agente, em segundos",
+        )
+        parser.add_argument(
+            "--debounce",
+            type=float,
+            default=0.0,
+            help="Debounce das mensagens durante o teste, em segundos",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=0.05,
+            help="Intervalo do agendador do debounce durante o teste",
+        )
+        parser.add_argument(
+            "--worker-concurrency",
+            type=int,
+            default=100,
+            help="Jobs respondidos ao mesmo tempo pelo worker do teste",
+        )
+        parser.add_argument(
+            "--max-agent-turns",
+            type=int,
+            help=(
+                "Turnos do agente ao mesmo tempo durante o teste (padrão: "
+                "AGENT_MAX_CONCURRENT_TURNS; 0 tira o limite)"
+            ),
+        )
+        parser.add_argument(
+            "--blocking",
+            action="store_true",
+            help="Simula o agente síncrono, que trava o event loop",
+        )
+        parser.add_argument(
+            "--max-p99-ratio",
+            type=float,
+            help="Falha se o p99 com o agente pendente passar desta razão do baseline",
+        )
+        parser.add_argument("--timeout", type=float, default=120.0)
+        parser.add_argument(
+            "--json", action="store_true", help="Saída em JSON, uma linha por fase"
+        )
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--requests e --concurrency precisam ser positivos")
+
+        agent = SimulatedAgent(options["agent_delay"], blocking=options["blocking"])
+        app = get_asgi_application()
+        with benchmark_settings(
+            agent,
+            options["debounce"],
+            options["poll_interval"],
+            options["max_agent_turns"],
+        ):
+            results = asyncio.run(self._run(app, agent, options))
+
+        if options["json"]:
+            for result in results:
+                self.stdout.write(json.dumps(result))
+        else:
+            self._write_table(results, options)
+
+        baseline, loaded = results
+        ratio = loaded["latency_p99_ms"] / max(baseline["latency_p99_ms"], 1e-9)
+        if options["max_p99_ratio"] is not None and ratio > options["max_p99_ratio"]:
+            raise CommandError(
+                f"p99 com o agente pendente {loaded['latency_p99_ms']:.1f} ms é "
+                f"{ratio:.1f}x o baseline ({baseline['latency_p99_ms']:.1f} ms)"
+            )
+
+    async def _run(self, app, agent, options):
+        try:
+            await message_buffer.redis_client.ping()
+        except Exception as e:
+            raise CommandError(f"Redis indisponível em REDIS_URL: {e}") from e
+        return await run_benchmark(
+            app,
+            options["requests"],
+            options["concurrency"],
+            options["pending"],
+            agent,
+            options["timeout"],
+            options["worker_concurrency"],
+        )
+
+    def _write_table(self, results, options):
+        mode = "bloqueante" if options["blocking"] else "assíncrono"
+        self.stdout.write(
+            f"{options['requests']} requisições por fase, concorrência "
+            f"{options['concurrency']}, agente {mode} de {options['agent_delay']}s"
+        )
+        self.stdout.write(
+            f"{'fase':<15}{'reqs':>6}{'erros':>7}{'agente':>8}"
+            f"{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'max (ms)':>10}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['phase']:<15}{result['requests']:>6}{result['errors']:>7}"
+                f"{result['pending_agent_calls']:>8}"
+                f"{result['latency_p50_ms']:>10.1f}{result['latency_p95_ms']:>10.1f}"
+                f"{result['latency_p99_ms']:>10.1f}{result['latency_max_ms']:>10.1f}"
+            )
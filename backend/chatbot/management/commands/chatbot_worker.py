@@ -0,0 +1,55 @@
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+from prometheus_client import start_http_server
+
+from chatbot.config import CHATBOT_WORKER_CONCURRENCY, CHATBOT_WORKER_METRICS_PORT
+from chatbot.message_buffer import run_chatbot_worker
+from chatbot.vectorstore import warm_up_vectorstore
+
+
+class Command(BaseCommand):
+    help = (
+        "Consome a fila de jobs do chatbot (Redis Streams) e responde as "
+        "conversas; rode quantos processos forem precisos"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=CHATBOT_WORKER_CONCURRENCY,
+            help="Conversas respondidas ao mesmo tempo por este processo",
+        )
+        parser.add_argument(
+            "--shutdown-timeout",
+            type=float,
+            default=30.0,
+            help="Segundos esperando as respostas em andamento ao encerrar",
+        )
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=CHATBOT_WORKER_METRICS_PORT,
+            help="Porta do /metrics do Prometheus deste processo (0 desliga)",
+        )
+
+    def handle(self, *args, **options):
+        if options["metrics_port"]:
+            # O worker não passa pelo django_prometheus: expõe as métricas à parte
+            start_http_server(options["metrics_port"])
+        # Os turnos do agente (e o rag_search) rodam aqui: carrega o índice
+        # antes de consumir a fila
+        warm_up_vectorstore()
+        asyncio.run(self._run(options["concurrency"], options["shutdown_timeout"]))
+        self.stdout.write("Worker encerrado")
+
+    async def _run(self, concurrency, shutdown_timeout):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await run_chatbot_worker(
+            stop, concurrency=concurrency, shutdown_timeout=shutdown_timeout
+        )
@@ -0,0 +1,91 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.chunking import chunk_stats
+from chatbot.vectorstore import lazy_load_file, list_rag_files, split_documents
+
+STRATEGIES = ("characters", "tokens")
+
+
+def compare_chunking(files, strategies=STRATEGIES):
+    """Divide os arquivos com cada estratégia e resume chunks e tokens por tipo.
+
+    Retorna uma linha por estratégia e tipo de documento, mais uma com o
+    total ("all") de cada estratégia. Nada é gravado nem enviado à API.
+    """
+    results = []
+    for strategy in strategies:
+        chunks_by_type = {}
+        files_by_type = {}
+        for path in files:
+            chunks = list(split_documents(lazy_load_file(path), strategy))
+            doc_type = os.path.splitext(path)[1].lstrip(".").lower()
+            chunks_by_type.setdefault(doc_type, []).extend(chunks)
+            files_by_type[doc_type] = files_by_type.get(doc_type, 0) + 1
+
+        all_chunks = [c for chunks in chunks_by_type.values() for c in chunks]
+        for doc_type, chunks in [*sorted(chunks_by_type.items()), ("all", all_chunks)]:
+            results.append(
+                {
+                    "strategy": strategy,
+                    "doc_type": doc_type,
+                    "files": (
+                        len(files) if doc_type == "all" else files_by_type[doc_type]
+                    ),
+                    **chunk_stats(chunks),
+                }
+            )
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara o número de chunks e os tokens por chunk do splitter por "
+        "caracteres com o splitter por tokens e estrutura, por tipo de documento"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths",
+            nargs="*",
+            help="Arquivos a dividir (padrão: os de RAG_FILES_DIR e processed)",
+        )
+        parser.add_argument(
+            "--strategies", nargs="+", choices=STRATEGIES, default=list(STRATEGIES)
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Saída em JSON, uma linha por tipo"
+        )
+
+    def handle(self, *args, **options):
+        files = options["paths"] or list(list_rag_files().values())
+        if not files:
+            raise CommandError("Nenhum arquivo para dividir")
+
+        results = compare_chunking(files, options["strategies"])
+        if options["json"]:
+            for result in results:
+                self.stdout.write(json.dumps(result))
+            return
+
+        self.stdout.write(
+            f"{'estratégia':<12}{'tipo':<6}{'arquivos':>9}{'chunks':>9}"
+            f"{'média tokens':>14}{'p95':>7}{'máx':>7}{'total tokens':>14}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['strategy']:<12}{result['doc_type']:<6}"
+                f"{result['files']:>9}{result['chunks']:>9}"
+                f"{result['avg_tokens']:>14.1f}{result['p95_tokens']:>7}"
+                f"{result['max_tokens']:>7}{result['total_tokens']:>14}"
+            )
+
+        totals = {r["strategy"]: r for r in results if r["doc_type"] == "all"}
+        if set(STRATEGIES) <= set(totals) and totals["characters"]["chunks"]:
+            before, after = totals["characters"], totals["tokens"]
+            self.stdout.write(
+                f"Chunks: {before['chunks']} -> {after['chunks']} "
+                f"({after['chunks'] / before['chunks'] - 1:+.0%})"
+            )
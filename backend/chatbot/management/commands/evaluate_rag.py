@@ -0,0 +1,309 @@
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from chromadb.api.client import SharedSystemClient
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot import retrieval_cache, vectorstore
+from chatbot.config import (
+    RAG_CHUNK_OVERLAP,
+    RAG_CHUNK_OVERLAP_TOKENS,
+    RAG_CHUNK_SIZE,
+    RAG_CHUNK_TOKENS,
+    RAG_CHUNKING,
+)
+from chatbot.tools import RAGSearchTool
+
+from .benchmark_rag_search import SEARCH_MODES, benchmark_mode, load_queries
+from .benchmark_vector_storage import directory_size
+
+BENCHMARK_DIR = os.path.join(settings.BASE_DIR, "benchmarks", "rag")
+# Métricas comparadas com o --baseline; maior é melhor
+QUALITY_METRICS = ("recall", "mrr")
+CHUNKING_STRATEGIES = ("tokens", "characters")
+# Tamanho e sobreposição padrão de cada estratégia, na unidade dela
+DEFAULT_CHUNK_SIZES = {"tokens": RAG_CHUNK_TOKENS, "characters": RAG_CHUNK_SIZE}
+DEFAULT_CHUNK_OVERLAPS = {
+    "tokens": RAG_CHUNK_OVERLAP_TOKENS,
+    "characters": RAG_CHUNK_OVERLAP,
+}
+
+
+@contextmanager
+def evaluation_settings(**overrides):
+    """Aponta o vectorstore deste processo para um índice temporário.
+
+    Troca as configurações lidas por chatbot.vectorstore e desliga os
+    caches, para que cada configuração avaliada seja indexada do zero e as
+    buscas não venham do cache de uma rodada anterior.
+    """
+    overrides = {
+        "_vectorstore": None,
+        "_vectorstore_key": None,
+        "_lexical_index": None,
+        "_lexical_index_key": None,
+        "_lexical_index_loading": None,
+        "_index_version_cache": (None, 0),
+        "RAG_INGESTION_MODE": "incremental",
+        "RAG_LOADER_WORKERS": 0,
+        "RAG_CACHE_ENABLED": False,
+        "EMBEDDING_CACHE_ENABLED": False,
+        **overrides,
+    }
+    previous = {name: getattr(vectorstore, name) for name in overrides}
+    previous_cache = retrieval_cache.RAG_CACHE_ENABLED
+    for name, value in overrides.items():
+        setattr(vectorstore, name, value)
+    retrieval_cache.RAG_CACHE_ENABLED = False
+    try:
+        yield
+    finally:
+        if vectorstore._lexical_index is not None:
+            vectorstore._lexical_index.close()
+        for name, value in previous.items():
+            setattr(vectorstore, name, value)
+        retrieval_cache.RAG_CACHE_ENABLED = previous_cache
+
+
+def chunking_settings(chunking, chunk_size, chunk_overlap):
+    """Configurações do splitter; o tamanho é em tokens ou em caracteres"""
+    if chunking == "tokens":
+        return {
+            "RAG_CHUNKING": chunking,
+            "RAG_CHUNK_TOKENS": chunk_size,
+            "RAG_CHUNK_OVERLAP_TOKENS": chunk_overlap,
+        }
+    return {
+        "RAG_CHUNKING": chunking,
+        "RAG_CHUNK_SIZE": chunk_size,
+        "RAG_CHUNK_OVERLAP": chunk_overlap,
+    }
+
+
+def evaluate_configuration(
+    corpus,
+    queries,
+    backend,
+    chunk_size,
+    chunk_overlap,
+    ks,
+    modes,
+    embedding,
+    chunking="characters",
+):
+    """Indexa o corpus numa configuração e mede cada combinação de k e modo"""
+    store_path = tempfile.mkdtemp(prefix="evaluate_rag_")
+    try:
+        with evaluation_settings(
+            VECTOR_STORE_PATH=store_path,
+            RAG_FILES_DIR=corpus,
+            RAG_VECTOR_BACKEND=backend,
+            RAG_EMBEDDING_PROVIDER=embedding,
+            **chunking_settings(chunking, chunk_size, chunk_overlap),
+        ):
+            start_time = time.perf_counter()
+            vectorstore.ingest_vectorstore()
+            build_seconds = time.perf_counter() - start_time
+            chunks = vectorstore.count_chunks(vectorstore.get_vectorstore())
+            index_bytes = directory_size(store_path)
+
+            tool = RAGSearchTool()
+            results = []
+            for k, mode in itertools.product(ks, modes):
+                result = benchmark_mode(tool, queries, k, mode)
+                results.append(
+                    {
+                        "backend": backend,
+                        "embedding": embedding,
+                        "chunking": chunking,
+                        "chunk_size": chunk_size,
+                        "chunk_overlap": chunk_overlap,
+                        "k": k,
+                        **result,
+                        "chunks": chunks,
+                        "build_seconds": build_seconds,
+                        "index_bytes": index_bytes,
+                    }
+                )
+            return results
+    finally:
+        SharedSystemClient.clear_system_cache()
+        shutil.rmtree(store_path, ignore_errors=True)
+
+
+def result_key(result):
+    return (
+        result["backend"],
+        result["embedding"],
+        # Referências anteriores ao splitter por tokens usavam caracteres
+        result.get("chunking", "characters"),
+        result["chunk_size"],
+        result["chunk_overlap"],
+        result["k"],
+        result["mode"],
+    )
+
+
+def find_regressions(results, baseline, tolerance):
+    """Métricas de qualidade que caíram mais que tolerance em relação à referência"""
+    reference = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        expected = reference.get(result_key(result))
+        if expected is None:
+            continue
+        for metric in QUALITY_METRICS:
+            if result[metric] < expected[metric] - tolerance:
+                regressions.append(
+                    f"{'/'.join(map(str, result_key(result)))}: {metric} "
+                    f"{result[metric]:.3f} < {expected[metric]:.3f}"
+                )
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Avalia a recuperação do RAG num corpus fixo com perguntas rotuladas: "
+        "recall@k, MRR, latência, tempo de indexação e tamanho do índice"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--corpus",
+            default=os.path.join(BENCHMARK_DIR, "corpus"),
+            help="Pasta com os documentos indexados na avaliação",
+        )
+        parser.add_argument(
+            "--questions",
+            default=os.path.join(BENCHMARK_DIR, "questions.jsonl"),
+            help="Arquivo JSONL com as perguntas e o acerto esperado",
+        )
+        parser.add_argument(
+            "--backends", nargs="+", choices=("chroma", "faiss"), default=["chroma"]
+        )
+        parser.add_argument(
+            "--chunking",
+            nargs="+",
+            choices=CHUNKING_STRATEGIES,
+            default=[RAG_CHUNKING],
+            help="Splitter por tokens e estrutura ou por caracteres",
+        )
+        parser.add_argument(
+            "--chunk-sizes",
+            nargs="+",
+            type=int,
+            help="Em tokens ou caracteres, conforme o --chunking (padrão: o configurado)",
+        )
+        parser.add_argument("--chunk-overlaps", nargs="+", type=int)
+        parser.add_argument("--k", nargs="+", type=int, default=[3])
+        parser.add_argument(
+            "--modes", nargs="+", choices=SEARCH_MODES, default=list(SEARCH_MODES)
+        )
+        parser.add_argument(
+            "--embedding",
+            choices=("hashing", "local", "openai"),
+            default="hashing",
+            help="Provider de embeddings; hashing é determinístico e não usa rede",
+        )
+        parser.add_argument(
+            "--baseline",
+            help="Saída --json de uma execução anterior; falha se a qualidade cair",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.02,
+            help="Queda máxima de recall e MRR aceita em relação ao --baseline",
+        )
+        parser.add_argument("--min-recall", type=float)
+        parser.add_argument("--min-mrr", type=float)
+        parser.add_argument(
+            "--json", action="store_true", help="Saída em JSON, uma linha por rodada"
+        )
+
+    def handle(self, *args, **options):
+        queries = load_queries(options["questions"])
+        if not queries:
+            raise CommandError("Nenhuma pergunta para avaliar")
+
+        configurations = [
+            (backend, chunking, chunk_size, chunk_overlap)
+            for backend, chunking in itertools.product(
+                options["backends"], options["chunking"]
+            )
+            for chunk_size, chunk_overlap in itertools.product(
+                options["chunk_sizes"] or [DEFAULT_CHUNK_SIZES[chunking]],
+                options["chunk_overlaps"] or [DEFAULT_CHUNK_OVERLAPS[chunking]],
+            )
+        ]
+        results = []
+        for backend, chunking, chunk_size, chunk_overlap in configurations:
+            if chunk_overlap >= chunk_size:
+                raise CommandError(
+                    f"Sobreposição {chunk_overlap} precisa ser menor que o chunk "
+                    f"de {chunk_size}"
+                )
+            results.extend(
+                evaluate_configuration(
+                    options["corpus"],
+                    queries,
+                    backend,
+                    chunk_size,
+                    chunk_overlap,
+                    options["k"],
+                    options["modes"],
+                    options["embedding"],
+                    chunking=chunking,
+                )
+            )
+
+        if options["json"]:
+            for result in results:
+                self.stdout.write(json.dumps(result))
+        else:
+            self._write_table(results, len(queries))
+
+        failures = []
+        if options["baseline"]:
+            failures.extend(
+                find_regressions(
+                    results, load_queries(options["baseline"]), options["tolerance"]
+                )
+            )
+        for metric in QUALITY_METRICS:
+            minimum = options[f"min_{metric}"]
+            if minimum is not None:
+                failures.extend(
+                    f"{'/'.join(map(str, result_key(result)))}: {metric} "
+                    f"{result[metric]:.3f} < {minimum:.3f}"
+                    for result in results
+                    if result[metric] < minimum
+                )
+        if failures:
+            raise CommandError(
+                "Regressão na qualidade da recuperação:\n" + "\n".join(failures)
+            )
+
+    def _write_table(self, results, total_queries):
+        self.stdout.write(f"{total_queries} perguntas")
+        self.stdout.write(
+            f"{'backend':<8}{'splitter':<11}{'chunk':>7}{'overlap':>9}{'k':>4} "
+            f"{'modo':<9}"
+            f"{'recall':>8}{'mrr':>7}{'p50 (ms)':>10}{'p95 (ms)':>10}"
+            f"{'chunks':>8}{'build (s)':>11}{'índice (KB)':>13}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['backend']:<8}{result['chunking']:<11}{result['chunk_size']:>7}"
+                f"{result['chunk_overlap']:>9}{result['k']:>4} {result['mode']:<9}"
+                f"{result['recall']:>8.3f}{result['mrr']:>7.3f}"
+                f"{result['latency_p50_ms']:>10.1f}{result['latency_p95_ms']:>10.1f}"
+                f"{result['chunks']:>8}{result['build_seconds']:>11.2f}"
+                f"{result['index_bytes'] / 1024:>13.0f}"
+            )
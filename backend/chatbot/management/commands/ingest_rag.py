@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot.vectorstore import (
+    estimate_ingestion,
+    ingest_vectorstore,
+    rebuild_vectorstore,
+)
+
+
+class ProgressReporter:
+    """Acumula os eventos da ingestão e escreve o progresso periodicamente"""
+
+    def __init__(self, write, interval=5.0):
+        self.write = write
+        self.interval = interval
+        self.files_total = 0
+        self.files_done = 0
+        self.files_failed = 0
+        self.chunks = 0
+        self.resumed = 0
+        self.tokens = 0
+        self.start_time = time.monotonic()
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, event, **info):
+        # Os lotes terminam nas threads do scheduler
+        with self._lock:
+            if event == "queued":
+                self.files_total += info["files"]
+            elif event == "resumed":
+                self.resumed += info["chunks"]
+            elif event == "batch":
+                self.chunks += info["chunks"]
+                self.tokens += info["tokens"]
+            elif event == "file":
+                self.files_done += 1
+            elif event == "failed":
+                self.files_failed += 1
+
+            now = time.monotonic()
+            if event in ("file", "failed") or now - self._last_report >= self.interval:
+                self._last_report = now
+                self.write(self.summary())
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.start_time, 1e-9)
+        return (
+            f"[{elapsed:7.1f}s] arquivos {self.files_done + self.files_failed}"
+            f"/{self.files_total} ({self.files_failed} com falha) | "
+            f"chunks {self.chunks} (+{self.resumed} retomados) | "
+            f"tokens {self.tokens} | {self.chunks / elapsed:.1f} chunks/s, "
+            f"{self.tokens / elapsed:.0f} tokens/s"
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Cria ou atualiza o índice RAG com os arquivos de RAG_FILES_DIR. "
+        "Uma execução interrompida retoma do último lote gravado."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Só estima arquivos, chunks e tokens, sem indexar nem chamar a API",
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help=(
+                "Reindexa todos os arquivos numa coleção nova e troca a ativa; "
+                "necessário ao mudar metadados, chunking ou quantização"
+            ),
+        )
+        parser.add_argument(
+            "--progress-interval",
+            type=float,
+            default=5.0,
+            help="Segundos entre as linhas de progresso",
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Estimativa do --dry-run em JSON"
+        )
+
+    def handle(self, *args, **options):
+        if options["dry_run"]:
+            estimate = estimate_ingestion()
+            if options["json"]:
+                self.stdout.write(json.dumps(estimate))
+                return
+
+            self.stdout.write(
+                f"{estimate['files']} arquivos: {estimate['index']} a indexar, "
+                f"{estimate['unchanged']} sem alteração, {estimate['removed']} "
+                f"removidos, {estimate['moved']} movidos, {estimate['failed']} "
+                "com erro de leitura"
+            )
+            self.stdout.write(
+                f"{estimate['chunks']} chunks ({estimate['resumed']} já gravados), "
+                f"{estimate['duplicates']} duplicados descartados, "
+                f"~{estimate['tokens']} tokens para o embedding"
+            )
+            return
+
+        reporter = ProgressReporter(self.stdout.write, options["progress_interval"])
+        if options["rebuild"]:
+            rebuild_vectorstore(progress=reporter)
+        else:
+            ingest_vectorstore(progress=reporter)
+        self.stdout.write(
+            self.style.SUCCESS(f"Ingestão concluída {reporter.summary()}")
+        )
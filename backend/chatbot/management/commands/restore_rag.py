@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.snapshot import SnapshotError
+from chatbot.vectorstore import restore_vectorstore_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Restaura um snapshot gravado pelo snapshot_rag em VECTOR_STORE_PATH, "
+        "conferindo os checksums antes de trocar qualquer arquivo"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("archive", help="Arquivo .tar do snapshot")
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Substitui o índice existente em VECTOR_STORE_PATH",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            snapshot_info = restore_vectorstore_snapshot(
+                options["archive"], force=options["force"]
+            )
+        except SnapshotError as e:
+            raise CommandError(str(e)) from e
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Índice restaurado: coleção {snapshot_info['collection']} "
+                f"v{snapshot_info['index_version']}, {snapshot_info['chunks']} chunks"
+            )
+        )
@@ -0,0 +1,32 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.snapshot import SnapshotError
+from chatbot.vectorstore import create_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Grava o índice RAG atual (vetores, metadados, índice léxico e manifesto) "
+        "num único arquivo, para subir novas réplicas sem reindexar"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("archive", help="Arquivo .tar do snapshot")
+
+    def handle(self, *args, **options):
+        archive_path = options["archive"]
+        try:
+            snapshot_info = create_snapshot(archive_path)
+        except SnapshotError as e:
+            raise CommandError(str(e)) from e
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Snapshot {archive_path}: coleção {snapshot_info['collection']} "
+                f"v{snapshot_info['index_version']}, {snapshot_info['chunks']} chunks, "
+                f"{len(snapshot_info['files'])} arquivos, "
+                f"{os.path.getsize(archive_path) / 2**20:.1f} MB"
+            )
+        )
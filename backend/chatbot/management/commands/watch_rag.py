@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.config import RAG_INGESTION_MODE
+from chatbot.rag_watcher import RagFilesWatcher
+
+
+class Command(BaseCommand):
+    help = (
+        "Observa RAG_FILES_DIR, indexa os arquivos novos e os move para "
+        "processed/; a API recarrega o índice sem reiniciar"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval", type=float, help="Segundos entre as varreduras da pasta"
+        )
+        parser.add_argument(
+            "--debounce",
+            type=float,
+            help="Segundos sem alterações antes de iniciar a ingestão",
+        )
+
+    def handle(self, *args, **options):
+        if RAG_INGESTION_MODE != "incremental":
+            raise CommandError(
+                "O watch_rag precisa de RAG_INGESTION_MODE=incremental para "
+                "indexar só os arquivos novos"
+            )
+
+        watcher = RagFilesWatcher(
+            interval=options["interval"], debounce=options["debounce"]
+        )
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            # Uma ingestão interrompida é retomada do checkpoint na próxima execução
+            self.stdout.write("Watcher encerrado")
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Um manifesto e um checkpoint por coleção, como os demais índices
+MANIFEST_DIR = "manifests"
+CHECKPOINT_DIR = "checkpoints"
+# Formato antigo: um arquivo só, de qualquer coleção
+MANIFEST_FILE = "manifest.json"
+CHECKPOINT_FILE = "ingest_checkpoint.json"
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Calcula o hash SHA-256 do conteúdo de um arquivo"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IndexManifest:
+    """Manifesto dos arquivos indexados no vectorstore.
+
+    Para cada arquivo guarda tamanho, mtime, hash do conteúdo, a
+    configuração de chunking e os ids dos chunks gravados, o que permite
+    reprocessar apenas o que mudou. A versão do índice é incrementada a
+    cada alteração aplicada.
+    """
+
+    def __init__(self, path, collection=None, version=0, files=None):
+        self.path = path
+        self.collection = collection
+        self.version = version
+        self.files = files or {}
+
+    @classmethod
+    def load(cls, path, collection=None):
+        """Lê o manifesto do disco; retorna um vazio se não existir ou for de outra coleção"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(path, collection=collection)
+        except (OSError, ValueError) as e:
+            logger.error(f"Manifesto inválido em {path}, ignorando: {e}")
+            return cls(path, collection=collection)
+
+        if collection and data.get("collection") != collection:
+            logger.info(
+                f"Manifesto pertence à coleção {data.get('collection')}, "
+                f"iniciando um novo para {collection}"
+            )
+            return cls(path, collection=collection, version=data.get("version", 0))
+
+        return cls(
+            path,
+            collection=data.get("collection", collection),
+            version=data.get("version", 0),
+            files=data.get("files", {}),
+        )
+
+    def save(self):
+        """Grava o manifesto de forma atômica"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": self.version,
+                    "collection": self.collection,
+                    "updated_at": time.time(),
+                    "files": self.files,
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        os.replace(tmp_path, self.path)
+
+    def is_unchanged(self, key, stat, chunking=None):
+        """Verifica pelo tamanho e mtime se o arquivo continua igual ao indexado.
+
+        Com chunking, o arquivo também precisa ter sido dividido com essa
+        configuração; entradas antigas, sem o registro, são aceitas.
+        """
+        entry = self.files.get(key)
+        return bool(
+            entry
+            and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime
+            and self.same_chunking(entry, chunking)
+        )
+
+    @staticmethod
+    def same_chunking(entry, chunking):
+        return chunking is None or entry.get("chunking", chunking) == chunking
+
+    def find_by_hash(self, sha256):
+        """Retorna a chave de um arquivo indexado com o mesmo conteúdo"""
+        for key, entry in self.files.items():
+            if entry["sha256"] == sha256:
+                return key
+        return None
+
+    def record(self, key, stat, sha256, chunk_ids, chunking=None):
+        self.files[key] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": sha256,
+            "chunk_ids": list(chunk_ids),
+            "indexed_at": time.time(),
+        }
+        if chunking is not None:
+            self.files[key]["chunking"] = chunking
+
+    def remove(self, key):
+        return self.files.pop(key, None)
+
+
+class IngestionCheckpoint:
+    """Chunks já gravados de arquivos cuja indexação ainda não terminou.
+
+    Cada lote confirmado pelo vectorstore é registrado aqui antes de o
+    arquivo entrar no manifesto. Uma ingestão interrompida retoma o arquivo
+    sem reenviar esses chunks, desde que o conteúdo e a configuração de
+    chunking não tenham mudado.
+    """
+
+    def __init__(self, path, collection=None, files=None):
+        self.path = path
+        self.collection = collection
+        self.files = files or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, collection=None):
+        """Lê o checkpoint do disco; retorna um vazio se não existir ou for de outra coleção"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(path, collection=collection)
+        except (OSError, ValueError) as e:
+            logger.error(f"Checkpoint inválido em {path}, ignorando: {e}")
+            return cls(path, collection=collection)
+
+        if collection and data.get("collection") != collection:
+            return cls(path, collection=collection)
+        return cls(path, collection=collection, files=data.get("files", {}))
+
+    def save(self):
+        """Grava o checkpoint de forma atômica"""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "collection": self.collection,
+                        "updated_at": time.time(),
+                        "files": self.files,
+                    },
+                    f,
+                    ensure_ascii=False,
+                )
+            os.replace(tmp_path, self.path)
+
+    def committed(self, key, sha256, chunking=None):
+        """Ids já gravados do arquivo, se o checkpoint for do mesmo conteúdo"""
+        with self._lock:
+            entry = self.files.get(key)
+            if (
+                entry
+                and entry["sha256"] == sha256
+                and entry.get("chunking") == chunking
+            ):
+                return set(entry["chunk_ids"])
+            return set()
+
+    def add(self, key, sha256, chunk_ids, chunking=None):
+        with self._lock:
+            entry = self.files.get(key)
+            if (
+                not entry
+                or entry["sha256"] != sha256
+                or entry.get("chunking") != chunking
+            ):
+                entry = self.files[key] = {
+                    "sha256": sha256,
+                    "chunking": chunking,
+                    "chunk_ids": [],
+                }
+            entry["chunk_ids"].extend(chunk_ids)
+
+    def discard(self, key):
+        with self._lock:
+            return self.files.pop(key, None)
+
+    def remove(self):
+        """Apaga o checkpoint ao fim de uma ingestão completa"""
+        with self._lock:
+            self.files = {}
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
@@ -1,10 +1,67 @@
+import asyncio
+import json
+
+import redis.asyncio as redis
 from langchain_community.chat_message_histories import RedisChatMessageHistory
+from langchain_core.messages import messages_from_dict, message_to_dict
 
 from .config import REDIS_URL
 
+HISTORY_KEY_PREFIX = "message_store:"
+
+# Clientes assíncronos por event loop e URL, compartilhados entre as sessões
+_async_clients = {}
+
+
+def get_async_redis_client(url):
+    loop = asyncio.get_running_loop()
+    if (loop, url) not in _async_clients:
+        # Loops já encerrados (ex.: testes) não voltam a ser usados
+        for key in [key for key in _async_clients if key[0].is_closed()]:
+            del _async_clients[key]
+        _async_clients[loop, url] = redis.Redis.from_url(url)
+    return _async_clients[loop, url]
+
+
+class AsyncRedisChatMessageHistory(RedisChatMessageHistory):
+    """Histórico da conversa no Redis com leitura e escrita assíncronas.
+
+    Usa as mesmas chaves e o mesmo formato do RedisChatMessageHistory, então
+    as conversas já gravadas continuam valendo. O ainvoke do agente chama
+    as versões assíncronas, que não bloqueiam o event loop do worker.
+    """
+
+    def __init__(self, session_id, url, key_prefix=HISTORY_KEY_PREFIX, ttl=None):
+        super().__init__(session_id=session_id, url=url, key_prefix=key_prefix, ttl=ttl)
+        self.url = url
+
+    @property
+    def async_redis_client(self):
+        return get_async_redis_client(self.url)
+
+    async def aget_messages(self):
+        items = await self.async_redis_client.lrange(self.key, 0, -1)
+        # As mensagens são empilhadas com LPUSH: a mais recente vem primeiro
+        return messages_from_dict([json.loads(item) for item in items[::-1]])
+
+    async def aadd_messages(self, messages):
+        if not messages:
+            return
+        async with self.async_redis_client.pipeline(transaction=True) as pipe:
+            pipe.lpush(
+                self.key,
+                *[json.dumps(message_to_dict(message)) for message in messages]
+            )
+            if self.ttl:
+                pipe.expire(self.key, self.ttl)
+            await pipe.execute()
+
+    async def aclear(self):
+        await self.async_redis_client.delete(self.key)
+
 
 def get_session_history(session_id):
-    return RedisChatMessageHistory(
+    return AsyncRedisChatMessageHistory(
         session_id=session_id,
         url=REDIS_URL,
     )
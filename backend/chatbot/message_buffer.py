@@ -1,17 +1,153 @@
 import asyncio
 import logging
-from collections import defaultdict
+import time
+import uuid
+from contextlib import asynccontextmanager
 
 import redis.asyncio as redis
 from asgiref.sync import sync_to_async
 
-from .chains import get_conversational_agent
-from .config import BUFFER_KEY_SUFIX, BUFFER_TTL, DEBOUNCE_SECONDS, REDIS_URL
-from .evolution_api import send_whatsapp_message
+from .admission import OVERLOAD_POLICIES, AdmissionControl, Overloaded
+from .chains import get_conversational_agent, get_degraded_agent
+from .config import (
+    AGENT_ADMISSION_KEY,
+    AGENT_ADMISSION_POLL_INTERVAL,
+    AGENT_ADMISSION_QUEUE_SIZE,
+    AGENT_ADMISSION_RETRY_SECONDS,
+    AGENT_ADMISSION_TIMEOUT,
+    AGENT_BUSY_MESSAGE,
+    AGENT_DEGRADED_MAX_CONCURRENT_TURNS,
+    AGENT_MAX_CONCURRENT_TURNS,
+    AGENT_OVERLOAD_POLICY,
+    AGENT_PRIORITY_BOOST_SECONDS,
+    AGENT_SHORT_MESSAGE_CHARS,
+    BUFFER_KEY_SUFIX,
+    BUFFER_TTL,
+    CHATBOT_INLINE_WORKER,
+    CHATBOT_JOB_MAX_DELIVERIES,
+    CHATBOT_JOB_TIMEOUT,
+    CHATBOT_STREAM_GROUP,
+    CHATBOT_STREAM_KEY,
+    CHATBOT_STREAM_MAXLEN,
+    CHATBOT_WORKER_CONCURRENCY,
+    DEBOUNCE_BATCH_SIZE,
+    DEBOUNCE_LEASE_SECONDS,
+    DEBOUNCE_POLL_INTERVAL,
+    DEBOUNCE_SCHEDULE_KEY,
+    DEBOUNCE_SECONDS,
+    REDIS_URL,
+)
+from .evolution_api import asend_whatsapp_message
+from .job_queue import StreamWorker
+from .memory import HISTORY_KEY_PREFIX
+from .metrics import track_agent_overload
+
+if AGENT_OVERLOAD_POLICY not in OVERLOAD_POLICIES:
+    raise ValueError(f"AGENT_OVERLOAD_POLICY inválido: {AGENT_OVERLOAD_POLICY}")
 
 redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
 conversational_agent = get_conversational_agent()
-debounce_tasks = defaultdict(asyncio.Task)
+degraded_agent = get_degraded_agent() if AGENT_OVERLOAD_POLICY == "degrade" else None
+
+# Limite global dos turnos do agente, compartilhado por todos os workers
+agent_admission = AdmissionControl(
+    redis_client,
+    AGENT_ADMISSION_KEY,
+    AGENT_MAX_CONCURRENT_TURNS,
+    queue_size=AGENT_ADMISSION_QUEUE_SIZE,
+    timeout=AGENT_ADMISSION_TIMEOUT,
+    slot_ttl=DEBOUNCE_LEASE_SECONDS,
+    poll_interval=AGENT_ADMISSION_POLL_INTERVAL,
+)
+# O agente reduzido tem o seu próprio limite e não espera: sem vaga, a
+# resposta é o AGENT_BUSY_MESSAGE
+degraded_admission = AdmissionControl(
+    redis_client,
+    f"{AGENT_ADMISSION_KEY}:degraded",
+    AGENT_DEGRADED_MAX_CONCURRENT_TURNS,
+    queue_size=0,
+    timeout=0,
+    slot_ttl=DEBOUNCE_LEASE_SECONDS,
+)
+
+# Guarda a mensagem, renova o TTL do buffer e recomeça o debounce numa ida
+# só ao Redis, sem janela entre os três passos.
+# KEYS: buffer, agenda; ARGV: mensagem, ttl, chat_id, prazo
+BUFFER_SCRIPT = """
+local size = redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[3])
+return size
+"""
+
+# Passa uma conversa vencida da agenda para a fila de jobs, uma vez só mesmo
+# com o agendador rodando em vários workers.
+# KEYS: agenda, stream; ARGV: chat_id, agora, maxlen
+ENQUEUE_SCRIPT = """
+local deadline = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not deadline or tonumber(deadline) > tonumber(ARGV[2]) then
+    return false
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+return redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'chat_id', ARGV[1])
+"""
+
+# Pega o lease da conversa e lê o buffer; falso se já houver outra resposta
+# da mesma conversa em andamento.
+# KEYS: buffer, lease; ARGV: token, lease_ms
+CLAIM_SCRIPT = """
+if not redis.call('SET', KEYS[2], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return false
+end
+return redis.call('LRANGE', KEYS[1], 0, -1)
+"""
+
+# Tira do buffer só as mensagens respondidas e solta o lease. As que
+# chegaram durante o turno viram o próximo turno: se o debounce delas já
+# venceu (ou o job delas encontrou o lease ocupado), o job vai direto para a
+# fila; se o usuário ainda está digitando, seguem na agenda.
+# KEYS: buffer, lease, agenda, stream; ARGV: respondidas, token, chat_id,
+# agora, maxlen
+ACK_SCRIPT = """
+redis.call('LTRIM', KEYS[1], ARGV[1], -1)
+if redis.call('GET', KEYS[2]) == ARGV[2] then
+    redis.call('DEL', KEYS[2])
+end
+if redis.call('LLEN', KEYS[1]) == 0 then
+    return false
+end
+local deadline = redis.call('ZSCORE', KEYS[3], ARGV[3])
+if deadline and tonumber(deadline) > tonumber(ARGV[4]) then
+    return false
+end
+redis.call('ZREM', KEYS[3], ARGV[3])
+return redis.call('XADD', KEYS[4], 'MAXLEN', '~', ARGV[5], '*', 'chat_id', ARGV[3])
+"""
+
+# Renova o lease enquanto o agente pensa, se ele ainda for deste turno
+# KEYS: lease; ARGV: token, lease_ms
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Solta o lease sem tirar nada do buffer: o job volta pelo reclaim do stream
+# KEYS: lease; ARGV: token
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+buffer_script = redis_client.register_script(BUFFER_SCRIPT)
+enqueue_script = redis_client.register_script(ENQUEUE_SCRIPT)
+claim_script = redis_client.register_script(CLAIM_SCRIPT)
+ack_script = redis_client.register_script(ACK_SCRIPT)
+renew_script = redis_client.register_script(RENEW_SCRIPT)
+release_script = redis_client.register_script(RELEASE_SCRIPT)
 
 logger = logging.getLogger(__name__)
 
@@ -64,54 +200,298 @@ def check_user_permission(phone_number: str) -> tuple[bool, str]:
 async def buffer_message(chat_id: str, message: str):
     buffer_key = f"{chat_id}{BUFFER_KEY_SUFIX}"
 
-    await redis_client.rpush(buffer_key, message)
-    await redis_client.expire(buffer_key, BUFFER_TTL)
+    # O prazo fica no Redis: qualquer worker pode receber a próxima mensagem
+    # da conversa e o debounce recomeça para todos
+    await buffer_script(
+        keys=[buffer_key, DEBOUNCE_SCHEDULE_KEY],
+        args=[
+            message,
+            BUFFER_TTL,
+            chat_id,
+            repr(time.time() + float(DEBOUNCE_SECONDS)),
+        ],
+        client=redis_client,
+    )
 
     log(f"Mensagem adicionada ao buffer de {chat_id}: {message}")
 
-    if debounce_tasks.get(chat_id):
-        debounce_tasks[chat_id].cancel()
-        log(f"Debounce resetado para {chat_id}")
 
-    debounce_tasks[chat_id] = asyncio.create_task(handle_debounce(chat_id))
+def lease_key(chat_id: str) -> str:
+    return f"{DEBOUNCE_SCHEDULE_KEY}:lease:{chat_id}"
 
 
-async def handle_debounce(chat_id: str):
-    try:
-        log(f"Iniciando debounce para {chat_id}")
-        await asyncio.sleep(float(DEBOUNCE_SECONDS))
+def priority_key(chat_id: str) -> str:
+    return f"{DEBOUNCE_SCHEDULE_KEY}:priority:{chat_id}"
 
-        buffer_key = f"{chat_id}{BUFFER_KEY_SUFIX}"
-        messages = await redis_client.lrange(buffer_key, 0, -1)
 
-        if full_message := " ".join(messages).strip():
-            log(f"Processando mensagem para {chat_id}: {full_message}")
+async def turn_priority(chat_id: str, full_message: str) -> float:
+    """Lugar do turno na fila de admissão (menor entra antes).
 
-            # Extrai o número de telefone do chat_id
-            phone_number = chat_id.split("@")[0] if "@" in chat_id else chat_id
+    Mensagens curtas e conversas com histórico entram como se tivessem
+    chegado AGENT_PRIORITY_BOOST_SECONDS antes, cada uma. Um turno adiado
+    por sobrecarga volta com a prioridade da primeira tentativa.
+    """
+    if deferred := await redis_client.get(priority_key(chat_id)):
+        return float(deferred)
+    boost = 0.0
+    if len(full_message) <= AGENT_SHORT_MESSAGE_CHARS:
+        boost += AGENT_PRIORITY_BOOST_SECONDS
+    if await redis_client.exists(f"{HISTORY_KEY_PREFIX}{chat_id}"):
+        boost += AGENT_PRIORITY_BOOST_SECONDS
+    return time.time() - boost
 
-            # Verifica permissão do usuário
-            has_permission, permission_message = await check_user_permission(
-                phone_number
+
+async def ask_agent(chat_id: str, full_message: str) -> str:
+    """Consulta o agente dentro do limite global de turnos em andamento.
+
+    Sem vaga, segue o AGENT_OVERLOAD_POLICY: queue propaga o Overloaded e o
+    turno volta para a agenda guardando a prioridade, degrade responde com o
+    agente reduzido (no limite dele) e busy responde o AGENT_BUSY_MESSAGE.
+    """
+    request = {
+        "input": {"input": full_message},
+        "config": {"configurable": {"session_id": chat_id}},
+    }
+    priority = await turn_priority(chat_id, full_message)
+    try:
+        async with agent_admission.turn(priority):
+            response = await conversational_agent.ainvoke(**request)
+        await redis_client.delete(priority_key(chat_id))
+        return response["output"]
+    except Overloaded as e:
+        track_agent_overload(e.reason, AGENT_OVERLOAD_POLICY)
+        log(f"Agente sobrecarregado para {chat_id}: {e} ({AGENT_OVERLOAD_POLICY})")
+        if AGENT_OVERLOAD_POLICY == "queue":
+            await redis_client.set(
+                priority_key(chat_id), repr(priority), nx=True, ex=BUFFER_TTL
             )
+            raise
 
-            if has_permission:
-                # Usuário autorizado - processa normalmente
-                log(f"Usuário autorizado, processando mensagem para {chat_id}")
-                ai_response = conversational_agent.invoke(
-                    input={"input": full_message},
-                    config={"configurable": {"session_id": chat_id}},
-                )["output"]
-            else:
-                # Usuário não autorizado - envia mensagem de erro
-                log(f"Usuário não autorizado: {phone_number}")
-                ai_response = permission_message
+    if AGENT_OVERLOAD_POLICY == "degrade":
+        try:
+            async with degraded_admission.turn():
+                response = await degraded_agent.ainvoke(**request)
+            return response["output"]
+        except Overloaded as e:
+            track_agent_overload(e.reason, "busy")
+            log(f"Agente reduzido também sem vaga para {chat_id}")
+    return AGENT_BUSY_MESSAGE
+
+
+async def reply_to_chat(chat_id: str, full_message: str):
+    """Verifica a permissão, consulta o agente e envia a resposta no WhatsApp"""
+    log(f"Processando mensagem para {chat_id}: {full_message}")
+
+    # Extrai o número de telefone do chat_id
+    phone_number = chat_id.split("@")[0] if "@" in chat_id else chat_id
+
+    # Verifica permissão do usuário
+    has_permission, permission_message = await check_user_permission(phone_number)
+
+    if has_permission:
+        # Usuário autorizado - processa normalmente
+        log(f"Usuário autorizado, processando mensagem para {chat_id}")
+        ai_response = await ask_agent(chat_id, full_message)
+    else:
+        # Usuário não autorizado - envia mensagem de erro
+        log(f"Usuário não autorizado: {phone_number}")
+        ai_response = permission_message
+
+    await asend_whatsapp_message(
+        number=chat_id,
+        text=ai_response,
+    )
+
+
+class LeaseLost(RuntimeError):
+    """O lease da conversa venceu ou foi tomado durante o turno"""
+
+
+@asynccontextmanager
+async def hold_lease(chat_id: str, token: str):
+    """Renova o lease da conversa a cada terço do prazo enquanto o turno roda.
+
+    Se a renovação falhar, o turno é cancelado com LeaseLost em vez de
+    arriscar duas respostas em paralelo; as mensagens continuam no buffer.
+    """
+    turn = asyncio.current_task()
+    lost = False
 
-            send_whatsapp_message(
-                number=chat_id,
-                text=ai_response,
+    async def renew():
+        nonlocal lost
+        while True:
+            await asyncio.sleep(DEBOUNCE_LEASE_SECONDS / 3)
+            renewed = await renew_script(
+                keys=[lease_key(chat_id)],
+                args=[token, DEBOUNCE_LEASE_SECONDS * 1000],
+                client=redis_client,
             )
-        await redis_client.delete(buffer_key)
+            if not renewed:
+                lost = True
+                turn.cancel()
+                return
 
+    renewer = asyncio.create_task(renew())
+    try:
+        yield
     except asyncio.CancelledError:
-        log(f"Debounce cancelado para {chat_id}")
+        if lost:
+            turn.uncancel()
+            raise LeaseLost(f"Lease de {chat_id} perdido durante o turno")
+        raise
+    finally:
+        renewer.cancel()
+        await asyncio.gather(renewer, return_exceptions=True)
+
+
+async def process_chat_job(fields: dict) -> bool:
+    """Responde as mensagens no buffer da conversa de um job da fila.
+
+    Cada conversa tem um turno de cada vez (lease): o histórico é lido e
+    gravado por um turno só e as respostas saem na ordem. Mensagens que
+    chegam enquanto o agente pensa não abrem outra chamada ao LLM; entram
+    juntas no próximo turno, enfileirado quando este termina. As mensagens
+    saem do buffer depois do envio; se o turno falhar ou o worker cair,
+    elas ficam e o job volta pelo reclaim do stream.
+    """
+    chat_id = fields["chat_id"]
+    buffer_key = f"{chat_id}{BUFFER_KEY_SUFIX}"
+    token = uuid.uuid4().hex
+
+    messages = await claim_script(
+        keys=[buffer_key, lease_key(chat_id)],
+        args=[token, DEBOUNCE_LEASE_SECONDS * 1000],
+        client=redis_client,
+    )
+    if messages is None:
+        # O turno em andamento enfileira as mensagens novas quando terminar
+        log(f"Turno de {chat_id} em andamento, mensagens ficam para o próximo")
+        return False
+
+    try:
+        if full_message := " ".join(messages).strip():
+            async with hold_lease(chat_id, token):
+                await reply_to_chat(chat_id, full_message)
+    except Overloaded:
+        # Backpressure: as mensagens esperam no Redis, não num worker
+        await release_script(
+            keys=[lease_key(chat_id)], args=[token], client=redis_client
+        )
+        await redis_client.zadd(
+            DEBOUNCE_SCHEDULE_KEY,
+            {chat_id: time.time() + AGENT_ADMISSION_RETRY_SECONDS},
+            gt=True,
+        )
+        log(f"Turno de {chat_id} adiado por {AGENT_ADMISSION_RETRY_SECONDS}s")
+        return False
+    except BaseException:
+        await release_script(
+            keys=[lease_key(chat_id)], args=[token], client=redis_client
+        )
+        raise
+
+    follow_up = await ack_script(
+        keys=[
+            buffer_key,
+            lease_key(chat_id),
+            DEBOUNCE_SCHEDULE_KEY,
+            CHATBOT_STREAM_KEY,
+        ],
+        args=[len(messages), token, chat_id, repr(time.time()), CHATBOT_STREAM_MAXLEN],
+        client=redis_client,
+    )
+    if follow_up:
+        log(f"Mensagens de {chat_id} durante o turno, próximo turno: job {follow_up}")
+    return True
+
+
+async def enqueue_due_chats(now: float = None) -> list:
+    """Coloca na fila de jobs as conversas com o debounce vencido"""
+    now = time.time() if now is None else now
+    due = await redis_client.zrangebyscore(
+        DEBOUNCE_SCHEDULE_KEY, "-inf", now, start=0, num=DEBOUNCE_BATCH_SIZE
+    )
+    job_ids = []
+    for chat_id in due:
+        job_id = await enqueue_script(
+            keys=[DEBOUNCE_SCHEDULE_KEY, CHATBOT_STREAM_KEY],
+            args=[chat_id, repr(now), CHATBOT_STREAM_MAXLEN],
+            client=redis_client,
+        )
+        if job_id:
+            log(f"Debounce de {chat_id} vencido, job {job_id} na fila")
+            job_ids.append(job_id)
+    return job_ids
+
+
+async def run_debounce_scheduler():
+    """Consulta a agenda do Redis a cada DEBOUNCE_POLL_INTERVAL segundos"""
+    log("Agendador do debounce iniciado")
+    while True:
+        try:
+            await enqueue_due_chats()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Erro no agendador do debounce: {e}")
+        await asyncio.sleep(DEBOUNCE_POLL_INTERVAL)
+
+
+def get_chat_worker(concurrency: int = None, consumer: str = None) -> StreamWorker:
+    return StreamWorker(
+        redis_client,
+        CHATBOT_STREAM_KEY,
+        CHATBOT_STREAM_GROUP,
+        process_chat_job,
+        consumer=consumer,
+        concurrency=concurrency or CHATBOT_WORKER_CONCURRENCY,
+        claim_idle_seconds=CHATBOT_JOB_TIMEOUT,
+        max_deliveries=CHATBOT_JOB_MAX_DELIVERIES,
+    )
+
+
+async def run_chatbot_worker(
+    stop: asyncio.Event, concurrency: int = None, shutdown_timeout: float = None
+):
+    """Agendador do debounce e consumidor da fila de jobs até stop.
+
+    Vários processos podem rodar isto ao mesmo tempo: o agendador enfileira
+    cada conversa uma vez só e o consumer group divide os jobs.
+    """
+    worker = get_chat_worker(concurrency)
+    scheduler = asyncio.create_task(run_debounce_scheduler())
+    try:
+        await worker.run(stop, shutdown_timeout=shutdown_timeout)
+    finally:
+        scheduler.cancel()
+        await asyncio.gather(scheduler, return_exceptions=True)
+
+
+def with_chatbot_worker(application):
+    """Roda o worker dentro do processo web quando CHATBOT_INLINE_WORKER.
+
+    Para ambientes com um único processo; em produção o web só enfileira e o
+    manage.py chatbot_worker responde. O Django não trata o protocolo
+    lifespan, então ele é respondido aqui.
+    """
+    if not CHATBOT_INLINE_WORKER:
+        return application
+
+    async def app(scope, receive, send):
+        if scope["type"] != "lifespan":
+            return await application(scope, receive, send)
+        stop = asyncio.Event()
+        worker = None
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                worker = asyncio.create_task(run_chatbot_worker(stop))
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                stop.set()
+                if worker is not None:
+                    await worker
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    return app
@@ -24,6 +24,30 @@ chatbot_rag_searches = Counter(
     ["query_type"],
 )
 
+chatbot_rag_search_modes = Counter(
+    "chatbot_rag_search_modes_total",
+    "RAG searches by retrieval mode",
+    ["mode"],
+)
+
+chatbot_rag_cache_requests = Counter(
+    "chatbot_rag_cache_requests_total",
+    "RAG cache lookups by cache tier result",
+    ["cache", "result"],
+)
+
+chatbot_rag_context_tokens = Counter(
+    "chatbot_rag_context_tokens_total",
+    "Tokens of RAG context before and after result packing",
+    ["stage"],
+)
+
+chatbot_rag_context_tokens_saved = Histogram(
+    "chatbot_rag_context_tokens_saved",
+    "Tokens removed from each rag_search result by packing",
+    buckets=(0, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+
 chatbot_weather_searches = Counter(
     "chatbot_weather_searches_total",
     "Total number of weather searches performed",
@@ -51,6 +75,41 @@ chatbot_debounce_triggered = Counter(
     ["chat_id"],
 )
 
+# Agent admission metrics
+chatbot_agent_queue_depth = Gauge(
+    "chatbot_agent_queue_depth",
+    "Agent turns waiting for admission across all workers",
+)
+
+chatbot_agent_turns_in_flight = Gauge(
+    "chatbot_agent_turns_in_flight",
+    "Agent turns holding an admission slot across all workers",
+)
+
+chatbot_agent_queue_wait_seconds = Gauge(
+    "chatbot_agent_queue_wait_seconds",
+    "Admission wait of the last agent turn admitted by this process",
+)
+
+chatbot_agent_admission_wait = Histogram(
+    "chatbot_agent_admission_wait_seconds",
+    "Time agent turns waited for an admission slot",
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+chatbot_agent_overload_total = Counter(
+    "chatbot_agent_overload_total",
+    "Agent turns not admitted, by reason and overload policy",
+    ["reason", "policy"],
+)
+
+# RAG metrics
+chatbot_embedding_cache_requests = Counter(
+    "chatbot_embedding_cache_requests_total",
+    "Embedding cache lookups during RAG ingestion",
+    ["result"],
+)
+
 
 def track_message_processed(phone_number: str, message_type: str = "text"):
     """Incrementa contador de mensagens processadas."""
@@ -72,6 +131,23 @@ def track_rag_search(query_type: str = "general"):
     logger.info(f"Metric tracked: RAG search {query_type}")
 
 
+def track_rag_search_mode(mode: str):
+    """Incrementa contador de buscas RAG por modo (vector, hybrid, lexical)."""
+    chatbot_rag_search_modes.labels(mode=mode).inc()
+
+
+def track_rag_cache(cache: str, result: str):
+    """Incrementa contador de acertos/faltas dos caches de busca RAG."""
+    chatbot_rag_cache_requests.labels(cache=cache, result=result).inc()
+
+
+def track_rag_context(retrieved_tokens: int, packed_tokens: int):
+    """Registra os tokens do contexto RAG antes e depois do empacotamento."""
+    chatbot_rag_context_tokens.labels(stage="retrieved").inc(retrieved_tokens)
+    chatbot_rag_context_tokens.labels(stage="packed").inc(packed_tokens)
+    chatbot_rag_context_tokens_saved.observe(max(retrieved_tokens - packed_tokens, 0))
+
+
 def track_weather_search(location: str = "unknown"):
     """Incrementa contador de buscas meteorológicas."""
     chatbot_weather_searches.labels(location=location).inc()
@@ -98,3 +174,28 @@ def update_buffer_size(chat_id: str, size: int):
 def track_debounce_triggered(chat_id: str):
     """Incrementa contador de debounce."""
     chatbot_debounce_triggered.labels(chat_id=chat_id).inc()
+
+
+def track_embedding_cache(hits: int, misses: int):
+    """Incrementa os contadores de acertos e faltas do cache de embeddings."""
+    if hits:
+        chatbot_embedding_cache_requests.labels(result="hit").inc(hits)
+    if misses:
+        chatbot_embedding_cache_requests.labels(result="miss").inc(misses)
+
+
+def update_admission_queue(waiting: int, in_flight: int):
+    """Atualiza a fila de espera e os turnos em andamento do agente."""
+    chatbot_agent_queue_depth.set(waiting)
+    chatbot_agent_turns_in_flight.set(in_flight)
+
+
+def track_admission_wait(seconds: float):
+    """Registra a espera de um turno admitido."""
+    chatbot_agent_queue_wait_seconds.set(seconds)
+    chatbot_agent_admission_wait.observe(seconds)
+
+
+def track_agent_overload(reason: str, policy: str):
+    """Incrementa contador de turnos recusados pela admissão."""
+    chatbot_agent_overload_total.labels(reason=reason, policy=policy).inc()
@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+import time
+
+from .config import (
+    RAG_FILES_DIR,
+    RAG_WATCH_DEBOUNCE,
+    RAG_WATCH_INTERVAL,
+    RAG_WATCH_RETRY_SECONDS,
+)
+from .vectorstore import SUPPORTED_EXTENSIONS, archive_indexed_files, ingest_vectorstore
+
+logger = logging.getLogger(__name__)
+
+
+class RagFilesWatcher:
+    """Observa RAG_FILES_DIR e indexa os arquivos novos em segundo plano.
+
+    A pasta é varrida a cada interval segundos, o que funciona também em
+    volumes montados, onde eventos do sistema de arquivos nem sempre chegam.
+    Uma rajada de alterações só dispara a ingestão depois de debounce
+    segundos sem mudanças, o que também evita ler arquivos ainda sendo
+    copiados. Os arquivos indexados vão para processed/ e a nova versão do
+    índice é publicada no manifesto, de onde os workers da API a recarregam.
+    """
+
+    def __init__(
+        self,
+        directory=None,
+        interval=None,
+        debounce=None,
+        retry_seconds=None,
+        ingest=None,
+        archive=None,
+    ):
+        self.directory = directory or RAG_FILES_DIR
+        self.interval = RAG_WATCH_INTERVAL if interval is None else interval
+        self.debounce = RAG_WATCH_DEBOUNCE if debounce is None else debounce
+        self.retry_seconds = (
+            RAG_WATCH_RETRY_SECONDS if retry_seconds is None else retry_seconds
+        )
+        self.ingest = ingest or ingest_vectorstore
+        self.archive = archive or archive_indexed_files
+        self._snapshot = None
+        self._changed_at = None
+
+    def snapshot(self):
+        """Tamanho e mtime dos arquivos suportados na raiz da pasta"""
+        files = {}
+        try:
+            entries = os.scandir(self.directory)
+        except FileNotFoundError:
+            return files
+
+        with entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(SUPPORTED_EXTENSIONS):
+                    stat = entry.stat()
+                    files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def poll(self, now=None):
+        """Verifica a pasta uma vez; retorna True se a ingestão rodou"""
+        now = time.monotonic() if now is None else now
+        snapshot = self.snapshot()
+        if snapshot != self._snapshot:
+            self._snapshot = snapshot
+            self._changed_at = now if snapshot else None
+            return False
+
+        if self._changed_at is None or now - self._changed_at < self.debounce:
+            return False
+
+        self.process()
+        self._snapshot = self.snapshot()
+        # O que continua na pasta falhou na indexação: tenta de novo mais tarde
+        self._changed_at = (
+            now + self.retry_seconds - self.debounce if self._snapshot else None
+        )
+        return True
+
+    def process(self):
+        """Indexa os arquivos novos e move os indexados para processed/"""
+        start_time = time.monotonic()
+        try:
+            self.ingest()
+            moved = self.archive()
+        except Exception as e:
+            logger.error(f"Erro na ingestão dos arquivos novos: {e}")
+            return []
+
+        logger.info(
+            f"{len(moved)} arquivos indexados e movidos para processed/ "
+            f"em {time.monotonic() - start_time:.2f}s"
+        )
+        return moved
+
+    def run(self, stop_event=None):
+        """Varre a pasta até stop_event ser sinalizado"""
+        stop_event = stop_event or threading.Event()
+        logger.info(
+            f"Observando {self.directory} (varredura a cada {self.interval}s, "
+            f"debounce de {self.debounce}s)"
+        )
+        while True:
+            self.poll()
+            if stop_event.wait(self.interval):
+                return
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from langchain_core.documents import Document
+
+from .config import RAG_CACHE_ENABLED, RAG_CACHE_LRU_SIZE, RAG_CACHE_TTL, REDIS_URL
+from .embeddings import normalize_query
+from .metrics import track_rag_cache
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "rag_cache"
+
+_redis_client = None
+_redis_client_lock = threading.Lock()
+
+
+def get_redis_client():
+    """Cliente Redis síncrono compartilhado pelas ferramentas"""
+    global _redis_client
+
+    with _redis_client_lock:
+        if _redis_client is None:
+            _redis_client = redis.Redis.from_url(
+                REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5
+            )
+        return _redis_client
+
+
+class TwoTierCache:
+    """Cache em dois níveis: LRU no processo e Redis compartilhado entre workers.
+
+    Valores precisam ser serializáveis em JSON. Falhas no Redis apenas
+    desativam o segundo nível para aquela operação.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: int):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _redis_key(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f"{REDIS_KEY_PREFIX}:{self.name}:{digest}"
+
+    def get(self, key):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._lru.move_to_end(key)
+                    track_rag_cache(self.name, "hit")
+                    return value
+                del self._lru[key]
+
+        try:
+            raw = get_redis_client().get(self._redis_key(key))
+        except redis.RedisError as e:
+            logger.warning(f"Cache RAG {self.name}: Redis indisponível: {e}")
+            raw = None
+
+        if raw is None:
+            track_rag_cache(self.name, "miss")
+            return None
+
+        value = json.loads(raw)
+        self._set_local(key, value)
+        track_rag_cache(self.name, "hit")
+        return value
+
+    def set(self, key, value):
+        raw = json.dumps(value, ensure_ascii=False)
+        self._set_local(key, value)
+        try:
+            get_redis_client().set(self._redis_key(key), raw, ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Cache RAG {self.name}: Redis indisponível: {e}")
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._lru[key] = (value, time.monotonic() + self.ttl)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name: str) -> TwoTierCache:
+    """Retorna o cache do processo com o nome informado"""
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = TwoTierCache(name, RAG_CACHE_LRU_SIZE, RAG_CACHE_TTL)
+        return _caches[name]
+
+
+def retrieval_key(
+    query: str, k: int, index_version: int, mode: str = "vector", filter=None
+) -> str:
+    # A versão do índice na chave invalida tudo automaticamente após reindexar
+    key = f"v{index_version}|{mode}|k{k}|{normalize_query(query)}"
+    if filter:
+        key += f"|{json.dumps(filter, sort_keys=True, ensure_ascii=False)}"
+    return key
+
+
+def get_cached_documents(
+    query: str, k: int, index_version: int, mode: str = "vector", filter=None
+):
+    """Retorna os documentos em cache para a busca, ou None"""
+    if not RAG_CACHE_ENABLED:
+        return None
+    cached = get_cache("retrieval").get(
+        retrieval_key(query, k, index_version, mode, filter)
+    )
+    if cached is None:
+        return None
+    return [
+        Document(
+            id=doc.get("id"), page_content=doc["page_content"], metadata=doc["metadata"]
+        )
+        for doc in cached
+    ]
+
+
+def cache_documents(
+    query: str, k: int, index_version: int, docs, mode: str = "vector", filter=None
+):
+    """Guarda o resultado top-k de uma busca"""
+    if not RAG_CACHE_ENABLED or not docs:
+        return
+    try:
+        get_cache("retrieval").set(
+            retrieval_key(query, k, index_version, mode, filter),
+            [
+                {
+                    "id": doc.id,
+                    "page_content": doc.page_content,
+                    "metadata": doc.metadata,
+                }
+                for doc in docs
+            ],
+        )
+    except (TypeError, ValueError) as e:
+        # Metadados não serializáveis não devem derrubar a busca
+        logger.warning(f"Resultado da busca não pôde ser guardado em cache: {e}")
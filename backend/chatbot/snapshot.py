@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import shutil
+import tarfile
+import time
+
+from .manifest import file_sha256
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_INFO_FILE = "snapshot.json"
+CHECKSUM_SUFFIX = ".sha256"
+STAGING_PREFIX = ".restore-"
+
+
+class SnapshotError(ValueError):
+    """Snapshot inválido, corrompido ou incompatível"""
+
+
+def _snapshot_files(store_path, exclude):
+    """Arquivos do índice, relativos ao diretório, em ordem estável"""
+    files = []
+    for root, dirs, names in os.walk(store_path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(STAGING_PREFIX))
+        for name in sorted(names):
+            relative = os.path.relpath(os.path.join(root, name), store_path)
+            if (
+                relative in exclude
+                or os.path.dirname(relative) in exclude
+                or name.endswith(".tmp")
+            ):
+                continue
+            files.append(relative)
+    return files
+
+
+def export_snapshot(store_path, archive_path, info, exclude=()):
+    """Grava o diretório do índice num único arquivo tar com checksums.
+
+    O snapshot.json vai primeiro no tar, com a versão do formato, os dados
+    do índice recebidos em info e o tamanho e o sha256 de cada arquivo. O
+    sha256 do próprio tar fica ao lado, em <arquivo>.sha256, para conferir
+    a cópia antes de extrair. Retorna o snapshot.json gravado.
+    """
+    exclude = {SNAPSHOT_INFO_FILE, *exclude}
+    files = {}
+    for relative in _snapshot_files(store_path, exclude):
+        path = os.path.join(store_path, relative)
+        files[relative] = {"size": os.path.getsize(path), "sha256": file_sha256(path)}
+
+    snapshot_info = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "created_at": time.time(),
+        **info,
+        "files": files,
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(archive_path)), exist_ok=True)
+    tmp_path = f"{archive_path}.tmp"
+    info_path = os.path.join(store_path, f"{SNAPSHOT_INFO_FILE}.tmp")
+    with open(info_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot_info, f, ensure_ascii=False, indent=2)
+    try:
+        with tarfile.open(tmp_path, "w") as archive:
+            archive.add(info_path, arcname=SNAPSHOT_INFO_FILE)
+            for relative in files:
+                archive.add(os.path.join(store_path, relative), arcname=relative)
+    finally:
+        os.remove(info_path)
+
+    checksum = file_sha256(tmp_path)
+    os.replace(tmp_path, archive_path)
+    with open(f"{archive_path}{CHECKSUM_SUFFIX}", "w", encoding="utf-8") as f:
+        f.write(f"{checksum}  {os.path.basename(archive_path)}\n")
+    return snapshot_info
+
+
+def read_snapshot_info(archive_path):
+    """Lê o snapshot.json de um arquivo de snapshot sem extrair o resto"""
+    try:
+        with tarfile.open(archive_path, "r") as archive:
+            member = archive.extractfile(SNAPSHOT_INFO_FILE)
+            return json.load(member)
+    except (KeyError, OSError, tarfile.TarError, ValueError) as e:
+        raise SnapshotError(f"Snapshot {archive_path} ilegível: {e}") from e
+
+
+def verify_archive(archive_path):
+    """Confere o sha256 do arquivo com o .sha256 gravado ao lado, se existir"""
+    checksum_path = f"{archive_path}{CHECKSUM_SUFFIX}"
+    try:
+        with open(checksum_path, encoding="utf-8") as f:
+            expected = f.read().split()[0]
+    except FileNotFoundError:
+        logger.warning(
+            f"Snapshot {archive_path} sem {CHECKSUM_SUFFIX}, conferindo só os arquivos"
+        )
+        return False
+    if file_sha256(archive_path) != expected:
+        raise SnapshotError(
+            f"Checksum de {archive_path} não confere: arquivo corrompido"
+        )
+    return True
+
+
+def verify_files(store_path, snapshot_info, checksum=True):
+    """Confere tamanho (e sha256) dos arquivos do snapshot no diretório.
+
+    Retorna a lista de problemas encontrados; vazia se tudo confere.
+    """
+    problems = []
+    for relative, expected in snapshot_info["files"].items():
+        path = os.path.join(store_path, relative)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            problems.append(f"{relative}: ausente")
+            continue
+        if size != expected["size"]:
+            problems.append(f"{relative}: {size} bytes, esperado {expected['size']}")
+        elif checksum and file_sha256(path) != expected["sha256"]:
+            problems.append(f"{relative}: sha256 não confere")
+    return problems
+
+
+def restore_snapshot(archive_path, store_path, last=()):
+    """Extrai e verifica um snapshot e move os arquivos para o diretório do índice.
+
+    A extração vai para uma pasta temporária dentro do próprio diretório
+    (mesmo sistema de arquivos, então mover é só renomear). Nada é trocado
+    se algum arquivo não conferir. Os arquivos em last são movidos por
+    último: são os que fazem os workers recarregarem o índice.
+    """
+    verify_archive(archive_path)
+    snapshot_info = read_snapshot_info(archive_path)
+    if snapshot_info.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotError(
+            f"Formato de snapshot {snapshot_info.get('format_version')} não "
+            f"suportado (esperado {SNAPSHOT_FORMAT_VERSION})"
+        )
+
+    os.makedirs(store_path, exist_ok=True)
+    staging = os.path.join(store_path, f"{STAGING_PREFIX}{os.getpid()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        with tarfile.open(archive_path, "r") as archive:
+            expected = {SNAPSHOT_INFO_FILE, *snapshot_info["files"]}
+            members = [m for m in archive.getmembers() if m.isfile()]
+            unexpected = {m.name for m in members} - expected
+            if unexpected:
+                raise SnapshotError(
+                    f"Snapshot com arquivos não listados: {sorted(unexpected)}"
+                )
+            archive.extractall(staging, members=members, filter="data")
+
+        problems = verify_files(staging, snapshot_info)
+        if problems:
+            raise SnapshotError("Snapshot corrompido: " + "; ".join(problems[:5]))
+
+        ordered = sorted(
+            snapshot_info["files"],
+            key=lambda name: last.index(name) + 1 if name in last else 0,
+        )
+        for relative in [*ordered, SNAPSHOT_INFO_FILE]:
+            target = os.path.join(store_path, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(os.path.join(staging, relative), target)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    return snapshot_info
@@ -3,8 +3,11 @@ import json
 import os
 import shutil
 import tempfile
-from unittest.mock import AsyncMock, MagicMock, patch
+import time
+from collections import defaultdict
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
+import numpy as np
 import pytest
 from django.test import AsyncRequestFactory
 from rest_framework import status
@@ -13,6 +16,8 @@ from rest_framework import status
 @pytest.fixture(autouse=True)
 def mock_external_services():
     """Mock all external services to avoid real connections during tests"""
+    from .lexical import BM25Index
+
     with patch("chatbot.chains.ChatOpenAI") as mock_openai, patch(
         "chatbot.vectorstore.Chroma"
     ) as mock_chroma, patch(
@@ -23,7 +28,19 @@ def mock_external_services():
         "chatbot.message_buffer.redis_client"
     ) as mock_redis_client, patch(
         "chatbot.evolution_api.requests.post"
-    ) as mock_requests:
+    ) as mock_requests, patch(
+        "chatbot.vectorstore._vectorstore", None
+    ), patch(
+        "chatbot.vectorstore._vectorstore_key", None
+    ), patch(
+        "chatbot.embeddings.RAG_EMBEDDING_RETRY_BACKOFF", 0
+    ), patch(
+        "chatbot.retrieval_cache._caches", {}
+    ), patch(
+        "chatbot.retrieval_cache.get_redis_client"
+    ) as mock_rag_cache_redis, patch(
+        "chatbot.tools.get_lexical_index"
+    ) as mock_lexical_index:
 
         mock_openai.return_value = MagicMock()
         mock_chroma.return_value = MagicMock()
@@ -34,16 +51,27 @@ def mock_external_services():
         mock_redis_client.expire = AsyncMock()
         mock_redis_client.lrange = AsyncMock()
         mock_redis_client.delete = AsyncMock()
+        mock_redis_client.zadd = AsyncMock()
+        mock_redis_client.zrem = AsyncMock()
+        mock_redis_client.zrangebyscore = AsyncMock(return_value=[])
+        mock_redis_client.evalsha = AsyncMock()
         mock_requests.return_value = MagicMock()
+        mock_rag_cache_redis.return_value.get.return_value = None
+        mock_lexical_index.return_value = BM25Index()
 
-        yield {
-            "openai": mock_openai,
-            "chroma": mock_chroma,
-            "embeddings": mock_embeddings,
-            "redis_history": mock_redis_history,
-            "redis_client": mock_redis_client,
-            "requests": mock_requests,
-        }
+        with patch(
+            "chatbot.message_buffer.agent_admission.client", mock_redis_client
+        ), patch("chatbot.message_buffer.degraded_admission.client", mock_redis_client):
+            yield {
+                "openai": mock_openai,
+                "chroma": mock_chroma,
+                "embeddings": mock_embeddings,
+                "redis_history": mock_redis_history,
+                "redis_client": mock_redis_client,
+                "requests": mock_requests,
+                "rag_cache_redis": mock_rag_cache_redis.return_value,
+                "lexical_index": mock_lexical_index.return_value,
+            }
 
 
 @pytest.mark.asyncio
@@ -192,7 +220,19 @@ class TestVectorstore:
         self.test_files_dir = os.path.join(self.test_dir, "rag_files")
         os.makedirs(self.test_files_dir)
 
+        # Os testes desta classe cobrem a reconstrução completa do índice vetorial
+        self.patchers = [
+            patch("chatbot.vectorstore.RAG_INGESTION_MODE", "full"),
+            patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.test_dir),
+            patch("chatbot.vectorstore.open_lexical_index"),
+            patch("chatbot.vectorstore.open_deduplicator", return_value=None),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
     def teardown_method(self):
+        for patcher in self.patchers:
+            patcher.stop()
         shutil.rmtree(self.test_dir)
 
     def test_load_documents_multiple_file_types(self, mock_external_services):
@@ -252,44 +292,49 @@ class TestVectorstore:
             assert len(docs) == 1
             mock_text_loader.assert_called_once_with(txt_file, encoding="utf-8")
 
-    def test_get_vectorstore_with_documents(self, mock_external_services):
+    def test_ingest_vectorstore_with_documents(self, mock_external_services):
         """Testa a criação do vectorstore com documentos"""
-        from .vectorstore import get_vectorstore
+        from .vectorstore import ingest_vectorstore
 
-        with patch("chatbot.vectorstore.load_documents") as mock_load_docs, patch(
-            "chatbot.vectorstore.RecursiveCharacterTextSplitter"
-        ) as mock_splitter:
+        with patch("chatbot.vectorstore.list_rag_files") as mock_list_files, patch(
+            "chatbot.vectorstore.iter_split_segments"
+        ) as mock_iter_split:
 
             # Mock o vectorstore vazio primeiro (para forçar recriação)
             mock_vectorstore = MagicMock()
-            mock_vectorstore.similarity_search.return_value = []
+            mock_vectorstore._collection.count.return_value = 0
             mock_external_services["chroma"].return_value = mock_vectorstore
 
+            mock_list_files.return_value = {"test.pdf": "rag_files/test.pdf"}
             mock_docs = [MagicMock(), MagicMock()]
-            mock_load_docs.return_value = mock_docs
-
-            mock_splitter.return_value.split_documents.return_value = mock_docs
+            mock_iter_split.return_value = [
+                ("rag_files/test.pdf", mock_docs, None, True)
+            ]
 
-            result = get_vectorstore()
+            result = ingest_vectorstore()
 
-            mock_load_docs.assert_called_once()
+            mock_iter_split.assert_called_once_with(["rag_files/test.pdf"])
+            mock_vectorstore.add_texts.assert_called_once()
             assert result is not None
 
-    def test_get_vectorstore_without_documents(self, mock_external_services):
+    def test_ingest_vectorstore_without_documents(self, mock_external_services):
         """Testa a criação do vectorstore sem documentos"""
-        from .vectorstore import get_vectorstore
+        from .vectorstore import ingest_vectorstore
 
-        with patch("chatbot.vectorstore.load_documents") as mock_load_docs:
+        with patch("chatbot.vectorstore.list_rag_files") as mock_list_files, patch(
+            "chatbot.vectorstore.iter_split_segments"
+        ) as mock_iter_split:
             # Mock o vectorstore vazio primeiro (para forçar recriação)
             mock_vectorstore = MagicMock()
-            mock_vectorstore.similarity_search.return_value = []
+            mock_vectorstore._collection.count.return_value = 0
             mock_external_services["chroma"].return_value = mock_vectorstore
 
-            mock_load_docs.return_value = []
+            mock_list_files.return_value = {}
 
-            result = get_vectorstore()
+            result = ingest_vectorstore()
 
-            mock_load_docs.assert_called_once()
+            mock_list_files.assert_called_once()
+            mock_iter_split.assert_not_called()
             mock_external_services["chroma"].assert_called()
             assert result is not None
 
@@ -315,128 +360,2546 @@ class TestVectorstore:
             "chatbot.vectorstore.load_documents_from_directory"
         ) as mock_load_from_dir:
 
-            # Mock retorna documentos diferentes para cada diretório
-            mock_load_from_dir.side_effect = lambda dir_path: (
-                [MagicMock()] if "processed" in dir_path else [MagicMock(), MagicMock()]
-            )
+            # Mock retorna documentos diferentes para cada diretório
+            mock_load_from_dir.side_effect = lambda dir_path: (
+                [MagicMock()] if "processed" in dir_path else [MagicMock(), MagicMock()]
+            )
+
+            docs = load_documents()
+
+            # Deve ter chamado para ambos os diretórios
+            assert mock_load_from_dir.call_count == 2
+            # Deve retornar 3 documentos total (1 + 2)
+            assert len(docs) == 3
+
+    def test_load_documents_from_directory_error_handling(self, mock_external_services):
+        """Testa o tratamento de erro no carregamento de documentos"""
+        from .vectorstore import load_documents_from_directory
+
+        # Criar arquivo de teste
+        test_file = os.path.join(self.test_files_dir, "error.pdf")
+        with open(test_file, "w") as f:
+            f.write("test content")
+
+        with patch("chatbot.vectorstore.PyPDFLoader") as mock_loader:
+            # Simula erro no carregamento
+            mock_loader.return_value.load.side_effect = Exception("Load error")
+
+            docs = load_documents_from_directory(self.test_files_dir)
+
+            # Deve retornar lista vazia em caso de erro
+            assert len(docs) == 0
+            mock_loader.assert_called_once()
+
+    def test_load_documents_from_directory_nonexistent(self, mock_external_services):
+        """Testa carregamento de diretório inexistente"""
+        from .vectorstore import load_documents_from_directory
+
+        docs = load_documents_from_directory("/path/que/nao/existe")
+        assert len(docs) == 0
+
+    def test_get_vectorstore_existing_with_data(self, mock_external_services):
+        """Testa carregamento de vectorstore existente com dados"""
+        from .vectorstore import load_vectorstore
+
+        # Mock vectorstore com dados existentes
+        mock_vectorstore = MagicMock()
+        mock_vectorstore._collection.count.return_value = 42
+        mock_external_services["chroma"].return_value = mock_vectorstore
+
+        result = load_vectorstore()
+
+        # Deve retornar o vectorstore existente sem gastar chamada de embedding
+        assert result == mock_vectorstore
+        mock_vectorstore._collection.count.assert_called_once()
+        mock_vectorstore.similarity_search.assert_not_called()
+
+    def test_ingest_vectorstore_exception_in_loading(self, mock_external_services):
+        """Testa tratamento de exceção ao carregar vectorstore existente"""
+        from .vectorstore import ingest_vectorstore
+
+        with patch("chatbot.vectorstore.list_rag_files") as mock_list_files, patch(
+            "chatbot.vectorstore.iter_split_segments"
+        ) as mock_iter_split:
+            # Simula erro apenas na primeira chamada (carregamento do existente)
+            mock_vectorstore_error = MagicMock()
+            mock_vectorstore_error._collection.count.side_effect = Exception(
+                "Count error"
+            )
+
+            # Segunda chamada retorna vectorstore válido
+            mock_vectorstore_ok = MagicMock()
+            mock_external_services["chroma"].side_effect = [
+                mock_vectorstore_error,
+                mock_vectorstore_ok,
+            ]
+
+            # Mock documento com page_content como string
+            mock_doc = MagicMock()
+            mock_doc.page_content = "Test document content"
+            mock_doc.metadata = {"source": "test"}
+            mock_docs = [mock_doc]
+            mock_list_files.return_value = {"test.txt": "rag_files/test.txt"}
+            mock_iter_split.return_value = [
+                ("rag_files/test.txt", mock_docs, None, True)
+            ]
+
+            result = ingest_vectorstore()
+
+            # Deve ter tentado carregar documentos
+            mock_iter_split.assert_called_once()
+            mock_vectorstore_ok.add_texts.assert_called_once()
+            assert result is mock_vectorstore_ok
+
+    def test_ingest_vectorstore_batch_processing_error(self, mock_external_services):
+        """Testa tratamento de erro no processamento em lotes"""
+        from .vectorstore import ingest_vectorstore
+
+        with patch("chatbot.vectorstore.list_rag_files") as mock_list_files, patch(
+            "chatbot.vectorstore.iter_split_segments"
+        ) as mock_iter_split:
+
+            # Mock vectorstore vazio (força recriação)
+            mock_vectorstore = MagicMock()
+            mock_vectorstore._collection.count.return_value = 0
+            # Simula erro na adição de textos
+            mock_vectorstore.add_texts.side_effect = Exception("Add texts error")
+            mock_external_services["chroma"].return_value = mock_vectorstore
+
+            # Mock splits
+            mock_splits = []
+            for i in range(120):  # 2 lotes + resto
+                mock_split = MagicMock()
+                mock_split.page_content = f"Split content {i}"
+                mock_split.metadata = {"source": f"split{i}"}
+                mock_splits.append(mock_split)
+            mock_list_files.return_value = {"test.pdf": "rag_files/test.pdf"}
+            mock_iter_split.return_value = [
+                ("rag_files/test.pdf", mock_splits, None, True)
+            ]
+
+            result = ingest_vectorstore()
+
+            # Deve ter tentado o lote de novo antes de desistir
+            assert mock_vectorstore.add_texts.call_count > 1
+            assert result is not None
+
+    def test_load_vectorstore_never_builds_the_index(self, mock_external_services):
+        """Testa que abrir o índice vazio no caminho da requisição não indexa nada"""
+        from .vectorstore import load_vectorstore
+
+        with patch("chatbot.vectorstore.list_rag_files") as mock_list_files, patch(
+            "chatbot.vectorstore.iter_split_segments"
+        ) as mock_iter_split:
+            mock_vectorstore = MagicMock()
+            mock_vectorstore._collection.count.return_value = 0
+            mock_external_services["chroma"].return_value = mock_vectorstore
+
+            result = load_vectorstore()
+
+            assert result is mock_vectorstore
+            mock_list_files.assert_not_called()
+            mock_iter_split.assert_not_called()
+            mock_vectorstore.add_texts.assert_not_called()
+
+    def test_get_vectorstore_reuses_process_handle(self, mock_external_services):
+        """Testa que o vectorstore é carregado uma única vez por processo"""
+        from .vectorstore import get_vectorstore
+
+        with patch("chatbot.vectorstore.load_vectorstore") as mock_load:
+            mock_load.return_value = MagicMock()
+
+            first = get_vectorstore()
+            second = get_vectorstore()
+
+            assert first is second
+            mock_load.assert_called_once()
+
+    def test_lexical_index_reloads_in_background(self, mock_external_services):
+        """A nova versão do índice léxico é montada numa thread, sem travar a busca"""
+        import threading
+
+        from . import vectorstore
+
+        old, new = MagicMock(), MagicMock()
+        release = threading.Event()
+
+        def slow_open(collection_name):
+            release.wait(5)
+            return new
+
+        with patch.object(vectorstore, "_lexical_index", old), patch.object(
+            vectorstore, "_lexical_index_key", ("langchain", 1)
+        ), patch.object(vectorstore, "_lexical_index_loading", None), patch(
+            "chatbot.vectorstore.get_vectorstore"
+        ), patch(
+            "chatbot.vectorstore._index_key", return_value=("langchain", 2)
+        ), patch(
+            "chatbot.vectorstore.open_lexical_index", side_effect=slow_open
+        ) as mock_open:
+            # Enquanto a versão nova carrega, as buscas usam a anterior
+            assert vectorstore.get_lexical_index() is old
+            assert vectorstore.get_lexical_index() is old
+
+            release.set()
+            for _ in range(500):
+                if vectorstore._lexical_index is new:
+                    break
+                time.sleep(0.01)
+
+            assert vectorstore.get_lexical_index() is new
+            mock_open.assert_called_once_with("langchain")
+            old.close.assert_called_once()
+
+    def test_get_vectorstore_reloads_new_index_version(self, mock_external_services):
+        """Testa que uma nova versão publicada por outro processo é recarregada"""
+        from .manifest import IndexManifest
+        from .vectorstore import get_vectorstore
+
+        first, second = MagicMock(), MagicMock()
+        with patch(
+            "chatbot.vectorstore.load_vectorstore", side_effect=[first, second]
+        ), patch("chatbot.vectorstore.SharedSystemClient") as mock_shared_client:
+            assert get_vectorstore() is first
+            assert get_vectorstore() is first
+
+            IndexManifest(
+                os.path.join(self.test_dir, "manifests", "langchain.json"), version=1
+            ).save()
+
+            assert get_vectorstore() is second
+            assert get_vectorstore() is second
+            mock_shared_client.clear_system_cache.assert_called_once()
+
+    def test_warm_up_vectorstore(self, mock_external_services):
+        """Testa o aquecimento do vectorstore na inicialização do worker"""
+        from .vectorstore import get_vectorstore, warm_up_vectorstore
+
+        with patch("chatbot.vectorstore.load_vectorstore") as mock_load, patch(
+            "chatbot.vectorstore.get_lexical_index"
+        ) as mock_lexical:
+            mock_load.return_value = MagicMock()
+
+            assert warm_up_vectorstore() is mock_load.return_value
+            assert get_vectorstore() is mock_load.return_value
+            mock_load.assert_called_once()
+            mock_lexical.assert_called_once()
+
+        with patch("chatbot.vectorstore._vectorstore", None), patch(
+            "chatbot.vectorstore.load_vectorstore"
+        ) as mock_load:
+            mock_load.side_effect = Exception("Chroma indisponível")
+
+            # Falha no aquecimento não deve derrubar o worker
+            assert warm_up_vectorstore() is None
+
+    def test_rebuild_vectorstore_swaps_handle(self, mock_external_services):
+        """Testa que a reconstrução troca o handle compartilhado"""
+        from .vectorstore import (
+            RAG_COLLECTION_NAME,
+            get_vectorstore,
+            rebuild_vectorstore,
+            set_vectorstore,
+        )
+
+        old_vectorstore = MagicMock()
+        new_vectorstore = MagicMock()
+        set_vectorstore(old_vectorstore)
+
+        with patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.test_dir), patch(
+            "chatbot.vectorstore.build_vectorstore"
+        ) as mock_build, patch(
+            "chatbot.vectorstore.open_vectorstore"
+        ) as mock_open, patch(
+            "chatbot.vectorstore.time.time", return_value=1000
+        ):
+            mock_build.return_value = new_vectorstore
+
+            result = rebuild_vectorstore()
+
+            assert result is new_vectorstore
+            assert get_vectorstore() is new_vectorstore
+            # Buscas em andamento ainda podem usar a coleção antiga
+            old_vectorstore.delete_collection.assert_not_called()
+            mock_open.assert_not_called()
+
+            collection_name = mock_build.call_args.args[0]
+            with open(os.path.join(self.test_dir, "active_collection")) as f:
+                assert f.read() == collection_name
+
+        with patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.test_dir), patch(
+            "chatbot.vectorstore.build_vectorstore", return_value=MagicMock()
+        ), patch("chatbot.vectorstore.open_vectorstore") as mock_open, patch(
+            "chatbot.vectorstore.time.time", return_value=2000
+        ):
+            rebuild_vectorstore()
+
+        # Na reconstrução seguinte a coleção de duas versões atrás é apagada
+        mock_open.assert_called_once_with(RAG_COLLECTION_NAME)
+        mock_open.return_value.delete_collection.assert_called_once()
+        with open(os.path.join(self.test_dir, "retired_collections")) as f:
+            assert f.read() == collection_name
+
+    def test_iter_split_segments_with_process_pool(self, mock_external_services):
+        """Testa o carregamento paralelo de arquivos reais em um pool de processos"""
+        from .vectorstore import iter_split_segments
+
+        files = []
+        for name in ("milho.txt", "soja.txt", "feijao.txt"):
+            path = os.path.join(self.test_files_dir, name)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"Manual técnico de {name}. " * 400)
+            files.append(path)
+
+        results = list(iter_split_segments(files, workers=2, segment_size=2))
+
+        splits_by_file = {}
+        for file, splits, error, last in results:
+            assert error is None
+            assert len(splits) <= 2
+            assert file not in splits_by_file or not splits_by_file[file][1]
+            chunks = splits_by_file.get(file, ([], False))[0] + splits
+            splits_by_file[file] = (chunks, last)
+        assert sorted(splits_by_file) == sorted(files)
+        for file, (splits, last) in splits_by_file.items():
+            assert last
+            assert len(splits) > 1
+            assert all(split.metadata["source"] == file for split in splits)
+
+    def test_iter_split_segments_reports_failures(self, mock_external_services):
+        """Testa que falhas por arquivo são reportadas sem interromper os demais"""
+        from .vectorstore import iter_split_segments
+
+        with patch("chatbot.vectorstore.lazy_load_file") as mock_load_file:
+            mock_load_file.side_effect = [Exception("PDF corrompido"), [MagicMock()]]
+            with patch("chatbot.vectorstore.split_documents", lambda docs: docs):
+                results = list(iter_split_segments(["a.pdf", "b.pdf"], workers=1))
+
+        assert results[0][0] == "a.pdf"
+        assert str(results[0][2]) == "PDF corrompido"
+        assert results[0][3] is True
+        assert results[1][0] == "b.pdf"
+        assert results[1][2] is None
+        assert results[1][3] is True
+        assert len(results[1][1]) == 1
+
+    def test_iter_split_segments_streams_pages(self, mock_external_services):
+        """Testa que as páginas são lidas sob demanda, um segmento por vez"""
+        from .vectorstore import iter_split_segments
+
+        pages_read = []
+
+        def lazy_pages(path):
+            for i in range(1000):
+                pages_read.append(i)
+                yield MagicMock(page_content=f"página {i}", metadata={"page": i})
+
+        with patch("chatbot.vectorstore.lazy_load_file", lazy_pages), patch(
+            "chatbot.vectorstore.split_documents", lambda docs: docs
+        ):
+            segments = iter_split_segments(["manual.pdf"], workers=1, segment_size=10)
+            file, splits, error, last = next(segments)
+
+            assert len(splits) == 10
+            assert not last
+            assert len(pages_read) == 10
+
+            total = len(splits) + sum(len(segment[1]) for segment in segments)
+            assert total == 1000
+
+
+class TestIncrementalIngestion:
+    def setup_method(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.test_files_dir = os.path.join(self.test_dir, "rag_files")
+        self.store_dir = os.path.join(self.test_dir, "vectorstore")
+        os.makedirs(os.path.join(self.test_files_dir, "processed"))
+
+        self.patchers = [
+            patch("chatbot.vectorstore.RAG_FILES_DIR", self.test_files_dir),
+            patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.store_dir),
+            patch("chatbot.vectorstore.RAG_INGESTION_MODE", "incremental"),
+            patch("chatbot.vectorstore.RAG_LOADER_WORKERS", 1),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def teardown_method(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.test_dir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.test_files_dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def _sync(self, vectorstore):
+        from .vectorstore import sync_vectorstore
+
+        with patch("chatbot.vectorstore.lazy_load_file") as mock_load_file:
+            mock_load_file.side_effect = lambda path: [
+                MagicMock(page_content=open(path).read(), metadata={"source": path})
+            ]
+            with patch("chatbot.vectorstore.split_documents", lambda docs: docs):
+                stats = sync_vectorstore(vectorstore, "langchain")
+            return stats, mock_load_file
+
+    def _manifest_chunk_ids(self, key):
+        from .manifest import IndexManifest
+
+        manifest = IndexManifest.load(
+            os.path.join(self.store_dir, "manifests", "langchain.json")
+        )
+        return manifest.files[key]["chunk_ids"]
+
+    def test_sync_indexes_only_new_files(self, mock_external_services):
+        """Testa que a segunda sincronização só processa o arquivo novo"""
+        from .vectorstore import get_index_version
+
+        vectorstore = MagicMock()
+        self._write("milho.txt", "espaçamento do milho")
+
+        stats, _ = self._sync(vectorstore)
+        assert stats["added"] == 1
+        assert get_index_version() == 1
+
+        self._write("soja.txt", "adubação da soja")
+        stats, mock_load_file = self._sync(vectorstore)
+
+        assert stats == {
+            "added": 1,
+            "updated": 0,
+            "removed": 0,
+            "moved": 0,
+            "unchanged": 1,
+            "failed": 0,
+            "chunks": 1,
+            "duplicates": 0,
+            "dead_letters": 0,
+        }
+        mock_load_file.assert_called_once_with(
+            os.path.join(self.test_files_dir, "soja.txt")
+        )
+        assert vectorstore.add_texts.call_count == 2
+        assert get_index_version() == 2
+
+    def test_sync_keeps_lexical_index_in_step(self, mock_external_services):
+        """Testa que o índice léxico acompanha as alterações do vetorial"""
+        from .vectorstore import open_lexical_index
+
+        vectorstore = MagicMock()
+        path = self._write("milho.txt", "cultivar BRS-7280 para safrinha")
+        self._sync(vectorstore)
+
+        lexical_index = open_lexical_index("langchain")
+        assert lexical_index.count() == 1
+        assert lexical_index.search("BRS 7280", k=1)[0][0].metadata["source"] == path
+        lexical_index.close()
+
+        os.remove(path)
+        self._sync(vectorstore)
+
+        assert open_lexical_index("langchain").count() == 0
+
+    def test_sync_backfills_lexical_index(self, mock_external_services):
+        """Testa o preenchimento do índice léxico a partir de um índice vetorial existente"""
+        from .faiss_store import FaissVectorStore
+        from .vectorstore import get_index_version, open_lexical_index
+
+        embedding = MagicMock()
+        embedding.embed_documents.side_effect = lambda texts: [
+            [1.0, float(i)] for i, _ in enumerate(texts)
+        ]
+        vectorstore = FaissVectorStore(os.path.join(self.test_dir, "faiss"), embedding)
+        vectorstore.add_texts(["calagem do solo"], ids=["antigo-0"])
+
+        self._sync(vectorstore)
+
+        lexical_index = open_lexical_index("langchain")
+        assert lexical_index.search("calagem", k=1)[0][0].id == "antigo-0"
+        assert get_index_version() == 1
+
+    def test_sync_skips_duplicate_chunks(self, mock_external_services):
+        """Testa que chunks repetidos de outra edição não são enviados ao embedding"""
+        from .vectorstore import duplicate_sources, open_deduplicator
+
+        paragraph = (
+            "A lagarta-do-cartucho ataca o milho desde a emergência até o "
+            "pendoamento. O monitoramento deve ser semanal, contando as plantas "
+            "com folhas raspadas em cinco pontos de cada talhão, e o controle é "
+            "recomendado quando vinte por cento das plantas apresentam sintomas "
+            "de ataque nas folhas do cartucho durante as primeiras semanas após "
+            "a emergência, antes que as lagartas fiquem protegidas no cartucho "
+            "e escapem da ação dos inseticidas aplicados sobre a lavoura"
+        )
+        vectorstore = MagicMock()
+        self._write("manual_2019.txt", paragraph)
+        self._sync(vectorstore)
+
+        edition = self._write("manual_2023.txt", paragraph.replace("cinco", "dez"))
+        stats, _ = self._sync(vectorstore)
+
+        assert stats["added"] == 1
+        assert stats["duplicates"] == 1
+        assert stats["chunks"] == 0
+        assert vectorstore.add_texts.call_count == 1
+
+        deduplicator = open_deduplicator("langchain")
+        (canonical_id,) = self._manifest_chunk_ids("manual_2019.txt")
+        assert deduplicator.provenance([canonical_id]) == {
+            canonical_id: [{"source": edition}]
+        }
+        assert duplicate_sources([canonical_id]) == {
+            canonical_id: ["manual_2023.txt"]
+        }
+
+    def test_sync_reindexes_duplicates_of_removed_file(self, mock_external_services):
+        """Testa que o duplicado volta ao índice quando o original é removido"""
+        paragraph = "Calagem corrige a acidez do solo e fornece cálcio e magnésio"
+        vectorstore = MagicMock()
+        original = self._write("a.txt", paragraph)
+        self._write("b.txt", paragraph)
+        self._sync(vectorstore)
+        assert self._manifest_chunk_ids("b.txt") == []
+
+        os.remove(original)
+        stats, _ = self._sync(vectorstore)
+
+        assert stats["removed"] == 1
+        assert stats["updated"] == 1
+        assert len(self._manifest_chunk_ids("b.txt")) == 1
+        assert vectorstore.add_texts.call_args.kwargs["texts"] == [paragraph]
+
+    def test_sync_without_changes_keeps_version(self, mock_external_services):
+        """Testa que nada é reindexado quando os arquivos não mudam"""
+        from .vectorstore import get_index_version
+
+        vectorstore = MagicMock()
+        self._write("milho.txt", "espaçamento do milho")
+        self._sync(vectorstore)
+
+        stats, mock_load_file = self._sync(vectorstore)
+
+        assert stats["unchanged"] == 1
+        mock_load_file.assert_not_called()
+        assert get_index_version() == 1
+
+    def test_sync_reindexes_changed_and_removes_deleted(self, mock_external_services):
+        """Testa a reindexação de arquivos alterados e remoção de apagados"""
+        from .manifest import IndexManifest
+
+        vectorstore = MagicMock()
+        path = self._write("milho.txt", "versão 1")
+        removed_path = self._write("antigo.txt", "manual antigo")
+        self._sync(vectorstore)
+
+        manifest = IndexManifest.load(
+            os.path.join(self.store_dir, "manifests", "langchain.json")
+        )
+        old_ids = manifest.files["milho.txt"]["chunk_ids"]
+        removed_ids = manifest.files["antigo.txt"]["chunk_ids"]
+
+        self._write("milho.txt", "versão 2 com mais conteúdo")
+        os.remove(removed_path)
+        stats, _ = self._sync(vectorstore)
+
+        assert stats["updated"] == 1
+        assert stats["removed"] == 1
+        vectorstore.delete.assert_any_call(ids=removed_ids)
+        vectorstore.delete.assert_any_call(ids=old_ids)
+
+        manifest = IndexManifest.load(
+            os.path.join(self.store_dir, "manifests", "langchain.json")
+        )
+        assert set(manifest.files) == {"milho.txt"}
+        assert manifest.files["milho.txt"]["chunk_ids"] != old_ids
+        assert os.path.exists(path)
+
+    def test_sync_rechunks_when_chunking_changes(self, mock_external_services):
+        """Testa que mudar a configuração de chunking redivide os arquivos"""
+        from .vectorstore import get_index_version
+
+        vectorstore = MagicMock()
+        self._write("milho.txt", "espaçamento do milho")
+        self._write("soja.txt", "plantio da soja")
+        self._sync(vectorstore)
+
+        with patch("chatbot.vectorstore.RAG_CHUNK_TOKENS", 120):
+            stats, mock_load_file = self._sync(vectorstore)
+            assert stats["updated"] == 2
+            assert mock_load_file.call_count == 2
+            assert get_index_version() == 2
+
+            stats, mock_load_file = self._sync(vectorstore)
+            assert stats["unchanged"] == 2
+            mock_load_file.assert_not_called()
+
+        # Entradas de manifestos antigos, sem o registro, não são redivididas
+        manifest_path = os.path.join(self.store_dir, "manifests", "langchain.json")
+        with open(manifest_path) as f:
+            data = json.load(f)
+        for entry in data["files"].values():
+            del entry["chunking"]
+        with open(manifest_path, "w") as f:
+            json.dump(data, f)
+
+        stats, mock_load_file = self._sync(vectorstore)
+        assert stats["unchanged"] == 2
+        mock_load_file.assert_not_called()
+
+    def test_interrupted_rebuild_keeps_active_manifest(self, mock_external_services):
+        """Uma reconstrução interrompida não mexe no manifesto da coleção ativa"""
+        from .vectorstore import (
+            _read_retired_collections,
+            get_index_version,
+            rebuild_vectorstore,
+        )
+
+        vectorstore = MagicMock()
+        self._write("milho.txt", "espaçamento do milho")
+        self._sync(vectorstore)
+
+        with patch(
+            "chatbot.vectorstore.build_vectorstore", side_effect=KeyboardInterrupt
+        ), patch("chatbot.vectorstore.time.time", return_value=1000):
+            with pytest.raises(KeyboardInterrupt):
+                rebuild_vectorstore()
+
+        assert get_index_version() == 1
+        stats, mock_load_file = self._sync(vectorstore)
+        assert stats["unchanged"] == 1
+        mock_load_file.assert_not_called()
+        # A coleção que não foi publicada sai na próxima reconstrução
+        assert _read_retired_collections() == ["langchain_1000"]
+
+    def test_rebuild_publishes_manifest_with_collection(self, mock_external_services):
+        """A coleção nova tem o próprio manifesto, com uma versão acima da anterior"""
+        from .manifest import IndexManifest
+        from .vectorstore import (
+            _read_active_collection,
+            get_index_version,
+            rebuild_vectorstore,
+        )
+
+        vectorstore = MagicMock()
+        self._write("milho.txt", "espaçamento do milho")
+        self._sync(vectorstore)
+
+        with patch(
+            "chatbot.vectorstore.open_vectorstore", return_value=vectorstore
+        ), patch(
+            "chatbot.vectorstore.lazy_load_file",
+            side_effect=lambda path: [
+                MagicMock(page_content=open(path).read(), metadata={"source": path})
+            ],
+        ), patch(
+            "chatbot.vectorstore.split_documents", lambda docs: docs
+        ), patch(
+            "chatbot.vectorstore.set_vectorstore"
+        ), patch(
+            "chatbot.vectorstore.time.time", return_value=1000
+        ):
+            rebuild_vectorstore()
+
+        assert _read_active_collection() == "langchain_1000"
+        manifest = IndexManifest.load(
+            os.path.join(self.store_dir, "manifests", "langchain_1000.json")
+        )
+        assert manifest.collection == "langchain_1000"
+        assert list(manifest.files) == ["milho.txt"]
+        # Versões novas nunca repetem a chave do cache das buscas
+        assert get_index_version() > 1
+
+    def test_legacy_manifest_is_adopted(self, mock_external_services):
+        """O manifesto único do formato antigo passa a ser o da sua coleção"""
+        from .manifest import IndexManifest
+
+        vectorstore = MagicMock()
+        self._write("milho.txt", "espaçamento do milho")
+        self._sync(vectorstore)
+        os.replace(
+            os.path.join(self.store_dir, "manifests", "langchain.json"),
+            os.path.join(self.store_dir, "manifest.json"),
+        )
+        assert IndexManifest.load(os.path.join(self.store_dir, "manifest.json")).files
+
+        stats, mock_load_file = self._sync(vectorstore)
+
+        assert stats["unchanged"] == 1
+        mock_load_file.assert_not_called()
+        assert not os.path.exists(os.path.join(self.store_dir, "manifest.json"))
+
+    def test_sync_moved_file_is_not_reembedded(self, mock_external_services):
+        """Testa que mover um arquivo para processed não gera novos embeddings"""
+        vectorstore = MagicMock()
+        path = self._write("milho.txt", "espaçamento do milho")
+        self._sync(vectorstore)
+
+        shutil.move(path, os.path.join(self.test_files_dir, "processed", "milho.txt"))
+        stats, mock_load_file = self._sync(vectorstore)
+
+        assert stats["moved"] == 1
+        mock_load_file.assert_not_called()
+        vectorstore.delete.assert_not_called()
+
+    def test_sync_failed_batch_is_retried(self, mock_external_services):
+        """Testa que um arquivo com falha na indexação é tentado de novo"""
+        vectorstore = MagicMock()
+        vectorstore.add_texts.side_effect = Exception("Rate limit")
+        self._write("milho.txt", "espaçamento do milho")
+
+        stats, _ = self._sync(vectorstore)
+        assert stats["failed"] == 1
+        assert stats["dead_letters"] == 1
+
+        vectorstore.add_texts.side_effect = None
+        stats, _ = self._sync(vectorstore)
+        assert stats["added"] == 1
+
+    def _sync_lines(self, vectorstore):
+        """Sincroniza com um chunk por linha e lotes de um chunk, sem novas tentativas"""
+        from .vectorstore import sync_vectorstore
+
+        def load_lines(path):
+            return [
+                MagicMock(page_content=line, metadata={"source": path})
+                for line in open(path).read().splitlines()
+            ]
+
+        with patch("chatbot.vectorstore.lazy_load_file", side_effect=load_lines), patch(
+            "chatbot.vectorstore.split_documents", lambda docs: docs
+        ), patch("chatbot.embeddings.RAG_EMBEDDING_BATCH_SIZE", 1), patch(
+            "chatbot.embeddings.RAG_EMBEDDING_CONCURRENCY", 1
+        ), patch(
+            "chatbot.embeddings.RAG_EMBEDDING_MAX_RETRIES", 0
+        ):
+            return sync_vectorstore(vectorstore, "langchain")
+
+    def test_interrupted_sync_resumes_from_checkpoint(self, mock_external_services):
+        """Testa que a sincronização retoma o arquivo sem reenviar lotes gravados"""
+        from .manifest import IngestionCheckpoint
+
+        checkpoint_path = os.path.join(self.store_dir, "checkpoints", "langchain.json")
+        vectorstore = MagicMock()
+        vectorstore.add_texts.side_effect = [None, Exception("Timeout"), None]
+        self._write("milho.txt", "semeadura\nadubação\ncolheita")
+
+        stats = self._sync_lines(vectorstore)
+        assert stats["failed"] == 1
+        checkpoint = IngestionCheckpoint.load(checkpoint_path, "langchain")
+        assert len(checkpoint.files["milho.txt"]["chunk_ids"]) == 2
+
+        vectorstore.add_texts.side_effect = None
+        stats = self._sync_lines(vectorstore)
+
+        assert stats["added"] == 1
+        assert vectorstore.add_texts.call_count == 4
+        assert vectorstore.add_texts.call_args.kwargs["texts"] == ["adubação"]
+        assert len(self._manifest_chunk_ids("milho.txt")) == 3
+        assert not os.path.exists(checkpoint_path)
+
+    def test_sync_persists_once_per_file(self, mock_external_services):
+        """O índice vai para o disco por arquivo concluído, não a cada lote"""
+        from .manifest import IngestionCheckpoint
+
+        checkpoint_path = os.path.join(self.store_dir, "checkpoints", "langchain.json")
+        vectorstore = MagicMock()
+        self._write("milho.txt", "semeadura\nadubação")
+        self._write("soja.txt", "plantio\ncolheita")
+        checkpointed = []
+
+        def add_texts(texts, **kwargs):
+            if texts == ["colheita"]:
+                raise Exception("Timeout")
+
+        vectorstore.add_texts.side_effect = add_texts
+
+        def persist(_):
+            # O checkpoint só pode citar lotes que já estavam no disco
+            checkpoint = IngestionCheckpoint.load(checkpoint_path, "langchain")
+            checkpointed.append(
+                sum(len(e["chunk_ids"]) for e in checkpoint.files.values())
+            )
+
+        with patch("chatbot.vectorstore.RAG_CHECKPOINT_INTERVAL", 3600), patch(
+            "chatbot.vectorstore.persist_vectorstore", side_effect=persist
+        ) as mock_persist:
+            stats = self._sync_lines(vectorstore)
+
+        assert stats["added"] == 1
+        assert stats["failed"] == 1
+        # Um arquivo concluído e o fim da sincronização; não um por lote
+        assert mock_persist.call_count == 2
+        # Nada entra no checkpoint antes da primeira ida ao disco
+        assert checkpointed[0] == 0
+        checkpoint = IngestionCheckpoint.load(checkpoint_path, "langchain")
+        (entry,) = checkpoint.files.values()
+        assert len(entry["chunk_ids"]) == 1
+
+    def test_sync_failed_canonical_does_not_drop_copies(self, mock_external_services):
+        """Cópias de um chunk cujo arquivo falhou são indexadas pelo outro arquivo"""
+        vectorstore = MagicMock()
+        self._write("a.txt", "semeadura do milho\nrotação com braquiária")
+        self._write("b.txt", "colheita da soja\nrotação com braquiária")
+
+        def add_texts(texts, **kwargs):
+            if texts == ["semeadura do milho"]:
+                raise Exception("Timeout")
+
+        vectorstore.add_texts.side_effect = add_texts
+        stats = self._sync_lines(vectorstore)
+
+        assert stats["failed"] == 1
+        # b.txt fica com o próprio chunk, não com o de a.txt que não foi gravado
+        assert len(self._manifest_chunk_ids("b.txt")) == 2
+
+    def test_build_retries_copies_of_failed_canonical(self, mock_external_services):
+        """No modo full, cópias de um chunk que falhou voltam com o próprio arquivo"""
+        from .vectorstore import build_vectorstore
+
+        vectorstore = MagicMock()
+        self._write("a.txt", "semeadura do milho\nrotação com braquiária")
+        path = self._write("b.txt", "colheita da soja\nrotação com braquiária")
+
+        def add_texts(texts, **kwargs):
+            if texts == ["semeadura do milho"]:
+                raise Exception("Timeout")
+
+        vectorstore.add_texts.side_effect = add_texts
+
+        def load_lines(path):
+            return [
+                MagicMock(page_content=line, metadata={"source": path})
+                for line in open(path).read().splitlines()
+            ]
+
+        with patch("chatbot.vectorstore.RAG_INGESTION_MODE", "full"), patch(
+            "chatbot.vectorstore.open_vectorstore", return_value=vectorstore
+        ), patch("chatbot.vectorstore.lazy_load_file", side_effect=load_lines), patch(
+            "chatbot.vectorstore.split_documents", lambda docs: docs
+        ), patch(
+            "chatbot.embeddings.RAG_EMBEDDING_BATCH_SIZE", 1
+        ), patch(
+            "chatbot.embeddings.RAG_EMBEDDING_CONCURRENCY", 1
+        ), patch(
+            "chatbot.embeddings.RAG_EMBEDDING_MAX_RETRIES", 0
+        ):
+            build_vectorstore("langchain")
+
+        # O chunk de b.txt, descartado como cópia do de a.txt, é gravado de novo
+        copies = [
+            call.kwargs
+            for call in vectorstore.add_texts.call_args_list
+            if call.kwargs["texts"] == ["rotação com braquiária"]
+        ]
+        assert len(copies) == 2
+        assert copies[1]["metadatas"][0]["source"] == path
+
+    def test_checkpoint_of_changed_file_is_discarded(self, mock_external_services):
+        """Testa que chunks gravados de um arquivo alterado depois da falha são apagados"""
+        vectorstore = MagicMock()
+        vectorstore.add_texts.side_effect = [None, Exception("Timeout")]
+        self._write("milho.txt", "semeadura\nadubação")
+        self._sync_lines(vectorstore)
+        (written,) = vectorstore.add_texts.call_args_list[0].kwargs["ids"]
+
+        vectorstore.add_texts.side_effect = None
+        self._write("milho.txt", "semeadura\nadubação de cobertura")
+        stats = self._sync_lines(vectorstore)
+
+        assert stats["added"] == 1
+        vectorstore.delete.assert_called_once_with(ids=[written])
+
+    def test_archive_moves_indexed_files(self, mock_external_services):
+        """Testa que os arquivos indexados vão para processed/ sem reindexação"""
+        from .vectorstore import archive_indexed_files, get_index_version
+
+        vectorstore = MagicMock()
+        self._write("milho.txt", "espaçamento do milho")
+        self._write(os.path.join("processed", "milho.txt"), "milho safrinha")
+        self._sync(vectorstore)
+
+        assert archive_indexed_files() == ["milho.txt"]
+        assert not os.path.exists(os.path.join(self.test_files_dir, "milho.txt"))
+        with open(os.path.join(self.test_files_dir, "processed", "milho_1.txt")) as f:
+            assert f.read() == "espaçamento do milho"
+
+        stats, mock_load_file = self._sync(vectorstore)
+        assert stats["unchanged"] == 2
+        mock_load_file.assert_not_called()
+        assert get_index_version() == 1
+
+    def test_ingest_command_dry_run(self, mock_external_services):
+        """Testa que o dry-run estima chunks e tokens sem indexar"""
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        self._write("milho.txt", "espaçamento do milho")
+        self._write("soja.txt", "adubação da soja")
+        out = StringIO()
+
+        with patch("chatbot.vectorstore.lazy_load_file") as mock_load_file, patch(
+            "chatbot.vectorstore.split_documents", lambda docs: docs
+        ), patch("chatbot.vectorstore.open_vectorstore") as mock_open:
+            mock_load_file.side_effect = lambda path: [
+                MagicMock(page_content=open(path).read(), metadata={"source": path})
+            ]
+            call_command("ingest_rag", "--dry-run", "--json", stdout=out)
+
+        estimate = json.loads(out.getvalue())
+        assert estimate["index"] == 2
+        assert estimate["chunks"] == 2
+        assert estimate["tokens"] > 0
+        mock_open.assert_not_called()
+        assert not os.path.exists(
+            os.path.join(self.store_dir, "manifests", "langchain.json")
+        )
+
+    def test_ingest_command_reports_progress(self, mock_external_services):
+        """Testa que o comando indexa e informa arquivos, chunks e tokens"""
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        self._write("milho.txt", "espaçamento do milho")
+        vectorstore = MagicMock()
+        out = StringIO()
+
+        with patch("chatbot.vectorstore.lazy_load_file") as mock_load_file, patch(
+            "chatbot.vectorstore.split_documents", lambda docs: docs
+        ), patch("chatbot.vectorstore.open_vectorstore", return_value=vectorstore):
+            mock_load_file.side_effect = lambda path: [
+                MagicMock(page_content=open(path).read(), metadata={"source": path})
+            ]
+            call_command("ingest_rag", stdout=out)
+
+        vectorstore.add_texts.assert_called_once()
+        assert "arquivos 1/1 (0 com falha) | chunks 1" in out.getvalue()
+        assert "Ingestão concluída" in out.getvalue()
+
+    def test_ingest_command_rebuild(self, mock_external_services):
+        """Testa que --rebuild reindexa numa coleção nova em vez de sincronizar"""
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        with patch(
+            "chatbot.management.commands.ingest_rag.rebuild_vectorstore"
+        ) as mock_rebuild, patch(
+            "chatbot.management.commands.ingest_rag.ingest_vectorstore"
+        ) as mock_ingest:
+            call_command("ingest_rag", "--rebuild", stdout=StringIO())
+
+        mock_rebuild.assert_called_once()
+        assert mock_rebuild.call_args.kwargs["progress"] is not None
+        mock_ingest.assert_not_called()
+
+
+class TestEmbeddingCache:
+    def setup_method(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.test_dir, "embeddings.sqlite3")
+
+    def teardown_method(self):
+        shutil.rmtree(self.test_dir)
+
+    def _fake_embeddings(self):
+        fake = MagicMock()
+        fake.model = "text-embedding-test"
+        fake.embed_documents.side_effect = lambda texts: [
+            [float(len(text)), 1.0] for text in texts
+        ]
+        return fake
+
+    def test_cached_embeddings_only_embeds_unseen_chunks(self):
+        """Testa que apenas chunks novos são enviados ao modelo"""
+        from .embeddings import CachedEmbeddings, EmbeddingCache
+
+        fake = self._fake_embeddings()
+        cache = EmbeddingCache(self.cache_path)
+        embeddings = CachedEmbeddings(fake, cache)
+
+        first = embeddings.embed_documents(["milho safrinha", "soja"])
+        second = embeddings.embed_documents(["soja", "feijão", "milho  safrinha "])
+
+        assert first == [[14.0, 1.0], [4.0, 1.0]]
+        assert second == [[4.0, 1.0], [6.0, 1.0], [14.0, 1.0]]
+        assert fake.embed_documents.call_args_list[1].args[0] == ["feijão"]
+        assert cache.stats() == {"hits": 2, "misses": 3, "hit_rate": 0.4}
+
+    def test_cache_persists_across_processes(self):
+        """Testa que o cache em disco é reaproveitado por uma nova instância"""
+        from .embeddings import CachedEmbeddings, EmbeddingCache
+
+        CachedEmbeddings(
+            self._fake_embeddings(), EmbeddingCache(self.cache_path)
+        ).embed_documents(["adubação nitrogenada"])
+
+        fake = self._fake_embeddings()
+        cache = EmbeddingCache(self.cache_path)
+        result = CachedEmbeddings(fake, cache).embed_documents(["adubação nitrogenada"])
+
+        assert result == [[20.0, 1.0]]
+        fake.embed_documents.assert_not_called()
+        assert cache.hits == 1
+
+    def test_cache_is_keyed_by_model(self):
+        """Testa que modelos diferentes não compartilham vetores"""
+        from .embeddings import CachedEmbeddings, EmbeddingCache
+
+        cache = EmbeddingCache(self.cache_path)
+        CachedEmbeddings(self._fake_embeddings(), cache).embed_documents(["pH do solo"])
+
+        other = self._fake_embeddings()
+        other.model = "outro-modelo"
+        CachedEmbeddings(other, cache).embed_documents(["pH do solo"])
+
+        other.embed_documents.assert_called_once_with(["pH do solo"])
+
+    def test_get_embedding_function_uses_cache(self, mock_external_services):
+        """Testa que o vectorstore usa embeddings com cache quando habilitado"""
+        from .embeddings import CachedEmbeddings
+        from .vectorstore import get_embedding_function
+
+        with patch("chatbot.vectorstore.EMBEDDING_CACHE_PATH", self.cache_path):
+            assert isinstance(get_embedding_function(), CachedEmbeddings)
+
+        with patch("chatbot.vectorstore.EMBEDDING_CACHE_ENABLED", False), patch(
+            "chatbot.vectorstore.RAG_CACHE_ENABLED", False
+        ):
+            assert (
+                get_embedding_function()
+                == mock_external_services["embeddings"].return_value
+            )
+
+
+class TestEmbeddingBatchScheduler:
+    def _splits(self, *texts):
+        return [
+            MagicMock(page_content=text, metadata={"source": f"doc{i}.pdf"})
+            for i, text in enumerate(texts)
+        ]
+
+    def test_pack_by_token_budget(self):
+        """Testa que os lotes são montados pelo número de tokens"""
+        from .embeddings import EmbeddingBatchScheduler
+
+        with patch("chatbot.embeddings.count_tokens", len), EmbeddingBatchScheduler(
+            MagicMock(), batch_tokens=10, batch_size=100
+        ) as scheduler:
+            batches = scheduler.pack(
+                self._splits("aaaa", "bbbb", "cccc", "dddddddddddd", "e"),
+                ids=["1", "2", "3", "4", "5"],
+            )
+
+        assert [tokens for _, tokens in batches] == [8, 4, 12, 1]
+        assert [[chunk_id for _, chunk_id in batch] for batch, _ in batches] == [
+            ["1", "2"],
+            ["3"],
+            ["4"],
+            ["5"],
+        ]
+
+    def test_batches_run_concurrently(self):
+        """Testa que vários lotes ficam em andamento ao mesmo tempo"""
+        import threading
+
+        from .embeddings import EmbeddingBatchScheduler
+
+        barrier = threading.Barrier(3, timeout=5)
+        vectorstore = MagicMock()
+        vectorstore.add_texts.side_effect = lambda **kwargs: barrier.wait()
+
+        with patch("chatbot.embeddings.count_tokens", len), EmbeddingBatchScheduler(
+            vectorstore, concurrency=3, batch_tokens=1
+        ) as scheduler:
+            futures = scheduler.submit(self._splits("a", "b", "c"))
+
+        # Só passa da barreira se os três lotes estiverem em voo juntos
+        assert all(future.result() for future in futures)
+        assert vectorstore.add_texts.call_count == 3
+
+    def test_submit_waits_when_pending_batches_are_full(self):
+        """Testa que submit espera quando a fila de lotes está cheia"""
+        import threading
+
+        from .embeddings import EmbeddingBatchScheduler
+
+        release = threading.Event()
+        vectorstore = MagicMock()
+        vectorstore.add_texts.side_effect = lambda **kwargs: release.wait(5)
+
+        with patch("chatbot.embeddings.count_tokens", len), EmbeddingBatchScheduler(
+            vectorstore, concurrency=1, batch_tokens=1, max_pending=2
+        ) as scheduler:
+            producer = threading.Thread(
+                target=scheduler.submit, args=(self._splits("a", "b", "c", "d"),)
+            )
+            producer.start()
+            producer.join(0.2)
+
+            # Um lote em andamento e um na fila; os outros dois esperam vaga
+            assert producer.is_alive()
+            assert vectorstore.add_texts.call_count == 1
+
+            release.set()
+            producer.join(5)
+            assert not producer.is_alive()
+
+        assert vectorstore.add_texts.call_count == 4
+
+    def test_failed_batch_is_retried_then_dead_lettered(self):
+        """Testa o retry com backoff e o registro em dead letters"""
+        from .embeddings import EmbeddingBatchScheduler
+
+        vectorstore = MagicMock()
+        vectorstore.add_texts.side_effect = [Exception("429"), None] + [
+            Exception("500")
+        ] * 3
+
+        with EmbeddingBatchScheduler(
+            vectorstore, concurrency=1, batch_size=1, max_retries=2, retry_backoff=0
+        ) as scheduler:
+            futures = scheduler.submit(self._splits("milho", "soja"), ids=["m", "s"])
+
+        assert [future.result() for future in futures] == [True, False]
+        assert vectorstore.add_texts.call_count == 5
+        assert len(scheduler.dead_letters) == 1
+        assert scheduler.dead_letters[0]["ids"] == ["s"]
+        assert scheduler.dead_letters[0]["sources"] == ["doc1.pdf"]
+        assert scheduler.dead_letters[0]["error"] == "500"
+
+    def test_rate_limiter_waits_for_budget(self):
+        """Testa que o limitador espera a janela quando o orçamento acaba"""
+        from .embeddings import RateLimiter
+
+        clock = {"now": 0.0}
+        sleeps = []
+
+        def fake_sleep(seconds):
+            sleeps.append(seconds)
+            clock["now"] += seconds
+
+        limiter = RateLimiter(requests_per_minute=100, tokens_per_minute=1000)
+        with patch("chatbot.embeddings.time.monotonic", lambda: clock["now"]), patch(
+            "chatbot.embeddings.time.sleep", fake_sleep
+        ):
+            limiter.acquire(600)
+            limiter.acquire(300)
+            assert sleeps == []
+
+            # Estoura o orçamento de tokens: espera o primeiro lote sair da janela
+            limiter.acquire(200)
+            assert sum(sleeps) == pytest.approx(60)
+
+
+class TestFaissVectorStore:
+    def setup_method(self):
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        self.test_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.test_dir, "faiss", "langchain")
+        self.embedding = DeterministicFakeEmbedding(size=32)
+        self.texts = [
+            "Espaçamento do milho safrinha",
+            "Controle da lagarta-do-cartucho",
+            "Adubação nitrogenada da soja",
+        ]
+
+    def teardown_method(self):
+        shutil.rmtree(self.test_dir)
+
+    def _store(self, **kwargs):
+        from .faiss_store import FaissVectorStore
+
+        return FaissVectorStore(self.path, self.embedding, **kwargs)
+
+    @pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+    def test_add_and_search(self, index_type):
+        """Testa a indexação e a busca por similaridade"""
+        store = self._store(index_type=index_type)
+        store.add_texts(
+            self.texts,
+            metadatas=[{"source": f"doc{i}.pdf"} for i in range(3)],
+            ids=["a", "b", "c"],
+        )
+
+        results = store.similarity_search_with_score(self.texts[1], k=2)
+
+        assert len(results) == 2
+        assert results[0][0].page_content == self.texts[1]
+        assert results[0][0].metadata == {"source": "doc1.pdf"}
+        assert results[0][1] == pytest.approx(1.0, abs=1e-4)
+        assert store.count() == 3
+
+    @pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+    def test_search_while_another_store_adds_chunks(self, index_type):
+        """Chunks gravados por outro processo não quebram a busca do índice carregado"""
+        store = self._store(index_type=index_type)
+        store.add_texts(self.texts, ids=["a", "b", "c"])
+        store.persist()
+
+        reader = self._store(index_type=index_type)
+        # A ingestão continua gravando na mesma tabela antes de o worker recarregar
+        store.add_texts(
+            [f"Boletim técnico {i}" for i in range(10)],
+            ids=[f"novo-{i}" for i in range(10)],
+        )
+
+        results = reader.similarity_search(self.texts[1], k=3)
+
+        assert len(results) == 3
+        assert results[0].page_content == self.texts[1]
+
+    def test_persist_and_reopen_memory_mapped(self):
+        """Testa que o índice gravado é reaberto mapeado em memória"""
+        store = self._store()
+        store.add_texts(self.texts, ids=["a", "b", "c"])
+        store.persist()
+
+        reopened = self._store()
+
+        assert reopened._mmapped
+        assert reopened.similarity_search(self.texts[2], k=1)[0].id == "c"
+
+        # Escrever num índice mapeado carrega uma cópia gravável
+        reopened.add_texts(["Calagem do solo"], ids=["d"])
+        assert not reopened._mmapped
+        assert reopened.count() == 4
+
+    @pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+    def test_delete_and_upsert(self, index_type):
+        """Testa a remoção e a substituição de chunks pelo id"""
+        store = self._store(index_type=index_type)
+        store.add_texts(self.texts, ids=["a", "b", "c"])
+
+        assert store.delete(ids=["b"])
+        store.add_texts(["Texto novo para a"], ids=["a"])
+
+        assert store.count() == 2
+        found = [doc.id for doc in store.similarity_search(self.texts[1], k=3)]
+        assert sorted(found) == ["a", "c"]
+        assert store.similarity_search("Texto novo para a", k=1)[0].id == "a"
+
+    def test_metadata_filter(self):
+        """Testa o filtro por metadados na busca"""
+        store = self._store()
+        store.add_texts(
+            self.texts,
+            metadatas=[{"source": "a.pdf"}, {"source": "b.csv"}, {"source": "a.pdf"}],
+        )
+
+        results = store.similarity_search(
+            self.texts[1], k=3, filter={"source": "a.pdf"}
+        )
+
+        assert {doc.metadata["source"] for doc in results} == {"a.pdf"}
+        assert len(results) == 2
+
+    @pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+    @pytest.mark.parametrize("quantization", ["fp16", "int8"])
+    def test_quantized_index_reranks_with_exact_scores(self, index_type, quantization):
+        """Testa o índice quantizado com reordenação pelos vetores float32"""
+        store = self._store(index_type=index_type, quantization=quantization)
+        store.add_texts(self.texts, ids=["a", "b", "c"])
+        store.persist()
+
+        reopened = self._store(index_type=index_type, quantization=quantization)
+        results = reopened.similarity_search_with_score(self.texts[1], k=2)
+
+        assert results[0][0].id == "b"
+        # O score vem do vetor exato, não do quantizado
+        assert results[0][1] == pytest.approx(1.0, abs=1e-6)
+        assert results[0][1] >= results[1][1]
+        assert reopened.index.ntotal == 3
+
+    def test_quantized_index_is_smaller(self):
+        """Testa que o int8 ocupa um quarto do índice float32"""
+        from .faiss_store import INDEX_FILE
+
+        sizes = {}
+        for quantization in ("none", "int8"):
+            self.path = os.path.join(self.test_dir, quantization)
+            store = self._store(quantization=quantization)
+            store.add_texts([f"{text} {i}" for i in range(50) for text in self.texts])
+            store.persist()
+            sizes[quantization] = os.path.getsize(os.path.join(self.path, INDEX_FILE))
+
+        assert sizes["int8"] < sizes["none"] / 3
+
+    def test_reopen_keeps_stored_quantization(self):
+        """Testa que um índice existente mantém o formato com que foi criado"""
+        store = self._store()
+        store.add_texts(self.texts, ids=["a", "b", "c"])
+        store.persist()
+
+        reopened = self._store(quantization="int8")
+
+        assert reopened.quantization == "none"
+        assert reopened.similarity_search(self.texts[2], k=1)[0].id == "c"
+
+    def test_invalid_quantization(self):
+        """Testa a validação do tipo de quantização"""
+        with pytest.raises(ValueError):
+            self._store(quantization="int4")
+
+    def test_storage_benchmark_reports_recall_and_memory(self):
+        """Testa o benchmark de armazenamento com vetores sintéticos"""
+        from .management.commands.benchmark_vector_storage import (
+            benchmark_store,
+            exact_neighbors,
+            sample_queries,
+            synthetic_vectors,
+        )
+
+        vectors = synthetic_vectors(300, 32, seed=1)
+        queries = sample_queries(vectors, 20, seed=1)
+        neighbors = exact_neighbors(vectors, queries, 3)
+
+        results = {
+            store: benchmark_store(store, vectors, queries, neighbors, 3)
+            for store in ("float32", "int8")
+        }
+
+        assert results["float32"]["recall"] == pytest.approx(1.0)
+        assert results["int8"]["recall"] >= 0.9
+        assert (
+            results["int8"]["index_memory_bytes"]
+            < results["float32"]["index_memory_bytes"]
+        )
+        assert results["int8"]["latency_p95_ms"] >= results["int8"]["latency_p50_ms"]
+
+    def test_retriever_works_with_rag_search_tool(self):
+        """Testa que a RAGSearchTool funciona sem mudanças com o backend FAISS"""
+        from .tools import RAGSearchTool
+
+        store = self._store()
+        store.add_texts(self.texts)
+
+        with patch("chatbot.tools.get_vectorstore", return_value=store):
+            result = RAGSearchTool()._run(self.texts[0], k=1)
+
+        assert "Resultado 1:" in result
+        assert self.texts[0] in result
+
+    def test_backend_selected_by_config(self, mock_external_services):
+        """Testa a seleção do backend vetorial pela configuração"""
+        from .faiss_store import FaissVectorStore
+        from .vectorstore import count_chunks, open_vectorstore
+
+        with patch("chatbot.vectorstore.RAG_VECTOR_BACKEND", "faiss"), patch(
+            "chatbot.vectorstore.VECTOR_STORE_PATH", self.test_dir
+        ), patch("chatbot.vectorstore.RAG_FAISS_INDEX_TYPE", "hnsw"):
+            vectorstore = open_vectorstore("langchain")
+
+        assert isinstance(vectorstore, FaissVectorStore)
+        assert vectorstore.path == self.path
+        assert vectorstore.index_type == "hnsw"
+        assert count_chunks(vectorstore) == 0
+        mock_external_services["chroma"].assert_not_called()
+
+
+class TestRetrievalCache:
+    def _tool_with_vectorstore(self, docs):
+        mock_retriever = MagicMock()
+        mock_retriever.invoke.return_value = docs
+        mock_vectorstore = MagicMock()
+        mock_vectorstore.as_retriever.return_value = mock_retriever
+        return mock_vectorstore, mock_retriever
+
+    def test_repeated_question_uses_cache(self, mock_external_services):
+        """Testa que perguntas repetidas não repetem a busca"""
+        from langchain_core.documents import Document
+
+        from .tools import RAGSearchTool
+
+        docs = [Document(page_content="Controle da lagarta", metadata={"page": 3})]
+        mock_vectorstore, mock_retriever = self._tool_with_vectorstore(docs)
+
+        with patch("chatbot.tools.get_vectorstore", return_value=mock_vectorstore):
+            tool = RAGSearchTool()
+            first = tool._run("Como controlar a lagarta no milho?", k=3)
+            second = tool._run("  como controlar a LAGARTA no milho? ", k=3)
+
+        assert first == second
+        mock_retriever.invoke.assert_called_once()
+
+    def test_cache_key_includes_k_and_index_version(self, mock_external_services):
+        """Testa que k e a versão do índice separam as entradas do cache"""
+        from langchain_core.documents import Document
+
+        from .tools import RAGSearchTool
+
+        docs = [Document(page_content="Espaçamento", metadata={})]
+        mock_vectorstore, mock_retriever = self._tool_with_vectorstore(docs)
+
+        with patch("chatbot.tools.get_vectorstore", return_value=mock_vectorstore):
+            tool = RAGSearchTool()
+            with patch("chatbot.tools.get_index_version", return_value=1):
+                tool._run("espaçamento da soja", k=3)
+                tool._run("espaçamento da soja", k=5)
+            with patch("chatbot.tools.get_index_version", return_value=2):
+                tool._run("espaçamento da soja", k=3)
+
+        assert mock_retriever.invoke.call_count == 3
+
+    def test_redis_tier_shared_between_workers(self, mock_external_services):
+        """Testa que um resultado gravado no Redis é lido por outro processo"""
+        import json
+
+        from .retrieval_cache import TwoTierCache
+
+        redis_client = mock_external_services["rag_cache_redis"]
+        writer = TwoTierCache("retrieval", maxsize=10, ttl=60)
+        writer.set("chave", [{"page_content": "pH", "metadata": {}}])
+
+        redis_key, raw = redis_client.set.call_args.args
+        assert redis_client.set.call_args.kwargs == {"ex": 60}
+
+        redis_client.get.return_value = raw
+        reader = TwoTierCache("retrieval", maxsize=10, ttl=60)
+
+        assert reader.get("chave") == json.loads(raw)
+        redis_client.get.assert_called_with(redis_key)
+
+    def test_redis_failure_falls_back_to_lru(self, mock_external_services):
+        """Testa que o cache continua funcionando no processo sem Redis"""
+        import redis
+
+        from .retrieval_cache import TwoTierCache
+
+        redis_client = mock_external_services["rag_cache_redis"]
+        redis_client.get.side_effect = redis.ConnectionError("down")
+        redis_client.set.side_effect = redis.ConnectionError("down")
+
+        cache = TwoTierCache("retrieval", maxsize=1, ttl=60)
+        assert cache.get("a") is None
+
+        cache.set("a", [1.0])
+        assert cache.get("a") == [1.0]
+
+        # LRU limitado: a entrada mais antiga sai
+        cache.set("b", [2.0])
+        assert cache.get("a") is None
+
+    def test_query_embeddings_are_cached(self, mock_external_services):
+        """Testa o cache de embeddings das perguntas"""
+        from .embeddings import CachedEmbeddings
+        from .retrieval_cache import get_cache
+
+        fake = MagicMock()
+        fake.model = "text-embedding-test"
+        fake.embed_query.return_value = [0.1, 0.2]
+        embeddings = CachedEmbeddings(fake, query_cache=get_cache("query_embedding"))
+
+        assert embeddings.embed_query("Adubação do feijão") == [0.1, 0.2]
+        assert embeddings.embed_query("adubação do  feijão") == [0.1, 0.2]
+        fake.embed_query.assert_called_once()
+
+
+class TestLexicalSearch:
+    def setup_method(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.texts = [
+            "A cultivar BRS-7280 de soja tem ciclo precoce",
+            "Controle da lagarta-do-cartucho no milho com Bacillus thuringiensis",
+            "Adubação com NPK 04-14-08 no plantio do feijão",
+            "Irrigação por gotejamento em hortaliças",
+        ]
+
+    def teardown_method(self):
+        shutil.rmtree(self.test_dir)
+
+    def _index(self, path=None):
+        from .lexical import BM25Index
+
+        index = BM25Index(path)
+        index.add(
+            [f"chunk-{i}" for i in range(len(self.texts))],
+            self.texts,
+            [{"source": f"doc{i}.pdf"} for i in range(len(self.texts))],
+        )
+        return index
+
+    def test_tokenize_folds_accents_and_splits_codes(self):
+        """Testa a normalização dos termos e a quebra de códigos"""
+        from .lexical import tokenize
+
+        assert tokenize("Adubação da SOJA") == ["adubacao", "soja"]
+        assert tokenize("BRS-7280") == ["brs7280", "brs", "7280"]
+
+    def test_search_ranks_matching_terms(self):
+        """Testa que códigos e nomes de produtos encontram o chunk certo"""
+        index = self._index()
+
+        for query, expected in [
+            ("brs 7280", "chunk-0"),
+            ("BRS7280", "chunk-0"),
+            ("thuringiensis", "chunk-1"),
+            ("formulação 04-14-08", "chunk-2"),
+        ]:
+            doc, score = index.search(query, k=1)[0]
+            assert doc.id == expected
+            assert score > 0
+
+        assert index.search("tomate", k=3) == []
+
+    def test_search_with_filter(self):
+        """Testa o filtro por metadados na busca léxica"""
+        index = self._index()
+
+        results = index.search("milho soja", k=4, filter={"source": "doc0.pdf"})
+
+        assert [doc.id for doc, _ in results] == ["chunk-0"]
+
+    def test_persistence_and_delete(self):
+        """Testa que o índice é remontado do disco e acompanha remoções"""
+        from .lexical import BM25Index
+
+        path = os.path.join(self.test_dir, "lexical", "langchain.sqlite3")
+        index = self._index(path)
+        index.delete(["chunk-1"])
+        index.close()
+
+        reopened = BM25Index(path)
+        assert reopened.count() == 3
+        assert reopened.search("lagarta", k=1) == []
+        assert reopened.search("gotejamento", k=1)[0][0].id == "chunk-3"
+
+    def test_fuse_rankings(self):
+        """Testa que a fusão favorece documentos bem ranqueados nas duas buscas"""
+        from langchain_core.documents import Document
+
+        from .lexical import fuse_rankings
+
+        a, b, c = (Document(id=i, page_content=i) for i in "abc")
+
+        fused = fuse_rankings([[a, b, c], [b]], [0.5, 0.5], k=2)
+
+        assert [doc.id for doc in fused] == ["b", "a"]
+
+    def test_lexical_mode_skips_embeddings(self, mock_external_services):
+        """Testa que o modo léxico não usa o vectorstore nem embeddings"""
+        from .tools import RAGSearchTool
+
+        with patch(
+            "chatbot.tools.get_lexical_index", return_value=self._index()
+        ), patch("chatbot.tools.get_vectorstore") as mock_get_vectorstore:
+            result = RAGSearchTool()._run("BRS 7280", k=1, mode="lexical")
+
+        assert self.texts[0] in result
+        mock_get_vectorstore.assert_not_called()
+
+    def test_search_mode_metric_keeps_query_type(self, mock_external_services):
+        """O modo vai para uma métrica própria; a antiga segue como general"""
+        from .tools import RAGSearchTool
+
+        with patch(
+            "chatbot.tools.get_lexical_index", return_value=self._index()
+        ), patch("chatbot.tools.track_rag_search") as mock_track, patch(
+            "chatbot.tools.track_rag_search_mode"
+        ) as mock_track_mode:
+            RAGSearchTool()._run("BRS 7280", k=1, mode="lexical")
+
+        mock_track.assert_called_once_with()
+        mock_track_mode.assert_called_once_with("lexical")
+
+    def test_hybrid_mode_fuses_results(self, mock_external_services):
+        """Testa que o modo híbrido combina as buscas vetorial e léxica"""
+        from langchain_core.documents import Document
+
+        from .tools import RAGSearchTool
+
+        mock_vectorstore = MagicMock()
+        mock_vectorstore.similarity_search.return_value = [
+            Document(id="chunk-3", page_content=self.texts[3]),
+            Document(id="chunk-0", page_content=self.texts[0]),
+        ]
+
+        with patch(
+            "chatbot.tools.get_lexical_index", return_value=self._index()
+        ), patch("chatbot.tools.get_vectorstore", return_value=mock_vectorstore):
+            result = RAGSearchTool()._run("soja BRS-7280", k=1, mode="hybrid")
+
+        assert result.startswith(f"Resultado 1:\n{self.texts[0]}")
+        mock_vectorstore.similarity_search.assert_called_once_with("soja BRS-7280", k=4)
+        mock_vectorstore.as_retriever.assert_not_called()
+
+    def test_benchmark_command(self, mock_external_services):
+        """Testa o comando de benchmark com perguntas geradas do índice"""
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        vectorstore = MagicMock()
+        vectorstore.get.side_effect = [
+            {
+                "ids": [f"chunk-{i}" for i in range(len(self.texts))],
+                "documents": self.texts,
+                "metadatas": [{} for _ in self.texts],
+            },
+            {"ids": [], "documents": [], "metadatas": []},
+        ]
+        output = StringIO()
+
+        with patch(
+            "chatbot.management.commands.benchmark_rag_search.get_vectorstore",
+            return_value=vectorstore,
+        ), patch("chatbot.tools.get_lexical_index", return_value=self._index()):
+            call_command(
+                "benchmark_rag_search",
+                "--modes",
+                "lexical",
+                "--sample",
+                "10",
+                "--json",
+                stdout=output,
+            )
+
+        result = json.loads(output.getvalue())
+        assert result["mode"] == "lexical"
+        # Apenas os chunks com pelo menos 8 palavras viram perguntas
+        assert result["queries"] == 3
+        assert result["recall"] == 1.0
+
+
+class TestMetadataFilters:
+    def setup_method(self):
+        from langchain_core.documents import Document
+
+        from .chunk_metadata import enrich_metadata
+
+        self.test_dir = tempfile.mkdtemp()
+        self.docs = [
+            enrich_metadata(Document(page_content=text, metadata={"source": source}))
+            for text, source in [
+                ("Espaçamento entre linhas no plantio", "rag_files/manual_milho.pdf"),
+                ("Colheita do café arábica no cerrado", "rag_files/culturas.pdf"),
+                ("Preço da saca de café e de soja", "rag_files/cotacoes.csv"),
+                ("Controle de plantas daninhas na soja", "rag_files/culturas.pdf"),
+            ]
+        ]
+
+    def teardown_method(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_enrich_metadata(self):
+        """Testa os metadados de origem, tipo e culturas dos chunks"""
+        metadata = self.docs[0].metadata
+        assert metadata["file_name"] == "manual_milho.pdf"
+        assert metadata["doc_type"] == "pdf"
+        # A cultura vem do nome do arquivo quando o trecho não a cita
+        assert metadata["crops"] == "milho"
+        assert metadata["crop_milho"] is True
+
+        assert self.docs[2].metadata["crops"] == "cafe,soja"
+        assert self.docs[2].metadata["doc_type"] == "csv"
+
+    def test_build_filter(self):
+        """Testa a normalização dos filtros aceitos pela ferramenta"""
+        from .chunk_metadata import build_filter, chroma_where
+
+        assert build_filter() is None
+        assert build_filter(crop="Café") == {"crop_cafe": True}
+        assert build_filter(crop="cafeeiro") == {"crop_cafe": True}
+        # Cultura que nunca é marcada nos chunks não pode zerar a busca
+        assert build_filter(crop="tomate") is None
+        assert build_filter(crop="tomate", doc_type="pdf") == {"doc_type": "pdf"}
+        assert build_filter(source="rag_files/cotacoes.csv", doc_type=".CSV") == {
+            "file_name": "cotacoes.csv",
+            "doc_type": "csv",
+        }
+        assert chroma_where({"crop_soja": True, "doc_type": "pdf"}) == {
+            "$and": [{"crop_soja": True}, {"doc_type": "pdf"}]
+        }
+
+    @pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+    def test_faiss_prefilter(self, index_type):
+        """Testa que o FAISS busca só entre os chunks selecionados pelos metadados"""
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        from .faiss_store import FaissVectorStore
+
+        store = FaissVectorStore(
+            os.path.join(self.test_dir, "faiss"),
+            DeterministicFakeEmbedding(size=32),
+            index_type=index_type,
+        )
+        store.add_documents(self.docs, ids=["a", "b", "c", "d"])
+        # Chunks sem relação com o filtro, que não devem ocupar o top-k
+        store.add_texts([f"Assunto geral {i}" for i in range(200)])
+
+        assert len(store.filtered_ids({"crop_cafe": True})) == 2
+        results = store.similarity_search(
+            "Assunto geral 1", k=3, filter={"crop_soja": True, "doc_type": "pdf"}
+        )
+        assert [doc.id for doc in results] == ["d"]
+        assert store.similarity_search("café", k=2, filter={"crop_trigo": True}) == []
+
+    def test_lexical_prefilter(self):
+        """Testa o índice secundário de metadados do BM25"""
+        from .lexical import BM25Index
+
+        index = BM25Index()
+        index.add_documents(self.docs, ids=["a", "b", "c", "d"])
+
+        results = index.search("café soja", k=4, filter={"crop_cafe": True})
+        assert sorted(doc.id for doc, _ in results) == ["b", "c"]
+
+        index.delete(["c"])
+        results = index.search("café soja", k=4, filter={"doc_type": "csv"})
+        assert results == []
+
+    def test_chroma_where(self):
+        """Testa os filtros combinados num Chroma real"""
+        from chromadb.api.client import SharedSystemClient
+        from langchain_chroma import Chroma
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        from .vectorstore import vector_filter
+
+        store = Chroma(
+            collection_name="filtros",
+            embedding_function=DeterministicFakeEmbedding(size=32),
+            persist_directory=os.path.join(self.test_dir, "chroma"),
+        )
+        try:
+            store.add_documents(self.docs, ids=["a", "b", "c", "d"])
+            results = store.similarity_search(
+                "café",
+                k=4,
+                filter=vector_filter(store, {"crop_cafe": True, "doc_type": "pdf"}),
+            )
+            assert [doc.id for doc in results] == ["b"]
+        finally:
+            SharedSystemClient.clear_system_cache()
+
+    def test_tool_applies_filters(self, mock_external_services):
+        """Testa que a RAGSearchTool repassa os filtros à busca e ao cache"""
+        from .tools import RAGSearchTool
+
+        mock_vectorstore = MagicMock()
+        mock_vectorstore.similarity_search.return_value = [self.docs[1]]
+
+        with patch("chatbot.tools.get_vectorstore", return_value=mock_vectorstore):
+            tool = RAGSearchTool()
+            result = tool._run("colheita", k=2, mode="vector", crop="café")
+            # Sem filtro, a mesma pergunta não reaproveita o resultado filtrado
+            tool._run("colheita", k=2, mode="vector")
+
+        assert "Colheita do café" in result
+        mock_vectorstore.similarity_search.assert_called_once_with(
+            "colheita", k=2, filter={"crop_cafe": True}
+        )
+        mock_vectorstore.as_retriever.assert_called_once_with(search_kwargs={"k": 2})
+
+
+class TestTokenChunking:
+    def setup_method(self):
+        # Uma palavra por token deixa os orçamentos fáceis de conferir
+        self.patcher = patch(
+            "chatbot.chunking.count_tokens", lambda text: len(text.split())
+        )
+        self.patcher.start()
+
+    def teardown_method(self):
+        self.patcher.stop()
+
+    def _chunker(self, **kwargs):
+        from .chunking import TokenChunker
+
+        return TokenChunker(**{"max_tokens": 40, "overlap_tokens": 10, **kwargs})
+
+    def _doc(self, text, source="manual.txt", **metadata):
+        from langchain_core.documents import Document
+
+        return Document(page_content=text, metadata={"source": source, **metadata})
+
+    def _paragraph(self, topic, sentences):
+        return " ".join(
+            f"Frase {i} sobre {topic} com algumas palavras a mais."
+            for i in range(sentences)
+        )
+
+    def test_sections_start_new_chunks(self):
+        """Testa que cada seção abre um chunk e seções curtas seguem com a próxima"""
+        text = "\n\n".join(
+            [
+                "Plantio",
+                self._paragraph("plantio", 3),
+                "Adubação",
+                "Curta.",
+                "Colheita",
+                self._paragraph("colheita", 3),
+            ]
+        )
+        chunks = list(self._chunker(min_tokens=10).split_documents([self._doc(text)]))
+
+        assert [chunk.metadata["section"] for chunk in chunks] == [
+            "Plantio",
+            "Adubação",
+        ]
+        assert chunks[0].page_content.startswith("Plantio\n\nFrase 0 sobre plantio")
+        assert "Adubação\n\nCurta.\n\nColheita" in chunks[1].page_content
+        assert chunks[0].metadata["tokens"] == 1 + 3 * 9
+
+    def test_long_section_is_split_by_sentences_with_overlap(self):
+        """Testa o orçamento de tokens e a sobreposição de frases inteiras"""
+        text = "Manejo\n\n" + self._paragraph("manejo", 10)
+        chunks = list(self._chunker().split_documents([self._doc(text)]))
+
+        assert len(chunks) > 1
+        assert all(chunk.metadata["tokens"] <= 40 for chunk in chunks)
+        for previous, chunk in zip(chunks, chunks[1:]):
+            last_sentence = previous.page_content.rsplit("Frase", 1)[1]
+            assert chunk.page_content.startswith("Frase" + last_sentence)
+            assert chunk.metadata["section"] == "Manejo"
+        # Nenhuma frase é cortada no meio
+        for chunk in chunks:
+            assert chunk.page_content.endswith("mais.")
+
+    def test_table_rows_are_not_split(self):
+        """Testa que tabelas só se dividem entre linhas e não se repetem"""
+        rows = [f"Milho | {i} kg/ha | cobertura" for i in range(20)]
+        text = "Tabela de doses\n\n" + "\n".join(rows)
+        chunks = list(self._chunker().split_documents([self._doc(text)]))
+
+        lines = [
+            line
+            for chunk in chunks
+            for line in chunk.page_content.splitlines()
+            if "|" in line
+        ]
+        assert lines == rows
+        assert all(chunk.metadata["tokens"] <= 40 for chunk in chunks)
+
+    def test_pdf_pages_are_continuous(self):
+        """Testa que uma seção que atravessa a página fica no mesmo chunk"""
+        pages = [
+            self._doc("1. Calagem\nO calcário corrige a acidez", "manual.pdf", page=3),
+            self._doc(
+                "do solo antes do plantio.\n2. Gessagem\nO gesso", "manual.pdf", page=4
+            ),
+            self._doc("melhora o subsolo.", "manual.pdf", page=5),
+        ]
+        chunks = list(self._chunker(min_tokens=1).split_documents(pages))
+
+        assert [c.metadata["section"] for c in chunks] == ["1. Calagem", "2. Gessagem"]
+        assert "acidez do solo" in chunks[0].page_content
+        assert chunks[0].metadata["page"] == 3
+        assert chunks[0].metadata["page_end"] == 4
+        assert chunks[1].metadata["page"] == 4
+        assert chunks[1].metadata["page_end"] == 5
+
+    def test_csv_rows_are_grouped(self):
+        """Testa que linhas de CSV seguidas formam um chunk até o orçamento"""
+        rows = [
+            self._doc(f"cultura: milho\npreco: {i}", "cotacoes.csv", row=i)
+            for i in range(10)
+        ]
+        chunks = list(self._chunker(max_tokens=16).split_documents(rows))
+
+        assert [(c.metadata["row"], c.metadata.get("row_end")) for c in chunks] == [
+            (0, 3),
+            (4, 7),
+            (8, 9),
+        ]
+        assert chunks[0].page_content.count("cultura: milho") == 4
+
+    def test_files_are_chunked_separately(self):
+        """Testa que chunks nunca misturam arquivos"""
+        docs = [
+            self._doc("Texto do primeiro.", "a.txt"),
+            self._doc("Do segundo.", "b.txt"),
+        ]
+        chunks = list(self._chunker().split_documents(docs))
+
+        assert [c.metadata["source"] for c in chunks] == ["a.txt", "b.txt"]
+
+    def test_configured_strategy(self):
+        """Testa a escolha do splitter por RAG_CHUNKING e os metadados dos filtros"""
+        from .vectorstore import split_documents
+
+        docs = [self._doc("Adubação do milho.\n\n" + self._paragraph("milho", 30))]
+        with patch("chatbot.vectorstore.RAG_CHUNK_TOKENS", 500):
+            tokens = list(split_documents(docs))
+        characters = list(split_documents(docs, "characters"))
+
+        assert len(tokens) == 1 < len(characters)
+        assert tokens[0].metadata["crop_milho"] is True
+        with pytest.raises(ValueError):
+            list(split_documents(docs, "palavras"))
+
+    def test_compare_chunking_command(self, tmp_path):
+        """Testa as estatísticas de chunks e tokens antes e depois"""
+        from .management.commands.compare_chunking import compare_chunking
+
+        path = tmp_path / "manual.txt"
+        path.write_text("Plantio\n\n" + self._paragraph("plantio", 40))
+        results = {
+            (r["strategy"], r["doc_type"]): r for r in compare_chunking([str(path)])
+        }
+
+        before, after = results[("characters", "all")], results[("tokens", "all")]
+        assert results[("tokens", "txt")]["files"] == 1
+        assert after["chunks"] < before["chunks"]
+        assert after["avg_tokens"] > before["avg_tokens"]
+
+
+class TestRagEvaluation:
+    def _evaluate(self, *args):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        from .vectorstore import get_lexical_index
+
+        output = StringIO()
+        # O índice léxico real, em vez do mock da fixture
+        with patch("chatbot.tools.get_lexical_index", get_lexical_index):
+            call_command(
+                "evaluate_rag",
+                "--backends",
+                "faiss",
+                "--modes",
+                "vector",
+                "lexical",
+                "--json",
+                *args,
+                stdout=output,
+            )
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_hashing_embeddings_are_deterministic(self):
+        """Testa que os embeddings offline são estáveis e aproximam textos parecidos"""
+        import numpy as np
+
+        from .local_embeddings import HashingEmbeddings
+
+        embeddings = HashingEmbeddings(dimension=64)
+        query = np.array(embeddings.embed_query("adubação do milho"))
+        docs = np.array(
+            embeddings.embed_documents(
+                ["Adubação do milho safrinha", "Colheita do café"]
+            )
+        )
+
+        assert embeddings.embed_query("adubação do milho") == query.tolist()
+        assert docs[0] @ query > docs[1] @ query
+
+    def test_evaluate_fixed_corpus(self):
+        """Testa a avaliação offline no corpus fixo, sem tocar no índice real"""
+        from . import vectorstore
+
+        previous_path = vectorstore.VECTOR_STORE_PATH
+        results = self._evaluate("--k", "1", "3")
+
+        assert [(r["k"], r["mode"]) for r in results] == [
+            (1, "vector"),
+            (1, "lexical"),
+            (3, "vector"),
+            (3, "lexical"),
+        ]
+        for result in results:
+            assert result["queries"] == 30
+            assert 0 < result["mrr"] <= result["recall"] <= 1
+            assert result["latency_p95_ms"] >= result["latency_p50_ms"]
+            assert result["chunks"] > 0
+            assert result["index_bytes"] > 0
+        # O recall não diminui com k maior
+        assert results[2]["recall"] >= results[0]["recall"]
+        # Mesma entrada, mesma qualidade: a avaliação serve de gate
+        assert [r["recall"] for r in self._evaluate("--k", "1", "3")] == [
+            r["recall"] for r in results
+        ]
+        assert vectorstore.VECTOR_STORE_PATH == previous_path
+        assert vectorstore._vectorstore is None
+
+    def test_evaluate_fails_on_regression(self, tmp_path):
+        """Testa que uma queda de qualidade em relação à referência falha"""
+        from django.core.management.base import CommandError
+
+        baseline = self._evaluate()
+        for result in baseline:
+            result["recall"] += 0.1
+        baseline_path = tmp_path / "baseline.jsonl"
+        baseline_path.write_text("\n".join(json.dumps(r) for r in baseline))
+
+        with pytest.raises(CommandError, match="recall"):
+            self._evaluate("--baseline", str(baseline_path))
+        # Dentro da tolerância, passa
+        self._evaluate("--baseline", str(baseline_path), "--tolerance", "0.2")
+
+
+class TestVectorstoreSnapshot:
+    def setup_method(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.files_dir = os.path.join(self.test_dir, "arquivos")
+        self.store_dir = os.path.join(self.test_dir, "indice")
+        self.replica_dir = os.path.join(self.test_dir, "replica")
+        self.archive = os.path.join(self.test_dir, "snapshots", "rag.tar")
+        os.makedirs(self.files_dir)
+        for name, text in (
+            ("milho.txt", "Adubação nitrogenada do milho em cobertura."),
+            ("cafe.txt", "Poda e colheita do café arábica."),
+        ):
+            with open(os.path.join(self.files_dir, name), "w") as f:
+                f.write(text)
+
+        self.patches = [
+            patch("chatbot.vectorstore.RAG_FILES_DIR", self.files_dir),
+            patch("chatbot.vectorstore.RAG_VECTOR_BACKEND", "faiss"),
+            patch("chatbot.vectorstore.RAG_EMBEDDING_PROVIDER", "hashing"),
+            patch("chatbot.vectorstore.RAG_INGESTION_MODE", "incremental"),
+            patch("chatbot.vectorstore.RAG_LOADER_WORKERS", 0),
+            patch("chatbot.vectorstore.EMBEDDING_CACHE_ENABLED", False),
+            patch("chatbot.vectorstore.RAG_CACHE_ENABLED", False),
+            patch("chatbot.vectorstore._index_version_cache", (None, 0)),
+        ]
+        for p in self.patches:
+            p.start()
+
+        from .vectorstore import create_snapshot, ingest_vectorstore
+
+        with patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.store_dir):
+            ingest_vectorstore()
+            self.snapshot_info = create_snapshot(self.archive)
+
+    def teardown_method(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_restore_serves_searches_without_embedding_documents(self):
+        """Testa que a réplica restaurada busca sem reindexar os documentos"""
+        from .local_embeddings import HashingEmbeddings
+        from .vectorstore import (
+            count_chunks,
+            get_index_version,
+            load_vectorstore,
+            restore_vectorstore_snapshot,
+        )
+
+        assert self.snapshot_info["chunks"] == 2
+        assert self.snapshot_info["backend"] == "faiss"
+        assert os.path.exists(f"{self.archive}.sha256")
+
+        with patch(
+            "chatbot.vectorstore.VECTOR_STORE_PATH", self.replica_dir
+        ), patch.object(
+            HashingEmbeddings, "embed_documents", side_effect=AssertionError
+        ):
+            restore_vectorstore_snapshot(self.archive)
+            vectorstore = load_vectorstore()
+
+            assert count_chunks(vectorstore) == 2
+            assert get_index_version() == self.snapshot_info["index_version"]
+            doc = vectorstore.similarity_search("adubação do milho", k=1)[0]
+            assert doc.metadata["file_name"] == "milho.txt"
+            assert not any(
+                name.startswith(".restore-") for name in os.listdir(self.replica_dir)
+            )
+
+    def test_restore_refuses_existing_index(self):
+        """Testa que o restore não sobrescreve um índice sem --force"""
+        from .snapshot import SnapshotError
+        from .vectorstore import restore_vectorstore_snapshot
+
+        with patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.store_dir):
+            with pytest.raises(SnapshotError, match="force"):
+                restore_vectorstore_snapshot(self.archive)
+            assert restore_vectorstore_snapshot(self.archive, force=True)["chunks"] == 2
+
+    def test_corrupted_archive_is_rejected(self):
+        """Testa que um snapshot corrompido não troca nenhum arquivo"""
+        from .snapshot import SnapshotError
+        from .vectorstore import restore_vectorstore_snapshot
+
+        import tarfile
+
+        # Corrompe o conteúdo de um arquivo, não o preenchimento do tar
+        with tarfile.open(self.archive) as archive:
+            member = max(archive.getmembers(), key=lambda m: m.size)
+        with open(self.archive, "r+b") as f:
+            f.seek(member.offset_data + member.size // 2)
+            f.write(b"corrompido")
+
+        with patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.replica_dir):
+            with pytest.raises(SnapshotError, match="Checksum"):
+                restore_vectorstore_snapshot(self.archive)
+            # Sem o .sha256, a conferência arquivo a arquivo pega a corrupção
+            os.remove(f"{self.archive}.sha256")
+            with pytest.raises(SnapshotError):
+                restore_vectorstore_snapshot(self.archive)
+            assert set(os.listdir(self.replica_dir)) <= {".ingestion.lock"}
+
+    def test_snapshot_of_a_different_backend_is_rejected(self):
+        """Testa que um snapshot FAISS não é restaurado com o backend Chroma"""
+        from .snapshot import SnapshotError
+        from .vectorstore import restore_vectorstore_snapshot
+
+        with patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.replica_dir), patch(
+            "chatbot.vectorstore.RAG_VECTOR_BACKEND", "chroma"
+        ):
+            with pytest.raises(SnapshotError, match="backend"):
+                restore_vectorstore_snapshot(self.archive)
+
+    def test_startup_restores_and_repairs_from_snapshot_path(self):
+        """Testa a restauração automática e o reparo de um índice corrompido"""
+        from .faiss_store import INDEX_FILE
+        from .vectorstore import FAISS_DIR, count_chunks, load_vectorstore
+
+        with patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.replica_dir), patch(
+            "chatbot.vectorstore.RAG_SNAPSHOT_PATH", self.archive
+        ):
+            assert count_chunks(load_vectorstore()) == 2
+
+            index_path = next(
+                os.path.join(root, INDEX_FILE)
+                for root, _, files in os.walk(os.path.join(self.replica_dir, FAISS_DIR))
+                if INDEX_FILE in files
+            )
+            with open(index_path, "ab") as f:
+                f.write(b"lixo")
+
+            with patch("chatbot.vectorstore.logger") as mock_logger:
+                assert count_chunks(load_vectorstore()) == 2
+            assert "não confere" in mock_logger.error.call_args_list[0].args[0]
+            assert os.path.getsize(index_path) == (
+                self.snapshot_info["files"][
+                    os.path.relpath(index_path, self.replica_dir)
+                ]["size"]
+            )
+
+    def test_startup_verification_skips_newer_ingestions(self):
+        """Testa que o índice atualizado depois do restore não é tratado como corrompido"""
+        from .vectorstore import (
+            ingest_vectorstore,
+            restore_vectorstore_snapshot,
+            verify_vectorstore_snapshot,
+        )
+
+        with patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.replica_dir):
+            restore_vectorstore_snapshot(self.archive)
+            assert verify_vectorstore_snapshot(checksum=True) == []
+
+            with open(os.path.join(self.files_dir, "soja.txt"), "w") as f:
+                f.write("Semeadura da soja no cerrado.")
+            ingest_vectorstore()
+            assert verify_vectorstore_snapshot(checksum=True) == []
+
+    def test_snapshot_commands(self):
+        """Testa os comandos snapshot_rag e restore_rag"""
+        from io import StringIO
+
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+
+        output = StringIO()
+        archive = os.path.join(self.test_dir, "comando.tar")
+        with patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.store_dir):
+            call_command("snapshot_rag", archive, stdout=output)
+        assert "2 chunks" in output.getvalue()
+
+        with patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.replica_dir):
+            call_command("restore_rag", archive, stdout=output)
+            with pytest.raises(CommandError, match="force"):
+                call_command("restore_rag", archive, stdout=output)
+            call_command("restore_rag", archive, "--force", stdout=output)
+        assert "Índice restaurado" in output.getvalue()
+
+
+class TestLocalEmbeddings:
+    def setup_method(self):
+        from tokenizers import Tokenizer, models, pre_tokenizers
+
+        self.test_dir = tempfile.mkdtemp()
+        self.model_dir = os.path.join(self.test_dir, "mini-modelo")
+        os.makedirs(self.model_dir)
+
+        vocab = {"[UNK]": 0, "milho": 1, "soja": 2, "feijão": 3, "adubação": 4}
+        tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+        tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+        tokenizer.save(os.path.join(self.model_dir, "tokenizer.json"))
+
+        # Linha 0 (padding) bem diferente para detectar se entra na média
+        self.table = np.array(
+            [[100, 100, 100], [1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0]],
+            dtype=np.float32,
+        )
+        self.session = self._fake_session()
+
+    def teardown_method(self):
+        shutil.rmtree(self.test_dir)
+
+    def _fake_session(self):
+        from types import SimpleNamespace
+
+        table = self.table
+        session = MagicMock()
+        session.get_inputs.return_value = [
+            SimpleNamespace(name="input_ids"),
+            SimpleNamespace(name="attention_mask"),
+        ]
+        session.run.side_effect = lambda outputs, inputs: [table[inputs["input_ids"]]]
+        return session
+
+    def _embeddings(self, **kwargs):
+        from .local_embeddings import LocalEmbeddings
+
+        return LocalEmbeddings(self.model_dir, **kwargs)
+
+    def test_batched_mean_pooling_ignores_padding(self):
+        """Testa que o padding do lote não altera os vetores"""
+        with patch("onnxruntime.InferenceSession", return_value=self.session):
+            embeddings = self._embeddings(batch_size=8)
+            alone = embeddings.embed_query("milho")
+            batch = embeddings.embed_documents(["milho soja feijão", "milho"])
+
+        assert np.allclose(alone, [1, 0, 0])
+        assert np.allclose(batch[1], alone)
+        assert np.allclose(batch[0], np.ones(3) / np.sqrt(3))
+
+    def test_batches_and_threads(self):
+        """Testa o tamanho dos lotes, a ordem da saída e o número de threads"""
+        texts = ["milho soja", "soja", "feijão adubação milho", "adubação"]
+
+        with patch(
+            "onnxruntime.InferenceSession", return_value=self.session
+        ) as mock_session:
+            vectors = self._embeddings(batch_size=2, threads=3).embed_documents(texts)
+
+        assert mock_session.call_args.kwargs["sess_options"].intra_op_num_threads == 3
+        assert mock_session.call_args.kwargs["providers"] == ["CPUExecutionProvider"]
+        assert self.session.run.call_count == 2
+        assert np.allclose(vectors[1], [0, 1, 0])
+        assert np.allclose(vectors[3], np.array([1, 1, 0]) / np.sqrt(2))
+
+    def test_provider_is_stored_with_the_index(self, mock_external_services):
+        """Testa que as buscas usam o provider com que o índice foi criado"""
+        from .embeddings import CachedEmbeddings
+        from .local_embeddings import LocalEmbeddings
+        from .vectorstore import open_vectorstore, read_embedding_info
+
+        with patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.test_dir), patch(
+            "chatbot.vectorstore.RAG_VECTOR_BACKEND", "faiss"
+        ), patch("chatbot.vectorstore.EMBEDDING_CACHE_ENABLED", False), patch(
+            "chatbot.vectorstore.RAG_CACHE_ENABLED", False
+        ), patch(
+            "chatbot.vectorstore.RAG_LOCAL_EMBEDDING_MODEL_PATH", self.model_dir
+        ), patch(
+            "onnxruntime.InferenceSession", return_value=self.session
+        ):
+            with patch("chatbot.vectorstore.RAG_EMBEDDING_PROVIDER", "local"):
+                vectorstore = open_vectorstore("langchain")
+                vectorstore.add_texts(["milho", "soja"])
+                vectorstore.persist()
+
+            assert read_embedding_info("langchain") == {
+                "provider": "local",
+                "model": "mini-modelo",
+                "path": self.model_dir,
+            }
+
+            # A configuração mudou, mas o índice continua com o modelo local
+            reopened = open_vectorstore("langchain")
+            assert isinstance(reopened.embeddings, LocalEmbeddings)
+            assert reopened.similarity_search("soja", k=1)[0].page_content == "soja"
+            mock_external_services["embeddings"].assert_not_called()
+
+            # Coleções novas seguem a configuração
+            open_vectorstore("langchain_novo")
+            assert read_embedding_info("langchain_novo")["provider"] == "openai"
+            assert not isinstance(reopened.embeddings, CachedEmbeddings)
+
+    def test_legacy_index_keeps_openai(self, mock_external_services):
+        """Testa que índices sem registro de provider continuam com a OpenAI"""
+        from .vectorstore import (
+            LEGACY_EMBEDDING_INFO,
+            open_vectorstore,
+            read_embedding_info,
+        )
+
+        mock_external_services["chroma"].return_value._collection.count.return_value = (
+            10
+        )
+
+        with patch("chatbot.vectorstore.VECTOR_STORE_PATH", self.test_dir), patch(
+            "chatbot.vectorstore.RAG_EMBEDDING_PROVIDER", "local"
+        ):
+            open_vectorstore("langchain")
+            assert read_embedding_info("langchain") == LEGACY_EMBEDDING_INFO
+
+        mock_external_services["embeddings"].assert_called_with(
+            api_key=ANY, model="text-embedding-ada-002"
+        )
+
+
+class TestContextPacking:
+    def _doc(self, text, source="manual.pdf", page=1):
+        from langchain_core.documents import Document
+
+        return Document(page_content=text, metadata={"source": source, "page": page})
+
+    def test_merges_adjacent_chunks_and_removes_duplicates(self):
+        """Testa a união de chunks vizinhos e a remoção de repetidos"""
+        from .context_packing import pack_documents
+
+        first = "O milho safrinha deve ser semeado logo após a colheita da soja."
+        second = "logo após a colheita da soja. O espaçamento indicado é de 50 cm."
+        docs = [
+            self._doc(second),
+            self._doc(first),
+            self._doc(first),
+            self._doc("colheita da soja"),
+        ]
+
+        spans, stats = pack_documents(docs)
+
+        assert spans == [
+            "O milho safrinha deve ser semeado logo após a colheita da soja. "
+            "O espaçamento indicado é de 50 cm."
+        ]
+        assert stats["merged"] == 1
+        assert stats["duplicates"] == 2
+        assert stats["packed_tokens"] < stats["retrieved_tokens"]
+
+    def test_does_not_merge_other_sources(self):
+        """Testa que chunks de fontes diferentes não são unidos"""
+        from .context_packing import pack_documents
+
+        docs = [
+            self._doc("Calagem corrige o pH do solo ácido antes do plantio."),
+            self._doc("pH do solo ácido antes do plantio. Use calcário.", page=7),
+        ]
+
+        spans, stats = pack_documents(docs)
+
+        assert len(spans) == 2
+        assert stats["merged"] == 0
+
+    def test_token_budget_keeps_best_ranked_first(self):
+        """Testa o corte pelo orçamento de tokens mantendo a ordem de relevância"""
+        from .context_packing import TRIM_MARKER, pack_documents
+        from .embeddings import count_tokens
+
+        texts = [
+            " ".join(f"primeiro{i}" for i in range(40)),
+            " ".join(f"segundo{i}" for i in range(200)),
+            " ".join(f"terceiro{i}" for i in range(200)),
+        ]
+        budget = count_tokens(texts[0]) + 60
+
+        spans, stats = pack_documents(
+            [self._doc(text, source=f"doc{i}.pdf") for i, text in enumerate(texts)],
+            token_budget=budget,
+        )
+
+        assert spans[0] == texts[0]
+        assert spans[1].startswith("segundo0") and spans[1].endswith(TRIM_MARKER)
+        assert len(spans) == 2
+        assert stats["trimmed"] == 1
+        assert stats["dropped"] == 1
+        assert stats["packed_tokens"] <= budget + count_tokens(TRIM_MARKER)
+
+    def test_rag_search_reports_tokens_saved(self, mock_external_services):
+        """Testa que a ferramenta empacota o contexto e registra a economia"""
+        from .tools import RAGSearchTool
+
+        chunk = "Adubação de cobertura no milho com nitrogênio em V4."
+        mock_retriever = MagicMock()
+        mock_retriever.invoke.return_value = [self._doc(chunk), self._doc(chunk)]
+        mock_vectorstore = MagicMock()
+        mock_vectorstore.as_retriever.return_value = mock_retriever
+
+        with patch(
+            "chatbot.tools.get_vectorstore", return_value=mock_vectorstore
+        ), patch("chatbot.tools.track_rag_context") as mock_track:
+            result = RAGSearchTool()._run("adubação milho", k=2, mode="vector")
+
+        assert result.count(chunk) == 1
+        retrieved, packed = mock_track.call_args.args
+        assert packed * 2 == retrieved
+
+    def test_rag_search_cites_duplicate_sources(self, mock_external_services):
+        """Testa que o resultado cita os arquivos com cópias deduplicadas"""
+        from langchain_core.documents import Document
+
+        from .tools import RAGSearchTool
+
+        docs = [
+            Document(id="a0", page_content="Calagem corrige a acidez do solo."),
+            Document(id="b0", page_content="Gesso agrícola leva cálcio ao subsolo."),
+        ]
+        mock_retriever = MagicMock()
+        mock_retriever.invoke.return_value = docs
+        mock_vectorstore = MagicMock()
+        mock_vectorstore.as_retriever.return_value = mock_retriever
+
+        with patch(
+            "chatbot.tools.get_vectorstore", return_value=mock_vectorstore
+        ), patch(
+            "chatbot.tools.duplicate_sources",
+            return_value={"a0": ["manual_2023.txt", "resumo.pdf"]},
+        ) as mock_sources:
+            result = RAGSearchTool()._run("calagem", k=2, mode="vector")
+
+        mock_sources.assert_called_once_with(["a0", "b0"])
+        first, second = result.split("\n\n\n")
+        assert "(Também em: manual_2023.txt, resumo.pdf)" in first
+        assert "Também em" not in second
 
-            docs = load_documents()
 
-            # Deve ter chamado para ambos os diretórios
-            assert mock_load_from_dir.call_count == 2
-            # Deve retornar 3 documentos total (1 + 2)
-            assert len(docs) == 3
+class TestChunkDeduplicator:
+    def _docs(self, *texts, source="doc.pdf"):
+        from langchain_core.documents import Document
 
-    def test_load_documents_from_directory_error_handling(self, mock_external_services):
-        """Testa o tratamento de erro no carregamento de documentos"""
-        from .vectorstore import load_documents_from_directory
+        return [
+            Document(page_content=text, metadata={"source": source}) for text in texts
+        ]
 
-        # Criar arquivo de teste
-        test_file = os.path.join(self.test_files_dir, "error.pdf")
-        with open(test_file, "w") as f:
-            f.write("test content")
+    def test_exact_and_near_duplicates(self):
+        """Testa a detecção de duplicados exatos e quase exatos"""
+        from .dedup import ChunkDeduplicator
 
-        with patch("chatbot.vectorstore.PyPDFLoader") as mock_loader:
-            # Simula erro no carregamento
-            mock_loader.return_value.load.side_effect = Exception("Load error")
+        base = (
+            "O feijão carioca deve ser semeado com espaçamento de 45 a 50 cm "
+            "entre linhas e de 10 a 12 sementes por metro linear no sulco"
+        )
+        deduplicator = ChunkDeduplicator()
+        kept, kept_ids, duplicates = deduplicator.filter(
+            "manual.pdf",
+            self._docs(
+                base,
+                "  O FEIJÃO carioca deve ser semeado com espaçamento de 45 a 50 cm "
+                "entre linhas e de 10 a 12 sementes por metro linear no sulco ",
+                base.replace("sulco", "sulco de plantio"),
+                "Irrigação por gotejamento reduz o consumo de água nas hortaliças",
+            ),
+            ["c0", "c1", "c2", "c3"],
+        )
 
-            docs = load_documents_from_directory(self.test_files_dir)
+        assert kept_ids == ["c0", "c3"]
+        assert [d["canonical_id"] for d in duplicates] == ["c0", "c0"]
+        assert duplicates[0]["similarity"] == 1.0
+        assert 0.85 <= duplicates[1]["similarity"] < 1.0
 
-            # Deve retornar lista vazia em caso de erro
-            assert len(docs) == 0
-            mock_loader.assert_called_once()
+    def test_record_reports_dependent_files(self):
+        """Testa que remover o canônico indica os arquivos a reprocessar"""
+        from .dedup import ChunkDeduplicator
 
-    def test_load_documents_from_directory_nonexistent(self, mock_external_services):
-        """Testa carregamento de diretório inexistente"""
-        from .vectorstore import load_documents_from_directory
+        deduplicator = ChunkDeduplicator()
+        text = "Rotação de culturas com braquiária melhora a estrutura do solo"
 
-        docs = load_documents_from_directory("/path/que/nao/existe")
-        assert len(docs) == 0
+        _, ids, duplicates = deduplicator.filter("a.pdf", self._docs(text), ["a0"])
+        assert deduplicator.record("a.pdf", ids, duplicates) == set()
 
-    def test_get_vectorstore_existing_with_data(self, mock_external_services):
-        """Testa carregamento de vectorstore existente com dados"""
-        from .vectorstore import get_vectorstore
+        _, ids, duplicates = deduplicator.filter(
+            "b.pdf", self._docs(text, source="b.pdf"), ["b0"]
+        )
+        deduplicator.record("b.pdf", ids, duplicates)
+        assert ids == []
 
-        # Mock vectorstore com dados existentes
-        mock_vectorstore = MagicMock()
-        mock_vectorstore.similarity_search.return_value = [MagicMock()]
-        mock_external_services["chroma"].return_value = mock_vectorstore
+        # O mesmo arquivo reprocessado não é duplicado de si mesmo
+        _, ids, _ = deduplicator.filter("a.pdf", self._docs(text), ["a0"])
+        assert ids == ["a0"]
 
-        result = get_vectorstore()
+        assert deduplicator.remove_file("a.pdf") == {"b.pdf"}
 
-        # Deve retornar o vectorstore existente sem carregar documentos
-        assert result == mock_vectorstore
-        mock_vectorstore.similarity_search.assert_called_once_with("test", k=1)
+    def test_discard_releases_pending_canonicals(self):
+        """Chunks de um arquivo que não chegou ao índice não viram canônicos"""
+        from .dedup import ChunkDeduplicator
 
-    def test_get_vectorstore_exception_in_loading(self, mock_external_services):
-        """Testa tratamento de exceção ao carregar vectorstore existente"""
-        from .vectorstore import get_vectorstore
+        deduplicator = ChunkDeduplicator()
+        text = "Rotação de culturas com braquiária melhora a estrutura do solo"
 
-        with patch("chatbot.vectorstore.load_documents") as mock_load_docs:
-            # Simula erro apenas na primeira chamada (carregamento do existente)
-            mock_vectorstore_error = MagicMock()
-            mock_vectorstore_error.similarity_search.side_effect = Exception(
-                "Search error"
-            )
+        deduplicator.filter("a.pdf", self._docs(text), ["a0"])
+        _, ids, duplicates = deduplicator.filter(
+            "b.pdf", self._docs(text, source="b.pdf"), ["b0"]
+        )
+        assert ids == []
+        deduplicator.record("b.pdf", ids, duplicates)
 
-            # Segunda chamada retorna vectorstore válido
-            mock_vectorstore_ok = MagicMock()
-            mock_external_services["chroma"].side_effect = [
-                mock_vectorstore_error,
-                mock_vectorstore_ok,
-            ]
+        # O lote de a.pdf falhou: b.pdf precisa voltar com o próprio chunk
+        assert deduplicator.discard("a.pdf") == {"b.pdf"}
+        _, ids, _ = deduplicator.filter(
+            "b.pdf", self._docs(text, source="b.pdf"), ["b0"]
+        )
+        assert ids == ["b0"]
 
-            # Mock documento com page_content como string
-            mock_doc = MagicMock()
-            mock_doc.page_content = "Test document content"
-            mock_doc.metadata = {"source": "test"}
-            mock_docs = [mock_doc]
-            mock_load_docs.return_value = mock_docs
+    def test_record_after_discard_reports_itself(self):
+        """Um arquivo gravado depois da falha do canônico volta à fila"""
+        from .dedup import ChunkDeduplicator
 
-            result = get_vectorstore()
+        deduplicator = ChunkDeduplicator()
+        text = "Rotação de culturas com braquiária melhora a estrutura do solo"
 
-            # Deve ter tentado carregar documentos
-            mock_load_docs.assert_called_once()
-            assert result is not None
+        deduplicator.filter("a.pdf", self._docs(text), ["a0"])
+        _, ids, duplicates = deduplicator.filter(
+            "b.pdf", self._docs(text, source="b.pdf"), ["b0"]
+        )
+        assert deduplicator.discard("a.pdf") == set()
+        assert deduplicator.record("b.pdf", ids, duplicates) == {"b.pdf"}
 
-    def test_get_vectorstore_batch_processing_error(self, mock_external_services):
-        """Testa tratamento de erro no processamento em lotes"""
-        from .vectorstore import get_vectorstore
 
-        with patch("chatbot.vectorstore.load_documents") as mock_load_docs, patch(
-            "chatbot.vectorstore.RecursiveCharacterTextSplitter"
-        ) as mock_splitter:
+class TestRagFilesWatcher:
+    def setup_method(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        shutil.rmtree(self.test_dir)
 
-            # Mock vectorstore vazio (força recriação)
-            mock_vectorstore = MagicMock()
-            mock_vectorstore.similarity_search.return_value = []
-            # Simula erro na adição de textos
-            mock_vectorstore.add_texts.side_effect = Exception("Add texts error")
-            mock_external_services["chroma"].return_value = mock_vectorstore
+    def _write(self, name, content="conteúdo"):
+        with open(os.path.join(self.test_dir, name), "w", encoding="utf-8") as f:
+            f.write(content)
 
-            # Cria muitos documentos para forçar processamento em lotes
-            mock_docs = []
-            for i in range(60):  # Mais que 50 para múltiplos lotes
-                mock_doc = MagicMock()
-                mock_doc.page_content = f"Test document content {i}"
-                mock_doc.metadata = {"source": f"test{i}"}
-                mock_docs.append(mock_doc)
-            mock_load_docs.return_value = mock_docs
+    def test_burst_of_files_is_ingested_once_after_debounce(self):
+        """Testa que uma rajada de arquivos gera uma única ingestão"""
+        from .rag_watcher import RagFilesWatcher
 
-            # Mock splits
-            mock_splits = []
-            for i in range(120):  # 2 lotes + resto
-                mock_split = MagicMock()
-                mock_split.page_content = f"Split content {i}"
-                mock_split.metadata = {"source": f"split{i}"}
-                mock_splits.append(mock_split)
-            mock_splitter.return_value.split_documents.return_value = mock_splits
+        ingest, archive = MagicMock(), MagicMock(return_value=[])
+        watcher = RagFilesWatcher(
+            self.test_dir, debounce=5, retry_seconds=60, ingest=ingest, archive=archive
+        )
+        archive.side_effect = lambda: [
+            os.remove(os.path.join(self.test_dir, name))
+            for name in os.listdir(self.test_dir)
+        ]
 
-            result = get_vectorstore()
+        self._write("milho.pdf")
+        assert not watcher.poll(now=0)
+        self._write("soja.txt")
+        self._write("notas.docx")
+        assert not watcher.poll(now=3)
+        assert not watcher.poll(now=7)
+        assert watcher.poll(now=8)
+
+        ingest.assert_called_once()
+        archive.assert_called_once()
+        assert not watcher.poll(now=100)
+
+    def test_failed_files_are_retried_later(self):
+        """Testa que um arquivo que não foi indexado é tentado de novo após o intervalo"""
+        from .rag_watcher import RagFilesWatcher
+
+        ingest = MagicMock(side_effect=[Exception("API fora do ar"), None])
+        watcher = RagFilesWatcher(
+            self.test_dir,
+            debounce=5,
+            retry_seconds=60,
+            ingest=ingest,
+            archive=MagicMock(return_value=[]),
+        )
 
-            # Deve ter tentado processar em lotes
-            assert mock_vectorstore.add_texts.call_count > 0
-            assert result is not None
+        self._write("milho.pdf")
+        watcher.poll(now=0)
+        assert watcher.poll(now=5)
+        assert not watcher.poll(now=30)
+        assert watcher.poll(now=65)
+        assert ingest.call_count == 2
 
 
 class TestEvolutionApi:
@@ -462,21 +2925,340 @@ class TestEvolutionApi:
         assert kwargs["json"]["text"] == text
         assert kwargs["json"]["delay"] == 2000
 
+    @pytest.mark.asyncio
+    async def test_asend_whatsapp_message(self, mock_external_services):
+        """O envio assíncrono usa o cliente HTTP compartilhado, não o requests"""
+        from .evolution_api import asend_whatsapp_message
+
+        client = MagicMock()
+        client.post = AsyncMock(return_value=MagicMock(is_error=False))
+
+        with patch("chatbot.evolution_api.EVOLUTION_API_URL", "http://test.com"), patch(
+            "chatbot.evolution_api.EVOLUTION_INSTANCE_NAME", "test_instance"
+        ), patch("chatbot.evolution_api.get_async_http_client", return_value=client):
+            await asend_whatsapp_message("5511999999999", "Mensagem de teste")
+
+        mock_external_services["requests"].assert_not_called()
+        kwargs = client.post.call_args.kwargs
+        assert kwargs["url"] == "http://test.com/message/sendText/test_instance"
+        assert kwargs["json"]["text"] == "Mensagem de teste"
+
+    @pytest.mark.asyncio
+    async def test_async_http_client_is_shared_per_loop(self):
+        """O mesmo cliente (e pool de conexões) atende todo o event loop"""
+        from .http_client import get_async_http_client
+
+        client = get_async_http_client()
+        assert get_async_http_client() is client
+        assert not client.is_closed
+        await client.aclose()
+        assert get_async_http_client() is not client
+        await get_async_http_client().aclose()
+
 
 class TestMemory:
     def test_get_session_history(self, mock_external_services):
         """Testa a criação do histórico de sessão"""
-        from .memory import get_session_history
+        from .memory import AsyncRedisChatMessageHistory, get_session_history
 
         session_id = "test_session_123"
 
         with patch("chatbot.memory.REDIS_URL", "redis://localhost:6379"):
             result = get_session_history(session_id)
 
-        mock_external_services["redis_history"].assert_called_once_with(
-            session_id=session_id, url="redis://localhost:6379"
-        )
-        assert result is not None
+        assert isinstance(result, AsyncRedisChatMessageHistory)
+        assert result.key == f"message_store:{session_id}"
+        assert result.url == "redis://localhost:6379"
+
+    def _async_client(self, stored=()):
+        client = MagicMock()
+        client.lrange = AsyncMock(return_value=list(stored))
+        client.delete = AsyncMock()
+        pipe = MagicMock()
+        pipe.execute = AsyncMock()
+        client.pipeline.return_value.__aenter__ = AsyncMock(return_value=pipe)
+        client.pipeline.return_value.__aexit__ = AsyncMock(return_value=False)
+        return client, pipe
+
+    @pytest.mark.asyncio
+    async def test_async_history_reads_in_chronological_order(
+        self, mock_external_services
+    ):
+        """As mensagens gravadas com LPUSH voltam da mais antiga para a mais nova"""
+        from langchain_core.messages import AIMessage, HumanMessage, message_to_dict
+
+        from .memory import AsyncRedisChatMessageHistory
+
+        stored = [
+            json.dumps(message_to_dict(AIMessage(content="Oi! Como posso ajudar?"))),
+            json.dumps(message_to_dict(HumanMessage(content="Olá"))),
+        ]
+        client, _ = self._async_client(stored)
+
+        with patch("chatbot.memory.get_async_redis_client", return_value=client):
+            messages = await AsyncRedisChatMessageHistory(
+                session_id="s1", url="redis://localhost:6379"
+            ).aget_messages()
+
+        client.lrange.assert_awaited_once_with("message_store:s1", 0, -1)
+        assert [type(m) for m in messages] == [HumanMessage, AIMessage]
+        assert messages[0].content == "Olá"
+
+    @pytest.mark.asyncio
+    async def test_async_history_adds_messages_in_one_pipeline(
+        self, mock_external_services
+    ):
+        """Pergunta e resposta vão num único LPUSH, com o TTL na mesma transação"""
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        from .memory import AsyncRedisChatMessageHistory
+
+        client, pipe = self._async_client()
+
+        with patch("chatbot.memory.get_async_redis_client", return_value=client):
+            history = AsyncRedisChatMessageHistory(
+                session_id="s1", url="redis://localhost:6379", ttl=60
+            )
+            await history.aadd_messages(
+                [HumanMessage(content="Olá"), AIMessage(content="Oi!")]
+            )
+
+        key, *payloads = pipe.lpush.call_args.args
+        assert key == "message_store:s1"
+        assert [json.loads(p)["data"]["content"] for p in payloads] == ["Olá", "Oi!"]
+        pipe.expire.assert_called_once_with("message_store:s1", 60)
+        pipe.execute.assert_awaited_once()
+
+
+class FakeChatbotRedis:
+    """Redis em memória para o message_buffer e a fila de jobs.
+
+    Liga no mock do redis_client as listas, a agenda (sorted set), os
+    streams com consumer group e o efeito dos scripts Lua, para testar o
+    fluxo sem um Redis de verdade.
+    """
+
+    def __init__(self, redis_client):
+        from . import admission, message_buffer
+
+        self.message_buffer = message_buffer
+        self.lists = defaultdict(list)
+        self.deadlines = {}
+        self.leases = {}
+        self.values = {}
+        self.histories = set()
+        # Vagas, fila e prazos da fila de cada chave de admissão
+        self.zsets = defaultdict(dict)
+        self.admission_scripts = {
+            admission.acquire_script.sha: self.acquire,
+            admission.renew_script.sha: self.renew,
+            admission.leave_script.sha: self.leave,
+        }
+        self.streams = defaultdict(list)
+        self.pending = {}
+        self.delivered = defaultdict(int)
+        self.sequence = 0
+        for name in (
+            "rpush",
+            "lrange",
+            "expire",
+            "delete",
+            "exists",
+            "get",
+            "set",
+            "ping",
+            "zadd",
+            "zrangebyscore",
+            "evalsha",
+            "xgroup_create",
+            "xadd",
+            "xreadgroup",
+            "xack",
+            "xautoclaim",
+            "xclaim",
+            "xpending_range",
+        ):
+            setattr(redis_client, name, AsyncMock(side_effect=getattr(self, name)))
+
+    def buffer(self, chat_id):
+        return self.lists[f"{chat_id}{self.message_buffer.BUFFER_KEY_SUFIX}"]
+
+    def rpush(self, key, *values):
+        self.lists[key].extend(values)
+        return len(self.lists[key])
+
+    def lrange(self, key, start, end):
+        return list(self.lists.get(key, []))
+
+    def expire(self, key, seconds):
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.lists.pop(key, None)
+            self.streams.pop(key, None)
+            self.leases.pop(key, None)
+            self.values.pop(key, None)
+            self.zsets.pop(key, None)
+
+    def exists(self, *keys):
+        return sum(key in self.histories for key in keys)
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def ping(self):
+        return True
+
+    def zadd(self, key, mapping, nx=False, gt=False):
+        for member, score in mapping.items():
+            if nx and member in self.deadlines:
+                continue
+            if gt and self.deadlines.get(member, float("-inf")) >= score:
+                continue
+            self.deadlines[member] = score
+
+    def acquire(self, keys, token, priority, limit, queue_size, slot_ttl, wait_ttl):
+        slots, waiting, expires = (self.zsets[key] for key in keys)
+        now = time.time()
+        for holder, deadline in list(slots.items()):
+            if deadline <= now:
+                del slots[holder]
+        for waiter, deadline in list(expires.items()):
+            if deadline <= now:
+                waiting.pop(waiter, None)
+                del expires[waiter]
+        added = token not in waiting
+        waiting.setdefault(token, float(priority))
+        rank = sorted(waiting, key=lambda t: (waiting[t], t)).index(token)
+        if rank < int(limit) - len(slots):
+            del waiting[token]
+            expires.pop(token, None)
+            slots[token] = now + float(slot_ttl)
+            return [0, len(waiting), len(slots)]
+        if added and len(waiting) > int(queue_size):
+            del waiting[token]
+            return [-1, len(waiting), len(slots)]
+        expires[token] = now + float(wait_ttl)
+        return [rank + 1, len(waiting), len(slots)]
+
+    def renew(self, keys, token, slot_ttl):
+        slots = self.zsets[keys[0]]
+        if token not in slots:
+            return 0
+        slots[token] = time.time() + float(slot_ttl)
+        return 1
+
+    def leave(self, keys, token):
+        slots, waiting, expires = (self.zsets[key] for key in keys)
+        for zset in (slots, waiting, expires):
+            zset.pop(token, None)
+        return [len(waiting), len(slots)]
+
+    def zrangebyscore(self, key, low, high, start=0, num=None):
+        due = sorted((score, member) for member, score in self.deadlines.items())
+        return [member for score, member in due if score <= high][:num]
+
+    def evalsha(self, sha, numkeys, *args):
+        keys, args = args[:numkeys], args[numkeys:]
+        if sha in self.admission_scripts:
+            return self.admission_scripts[sha](keys, *args)
+        scripts = self.message_buffer
+        if sha == scripts.buffer_script.sha:
+            message, ttl, chat_id, deadline = args
+            self.deadlines[chat_id] = float(deadline)
+            return self.rpush(keys[0], message)
+        if sha == scripts.enqueue_script.sha:
+            chat_id, now, maxlen = args
+            deadline = self.deadlines.get(chat_id)
+            if deadline is None or deadline > float(now):
+                return None
+            del self.deadlines[chat_id]
+            return self.xadd(keys[1], {"chat_id": chat_id})
+        if sha == scripts.claim_script.sha:
+            token, lease_ms = args
+            if keys[1] in self.leases:
+                return None
+            self.leases[keys[1]] = token
+            return list(self.lists.get(keys[0], []))
+        if sha == scripts.ack_script.sha:
+            count, token, chat_id, now, maxlen = args
+            self.lists[keys[0]] = self.lists.get(keys[0], [])[count:]
+            if self.leases.get(keys[1]) == token:
+                del self.leases[keys[1]]
+            if not self.lists[keys[0]]:
+                return None
+            if self.deadlines.get(chat_id, float("-inf")) > float(now):
+                return None
+            self.deadlines.pop(chat_id, None)
+            return self.xadd(keys[3], {"chat_id": chat_id})
+        if sha == scripts.renew_script.sha:
+            return int(self.leases.get(keys[0]) == args[0])
+        if self.leases.get(keys[0]) == args[0]:
+            del self.leases[keys[0]]
+        return 1
+
+    def xgroup_create(self, name, groupname, id="$", mkstream=False):
+        return True
+
+    def xadd(self, name, fields, **kwargs):
+        self.sequence += 1
+        entry_id = f"{self.sequence}-0"
+        self.streams[name].append((entry_id, dict(fields)))
+        return entry_id
+
+    def _deliver(self, entry_id, consumer):
+        self.pending[entry_id] = (consumer, time.monotonic())
+        self.delivered[entry_id] += 1
+
+    async def xreadgroup(self, groupname, consumername, streams, count=None, block=0):
+        response = []
+        for name in streams:
+            new = [
+                (entry_id, fields)
+                for entry_id, fields in self.streams[name]
+                if entry_id not in self.delivered
+            ][:count]
+            for entry_id, _ in new:
+                self._deliver(entry_id, consumername)
+            if new:
+                response.append([name, new])
+        if not response:
+            await asyncio.sleep(0.01)
+        return response
+
+    def xack(self, name, groupname, *ids):
+        for entry_id in ids:
+            self.pending.pop(entry_id, None)
+        return len(ids)
+
+    def xautoclaim(
+        self, name, groupname, consumername, min_idle_time, start_id="0-0", count=None
+    ):
+        now = time.monotonic()
+        claimed = []
+        for entry_id, fields in self.streams[name]:
+            if entry_id not in self.pending or len(claimed) == count:
+                continue
+            if (now - self.pending[entry_id][1]) * 1000 >= min_idle_time:
+                self._deliver(entry_id, consumername)
+                claimed.append((entry_id, fields))
+        return ["0-0", claimed, []]
+
+    def xclaim(self, name, groupname, consumername, min_idle_time, message_ids, **kw):
+        for entry_id in message_ids:
+            if entry_id in self.pending:
+                self.pending[entry_id] = (consumername, time.monotonic())
+        return list(message_ids)
+
+    def xpending_range(self, name, groupname, min, max, count):
+        return [{"message_id": min, "times_delivered": self.delivered[min]}]
 
 
 @pytest.mark.asyncio
@@ -489,106 +3271,847 @@ class TestMessageBuffer:
         """Testa o buffer de mensagens"""
         from .message_buffer import buffer_message
 
-        with patch(
-            "chatbot.message_buffer.asyncio.create_task"
-        ) as mock_create_task, patch(
-            "chatbot.message_buffer.BUFFER_KEY_SUFIX", "_buffer"
-        ), patch(
+        with patch("chatbot.message_buffer.BUFFER_KEY_SUFIX", "_buffer"), patch(
             "chatbot.message_buffer.BUFFER_TTL", 300
+        ), patch("chatbot.message_buffer.DEBOUNCE_SECONDS", "2"), patch(
+            "chatbot.message_buffer.time.time", return_value=1000.0
         ):
 
-            mock_task = AsyncMock()
-            mock_create_task.return_value = mock_task
-
+            fake = FakeChatbotRedis(mock_external_services["redis_client"])
             await buffer_message(self.chat_id, self.message)
 
-            buffer_key = f"{self.chat_id}_buffer"
-            mock_external_services["redis_client"].rpush.assert_called_once_with(
-                buffer_key, self.message
-            )
-            mock_external_services["redis_client"].expire.assert_called_once_with(
-                buffer_key, 300
-            )
-            mock_create_task.assert_called_once()
+        redis_client = mock_external_services["redis_client"]
+        # Mensagem, TTL e prazo do debounce numa ida só ao Redis
+        redis_client.evalsha.assert_awaited_once_with(
+            fake.message_buffer.buffer_script.sha,
+            2,
+            f"{self.chat_id}_buffer",
+            "chatbot:debounce",
+            self.message,
+            300,
+            self.chat_id,
+            "1002.0",
+        )
+        redis_client.rpush.assert_not_called()
+        redis_client.expire.assert_not_called()
+        redis_client.zadd.assert_not_called()
+        assert fake.lists[f"{self.chat_id}_buffer"] == [self.message]
+        # O prazo do debounce fica na agenda compartilhada do Redis
+        assert fake.deadlines == {self.chat_id: 1002.0}
+
+    async def test_enqueue_due_chats(self, mock_external_services):
+        """Só as conversas vencidas viram job, uma vez cada"""
+        from .message_buffer import enqueue_due_chats
 
-    async def test_handle_debounce(self, mock_external_services):
-        """Testa o tratamento do debounce"""
-        from .message_buffer import handle_debounce
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        fake.deadlines.update({"a": 990.0, "b": 995.0, "c": 1500.0})
+
+        assert len(await enqueue_due_chats(now=1000.0)) == 2
+        # Outro worker rodando o agendador no mesmo instante não duplica
+        assert await enqueue_due_chats(now=1000.0) == []
+
+        jobs = [fields["chat_id"] for _, fields in fake.streams["chatbot:jobs"]]
+        assert jobs == ["a", "b"]
+        assert fake.deadlines == {"c": 1500.0}
+
+    async def test_process_chat_job(self, mock_external_services):
+        """O job responde o buffer da conversa e o esvazia"""
+        from .message_buffer import process_chat_job
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        fake.buffer(self.chat_id).extend(["Olá", "como", "você", "está?"])
 
         with patch("chatbot.message_buffer.conversational_agent") as mock_agent, patch(
-            "chatbot.message_buffer.send_whatsapp_message"
+            "chatbot.message_buffer.asend_whatsapp_message"
         ) as mock_send_whatsapp, patch(
-            "chatbot.message_buffer.asyncio.sleep"
-        ) as mock_sleep, patch(
-            "chatbot.message_buffer.BUFFER_KEY_SUFIX", "_buffer"
-        ), patch(
-            "chatbot.message_buffer.DEBOUNCE_SECONDS", "2"
-        ), patch(
             "chatbot.message_buffer.check_user_permission"
         ) as mock_check_permission:
 
-            mock_sleep.return_value = None
-            mock_external_services["redis_client"].lrange.return_value = [
-                "Olá",
-                "como",
-                "você",
-                "está?",
-            ]
-            mock_agent.invoke.return_value = {"output": "Estou bem, obrigado!"}
+            mock_agent.ainvoke = AsyncMock(
+                return_value={"output": "Estou bem, obrigado!"}
+            )
             mock_check_permission.return_value = (True, "")
 
-            await handle_debounce(self.chat_id)
+            assert await process_chat_job({"chat_id": self.chat_id})
 
-            buffer_key = f"{self.chat_id}_buffer"
-            mock_external_services["redis_client"].lrange.assert_called_once_with(
-                buffer_key, 0, -1
-            )
             mock_check_permission.assert_called_once()
-            mock_agent.invoke.assert_called_once_with(
+            mock_agent.ainvoke.assert_awaited_once_with(
                 input={"input": "Olá como você está?"},
                 config={"configurable": {"session_id": self.chat_id}},
             )
-            mock_send_whatsapp.assert_called_once_with(
+            mock_agent.invoke.assert_not_called()
+            mock_send_whatsapp.assert_awaited_once_with(
                 number=self.chat_id, text="Estou bem, obrigado!"
             )
-            mock_external_services["redis_client"].delete.assert_called_once_with(
-                buffer_key
-            )
+        assert fake.buffer(self.chat_id) == []
+        assert fake.leases == {}
+
+    async def test_busy_chat_does_not_call_the_agent(self, mock_external_services):
+        """Com um turno da conversa em andamento, o job não abre outra chamada"""
+        from .message_buffer import lease_key, process_chat_job
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        fake.buffer(self.chat_id).append("Olá")
+        fake.leases[lease_key(self.chat_id)] = "outro-worker"
+
+        with patch("chatbot.message_buffer.reply_to_chat") as mock_reply:
+            assert not await process_chat_job({"chat_id": self.chat_id})
+
+        mock_reply.assert_not_called()
+        assert fake.buffer(self.chat_id) == ["Olá"]
+
+    async def test_messages_arriving_during_reply_are_kept(
+        self, mock_external_services
+    ):
+        """Mensagens que chegam durante a resposta ficam para a próxima rodada"""
+        from .message_buffer import buffer_message, process_chat_job
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        fake.buffer(self.chat_id).append("Olá")
+
+        async def reply(chat_id, full_message):
+            await buffer_message(chat_id, "E a chuva?")
+
+        with patch("chatbot.message_buffer.reply_to_chat", side_effect=reply):
+            assert await process_chat_job({"chat_id": self.chat_id})
+
+        assert fake.buffer(self.chat_id) == ["E a chuva?"]
+        # O usuário ainda está no debounce: o próximo turno espera o prazo
+        assert self.chat_id in fake.deadlines
+        assert fake.streams["chatbot:jobs"] == []
+
+    async def test_follow_ups_are_merged_into_the_next_turn(
+        self, mock_external_services
+    ):
+        """Mensagens durante o turno viram um único turno seguinte, na ordem"""
+        from .message_buffer import buffer_message, enqueue_due_chats, process_chat_job
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        fake.buffer(self.chat_id).append("Como está o milho?")
+        turns = []
+
+        async def reply(chat_id, full_message):
+            turns.append(full_message)
+            if len(turns) == 1:
+                # Duas mensagens chegam e vencem o debounce com o agente pensando
+                await buffer_message(chat_id, "E a soja?")
+                await buffer_message(chat_id, "E o feijão?")
+                job_id = (await enqueue_due_chats(now=time.time() + 60))[0]
+                assert not await process_chat_job({"chat_id": chat_id})
+                assert fake.streams["chatbot:jobs"][0][0] == job_id
+
+        with patch("chatbot.message_buffer.reply_to_chat", side_effect=reply):
+            assert await process_chat_job({"chat_id": self.chat_id})
+            # O fim do turno enfileirou o próximo com as duas mensagens
+            follow_up = fake.streams["chatbot:jobs"][-1][1]
+            assert await process_chat_job(follow_up)
+
+        assert turns == ["Como está o milho?", "E a soja? E o feijão?"]
+        assert fake.buffer(self.chat_id) == []
+        assert len(fake.streams["chatbot:jobs"]) == 2
+
+    async def test_lease_is_renewed_during_long_turn(self, mock_external_services):
+        """Um turno mais longo que o lease continua dono da conversa"""
+        from .message_buffer import lease_key, process_chat_job
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        fake.buffer(self.chat_id).append("Olá")
+        owners = []
+
+        async def reply(chat_id, full_message):
+            await asyncio.sleep(0.05)
+            owners.append(fake.leases.get(lease_key(chat_id)))
+
+        with patch("chatbot.message_buffer.reply_to_chat", side_effect=reply), patch(
+            "chatbot.message_buffer.DEBOUNCE_LEASE_SECONDS", 0.03
+        ):
+            assert await process_chat_job({"chat_id": self.chat_id})
+
+        renewals = [
+            call
+            for call in mock_external_services["redis_client"].evalsha.call_args_list
+            if call.args[0] == fake.message_buffer.renew_script.sha
+        ]
+        assert len(renewals) >= 2
+        assert owners[0] is not None
+        assert fake.leases == {}
+
+    async def test_lost_lease_cancels_the_turn(self, mock_external_services):
+        """Se outro worker tomou a conversa, o turno para e as mensagens ficam"""
+        from .message_buffer import LeaseLost, lease_key, process_chat_job
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        fake.buffer(self.chat_id).append("Olá")
+        sent = []
+
+        async def reply(chat_id, full_message):
+            fake.leases[lease_key(chat_id)] = "outro-worker"
+            await asyncio.sleep(1)
+            sent.append(full_message)
+
+        with patch("chatbot.message_buffer.reply_to_chat", side_effect=reply), patch(
+            "chatbot.message_buffer.DEBOUNCE_LEASE_SECONDS", 0.03
+        ), pytest.raises(LeaseLost):
+            await process_chat_job({"chat_id": self.chat_id})
+
+        assert sent == []
+        assert fake.buffer(self.chat_id) == ["Olá"]
+        assert fake.leases[lease_key(self.chat_id)] == "outro-worker"
+
+    def _fill_admission(self, fake, admission):
+        """Ocupa a única vaga e não deixa ninguém esperar"""
+        slots = fake.zsets[admission.keys[0]]
+        slots["outro-turno"] = time.time() + 60
+
+    async def test_overload_queue_defers_turn_keeping_priority(
+        self, mock_external_services
+    ):
+        """Sem vaga (queue), o turno volta para a agenda e mantém a prioridade"""
+        from .message_buffer import agent_admission, priority_key, process_chat_job
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        fake.buffer(self.chat_id).append("Olá")
+        self._fill_admission(fake, agent_admission)
+
+        with patch.object(agent_admission, "limit", 1), patch.object(
+            agent_admission, "queue_size", 0
+        ), patch("chatbot.message_buffer.AGENT_OVERLOAD_POLICY", "queue"), patch(
+            "chatbot.message_buffer.conversational_agent"
+        ) as mock_agent, patch(
+            "chatbot.message_buffer.check_user_permission",
+            AsyncMock(return_value=(True, "")),
+        ), patch(
+            "chatbot.message_buffer.asend_whatsapp_message"
+        ) as mock_send:
+            assert not await process_chat_job({"chat_id": self.chat_id})
+            first = fake.values[priority_key(self.chat_id)]
+            assert not await process_chat_job({"chat_id": self.chat_id})
+
+            mock_agent.ainvoke.assert_not_called()
+            mock_send.assert_not_called()
+            # A segunda tentativa usou e guardou a mesma prioridade
+            assert fake.values[priority_key(self.chat_id)] == first
+            assert self.chat_id in fake.deadlines
+            assert fake.buffer(self.chat_id) == ["Olá"]
+            assert fake.leases == {}
+
+            # Com a vaga livre, o turno roda e esquece a prioridade guardada
+            fake.zsets[agent_admission.keys[0]].clear()
+            mock_agent.ainvoke = AsyncMock(return_value={"output": "Oi!"})
+            assert await process_chat_job({"chat_id": self.chat_id})
+
+        assert priority_key(self.chat_id) not in fake.values
+        assert fake.buffer(self.chat_id) == []
+
+    async def test_overload_degrade_uses_reduced_agent(self, mock_external_services):
+        """Sem vaga (degrade), responde com o agente reduzido, no limite dele"""
+        from .message_buffer import agent_admission, ask_agent, degraded_admission
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        self._fill_admission(fake, agent_admission)
+        degraded = MagicMock()
+        degraded.ainvoke = AsyncMock(return_value={"output": "Resposta curta"})
+        in_flight = []
+
+        async def ainvoke(**kwargs):
+            in_flight.append(len(fake.zsets[degraded_admission.keys[0]]))
+            return {"output": "Resposta curta"}
+
+        degraded.ainvoke.side_effect = ainvoke
+
+        with patch.object(agent_admission, "limit", 1), patch.object(
+            agent_admission, "queue_size", 0
+        ), patch.object(degraded_admission, "limit", 1), patch(
+            "chatbot.message_buffer.AGENT_OVERLOAD_POLICY", "degrade"
+        ), patch(
+            "chatbot.message_buffer.degraded_agent", degraded
+        ):
+            assert await ask_agent(self.chat_id, "Olá") == "Resposta curta"
+
+        assert in_flight == [1]
+        assert fake.zsets[degraded_admission.keys[0]] == {}
+
+    async def test_overload_degrade_without_slot_replies_busy(
+        self, mock_external_services
+    ):
+        """Com o agente reduzido também cheio, a resposta é a de ocupado"""
+        from .message_buffer import agent_admission, ask_agent, degraded_admission
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        self._fill_admission(fake, agent_admission)
+        self._fill_admission(fake, degraded_admission)
+        degraded = MagicMock()
+        degraded.ainvoke = AsyncMock()
+
+        with patch.object(agent_admission, "limit", 1), patch.object(
+            agent_admission, "queue_size", 0
+        ), patch.object(degraded_admission, "limit", 1), patch(
+            "chatbot.message_buffer.AGENT_OVERLOAD_POLICY", "degrade"
+        ), patch(
+            "chatbot.message_buffer.degraded_agent", degraded
+        ), patch(
+            "chatbot.message_buffer.AGENT_BUSY_MESSAGE", "Ocupado"
+        ):
+            assert await ask_agent(self.chat_id, "Olá") == "Ocupado"
+
+        degraded.ainvoke.assert_not_called()
+
+    async def test_overload_busy_replies_busy_message(self, mock_external_services):
+        """Sem vaga (busy), manda o aviso de ocupado e consome as mensagens"""
+        from .message_buffer import agent_admission, process_chat_job
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        fake.buffer(self.chat_id).append("Olá")
+        self._fill_admission(fake, agent_admission)
+
+        with patch.object(agent_admission, "limit", 1), patch.object(
+            agent_admission, "queue_size", 0
+        ), patch("chatbot.message_buffer.AGENT_OVERLOAD_POLICY", "busy"), patch(
+            "chatbot.message_buffer.AGENT_BUSY_MESSAGE", "Ocupado"
+        ), patch(
+            "chatbot.message_buffer.conversational_agent"
+        ) as mock_agent, patch(
+            "chatbot.message_buffer.check_user_permission",
+            AsyncMock(return_value=(True, "")),
+        ), patch(
+            "chatbot.message_buffer.asend_whatsapp_message"
+        ) as mock_send:
+            assert await process_chat_job({"chat_id": self.chat_id})
+
+        mock_agent.ainvoke.assert_not_called()
+        mock_send.assert_awaited_once_with(number=self.chat_id, text="Ocupado")
+        assert fake.buffer(self.chat_id) == []
+
+    async def test_short_and_returning_chats_get_priority(self, mock_external_services):
+        """Mensagem curta e conversa com histórico furam a fila"""
+        from .memory import HISTORY_KEY_PREFIX
+        from .message_buffer import turn_priority
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        fake.histories.add(f"{HISTORY_KEY_PREFIX}{self.chat_id}")
+
+        with patch("chatbot.message_buffer.time.time", return_value=1000.0), patch(
+            "chatbot.message_buffer.AGENT_PRIORITY_BOOST_SECONDS", 30
+        ), patch("chatbot.message_buffer.AGENT_SHORT_MESSAGE_CHARS", 10):
+            assert await turn_priority(self.chat_id, "Olá") == 940.0
+            assert await turn_priority(self.chat_id, "x" * 50) == 970.0
+            assert await turn_priority("novo@s.whatsapp.net", "x" * 50) == 1000.0
+
+    async def test_failed_reply_keeps_messages(self, mock_external_services):
+        """Se a resposta falhar, as mensagens ficam e o lease é solto"""
+        from .message_buffer import process_chat_job
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        fake.buffer(self.chat_id).append("Olá")
+
+        with patch(
+            "chatbot.message_buffer.reply_to_chat",
+            side_effect=RuntimeError("LLM fora do ar"),
+        ), pytest.raises(RuntimeError):
+            await process_chat_job({"chat_id": self.chat_id})
 
-    async def test_handle_debounce_cancellation(self, mock_external_services):
-        """Testa o cancelamento do debounce"""
-        from .message_buffer import handle_debounce
+        assert fake.buffer(self.chat_id) == ["Olá"]
+        assert fake.leases == {}
 
-        with patch("chatbot.message_buffer.asyncio.sleep") as mock_sleep:
-            # Simular cancelamento
-            mock_sleep.side_effect = asyncio.CancelledError("Task cancelled")
+    async def test_two_workers_answer_each_burst_once(self, mock_external_services):
+        """Webhook, agendador e dois workers: cada conversa é respondida uma vez"""
+        from .message_buffer import buffer_message, get_chat_worker, enqueue_due_chats
 
-            try:
-                await handle_debounce(self.chat_id)
-            except asyncio.CancelledError:
-                pass  # Esperado
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        replies = []
 
-    async def test_handle_debounce_empty_message(self, mock_external_services):
-        """Testa o debounce com mensagem vazia"""
-        from .message_buffer import handle_debounce
+        async def reply(chat_id, full_message):
+            await asyncio.sleep(0.01)
+            replies.append((chat_id, full_message))
 
-        with patch("chatbot.message_buffer.asyncio.sleep") as mock_sleep, patch(
-            "chatbot.message_buffer.BUFFER_KEY_SUFIX", "_buffer"
+        with patch("chatbot.message_buffer.reply_to_chat", side_effect=reply), patch(
+            "chatbot.message_buffer.DEBOUNCE_SECONDS", "0"
         ):
+            for chat_id in ("a", "b", "a"):
+                await buffer_message(chat_id, f"oi {chat_id}")
+            await enqueue_due_chats(now=time.time() + 1)
+
+            stop = asyncio.Event()
+            workers = [
+                asyncio.create_task(
+                    get_chat_worker(concurrency=2, consumer=name).run(stop)
+                )
+                for name in ("w1", "w2")
+            ]
+            while len(replies) < 2:
+                await asyncio.sleep(0.01)
+            stop.set()
+            await asyncio.gather(*workers)
 
-            mock_sleep.return_value = None
-            mock_external_services["redis_client"].lrange.return_value = []
+        assert sorted(replies) == [("a", "oi a oi a"), ("b", "oi b")]
+        assert fake.pending == {}
 
-            await handle_debounce(self.chat_id)
+    async def test_inline_worker_lifespan(self, mock_external_services):
+        """Com CHATBOT_INLINE_WORKER, o startup do web liga o worker da fila"""
+        from .message_buffer import with_chatbot_worker
 
-            buffer_key = f"{self.chat_id}_buffer"
-            mock_external_services["redis_client"].lrange.assert_called_once_with(
-                buffer_key, 0, -1
-            )
-            mock_external_services["redis_client"].delete.assert_called_once_with(
-                buffer_key
+        inner = AsyncMock()
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        async def worker(stop):
+            await stop.wait()
+
+        with patch("chatbot.message_buffer.CHATBOT_INLINE_WORKER", False):
+            assert with_chatbot_worker(inner) is inner
+
+        with patch("chatbot.message_buffer.CHATBOT_INLINE_WORKER", True), patch(
+            "chatbot.message_buffer.run_chatbot_worker", side_effect=worker
+        ) as mock_worker:
+            await with_chatbot_worker(inner)({"type": "lifespan"}, receive, send)
+
+        mock_worker.assert_called_once()
+        inner.assert_not_called()
+        assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+
+
+@pytest.mark.asyncio
+class TestAdmissionControl:
+    def _admission(self, mock_external_services, **kwargs):
+        from .admission import AdmissionControl
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        kwargs = {
+            "limit": 2,
+            "queue_size": 10,
+            "timeout": 1.0,
+            "poll_interval": 0.01,
+            **kwargs,
+        }
+        admission = AdmissionControl(
+            mock_external_services["redis_client"], "adm", **kwargs
+        )
+        return fake, admission
+
+    async def test_scripts_match_the_client_registration(self):
+        """Os scripts sem client têm o mesmo SHA1 dos registrados num client"""
+        import redis.asyncio as redis
+
+        from . import admission
+
+        client = redis.Redis(decode_responses=True)
+        for script, source in (
+            (admission.acquire_script, admission.ACQUIRE_SCRIPT),
+            (admission.renew_script, admission.RENEW_SCRIPT),
+            (admission.leave_script, admission.LEAVE_SCRIPT),
+        ):
+            assert script.registered_client is None
+            assert script.sha == client.register_script(source).sha
+
+    async def test_acquire_admits_up_to_limit(self, mock_external_services):
+        """Até limit turnos entram; os seguintes esperam na ordem da prioridade"""
+        from .metrics import chatbot_agent_queue_depth, chatbot_agent_turns_in_flight
+
+        fake, admission = self._admission(mock_external_services)
+
+        assert await admission.acquire("a", 10.0) == 0
+        assert await admission.acquire("b", 20.0) == 0
+        assert await admission.acquire("c", 40.0) == 1
+        # Chegou depois, mas com prioridade melhor: passa na frente
+        assert await admission.acquire("d", 30.0) == 1
+        assert await admission.acquire("c", 40.0) == 2
+        assert chatbot_agent_queue_depth._value.get() == 2
+        assert chatbot_agent_turns_in_flight._value.get() == 2
+
+        await admission.leave("a")
+        assert await admission.acquire("d", 30.0) == 0
+        assert set(fake.zsets["adm:slots"]) == {"b", "d"}
+
+    async def test_leave_updates_gauges(self, mock_external_services):
+        """Ao sair, as métricas da fila voltam a zero"""
+        from .metrics import chatbot_agent_queue_depth, chatbot_agent_turns_in_flight
+
+        fake, admission = self._admission(mock_external_services)
+        async with admission.turn(1.0):
+            assert chatbot_agent_turns_in_flight._value.get() == 1
+
+        assert fake.zsets["adm:slots"] == {}
+        assert chatbot_agent_queue_depth._value.get() == 0
+        assert chatbot_agent_turns_in_flight._value.get() == 0
+
+    async def test_slot_is_renewed_during_long_turn(self, mock_external_services):
+        """A vaga de um turno longo é renovada e não vence no meio"""
+        fake, admission = self._admission(mock_external_services, slot_ttl=0.06)
+
+        async with admission.turn(1.0):
+            await asyncio.sleep(0.15)
+            # Sem renovação a vaga já teria vencido e outro turno entraria
+            assert len(fake.zsets["adm:slots"]) == 1
+            assert await admission.acquire("outro", 2.0) == 0
+            assert await admission.acquire("mais-um", 3.0) == 1
+
+    async def test_expired_slot_is_freed(self, mock_external_services):
+        """A vaga de um worker que caiu vence e volta a ficar livre"""
+        fake, admission = self._admission(mock_external_services)
+        fake.zsets["adm:slots"].update({"morto": time.time() - 1, "vivo": 1e12})
+
+        assert await admission.acquire("novo", 1.0) == 0
+        assert set(fake.zsets["adm:slots"]) == {"vivo", "novo"}
+
+    async def test_wait_times_out(self, mock_external_services):
+        """Sem vaga dentro do timeout, o turno desiste e sai da fila"""
+        from .admission import Overloaded
+        from .metrics import chatbot_agent_queue_depth
+
+        fake, admission = self._admission(mock_external_services, timeout=0.05)
+        fake.zsets["adm:slots"].update({"a": 1e12, "b": 1e12})
+
+        with pytest.raises(Overloaded) as error:
+            async with admission.turn(1.0):
+                pass
+
+        assert error.value.reason == "timeout"
+        assert fake.zsets["adm:waiting"] == {}
+        assert chatbot_agent_queue_depth._value.get() == 0
+
+    async def test_full_queue_is_rejected(self, mock_external_services):
+        """Com a fila cheia, o turno é recusado na hora"""
+        from .admission import Overloaded
+
+        fake, admission = self._admission(mock_external_services, queue_size=1)
+        fake.zsets["adm:slots"].update({"a": 1e12, "b": 1e12})
+        assert await admission.acquire("c", 1.0) == 1
+
+        with pytest.raises(Overloaded) as error:
+            async with admission.turn(2.0):
+                pass
+
+        assert error.value.reason == "queue_full"
+        assert set(fake.zsets["adm:waiting"]) == {"c"}
+
+    async def test_waiter_is_admitted_when_slot_frees(self, mock_external_services):
+        """O turno na fila entra assim que uma vaga é devolvida"""
+        fake, admission = self._admission(mock_external_services)
+        fake.zsets["adm:slots"].update({"a": 1e12, "b": 1e12})
+
+        async def free_slot():
+            await asyncio.sleep(0.05)
+            await admission.leave("a")
+
+        asyncio.create_task(free_slot())
+        async with admission.turn(1.0):
+            assert "a" not in fake.zsets["adm:slots"]
+            assert len(fake.zsets["adm:slots"]) == 2
+
+    async def test_no_limit(self, mock_external_services):
+        """Com limit 0 não há fila nem chamadas ao Redis"""
+        fake, admission = self._admission(mock_external_services, limit=0)
+
+        async with admission.turn():
+            pass
+
+        mock_external_services["redis_client"].evalsha.assert_not_called()
+
+
+class TestStreamWorker:
+    def _worker(self, mock_external_services, handler, **kwargs):
+        from .job_queue import StreamWorker
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        worker = StreamWorker(
+            mock_external_services["redis_client"],
+            "jobs",
+            "grupo",
+            handler,
+            consumer="w1",
+            block_seconds=0.01,
+            **kwargs,
+        )
+        return fake, worker
+
+    async def _run_until(self, worker, condition):
+        stop = asyncio.Event()
+        task = asyncio.create_task(worker.run(stop))
+        for _ in range(500):
+            if condition():
+                break
+            await asyncio.sleep(0.01)
+        stop.set()
+        await task
+
+    @pytest.mark.asyncio
+    async def test_consumes_and_acks(self, mock_external_services):
+        """Cada job roda uma vez e recebe XACK"""
+        done = []
+
+        async def handler(fields):
+            done.append(fields["n"])
+
+        fake, worker = self._worker(mock_external_services, handler)
+        for n in "123":
+            fake.xadd("jobs", {"n": n})
+
+        await self._run_until(worker, lambda: len(done) == 3)
+
+        assert sorted(done) == ["1", "2", "3"]
+        assert fake.pending == {}
+
+    @pytest.mark.asyncio
+    async def test_respects_concurrency(self, mock_external_services):
+        """Nunca mais que concurrency jobs ao mesmo tempo"""
+        running = []
+        peak = []
+
+        async def handler(fields):
+            running.append(fields)
+            peak.append(len(running))
+            await asyncio.sleep(0.02)
+            running.remove(fields)
+
+        fake, worker = self._worker(mock_external_services, handler, concurrency=2)
+        for n in range(6):
+            fake.xadd("jobs", {"n": str(n)})
+
+        await self._run_until(worker, lambda: len(peak) == 6 and not running)
+
+        assert max(peak) == 2
+        assert fake.pending == {}
+
+    @pytest.mark.asyncio
+    async def test_failed_job_is_reclaimed(self, mock_external_services):
+        """Sem XACK, o job volta pelo XAUTOCLAIM depois do timeout"""
+        attempts = []
+
+        async def handler(fields):
+            attempts.append(fields["n"])
+            if len(attempts) == 1:
+                raise RuntimeError("worker caiu")
+
+        fake, worker = self._worker(
+            mock_external_services, handler, claim_idle_seconds=0.05
+        )
+        fake.xadd("jobs", {"n": "1"})
+
+        await self._run_until(worker, lambda: len(attempts) == 2 and not fake.pending)
+
+        assert attempts == ["1", "1"]
+        assert fake.pending == {}
+
+    @pytest.mark.asyncio
+    async def test_long_job_is_not_reclaimed(self, mock_external_services):
+        """O job em andamento é renovado e outro worker não o pega"""
+        from .job_queue import StreamWorker
+
+        calls = []
+
+        async def handler(fields):
+            calls.append(fields["n"])
+            await asyncio.sleep(0.15)
+
+        fake, worker = self._worker(
+            mock_external_services, handler, claim_idle_seconds=0.05
+        )
+        other = StreamWorker(
+            mock_external_services["redis_client"],
+            "jobs",
+            "grupo",
+            handler,
+            consumer="w2",
+            block_seconds=0.01,
+            claim_idle_seconds=0.05,
+        )
+        fake.xadd("jobs", {"n": "1"})
+
+        stop = asyncio.Event()
+        task = asyncio.create_task(other.run(stop))
+        await self._run_until(worker, lambda: calls and not fake.pending)
+        stop.set()
+        await task
+
+        assert calls == ["1"]
+        assert fake.delivered["1-0"] == 1
+
+    @pytest.mark.asyncio
+    async def test_poison_job_goes_to_dead_letter(self, mock_external_services):
+        """Depois de max_deliveries falhas o job vai para o stream de mortos"""
+
+        async def handler(fields):
+            raise RuntimeError("sempre falha")
+
+        fake, worker = self._worker(
+            mock_external_services, handler, claim_idle_seconds=0.02, max_deliveries=2
+        )
+        fake.xadd("jobs", {"n": "1"})
+
+        await self._run_until(worker, lambda: fake.streams["jobs:dead"])
+
+        assert fake.streams["jobs:dead"][0][1] == {"n": "1", "job_id": "1-0"}
+        assert fake.delivered["1-0"] == 3
+        assert fake.pending == {}
+
+    @pytest.mark.asyncio
+    async def test_ensure_group_ignores_existing_group(self, mock_external_services):
+        """O grupo já criado por outro worker não é erro"""
+        from redis.exceptions import ResponseError
+
+        _, worker = self._worker(mock_external_services, AsyncMock())
+        mock_external_services["redis_client"].xgroup_create = AsyncMock(
+            side_effect=ResponseError("BUSYGROUP Consumer Group name already exists")
+        )
+
+        await worker.ensure_group()
+
+    def test_chatbot_worker_command(self, mock_external_services):
+        """O manage.py chatbot_worker roda o worker com a concorrência pedida"""
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        with patch(
+            "chatbot.management.commands.chatbot_worker.run_chatbot_worker",
+            new_callable=AsyncMock,
+        ) as mock_worker, patch(
+            "chatbot.management.commands.chatbot_worker.start_http_server"
+        ) as mock_metrics, patch(
+            "chatbot.management.commands.chatbot_worker.warm_up_vectorstore"
+        ) as mock_warm_up:
+            call_command(
+                "chatbot_worker",
+                "--concurrency",
+                "3",
+                "--metrics-port",
+                "9200",
+                stdout=StringIO(),
             )
 
+        assert mock_worker.await_args.kwargs["concurrency"] == 3
+        mock_metrics.assert_called_once_with(9200)
+        mock_warm_up.assert_called_once()
+
+
+class TestBufferBenchmark:
+    def _run(self, mock_external_services, *args):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        fake = FakeChatbotRedis(mock_external_services["redis_client"])
+        output = StringIO()
+        call_command(
+            "benchmark_buffer",
+            "--chats",
+            "3",
+            "--messages",
+            "40",
+            "--concurrency",
+            "10",
+            "--json",
+            *args,
+            stdout=output,
+        )
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        return fake, {result["mode"]: result for result in results}
+
+    def test_script_takes_one_round_trip_per_message(self, mock_external_services):
+        """O buffer atual faz uma ida ao Redis por mensagem, o antigo três"""
+        fake, results = self._run(mock_external_services)
+
+        assert results["separate"]["round_trips_per_message"] == 3
+        assert results["script"]["round_trips_per_message"] == 1
+        for result in results.values():
+            assert result["messages"] == 120
+            assert result["messages_per_second"] > 0
+        assert results["script"]["processed"] == 120
+        assert results["script"]["lost"] == 0
+        # Nada do teste fica no Redis
+        assert not any(fake.lists.values())
+        assert fake.leases == {}
+
+    def test_single_mode(self, mock_external_services):
+        """--mode escolhe um modo só"""
+        _, results = self._run(mock_external_services, "--mode", "script")
+
+        assert list(results) == ["script"]
+
+    def test_requires_redis(self, mock_external_services):
+        """Sem Redis o teste do buffer não roda"""
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+
+        mock_external_services["redis_client"].ping = AsyncMock(
+            side_effect=ConnectionError("recusada")
+        )
+
+        with pytest.raises(CommandError, match="Redis indisponível"):
+            call_command("benchmark_buffer")
+
+
+class TestWebhookLoadTest:
+    def _run(self, mock_external_services, *args):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        FakeChatbotRedis(mock_external_services["redis_client"])
+
+        output = StringIO()
+        call_command(
+            "benchmark_webhook",
+            "--requests",
+            "30",
+            "--concurrency",
+            "10",
+            "--pending",
+            "5",
+            # Estes testes medem o event loop, não o limite de turnos
+            "--max-agent-turns",
+            "0",
+            "--json",
+            *args,
+            stdout=output,
+        )
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_webhook_latency_stays_flat_with_pending_agent_calls(
+        self, mock_external_services
+    ):
+        """Com o agente assíncrono, o webhook responde enquanto o LLM trabalha"""
+        baseline, loaded = self._run(
+            mock_external_services,
+            "--agent-delay",
+            "0.5",
+            "--max-p99-ratio",
+            "50",
+        )
+
+        assert baseline["pending_agent_calls"] == 0
+        assert loaded["pending_agent_calls"] == 5
+        assert baseline["errors"] == loaded["errors"] == 0
+        assert loaded["latency_p99_ms"] < 500
+        # As mensagens medidas não ficam no Redis
+        mock_external_services["redis_client"].delete.assert_awaited()
+
+    def test_blocking_agent_stalls_the_webhook(self, mock_external_services):
+        """O agente síncrono (o invoke antigo) trava o event loop do webhook"""
+        _, loaded = self._run(
+            mock_external_services, "--agent-delay", "0.2", "--blocking"
+        )
+
+        assert loaded["latency_max_ms"] >= 200
+
+    def test_requires_redis(self, mock_external_services):
+        """Sem Redis o teste de carga não roda"""
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+
+        mock_external_services["redis_client"].ping = AsyncMock(
+            side_effect=ConnectionError("recusada")
+        )
+
+        with pytest.raises(CommandError, match="Redis indisponível"):
+            call_command("benchmark_webhook", "--requests", "1")
+
 
 class TestUrls:
     def test_urls_patterns(self):
@@ -1110,6 +4633,70 @@ class TestTools:
 
         assert "URL inválida" in result
 
+    @pytest.mark.asyncio
+    async def test_weather_tool_arun_uses_async_client(self):
+        """O _arun consulta a API pelo cliente httpx, sem o requests síncrono"""
+        from .tools import WeatherTool
+
+        response = MagicMock(status_code=200)
+        response.json.return_value = {
+            "name": "Parelheiros",
+            "sys": {"country": "BR"},
+            "main": {"temp": 22.0},
+            "weather": [{"description": "nublado"}],
+        }
+        client = MagicMock()
+        client.get = AsyncMock(return_value=response)
+
+        with patch("chatbot.tools.OPENWEATHER_API_KEY", "test_key"), patch(
+            "chatbot.tools.get_async_http_client", return_value=client
+        ), patch("chatbot.tools.requests.get") as mock_requests:
+            result = await WeatherTool()._arun("Parelheiros,SP,BR")
+
+        mock_requests.assert_not_called()
+        assert client.get.call_args.kwargs["params"]["q"] == "Parelheiros,SP,BR"
+        assert "🌤️ Clima em Parelheiros, BR" in result
+        assert "22.0°C" in result
+
+    @pytest.mark.asyncio
+    async def test_weather_tool_arun_connection_error(self):
+        """Falhas de conexão do httpx têm a mesma resposta do _run"""
+        import httpx
+
+        from .tools import WeatherTool
+
+        client = MagicMock()
+        client.get = AsyncMock(side_effect=httpx.ConnectError("recusada"))
+
+        with patch("chatbot.tools.OPENWEATHER_API_KEY", "test_key"), patch(
+            "chatbot.tools.get_async_http_client", return_value=client
+        ):
+            result = await WeatherTool()._arun("São Paulo")
+
+        assert "Erro de conexão ao consultar dados meteorológicos" in result
+
+    @pytest.mark.asyncio
+    async def test_web_scraping_tool_arun_fetches_with_async_client(self):
+        """O _arun baixa a página pelo httpx e extrai o conteúdo como o _run"""
+        from .tools import WebScrapingTool
+
+        response = MagicMock(status_code=200)
+        response.content = (
+            b"<html><head><title>Cotacoes</title></head><body>"
+            b"<div class='price'>Milho: R$ 70,00</div></body></html>"
+        )
+        client = MagicMock()
+        client.get = AsyncMock(return_value=response)
+
+        with patch("chatbot.tools.get_async_http_client", return_value=client):
+            result = await WebScrapingTool()._arun(
+                "https://exemplo.com/cotacoes", selector=".price"
+            )
+
+        assert client.get.call_args.kwargs["follow_redirects"] is True
+        assert "Cotacoes" in result
+        assert "Milho: R$ 70,00" in result
+
     def test_weather_tool_api_authentication_error(self):
         """Testa tratamento de erro de autenticação da API"""
         from .tools import WeatherTool
@@ -1,8 +1,9 @@
 import asyncio
 import logging
-from typing import List, Type
+from typing import List, Literal, Optional, Type
 from urllib.parse import urljoin, urlparse
 
+import httpx
 import requests
 from asgiref.sync import sync_to_async
 from bs4 import BeautifulSoup
@@ -10,12 +11,37 @@ from django.db import connection
 from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
 
-from .config import OPENWEATHER_API_KEY
-from .metrics import track_error, track_rag_search, track_weather_search
-from .vectorstore import get_vectorstore
+from .config import (
+    OPENWEATHER_API_KEY,
+    RAG_CONTEXT_TOKEN_BUDGET,
+    RAG_HYBRID_LEXICAL_WEIGHT,
+    RAG_SEARCH_MODE,
+)
+from .chunk_metadata import build_filter
+from .context_packing import pack_documents
+from .http_client import get_async_http_client
+from .lexical import fuse_rankings
+from .metrics import (
+    track_error,
+    track_rag_context,
+    track_rag_search,
+    track_rag_search_mode,
+    track_weather_search,
+)
+from .retrieval_cache import cache_documents, get_cached_documents
+from .vectorstore import (
+    duplicate_sources,
+    get_index_version,
+    get_lexical_index,
+    get_vectorstore,
+    vector_filter,
+)
 
 logger = logging.getLogger(__name__)
 
+# Candidatos buscados em cada índice, por resultado pedido, antes da fusão
+HYBRID_CANDIDATES_FACTOR = 4
+
 
 class RAGSearchInput(BaseModel):
     """Input para a ferramenta RAG Search."""
@@ -25,6 +51,32 @@ class RAGSearchInput(BaseModel):
         default=3,
         description="Número máximo de documentos relevantes a retornar (padrão = 3)",
     )
+    mode: Optional[Literal["hybrid", "vector", "lexical"]] = Field(
+        default=None,
+        description=(
+            "Modo de busca: 'hybrid' (palavras-chave + semântica), 'vector' "
+            "(apenas semântica) ou 'lexical' (apenas palavras-chave, mais rápido, "
+            "bom para nomes de produtos e códigos de cultivares)"
+        ),
+    )
+    crop: Optional[str] = Field(
+        default=None,
+        description=(
+            "Filtra pela cultura quando a pergunta é sobre uma só "
+            "(ex: 'milho', 'soja', 'café', 'feijão')"
+        ),
+    )
+    source: Optional[str] = Field(
+        default=None,
+        description="Filtra por um arquivo de origem (ex: 'manual_milho.pdf')",
+    )
+    doc_type: Optional[Literal["pdf", "csv", "txt"]] = Field(
+        default=None,
+        description=(
+            "Filtra pelo tipo de documento: 'csv' para tabelas de preços e "
+            "cotações, 'pdf' para manuais e artigos técnicos"
+        ),
+    )
 
 
 class RAGSearchTool(BaseTool):
@@ -44,26 +96,95 @@ class RAGSearchTool(BaseTool):
     - "Técnicas de irrigação por gotejamento para hortaliças"
     - "Como fazer rotação de culturas para melhorar o solo?"
     - "Manejo integrado de pragas em cultivos orgânicos"
+
+    Quando a pergunta é sobre uma cultura ou um tipo de documento específico,
+    informe crop e/ou doc_type para buscar só nesse subconjunto.
     """
     args_schema: Type[BaseModel] = RAGSearchInput
 
-    def _run(self, query: str, k: int = 3) -> str:
+    def _search(self, query: str, k: int, mode: str, filter: Optional[dict] = None):
+        """Executa a busca no modo informado e retorna os documentos"""
+        if mode == "lexical":
+            # Caminho rápido: só o índice invertido, nenhuma chamada de embedding
+            return [
+                doc for doc, _ in get_lexical_index().search(query, k=k, filter=filter)
+            ]
+
+        logger.debug("Obtendo vectorstore...")
+        vectorstore = get_vectorstore()
+        logger.debug("Vectorstore obtido com sucesso")
+
+        # Sem filtro a chamada fica igual à de antes, para qualquer backend
+        filter_kwargs = {"filter": vector_filter(vectorstore, filter)} if filter else {}
+
+        if mode == "hybrid":
+            lexical_index = get_lexical_index()
+            if lexical_index.count():
+                fetch_k = k * HYBRID_CANDIDATES_FACTOR
+                vector_docs = vectorstore.similarity_search(
+                    query, k=fetch_k, **filter_kwargs
+                )
+                lexical_docs = [
+                    doc
+                    for doc, _ in lexical_index.search(query, k=fetch_k, filter=filter)
+                ]
+                return fuse_rankings(
+                    [vector_docs, lexical_docs],
+                    [1 - RAG_HYBRID_LEXICAL_WEIGHT, RAG_HYBRID_LEXICAL_WEIGHT],
+                    k,
+                )
+            logger.warning("Índice léxico vazio, usando apenas a busca vetorial")
+
+        if filter:
+            return vectorstore.similarity_search(query, k=k, **filter_kwargs)
+        retriever = vectorstore.as_retriever(search_kwargs={"k": k})
+        return retriever.invoke(query)
+
+    def _duplicate_sources(self, docs):
+        """Outros arquivos com o mesmo conteúdo dos chunks encontrados"""
+        chunk_ids = [doc.id for doc in docs if doc.id]
+        if not chunk_ids:
+            return {}
+        try:
+            return duplicate_sources(chunk_ids)
+        except Exception as e:
+            # Sem a procedência a busca continua, só cita menos fontes
+            logger.warning(f"RAG Search - Erro ao ler chunks duplicados: {e}")
+            return {}
+
+    def _run(
+        self,
+        query: str,
+        k: int = 3,
+        mode: Optional[str] = None,
+        crop: Optional[str] = None,
+        source: Optional[str] = None,
+        doc_type: Optional[str] = None,
+    ) -> str:
         """Busca informações nos documentos RAG."""
-        logger.info(f"RAG Search iniciado - Query: '{query}', k: {k}")
+        mode = mode or RAG_SEARCH_MODE
+        filter = build_filter(crop=crop, source=source, doc_type=doc_type)
+        logger.info(
+            f"RAG Search iniciado - Query: '{query}', k: {k}, modo: {mode}, "
+            f"filtro: {filter}"
+        )
 
         try:
             # Track RAG search
-            track_rag_search("general")
-
-            logger.debug("Obtendo vectorstore...")
-            vectorstore = get_vectorstore()
-            retriever = vectorstore.as_retriever(search_kwargs={"k": k})
-            logger.debug("Vectorstore obtido com sucesso")
-
-            # Busca documentos relevantes
-            logger.debug(f"Executando busca por documentos relevantes...")
-            docs = retriever.invoke(query)
-            logger.info(f"RAG Search - Documentos encontrados: {len(docs)}")
+            track_rag_search()
+            track_rag_search_mode(mode)
+
+            # Perguntas repetidas são respondidas do cache, sem embedding nem busca
+            index_version = get_index_version()
+            docs = get_cached_documents(query, k, index_version, mode, filter)
+            if docs is not None:
+                logger.info(f"RAG Search - Resultado em cache: {len(docs)} documentos")
+            else:
+                # Busca documentos relevantes
+                logger.debug(f"Executando busca por documentos relevantes...")
+                docs = self._search(query, k, mode, filter)
+                logger.info(f"RAG Search - Documentos encontrados: {len(docs)}")
+                cache_documents(query, k, index_version, docs, mode, filter)
 
             if not docs:
                 logger.warning(
@@ -71,16 +192,32 @@ class RAGSearchTool(BaseTool):
                 )
                 return "Não foram encontradas informações relevantes nos documentos."
 
+            # Remove sobreposições, une chunks vizinhos e respeita o orçamento de tokens
+            spans, packing = pack_documents(docs, RAG_CONTEXT_TOKEN_BUDGET)
+            track_rag_context(packing["retrieved_tokens"], packing["packed_tokens"])
+            logger.info(
+                f"RAG Search - Contexto empacotado: {packing['retrieved_tokens']} -> "
+                f"{packing['packed_tokens']} tokens ({len(docs)} chunks -> "
+                f"{len(spans)} trechos)"
+            )
+
             # Formata as informações encontradas
             results = []
             logger.debug("Formatando resultados encontrados...")
-            for i, doc in enumerate(docs, 1):
-                content = doc.page_content.strip()
-                original_length = len(content)
-
-                logger.debug(
-                    f"Resultado {i}: conteúdo completo com {original_length} caracteres"
+            copies = self._duplicate_sources(docs)
+            for i, content in enumerate(spans, 1):
+                logger.debug(f"Resultado {i}: {len(content)} caracteres")
+                # A deduplicação indexou uma cópia só; cita as outras fontes
+                sources = sorted(
+                    {
+                        name
+                        for doc in docs
+                        if doc.page_content.strip() in content
+                        for name in copies.get(doc.id, ())
+                    }
                 )
+                if sources:
+                    content = f"{content}\n(Também em: {', '.join(sources)})"
 
                 results.append(f"Resultado {i}:\n{content}\n")
 
@@ -102,9 +239,23 @@ class RAGSearchTool(BaseTool):
             )
             return f"Erro ao buscar nos documentos: {str(e)}"
 
-    async def _arun(self, query: str, k: int = 3) -> str:
-        """Versão assíncrona da busca."""
-        return self._run(query, k)
+    async def _arun(
+        self,
+        query: str,
+        k: int = 3,
+        mode: Optional[str] = None,
+        crop: Optional[str] = None,
+        source: Optional[str] = None,
+        doc_type: Optional[str] = None,
+    ) -> str:
+        """Versão assíncrona da busca.
+
+        Os índices e o embedding da pergunta são síncronos: a busca roda numa
+        thread para não travar o event loop enquanto isso.
+        """
+        return await asyncio.to_thread(
+            self._run, query, k, mode, crop, source, doc_type
+        )
 
 
 class WeatherInput(BaseModel):
@@ -149,49 +300,66 @@ class WeatherTool(BaseTool):
                 track_error("missing_api_key", "weather_tool")
                 return "API key do OpenWeatherMap não configurada. Entre em contato com o administrador."
 
-            # URL da API OpenWeatherMap
-            url = f"http://api.openweathermap.org/data/2.5/weather"
-            params = {
+            response = requests.get(**self._request(location), timeout=10)
+            return self._format_response(location, response)
+
+        except requests.RequestException as e:
+            track_error("connection_error", "weather_tool")
+            logger.error(f"Erro na requisição meteorológica: {e}")
+            return "Erro de conexão ao consultar dados meteorológicos. Tente novamente em alguns minutos."
+        except Exception as e:
+            track_error("weather_tool_error", "weather_tool")
+            logger.error(f"Erro na WeatherTool: {e}")
+            return f"Erro ao consultar informações meteorológicas: {str(e)}"
+
+    def _request(self, location):
+        # URL da API OpenWeatherMap
+        return {
+            "url": "http://api.openweathermap.org/data/2.5/weather",
+            "params": {
                 "q": location,
                 "appid": OPENWEATHER_API_KEY,
                 "units": "metric",  # Celsius
                 "lang": "pt_br",  # Português brasileiro
-            }
-
-            response = requests.get(url, params=params, timeout=10)
-
-            if response.status_code == 401:
-                track_error("api_auth_error", "weather_tool")
-                return "Erro de autenticação na API meteorológica. Verifique a chave da API."
+            },
+        }
+
+    def _format_response(self, location, response):
+        """Formata a resposta da API (requests ou httpx) para o agente"""
+        if response.status_code == 401:
+            track_error("api_auth_error", "weather_tool")
+            return (
+                "Erro de autenticação na API meteorológica. Verifique a chave da API."
+            )
 
-            if response.status_code == 404:
-                track_error("location_not_found", "weather_tool")
-                return f"Localização '{location}' não encontrada. Tente com o nome de uma cidade válida."
+        if response.status_code == 404:
+            track_error("location_not_found", "weather_tool")
+            return f"Localização '{location}' não encontrada. Tente com o nome de uma cidade válida."
 
-            if response.status_code != 200:
-                track_error("api_request_error", "weather_tool")
-                return f"Erro ao consultar dados meteorológicos: {response.status_code}"
+        if response.status_code != 200:
+            track_error("api_request_error", "weather_tool")
+            return f"Erro ao consultar dados meteorológicos: {response.status_code}"
 
-            data = response.json()
+        data = response.json()
 
-            # Extrai informações relevantes
-            main = data.get("main", {})
-            weather = data.get("weather", [{}])[0]
-            wind = data.get("wind", {})
+        # Extrai informações relevantes
+        main = data.get("main", {})
+        weather = data.get("weather", [{}])[0]
+        wind = data.get("wind", {})
 
-            city_name = data.get("name", location)
-            country = data.get("sys", {}).get("country", "")
+        city_name = data.get("name", location)
+        country = data.get("sys", {}).get("country", "")
 
-            temperature = main.get("temp", 0)
-            feels_like = main.get("feels_like", 0)
-            humidity = main.get("humidity", 0)
-            pressure = main.get("pressure", 0)
+        temperature = main.get("temp", 0)
+        feels_like = main.get("feels_like", 0)
+        humidity = main.get("humidity", 0)
+        pressure = main.get("pressure", 0)
 
-            description = weather.get("description", "").title()
-            wind_speed = wind.get("speed", 0)
+        description = weather.get("description", "").title()
+        wind_speed = wind.get("speed", 0)
 
-            # Formata a resposta
-            weather_info = f"""🌤️ Clima em {city_name}, {country}
+        # Formata a resposta
+        weather_info = f"""🌤️ Clima em {city_name}, {country}
 
 🌡️ Temperatura: {temperature:.1f}°C (sensação térmica: {feels_like:.1f}°C)
 💧 Umidade: {humidity}%
@@ -202,11 +370,25 @@ class WeatherTool(BaseTool):
 📍 Localização consultada: {location}
 """
 
-            logger.info(f"Weather Search - Location: {location}, Temp: {temperature}°C")
+        logger.info(f"Weather Search - Location: {location}, Temp: {temperature}°C")
 
-            return weather_info
+        return weather_info
 
-        except requests.RequestException as e:
+    async def _arun(self, location: str = "Parelheiros,SP,BR") -> str:
+        """Versão assíncrona da consulta meteorológica."""
+        try:
+            track_weather_search(location)
+
+            if not OPENWEATHER_API_KEY:
+                track_error("missing_api_key", "weather_tool")
+                return "API key do OpenWeatherMap não configurada. Entre em contato com o administrador."
+
+            response = await get_async_http_client().get(
+                **self._request(location), timeout=10
+            )
+            return self._format_response(location, response)
+
+        except httpx.HTTPError as e:
             track_error("connection_error", "weather_tool")
             logger.error(f"Erro na requisição meteorológica: {e}")
             return "Erro de conexão ao consultar dados meteorológicos. Tente novamente em alguns minutos."
@@ -215,10 +397,6 @@ class WeatherTool(BaseTool):
             logger.error(f"Erro na WeatherTool: {e}")
             return f"Erro ao consultar informações meteorológicas: {str(e)}"
 
-    async def _arun(self, location: str = "Parelheiros,SP,BR") -> str:
-        """Versão assíncrona da consulta meteorológica."""
-        return self._run(location)
-
 
 class WebScrapingInput(BaseModel):
     """Input para a ferramenta de Web Scraping."""
@@ -234,6 +412,17 @@ class WebScrapingInput(BaseModel):
     )
 
 
+# Headers para simular um navegador real
+SCRAPING_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+}
+
+
 class WebScrapingTool(BaseTool):
     """Ferramenta para extrair informações de páginas web usando BeautifulSoup."""
 
@@ -268,131 +457,51 @@ class WebScrapingTool(BaseTool):
             if not parsed_url.scheme or not parsed_url.netloc:
                 return "URL inválida. Por favor, forneça uma URL completa (ex: https://exemplo.com)"
 
-            # Headers para simular um navegador real
-            headers = {
-                "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-                "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Connection": "keep-alive",
-                "Upgrade-Insecure-Requests": "1",
-            }
-
             # Requisição HTTP
             logger.debug(f"Fazendo requisição para: {url}")
-            response = requests.get(url, headers=headers, timeout=15)
+            response = requests.get(url, headers=SCRAPING_HEADERS, timeout=15)
 
             if response.status_code != 200:
                 track_error("http_error", "web_scraping")
                 return f"Erro HTTP {response.status_code} ao acessar a página: {url}"
 
-            # Parse do HTML com BeautifulSoup
-            logger.debug("Fazendo parse do HTML...")
-            soup = BeautifulSoup(response.content, "html.parser")
-
-            # Remove scripts e estilos para um conteúdo mais limpo
-            for script in soup(["script", "style", "nav", "footer", "aside"]):
-                script.decompose()
-
-            result_parts = []
-
-            # Título da página
-            title = soup.find("title")
-            if title:
-                result_parts.append(f"📄 **Título:** {title.get_text().strip()}")
-
-            # Se um seletor específico foi fornecido
-            if selector:
-                logger.debug(f"Aplicando seletor: {selector}")
-                elements = soup.select(selector)
-                if elements:
-                    result_parts.append(f"\n🎯 **Conteúdo do seletor '{selector}':**")
-                    for i, element in enumerate(elements[:5], 1):  # Máximo 5 elementos
-                        text = element.get_text().strip()
-                        if text:
-                            result_parts.append(
-                                f"{i}. {text[:300]}{'...' if len(text) > 300 else ''}"
-                            )
-                else:
-                    result_parts.append(
-                        f"\n❌ Nenhum elemento encontrado com o seletor '{selector}'"
-                    )
-            else:
-                # Extração de conteúdo principal
-                main_content = []
-
-                # Tenta encontrar o conteúdo principal
-                main_areas = soup.find_all(
-                    ["main", "article", "div"],
-                    class_=lambda x: x
-                    and any(
-                        keyword in x.lower()
-                        for keyword in ["content", "main", "article", "post", "body"]
-                    ),
-                )
-
-                if main_areas:
-                    for area in main_areas[:2]:  # Máximo 2 áreas principais
-                        text = area.get_text().strip()
-                        if len(text) > 50:  # Filtra textos muito pequenos
-                            main_content.append(text[:800])  # Limita o tamanho
-                else:
-                    # Fallback: pega todos os parágrafos
-                    paragraphs = soup.find_all("p")
-                    for p in paragraphs[:5]:  # Máximo 5 parágrafos
-                        text = p.get_text().strip()
-                        if len(text) > 30:
-                            main_content.append(text[:400])
-
-                if main_content:
-                    result_parts.append("\n📝 **Conteúdo principal:**")
-                    for i, content in enumerate(main_content, 1):
-                        result_parts.append(
-                            f"\n{i}. {content}{'...' if len(content) >= 400 else ''}"
-                        )
-
-            # Extração de links se solicitado
-            if extract_links:
-                logger.debug("Extraindo links...")
-                links = soup.find_all("a", href=True)
-                unique_links = []
-                seen_urls = set()
-
-                for link in links[:10]:  # Máximo 10 links
-                    href = link.get("href")
-                    text = link.get_text().strip()
-
-                    if href and text and len(text) > 3:
-                        # Converte links relativos em absolutos
-                        full_url = urljoin(url, href)
-                        if full_url not in seen_urls and full_url.startswith(
-                            ("http://", "https://")
-                        ):
-                            seen_urls.add(full_url)
-                            unique_links.append(f"• [{text[:50]}]({full_url})")
+            return self._parse_page(url, response.content, selector, extract_links)
 
-                if unique_links:
-                    result_parts.append("\n🔗 **Links encontrados:**")
-                    result_parts.extend(unique_links)
+        except requests.RequestException as e:
+            track_error("connection_error", "web_scraping")
+            logger.error(f"Erro de conexão no Web Scraping: {e}")
+            return f"Erro de conexão ao acessar a página: {str(e)}"
+        except Exception as e:
+            track_error("web_scraping_error", "web_scraping")
+            logger.error(f"Erro no Web Scraping: {e}", exc_info=True)
+            return f"Erro ao extrair informações da página: {str(e)}"
 
-            if not result_parts:
-                return "Não foi possível extrair conteúdo significativo da página."
+    async def _arun(
+        self, url: str, selector: str = "", extract_links: bool = False
+    ) -> str:
+        """Versão assíncrona do web scraping."""
+        logger.info(f"Web Scraping iniciado - URL: '{url}', Selector: '{selector}'")
 
-            # Adiciona informações da fonte
-            result_parts.append(f"\n🌐 **Fonte:** {url}")
+        try:
+            parsed_url = urlparse(url)
+            if not parsed_url.scheme or not parsed_url.netloc:
+                return "URL inválida. Por favor, forneça uma URL completa (ex: https://exemplo.com)"
 
-            final_result = "\n".join(result_parts)
+            logger.debug(f"Fazendo requisição para: {url}")
+            response = await get_async_http_client().get(
+                url, headers=SCRAPING_HEADERS, timeout=15, follow_redirects=True
+            )
 
-            # Limita o tamanho total da resposta
-            if len(final_result) > 2000:
-                final_result = final_result[:2000] + "\n\n[Conteúdo truncado...]"
+            if response.status_code != 200:
+                track_error("http_error", "web_scraping")
+                return f"Erro HTTP {response.status_code} ao acessar a página: {url}"
 
-            logger.info(
-                f"Web Scraping concluído - URL: {url}, Tamanho: {len(final_result)} chars"
+            # O parse do HTML é CPU: roda numa thread para não travar o event loop
+            return await asyncio.to_thread(
+                self._parse_page, url, response.content, selector, extract_links
             )
-            return final_result
 
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             track_error("connection_error", "web_scraping")
             logger.error(f"Erro de conexão no Web Scraping: {e}")
             return f"Erro de conexão ao acessar a página: {str(e)}"
@@ -401,11 +510,113 @@ class WebScrapingTool(BaseTool):
             logger.error(f"Erro no Web Scraping: {e}", exc_info=True)
             return f"Erro ao extrair informações da página: {str(e)}"
 
-    async def _arun(
-        self, url: str, selector: str = "", extract_links: bool = False
-    ) -> str:
-        """Versão assíncrona do web scraping."""
-        return self._run(url, selector, extract_links)
+    def _parse_page(self, url, content, selector, extract_links):
+        """Extrai título, conteúdo e links do HTML da página"""
+        # Parse do HTML com BeautifulSoup
+        logger.debug("Fazendo parse do HTML...")
+        soup = BeautifulSoup(content, "html.parser")
+
+        # Remove scripts e estilos para um conteúdo mais limpo
+        for script in soup(["script", "style", "nav", "footer", "aside"]):
+            script.decompose()
+
+        result_parts = []
+
+        # Título da página
+        title = soup.find("title")
+        if title:
+            result_parts.append(f"📄 **Título:** {title.get_text().strip()}")
+
+        # Se um seletor específico foi fornecido
+        if selector:
+            logger.debug(f"Aplicando seletor: {selector}")
+            elements = soup.select(selector)
+            if elements:
+                result_parts.append(f"\n🎯 **Conteúdo do seletor '{selector}':**")
+                for i, element in enumerate(elements[:5], 1):  # Máximo 5 elementos
+                    text = element.get_text().strip()
+                    if text:
+                        result_parts.append(
+                            f"{i}. {text[:300]}{'...' if len(text) > 300 else ''}"
+                        )
+            else:
+                result_parts.append(
+                    f"\n❌ Nenhum elemento encontrado com o seletor '{selector}'"
+                )
+        else:
+            # Extração de conteúdo principal
+            main_content = []
+
+            # Tenta encontrar o conteúdo principal
+            main_areas = soup.find_all(
+                ["main", "article", "div"],
+                class_=lambda x: x
+                and any(
+                    keyword in x.lower()
+                    for keyword in ["content", "main", "article", "post", "body"]
+                ),
+            )
+
+            if main_areas:
+                for area in main_areas[:2]:  # Máximo 2 áreas principais
+                    text = area.get_text().strip()
+                    if len(text) > 50:  # Filtra textos muito pequenos
+                        main_content.append(text[:800])  # Limita o tamanho
+            else:
+                # Fallback: pega todos os parágrafos
+                paragraphs = soup.find_all("p")
+                for p in paragraphs[:5]:  # Máximo 5 parágrafos
+                    text = p.get_text().strip()
+                    if len(text) > 30:
+                        main_content.append(text[:400])
+
+            if main_content:
+                result_parts.append("\n📝 **Conteúdo principal:**")
+                for i, content in enumerate(main_content, 1):
+                    result_parts.append(
+                        f"\n{i}. {content}{'...' if len(content) >= 400 else ''}"
+                    )
+
+        # Extração de links se solicitado
+        if extract_links:
+            logger.debug("Extraindo links...")
+            links = soup.find_all("a", href=True)
+            unique_links = []
+            seen_urls = set()
+
+            for link in links[:10]:  # Máximo 10 links
+                href = link.get("href")
+                text = link.get_text().strip()
+
+                if href and text and len(text) > 3:
+                    # Converte links relativos em absolutos
+                    full_url = urljoin(url, href)
+                    if full_url not in seen_urls and full_url.startswith(
+                        ("http://", "https://")
+                    ):
+                        seen_urls.add(full_url)
+                        unique_links.append(f"• [{text[:50]}]({full_url})")
+
+            if unique_links:
+                result_parts.append("\n🔗 **Links encontrados:**")
+                result_parts.extend(unique_links)
+
+        if not result_parts:
+            return "Não foi possível extrair conteúdo significativo da página."
+
+        # Adiciona informações da fonte
+        result_parts.append(f"\n🌐 **Fonte:** {url}")
+
+        final_result = "\n".join(result_parts)
+
+        # Limita o tamanho total da resposta
+        if len(final_result) > 2000:
+            final_result = final_result[:2000] + "\n\n[Conteúdo truncado...]"
+
+        logger.info(
+            f"Web Scraping concluído - URL: {url}, Tamanho: {len(final_result)} chars"
+        )
+        return final_result
 
 
 class SQLSelectInput(BaseModel):
@@ -1,16 +1,142 @@
+import fcntl
+import json
 import logging
+import multiprocessing
 import os
 import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from queue import Empty
 
+from chromadb.api.client import SharedSystemClient
 from langchain_chroma import Chroma
 from langchain_community.document_loaders import CSVLoader, PyPDFLoader, TextLoader
 from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from .config import OPENAI_API_KEY, RAG_FILES_DIR, VECTOR_STORE_PATH
+from .config import (
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_PATH,
+    OPENAI_API_KEY,
+    OPENAI_EMBEDDING_MODEL,
+    RAG_CACHE_ENABLED,
+    RAG_CHUNK_MIN_TOKENS,
+    RAG_CHUNK_OVERLAP,
+    RAG_CHUNK_OVERLAP_TOKENS,
+    RAG_CHUNK_SIZE,
+    RAG_CHUNK_TOKENS,
+    RAG_CHUNKING,
+    RAG_COLLECTION_NAME,
+    RAG_DEDUP_ENABLED,
+    RAG_DEDUP_THRESHOLD,
+    RAG_EMBEDDING_PROVIDER,
+    RAG_CHECKPOINT_INTERVAL,
+    RAG_FAISS_HNSW_M,
+    RAG_FAISS_INDEX_TYPE,
+    RAG_FAISS_QUANTIZATION,
+    RAG_FAISS_RERANK_FACTOR,
+    RAG_FILES_DIR,
+    RAG_INGESTION_MODE,
+    RAG_LOADER_WORKERS,
+    RAG_LOCAL_EMBEDDING_BATCH_SIZE,
+    RAG_LOCAL_EMBEDDING_MAX_LENGTH,
+    RAG_LOCAL_EMBEDDING_MODEL_PATH,
+    RAG_LOCAL_EMBEDDING_THREADS,
+    RAG_PIPELINE_QUEUE_SIZE,
+    RAG_PIPELINE_SEGMENT_SIZE,
+    RAG_SNAPSHOT_PATH,
+    RAG_SNAPSHOT_VERIFY,
+    RAG_VECTOR_BACKEND,
+    RAG_WARM_UP,
+    VECTOR_STORE_PATH,
+)
+from .embeddings import (
+    CachedEmbeddings,
+    EmbeddingBatchScheduler,
+    count_tokens,
+    get_embedding_cache,
+)
+from .chunk_metadata import chroma_where, enrich_metadata
+from .chunking import TokenChunker
+from .dedup import ChunkDeduplicator
+from .faiss_store import FaissVectorStore
+from .lexical import BM25Index
+from .local_embeddings import HashingEmbeddings, LocalEmbeddings
+from .manifest import (
+    CHECKPOINT_DIR,
+    CHECKPOINT_FILE,
+    MANIFEST_DIR,
+    MANIFEST_FILE,
+    IndexManifest,
+    IngestionCheckpoint,
+    file_sha256,
+)
+from .retrieval_cache import get_cache
+from .snapshot import (
+    SNAPSHOT_INFO_FILE,
+    SnapshotError,
+    export_snapshot,
+    read_snapshot_info,
+    restore_snapshot,
+    verify_files,
+)
 
 logger = logging.getLogger(__name__)
 
+ACTIVE_COLLECTION_FILE = "active_collection"
+RETIRED_COLLECTIONS_FILE = "retired_collections"
+FAISS_DIR = "faiss"
+INGESTION_LOCK_FILE = ".ingestion.lock"
+LEXICAL_DIR = "lexical"
+DEDUP_DIR = "dedup"
+EMBEDDING_INFO_DIR = "collections"
+
+# Índices criados antes do registro do provider só podiam usar a OpenAI
+LEGACY_EMBEDDING_INFO = {"provider": "openai", "model": "text-embedding-ada-002"}
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".csv")
+
+# Vectorstore compartilhado por todas as chamadas do processo
+_vectorstore = None
+_vectorstore_key = None
+_vectorstore_lock = threading.Lock()
+_index_version_cache = (None, 0)
+_lexical_index = None
+_lexical_index_key = None
+_lexical_index_lock = threading.Lock()
+# Chave do índice léxico sendo recarregado em segundo plano
+_lexical_index_loading = None
+
+
+def load_file(file):
+    """Carrega os documentos de um único arquivo de acordo com a extensão"""
+    if file.endswith(".pdf"):
+        loader = PyPDFLoader(file)
+    elif file.endswith(".txt"):
+        loader = TextLoader(file, encoding="utf-8")
+    elif file.endswith(".csv"):
+        loader = CSVLoader(file)
+    else:
+        return []
+
+    return loader.load()
+
+
+def lazy_load_file(file):
+    """Carrega os documentos do arquivo sob demanda (uma página do PDF por vez)"""
+    if file.endswith(".pdf"):
+        loader = PyPDFLoader(file)
+    elif file.endswith(".txt"):
+        loader = TextLoader(file, encoding="utf-8")
+    elif file.endswith(".csv"):
+        loader = CSVLoader(file)
+    else:
+        return iter(())
+
+    return loader.lazy_load()
+
 
 def load_documents_from_directory(directory):
     """Carrega documentos de um diretório específico sem movê-los"""
@@ -22,21 +148,12 @@ def load_documents_from_directory(directory):
     files = [
         os.path.join(directory, f)
         for f in os.listdir(directory)
-        if f.endswith((".pdf", ".txt", ".csv"))
+        if f.endswith(SUPPORTED_EXTENSIONS)
     ]
 
     for file in files:
         try:
-            if file.endswith(".pdf"):
-                loader = PyPDFLoader(file)
-            elif file.endswith(".txt"):
-                loader = TextLoader(file, encoding="utf-8")
-            elif file.endswith(".csv"):
-                loader = CSVLoader(file)
-            else:
-                continue
-
-            file_docs = loader.load()
+            file_docs = load_file(file)
             docs.extend(file_docs)
             logger.info(
                 f"Carregado: {os.path.basename(file)} ({len(file_docs)} documentos)"
@@ -71,19 +188,318 @@ def load_documents():
     return all_docs
 
 
-def get_vectorstore():
-    """Obtém o vectorstore, recriando se necessário"""
+def _read_active_collection():
+    """Lê o nome da coleção ativa, gravado na última reconstrução do índice"""
+    pointer = os.path.join(VECTOR_STORE_PATH, ACTIVE_COLLECTION_FILE)
     try:
-        # Primeiro tenta carregar vectorstore existente
-        vectorstore = Chroma(
-            embedding_function=OpenAIEmbeddings(api_key=OPENAI_API_KEY),
-            persist_directory=VECTOR_STORE_PATH,
+        with open(pointer, encoding="utf-8") as f:
+            return f.read().strip() or RAG_COLLECTION_NAME
+    except FileNotFoundError:
+        return RAG_COLLECTION_NAME
+
+
+def _write_active_collection(collection_name):
+    """Grava o nome da coleção ativa de forma atômica"""
+    os.makedirs(VECTOR_STORE_PATH, exist_ok=True)
+    pointer = os.path.join(VECTOR_STORE_PATH, ACTIVE_COLLECTION_FILE)
+    tmp_pointer = f"{pointer}.tmp"
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write(collection_name)
+    os.replace(tmp_pointer, pointer)
+
+
+def _read_retired_collections():
+    """Coleções substituídas na última reconstrução, ainda não apagadas"""
+    pointer = os.path.join(VECTOR_STORE_PATH, RETIRED_COLLECTIONS_FILE)
+    try:
+        with open(pointer, encoding="utf-8") as f:
+            return [name for name in f.read().split() if name]
+    except FileNotFoundError:
+        return []
+
+
+def _write_retired_collections(collection_names):
+    os.makedirs(VECTOR_STORE_PATH, exist_ok=True)
+    pointer = os.path.join(VECTOR_STORE_PATH, RETIRED_COLLECTIONS_FILE)
+    tmp_pointer = f"{pointer}.tmp"
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write("\n".join(collection_names))
+    os.replace(tmp_pointer, pointer)
+
+
+def configured_embedding_info():
+    """Provider e modelo de embeddings definidos na configuração"""
+    if RAG_EMBEDDING_PROVIDER == "local":
+        return {
+            "provider": "local",
+            "model": os.path.basename(os.path.normpath(RAG_LOCAL_EMBEDDING_MODEL_PATH)),
+            "path": RAG_LOCAL_EMBEDDING_MODEL_PATH,
+        }
+    if RAG_EMBEDDING_PROVIDER == "hashing":
+        return {"provider": "hashing", "model": HashingEmbeddings().model}
+    return {"provider": "openai", "model": OPENAI_EMBEDDING_MODEL}
+
+
+def _embedding_info_path(collection_name):
+    return os.path.join(
+        VECTOR_STORE_PATH, EMBEDDING_INFO_DIR, f"{collection_name}.json"
+    )
+
+
+def read_embedding_info(collection_name):
+    """Lê o provider de embeddings com que a coleção foi criada, se registrado"""
+    try:
+        with open(_embedding_info_path(collection_name), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_embedding_info(collection_name, embedding_info):
+    path = _embedding_info_path(collection_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(embedding_info, f)
+    os.replace(tmp_path, path)
+
+
+def create_embeddings(embedding_info):
+    """Instancia o provider de embeddings descrito por embedding_info"""
+    if embedding_info["provider"] == "local":
+        return LocalEmbeddings(
+            embedding_info["path"],
+            threads=RAG_LOCAL_EMBEDDING_THREADS,
+            batch_size=RAG_LOCAL_EMBEDDING_BATCH_SIZE,
+            max_length=RAG_LOCAL_EMBEDDING_MAX_LENGTH,
+        )
+    if embedding_info["provider"] == "hashing":
+        return HashingEmbeddings(int(embedding_info["model"].rsplit("-", 1)[1]))
+    if embedding_info["provider"] == "openai":
+        return OpenAIEmbeddings(api_key=OPENAI_API_KEY, model=embedding_info["model"])
+    raise ValueError(f"Provider de embeddings inválido: {embedding_info['provider']}")
+
+
+def get_embedding_function(embedding_info=None):
+    """Retorna a função de embedding, com os caches habilitados na configuração"""
+    embeddings = create_embeddings(embedding_info or configured_embedding_info())
+    cache = (
+        get_embedding_cache(EMBEDDING_CACHE_PATH) if EMBEDDING_CACHE_ENABLED else None
+    )
+    query_cache = get_cache("query_embedding") if RAG_CACHE_ENABLED else None
+    if cache is None and query_cache is None:
+        return embeddings
+    return CachedEmbeddings(embeddings, cache, query_cache=query_cache)
+
+
+def _open_collection(collection_name, embedding_function):
+    if RAG_VECTOR_BACKEND == "faiss":
+        return FaissVectorStore(
+            os.path.join(VECTOR_STORE_PATH, FAISS_DIR, collection_name),
+            embedding_function,
+            index_type=RAG_FAISS_INDEX_TYPE,
+            hnsw_m=RAG_FAISS_HNSW_M,
+            quantization=RAG_FAISS_QUANTIZATION,
+            rerank_factor=RAG_FAISS_RERANK_FACTOR,
+        )
+
+    return Chroma(
+        collection_name=collection_name,
+        embedding_function=embedding_function,
+        persist_directory=VECTOR_STORE_PATH,
+    )
+
+
+def open_vectorstore(collection_name=None):
+    """Abre a coleção no backend vetorial configurado (RAG_VECTOR_BACKEND).
+
+    A coleção guarda o provider de embeddings com que foi criada e as buscas
+    sempre usam esse mesmo modelo. Trocar RAG_EMBEDDING_PROVIDER só vale
+    para coleções vazias ou novas, como as criadas por rebuild_vectorstore.
+    """
+    collection_name = collection_name or _read_active_collection()
+    configured = configured_embedding_info()
+    embedding_info = read_embedding_info(collection_name)
+
+    vectorstore = _open_collection(
+        collection_name, get_embedding_function(embedding_info or configured)
+    )
+    if embedding_info == configured:
+        return vectorstore
+
+    # Sem registro, o índice existente (se houver) foi criado com a OpenAI
+    if (
+        embedding_info is None and configured == LEGACY_EMBEDDING_INFO
+    ) or not count_chunks(vectorstore):
+        resolved = configured
+    elif embedding_info is None:
+        resolved = LEGACY_EMBEDDING_INFO
+    else:
+        logger.warning(
+            f"Coleção {collection_name} criada com embeddings {embedding_info}, "
+            f"diferente da configuração {configured}; mantendo o modelo do índice. "
+            "Reconstrua o índice para trocar de provider."
+        )
+        return vectorstore
+
+    _write_embedding_info(collection_name, resolved)
+    if resolved != (embedding_info or configured):
+        vectorstore = _open_collection(
+            collection_name, get_embedding_function(resolved)
+        )
+    return vectorstore
+
+
+def _lexical_index_path(collection_name):
+    return os.path.join(VECTOR_STORE_PATH, LEXICAL_DIR, f"{collection_name}.sqlite3")
+
+
+def open_lexical_index(collection_name=None):
+    """Abre o índice léxico (BM25) que acompanha a coleção vetorial"""
+    return BM25Index(_lexical_index_path(collection_name or _read_active_collection()))
+
+
+def _deduplicator_path(collection_name):
+    return os.path.join(VECTOR_STORE_PATH, DEDUP_DIR, f"{collection_name}.sqlite3")
+
+
+def open_deduplicator(collection_name=None):
+    """Abre o registro de chunks duplicados da coleção, se a deduplicação estiver ativa"""
+    if not RAG_DEDUP_ENABLED:
+        return None
+    return ChunkDeduplicator(
+        _deduplicator_path(collection_name or _read_active_collection()),
+        threshold=RAG_DEDUP_THRESHOLD,
+    )
+
+
+
+def duplicate_sources(chunk_ids, collection_name=None):
+    """Arquivos com cópias descartadas de cada chunk canônico.
+
+    A deduplicação indexa só uma cópia de cada trecho repetido; as demais
+    fontes ficam no registro da coleção e são devolvidas aqui por nome de
+    arquivo, para a busca citar todas.
+    """
+    if not RAG_DEDUP_ENABLED or not chunk_ids:
+        return {}
+    path = _deduplicator_path(collection_name or _read_active_collection())
+    if not os.path.exists(path):
+        return {}
+
+    deduplicator = ChunkDeduplicator(path, threshold=RAG_DEDUP_THRESHOLD)
+    try:
+        provenance = deduplicator.provenance(chunk_ids)
+    finally:
+        deduplicator.close()
+    return {
+        chunk_id: sorted(
+            {
+                os.path.basename(metadata["source"])
+                for metadata in copies
+                if metadata.get("source")
+            }
+        )
+        for chunk_id, copies in provenance.items()
+    }
+
+def iter_indexed_chunks(vectorstore, batch_size=1000):
+    """Percorre os chunks gravados no vectorstore em lotes de (id, texto, metadados)"""
+    if isinstance(vectorstore, FaissVectorStore):
+        yield from vectorstore.iter_chunks(batch_size)
+        return
+
+    offset = 0
+    while True:
+        result = vectorstore.get(
+            include=["documents", "metadatas"], limit=batch_size, offset=offset
+        )
+        if not result["ids"]:
+            return
+        yield list(zip(result["ids"], result["documents"], result["metadatas"]))
+        offset += len(result["ids"])
+
+
+def ensure_lexical_index(vectorstore, lexical_index):
+    """Preenche o índice léxico a partir do vectorstore quando ele estiver vazio.
+
+    Cobre índices vetoriais criados antes da busca híbrida. Uma falha aqui
+    não impede o uso do vectorstore: a busca híbrida cai para a vetorial.
+    """
+    if lexical_index.count():
+        return 0
+
+    added = 0
+    try:
+        for batch in iter_indexed_chunks(vectorstore):
+            ids, texts, metadatas = zip(*batch)
+            lexical_index.add(list(ids), list(texts), list(metadatas))
+            added += len(batch)
+    except Exception as e:
+        logger.error(f"Erro ao preencher o índice léxico: {e}")
+
+    if added:
+        logger.info(f"Índice léxico preenchido com {added} chunks do vectorstore")
+    return added
+
+
+def count_chunks(vectorstore):
+    """Conta os chunks indexados sem gastar uma chamada de embedding"""
+    if isinstance(vectorstore, FaissVectorStore):
+        return vectorstore.count()
+    return vectorstore._collection.count()
+
+
+def persist_vectorstore(vectorstore):
+    """Grava no disco backends que não persistem a cada escrita (FAISS)"""
+    if isinstance(vectorstore, FaissVectorStore):
+        vectorstore.persist()
+
+
+def load_vectorstore():
+    """Abre o vectorstore persistido sem indexar documentos.
+
+    A indexação roda fora das requisições, pelo comando `manage.py ingest_rag`;
+    com o índice vazio a busca apenas não encontra resultados. Antes de abrir,
+    o índice vindo de um snapshot é conferido (ou restaurado, ver
+    prepare_snapshot).
+    """
+    prepare_snapshot()
+    vectorstore = open_vectorstore()
+
+    if count_chunks(vectorstore):
+        logger.info("Vectorstore existente carregado")
+        lexical_index = open_lexical_index()
+        ensure_lexical_index(vectorstore, lexical_index)
+        lexical_index.close()
+    else:
+        logger.warning(
+            "Vectorstore vazio: rode `python manage.py ingest_rag` para indexar "
+            "os documentos"
         )
+    return vectorstore
 
-        # Verifica se tem documentos no vectorstore
-        test_results = vectorstore.similarity_search("test", k=1)
-        if test_results:
+
+def ingest_vectorstore(progress=None):
+    """Cria ou atualiza o índice com os arquivos de RAG_FILES_DIR.
+
+    No modo incremental sincroniza o índice existente, retomando uma ingestão
+    interrompida; no modo full só recria o índice se estiver vazio ou
+    corrompido. Veja sync_vectorstore para os eventos enviados a progress.
+    """
+    try:
+        # Primeiro tenta carregar vectorstore existente
+        vectorstore = open_vectorstore()
+
+        if RAG_INGESTION_MODE == "incremental":
+            sync_vectorstore(vectorstore, progress=progress)
+            return vectorstore
+
+        if count_chunks(vectorstore):
             logger.info("Vectorstore existente carregado")
+            lexical_index = open_lexical_index()
+            ensure_lexical_index(vectorstore, lexical_index)
+            lexical_index.close()
             return vectorstore
         else:
             logger.info("Vectorstore vazio, recriando...")
@@ -92,50 +508,1182 @@ def get_vectorstore():
         logger.error(f"Erro ao carregar vectorstore existente: {e}")
         logger.info("Criando novo vectorstore...")
 
+    return build_vectorstore(progress=progress)
+
+
+def get_text_splitter(strategy=None):
+    """Splitter configurado: por tokens e estrutura ou o antigo, por caracteres"""
+    strategy = strategy or RAG_CHUNKING
+    if strategy == "characters":
+        return RecursiveCharacterTextSplitter(
+            chunk_size=RAG_CHUNK_SIZE,
+            chunk_overlap=RAG_CHUNK_OVERLAP,
+        )
+    if strategy != "tokens":
+        raise ValueError(f"RAG_CHUNKING inválido: {strategy}")
+    return TokenChunker(
+        max_tokens=RAG_CHUNK_TOKENS,
+        overlap_tokens=RAG_CHUNK_OVERLAP_TOKENS,
+        min_tokens=RAG_CHUNK_MIN_TOKENS,
+    )
+
+
+def chunking_signature():
+    """Configuração do chunking gravada no manifesto; mudou, o arquivo é redividido"""
+    if RAG_CHUNKING == "characters":
+        return f"characters:{RAG_CHUNK_SIZE}:{RAG_CHUNK_OVERLAP}"
+    return (
+        f"{RAG_CHUNKING}:{RAG_CHUNK_TOKENS}:{RAG_CHUNK_OVERLAP_TOKENS}"
+        f":{RAG_CHUNK_MIN_TOKENS}"
+    )
+
+
+def split_documents(docs, strategy=None):
+    """Divide os documentos em chunks com os metadados usados nos filtros.
+
+    Gera os chunks sob demanda; o TokenChunker junta as páginas e linhas
+    seguidas do mesmo arquivo, então os documentos devem vir em ordem.
+    """
+    text_splitter = get_text_splitter(strategy)
+    if isinstance(text_splitter, TokenChunker):
+        chunks = text_splitter.split_documents(docs)
+    else:
+        chunks = (
+            chunk for doc in docs for chunk in text_splitter.split_documents([doc])
+        )
+    return (enrich_metadata(chunk) for chunk in chunks)
+
+
+def vector_filter(vectorstore, filter):
+    """Filtro de metadados no formato esperado pelo backend vetorial"""
+    if isinstance(vectorstore, FaissVectorStore):
+        return filter
+    return chroma_where(filter)
+
+
+def add_splits(vectorstore, splits, ids=None):
+    """Adiciona os chunks ao vectorstore em lotes e retorna quantos lotes falharam"""
+    with EmbeddingBatchScheduler(vectorstore) as scheduler:
+        futures = scheduler.submit(splits, ids)
+    return sum(1 for future in futures if not future.result())
+
+
+def build_vectorstore(collection_name=None, progress=None):
+    """Carrega os documentos e cria o vectorstore na coleção informada"""
+    if RAG_INGESTION_MODE == "incremental":
+        vectorstore = open_vectorstore(collection_name)
+        sync_vectorstore(vectorstore, collection_name, progress=progress)
+        return vectorstore
+
     # Carregar documentos e criar novo vectorstore
-    docs = load_documents()
-    if not docs:
+    files = list(list_rag_files().values())
+    vectorstore = open_vectorstore(collection_name)
+    if not files:
         logger.warning("Nenhum documento encontrado para criar vectorstore")
-        return Chroma(
-            embedding_function=OpenAIEmbeddings(api_key=OPENAI_API_KEY),
-            persist_directory=VECTOR_STORE_PATH,
-        )
+        return vectorstore
+
+    logger.info(f"Criando vectorstore com {len(files)} arquivos...")
+    progress = progress or _no_progress
+    progress("queued", files=len(files))
+    total_chunks = 0
+    total_duplicates = 0
+    lexical_index = open_lexical_index(collection_name)
+    lexical_index.clear()
+    deduplicator = open_deduplicator(collection_name)
+    if deduplicator is not None:
+        deduplicator.clear()
+    dead_letters = []
+    # Ids e duplicados dos arquivos gravados, para refazer os que voltarem à fila
+    recorded = {}
+    retried = set()
+    while files:
+        retry = set()
+        # Ids, duplicados e lotes dos arquivos cujos segmentos ainda estão chegando
+        loading = {}
+        finished = []
+        with EmbeddingBatchScheduler(vectorstore) as scheduler:
+            for file, splits, error, last in iter_split_segments(files):
+                if error is not None:
+                    loading.pop(file, None)
+                    if deduplicator is not None:
+                        retry.update(deduplicator.discard(file))
+                    progress("failed", key=file)
+                    continue
+
+                kept_ids, file_duplicates, futures = loading.setdefault(
+                    file, ([], [], [])
+                )
+                # Os mesmos ids nos dois índices permitem combinar os resultados
+                ids = [uuid.uuid4().hex for _ in splits]
+                if deduplicator is not None:
+                    splits, ids, duplicates = deduplicator.filter(file, splits, ids)
+                    file_duplicates.extend(duplicates)
+                kept_ids.extend(ids)
+                # Lotes por tokens, vários em paralelo dentro do orçamento da API
+                futures.extend(
+                    scheduler.submit(
+                        splits,
+                        ids,
+                        on_batch=lambda docs, batch_ids, tokens: progress(
+                            "batch", chunks=len(batch_ids), tokens=tokens
+                        ),
+                    )
+                )
+                lexical_index.add_documents(splits, ids)
 
-    logger.info(f"Criando vectorstore com {len(docs)} documentos...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,  # Chunks menores
-        chunk_overlap=100,
+                if last:
+                    finished.append((file, *loading.pop(file)))
+        dead_letters.extend(scheduler.dead_letters)
+
+        # Só entram no deduplicador os arquivos com todos os lotes gravados
+        for file, kept_ids, file_duplicates, futures in finished:
+            if not all(future.result() for future in futures):
+                if deduplicator is not None:
+                    retry.update(deduplicator.discard(file))
+                progress("failed", key=file)
+                continue
+            if deduplicator is not None:
+                retry.update(deduplicator.record(file, kept_ids, file_duplicates))
+            recorded[file] = (kept_ids, file_duplicates)
+            total_chunks += len(kept_ids)
+            total_duplicates += len(file_duplicates)
+            progress("file", key=file, chunks=len(kept_ids))
+
+        # Arquivos com duplicados de chunks que não chegaram ao índice
+        files = [file for file in retry - retried if file in recorded]
+        retried.update(files)
+        for file in files:
+            logger.info(f"Reprocessando {file}: o chunk original não foi indexado")
+            kept_ids, file_duplicates = recorded.pop(file)
+            total_chunks -= len(kept_ids)
+            total_duplicates -= len(file_duplicates)
+            _delete_chunks(vectorstore, lexical_index, kept_ids)
+        if files:
+            progress("queued", files=len(files))
+
+    persist_vectorstore(vectorstore)
+    if dead_letters:
+        logger.error(f"{len(dead_letters)} lotes não foram indexados: {dead_letters}")
+        for dead_letter in dead_letters:
+            lexical_index.delete(dead_letter["ids"])
+    lexical_index.close()
+    if deduplicator is not None:
+        deduplicator.close()
+    logger.info(
+        f"Vectorstore criado com sucesso! ({total_chunks} chunks, "
+        f"{total_duplicates} duplicados descartados)"
     )
-    splits = text_splitter.split_documents(docs)
-    logger.info(f"Documentos divididos em {len(splits)} chunks")
+    return vectorstore
 
-    # Processar em lotes para evitar limite de tokens
-    embedding_function = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
-    vectorstore = Chroma(
-        embedding_function=embedding_function,
-        persist_directory=VECTOR_STORE_PATH,
+
+def iter_file_chunks(file):
+    """Gera os chunks do arquivo página a página, sem montar a lista inteira"""
+    yield from split_documents(lazy_load_file(file))
+
+
+def _file_segments(file, segment_size):
+    """Agrupa os chunks do arquivo em segmentos; o último (talvez vazio) encerra o arquivo"""
+    segment = []
+    for chunk in iter_file_chunks(file):
+        segment.append(chunk)
+        if len(segment) >= segment_size:
+            yield segment, False
+            segment = []
+    yield segment, True
+
+
+# Fila dos processos do pool para o processo principal, definida no initializer
+_segment_queue = None
+
+
+def _init_split_worker(queue):
+    global _segment_queue
+    _segment_queue = queue
+
+
+def _queue_file_segments(file, segment_size):
+    """Carrega e divide um arquivo nos processos do pool, enviando os segmentos pela fila.
+
+    A fila é limitada: se o embedding estiver atrasado, o processo espera
+    em vez de acumular o arquivo inteiro na memória.
+    """
+    start_time = time.time()
+    try:
+        for segment, last in _file_segments(file, segment_size):
+            _segment_queue.put((file, segment, None, last, time.time() - start_time))
+    except Exception as e:
+        # Nem toda exceção é serializável; a mensagem basta para o log
+        error = RuntimeError(f"{type(e).__name__}: {e}")
+        _segment_queue.put((file, [], error, True, time.time() - start_time))
+
+
+def iter_split_segments(files, workers=None, segment_size=None):
+    """Carrega e divide os arquivos em paralelo, entregando os chunks em segmentos.
+
+    Gera tuplas (arquivo, chunks, erro, último) à medida que os segmentos
+    ficam prontos; segmentos de arquivos diferentes podem se intercalar e o
+    último de cada arquivo vem com último=True. A memória fica limitada a
+    RAG_PIPELINE_QUEUE_SIZE segmentos de até segment_size chunks, qualquer
+    que seja o tamanho do acervo. Com um único worker o processamento
+    acontece no próprio processo.
+    """
+    workers = workers or RAG_LOADER_WORKERS or os.cpu_count() or 1
+    workers = min(workers, len(files)) or 1
+    segment_size = segment_size or RAG_PIPELINE_SEGMENT_SIZE
+    chunks = {}
+
+    def report(file, segment, error, last, elapsed):
+        if error is not None:
+            logger.error(f"Erro ao carregar {file}: {error}")
+        else:
+            chunks[file] = chunks.get(file, 0) + len(segment)
+            if last:
+                logger.info(
+                    f"Carregado: {os.path.basename(file)} "
+                    f"({chunks.pop(file)} chunks em {elapsed:.2f}s)"
+                )
+        return file, segment, error, last
+
+    if workers == 1:
+        for file in files:
+            start_time = time.time()
+            try:
+                for segment, last in _file_segments(file, segment_size):
+                    yield report(file, segment, None, last, time.time() - start_time)
+            except Exception as e:
+                yield report(file, [], e, True, time.time() - start_time)
+        return
+
+    # spawn evita herdar threads e conexões abertas do processo da API
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue(maxsize=RAG_PIPELINE_QUEUE_SIZE)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_split_worker,
+        initargs=(queue,),
+    ) as executor:
+        futures = {
+            executor.submit(_queue_file_segments, file, segment_size): file
+            for file in files
+        }
+        remaining = set(files)
+        try:
+            while remaining:
+                try:
+                    item = queue.get(timeout=1)
+                except Empty:
+                    # Um processo morto (ex.: sem memória) não avisa pela fila
+                    for future, file in futures.items():
+                        if file in remaining and future.done() and future.exception():
+                            remaining.discard(file)
+                            yield report(file, [], future.exception(), True, 0.0)
+                    continue
+
+                file, segment, error, last, elapsed = item
+                if last:
+                    remaining.discard(file)
+                yield report(file, segment, error, last, elapsed)
+        finally:
+            for future in futures:
+                future.cancel()
+            # Esvazia a fila para liberar processos bloqueados se o consumo parou antes
+            while not all(future.done() for future in futures):
+                try:
+                    queue.get(timeout=0.1)
+                except Empty:
+                    pass
+
+
+def list_rag_files():
+    """Lista os arquivos suportados de RAG_FILES_DIR e da pasta processed.
+
+    Retorna um dicionário com o caminho relativo a RAG_FILES_DIR como chave.
+    """
+    files = {}
+    for directory in (os.path.join(RAG_FILES_DIR, "processed"), RAG_FILES_DIR):
+        if not os.path.exists(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(SUPPORTED_EXTENSIONS):
+                path = os.path.join(directory, name)
+                files[os.path.relpath(path, RAG_FILES_DIR)] = path
+    return files
+
+
+def _collection_file(directory, legacy_file, collection_name):
+    """Arquivo da coleção em directory; adota o arquivo único do formato antigo"""
+    path = os.path.join(VECTOR_STORE_PATH, directory, f"{collection_name}.json")
+    legacy_path = os.path.join(VECTOR_STORE_PATH, legacy_file)
+    if os.path.exists(path) or not os.path.exists(legacy_path):
+        return path
+
+    try:
+        with open(legacy_path, encoding="utf-8") as f:
+            owner = json.load(f).get("collection")
+    except (OSError, ValueError):
+        return path
+    # Sem coleção registrada, o arquivo antigo é da coleção ativa
+    if owner == collection_name or (
+        owner is None and collection_name == _read_active_collection()
+    ):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(legacy_path, path)
+        except FileNotFoundError:
+            # Outro processo migrou primeiro
+            pass
+    return path
+
+
+def _manifest_path(collection_name=None):
+    return _collection_file(
+        MANIFEST_DIR, MANIFEST_FILE, collection_name or _read_active_collection()
     )
 
-    batch_size = 50  # Processar 50 chunks por vez
-    total_batches = (len(splits) + batch_size - 1) // batch_size
 
-    for i in range(0, len(splits), batch_size):
-        batch = splits[i : i + batch_size]
-        batch_num = (i // batch_size) + 1
+def _checkpoint_path(collection_name=None):
+    return _collection_file(
+        CHECKPOINT_DIR, CHECKPOINT_FILE, collection_name or _read_active_collection()
+    )
 
-        logger.debug(
-            f"Processando lote {batch_num}/{total_batches} ({len(batch)} chunks)..."
-        )
 
+def _no_progress(event, **info):
+    pass
+
+
+def get_index_version():
+    """Retorna a versão atual do índice registrada no manifesto.
+
+    O manifesto só é relido quando o arquivo muda, já que a versão entra na
+    chave do cache de cada busca.
+    """
+    global _index_version_cache
+
+    path = _manifest_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+    # O caminho muda com a coleção ativa: entra na chave junto com o mtime
+    cached_key, version = _index_version_cache
+    if cached_key != (path, mtime):
+        version = IndexManifest.load(path).version
+        _index_version_cache = ((path, mtime), version)
+    return version
+
+
+@contextmanager
+def ingestion_lock():
+    """Serializa a ingestão entre processos com um lock de arquivo"""
+    os.makedirs(VECTOR_STORE_PATH, exist_ok=True)
+    with open(os.path.join(VECTOR_STORE_PATH, INGESTION_LOCK_FILE), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
         try:
-            # Adiciona o lote ao vectorstore
-            texts = [doc.page_content for doc in batch]
-            metadatas = [doc.metadata for doc in batch]
-            vectorstore.add_texts(texts=texts, metadatas=metadatas)
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-        except Exception as e:
-            logger.error(f"Erro ao processar lote {batch_num}: {e}")
+
+def _delete_chunks(vectorstore, lexical_index, chunk_ids):
+    if chunk_ids:
+        vectorstore.delete(ids=list(chunk_ids))
+        lexical_index.delete(chunk_ids)
+
+
+def _changed_files(manifest, files, chunking=None):
+    """Separa os arquivos novos ou alterados em relação ao manifesto.
+
+    Arquivos divididos com outra configuração de chunking também entram.
+    Retorna {chave: (caminho, stat, sha256)} dos que precisam ser indexados
+    e quantos continuam iguais; o mtime destes é atualizado no manifesto.
+    """
+    # Tamanho e mtime iguais dispensam o hash; só os demais são lidos
+    pending = {}
+    unchanged = 0
+    for key, path in files.items():
+        stat = os.stat(path)
+        if manifest.is_unchanged(key, stat, chunking):
+            unchanged += 1
+            continue
+
+        sha256 = file_sha256(path)
+        entry = manifest.files.get(key)
+        if (
+            entry
+            and entry["sha256"] == sha256
+            and manifest.same_chunking(entry, chunking)
+        ):
+            manifest.record(
+                key, stat, sha256, entry["chunk_ids"], entry.get("chunking")
+            )
+            unchanged += 1
+            continue
+
+        pending[key] = (path, stat, sha256)
+    return pending, unchanged
+
+
+def estimate_ingestion():
+    """Estima o trabalho da próxima ingestão sem gravar nada nem chamar a API.
+
+    Carrega e divide os arquivos que seriam indexados e conta chunks,
+    tokens a enviar ao embedding e duplicados. Os duplicados são contados
+    só entre os próprios arquivos, sem consultar os já indexados.
+    """
+    collection_name = _read_active_collection()
+    files = list_rag_files()
+    estimate = {
+        "files": len(files),
+        "index": 0,
+        "unchanged": 0,
+        "removed": 0,
+        "moved": 0,
+        "failed": 0,
+        "chunks": 0,
+        "duplicates": 0,
+        "resumed": 0,
+        "tokens": 0,
+    }
+
+    chunking = chunking_signature()
+    if RAG_INGESTION_MODE == "incremental":
+        manifest = IndexManifest.load(
+            _manifest_path(collection_name), collection=collection_name
+        )
+        pending, estimate["unchanged"] = _changed_files(manifest, files, chunking)
+        for key, entry in manifest.files.items():
+            if key in files:
+                continue
+            moved_to = next(
+                (
+                    k
+                    for k, (_, _, sha) in pending.items()
+                    if sha == entry["sha256"]
+                    and manifest.same_chunking(entry, chunking)
+                ),
+                None,
+            )
+            if moved_to:
+                del pending[moved_to]
+                estimate["moved"] += 1
+            else:
+                estimate["removed"] += 1
+    else:
+        pending = {key: (path, None, file_sha256(path)) for key, path in files.items()}
+
+    checkpoint = IngestionCheckpoint.load(
+        _checkpoint_path(collection_name), collection=collection_name
+    )
+    deduplicator = (
+        ChunkDeduplicator(threshold=RAG_DEDUP_THRESHOLD) if RAG_DEDUP_ENABLED else None
+    )
+    keys_by_path = {path: key for key, (path, _, _) in pending.items()}
+    estimate["index"] = len(keys_by_path)
+    # Chunks já vistos e duplicados dos arquivos cujos segmentos ainda estão chegando
+    loading = {}
+    for path, splits, error, last in iter_split_segments(list(keys_by_path)):
+        key = keys_by_path[path]
+        if error is not None:
+            loading.pop(key, None)
+            if deduplicator is not None:
+                deduplicator.discard(key)
+            estimate["failed"] += 1
             continue
 
-    logger.info("Vectorstore criado com sucesso!")
+        sha256 = pending[key][2]
+        offset, kept_ids, file_duplicates = loading.get(key, (0, [], []))
+        loading[key] = (offset + len(splits), kept_ids, file_duplicates)
+        chunk_ids = [f"{sha256[:16]}-{offset + i}" for i in range(len(splits))]
+        if deduplicator is not None:
+            splits, chunk_ids, duplicates = deduplicator.filter(key, splits, chunk_ids)
+            kept_ids.extend(chunk_ids)
+            file_duplicates.extend(duplicates)
+            estimate["duplicates"] += len(duplicates)
+            if last:
+                deduplicator.record(key, kept_ids, file_duplicates)
+        if last:
+            del loading[key]
+
+        committed = checkpoint.committed(key, sha256, chunking)
+        for doc, chunk_id in zip(splits, chunk_ids):
+            estimate["chunks"] += 1
+            if chunk_id in committed:
+                estimate["resumed"] += 1
+            else:
+                estimate["tokens"] += count_tokens(doc.page_content)
+
+    if deduplicator is not None:
+        deduplicator.close()
+    return estimate
+
+
+def sync_vectorstore(vectorstore, collection_name=None, progress=None):
+    """Sincroniza o vectorstore com os arquivos de RAG_FILES_DIR.
+
+    Indexa apenas arquivos novos ou alterados, remove os chunks de arquivos
+    apagados e incrementa a versão do índice quando algo muda. Arquivos
+    movidos (mesmo conteúdo em outro caminho) não são reprocessados.
+
+    Os lotes gravados entram no checkpoint quando o índice vai para o
+    disco (a cada arquivo concluído ou RAG_CHECKPOINT_INTERVAL segundos),
+    então uma sincronização interrompida retoma os arquivos pela metade sem
+    reenviar chunks.
+    progress(evento, **info) recebe "queued" (files), "resumed" (key,
+    chunks), "batch" (chunks, tokens), "file" (key, chunks) e "failed" (key).
+    """
+    collection_name = collection_name or _read_active_collection()
+    progress = progress or _no_progress
+    stats = {
+        "added": 0,
+        "updated": 0,
+        "removed": 0,
+        "moved": 0,
+        "unchanged": 0,
+        "failed": 0,
+        "chunks": 0,
+        "duplicates": 0,
+        "dead_letters": 0,
+    }
+
+    with ingestion_lock():
+        manifest = IndexManifest.load(
+            _manifest_path(collection_name), collection=collection_name
+        )
+        checkpoint = IngestionCheckpoint.load(
+            _checkpoint_path(collection_name), collection=collection_name
+        )
+        lexical_index = open_lexical_index(collection_name)
+        deduplicator = open_deduplicator(collection_name)
+        files = list_rag_files()
+        # Arquivos cujos chunks duplicados perderam o canônico e precisam voltar
+        reindex = set()
+
+        chunking = chunking_signature()
+        pending, stats["unchanged"] = _changed_files(manifest, files, chunking)
+
+        for key in [key for key in manifest.files if key not in files]:
+            entry = manifest.remove(key)
+            moved_to = next(
+                (
+                    k
+                    for k, (_, _, sha) in pending.items()
+                    if sha == entry["sha256"]
+                    and manifest.same_chunking(entry, chunking)
+                ),
+                None,
+            )
+            if moved_to:
+                _, stat, sha256 = pending.pop(moved_to)
+                manifest.record(
+                    moved_to, stat, sha256, entry["chunk_ids"], entry.get("chunking")
+                )
+                if deduplicator is not None:
+                    deduplicator.rename_file(key, moved_to)
+                logger.info(f"Arquivo movido: {key} -> {moved_to}")
+                stats["moved"] += 1
+            else:
+                _delete_chunks(vectorstore, lexical_index, entry["chunk_ids"])
+                if deduplicator is not None:
+                    reindex.update(deduplicator.remove_file(key))
+                logger.info(f"Arquivo removido do índice: {key}")
+                stats["removed"] += 1
+
+        # Chunks gravados de arquivos que mudaram ou sumiram desde a interrupção,
+        # ou divididos com outra configuração de chunking
+        stale = [
+            key
+            for key, entry in checkpoint.files.items()
+            if key not in pending
+            or pending[key][2] != entry["sha256"]
+            or entry.get("chunking") != chunking
+        ]
+        if stale:
+            indexed = {
+                chunk_id
+                for entry in manifest.files.values()
+                for chunk_id in entry["chunk_ids"]
+            }
+            for key in stale:
+                entry = checkpoint.discard(key)
+                _delete_chunks(
+                    vectorstore,
+                    lexical_index,
+                    [i for i in entry["chunk_ids"] if i not in indexed],
+                )
+            checkpoint.save()
+
+        in_flight = {}
+        # Lotes gravados no vectorstore que ainda não foram para o disco
+        unpersisted = []
+        persist_lock = threading.Lock()
+        last_persist = [time.monotonic()]
+
+        def persist_batches():
+            """Persiste o índice e só então registra os lotes no checkpoint"""
+            with persist_lock:
+                batches = unpersisted[:]
+                unpersisted.clear()
+                persist_vectorstore(vectorstore)
+                last_persist[0] = time.monotonic()
+                for key, sha256, ids in batches:
+                    checkpoint.add(key, sha256, ids, chunking)
+                if batches:
+                    checkpoint.save()
+
+        def commit_finished(wait=False):
+            """Grava no manifesto os arquivos cujos lotes já terminaram"""
+            for key in list(in_flight):
+                futures, chunk_ids, duplicates = in_flight[key]
+                if not wait and not all(future.done() for future in futures):
+                    continue
+                del in_flight[key]
+
+                _, stat, sha256 = pending[key]
+                previous = manifest.files.get(key)
+                if not all(future.result() for future in futures):
+                    # Fica fora do manifesto para ser tentado de novo na próxima sincronização
+                    logger.error(f"Falha ao indexar {key}, será reprocessado")
+                    if deduplicator is not None:
+                        reindex.update(deduplicator.discard(key))
+                    stats["failed"] += 1
+                    progress("failed", key=key)
+                    continue
+
+                if previous:
+                    # Ids iguais já foram sobrescritos pelos chunks novos
+                    current_ids = set(chunk_ids)
+                    _delete_chunks(
+                        vectorstore,
+                        lexical_index,
+                        [i for i in previous["chunk_ids"] if i not in current_ids],
+                    )
+                if deduplicator is not None:
+                    reindex.update(deduplicator.record(key, chunk_ids, duplicates))
+                manifest.record(key, stat, sha256, chunk_ids, chunking)
+                # O índice vai para o disco antes do manifesto que o descreve
+                persist_batches()
+                manifest.save()
+                checkpoint.discard(key)
+                checkpoint.save()
+
+                stats["updated" if previous else "added"] += 1
+                stats["chunks"] += len(chunk_ids)
+                stats["duplicates"] += len(duplicates)
+                logger.info(
+                    f"Indexado: {key} ({len(chunk_ids)} chunks, "
+                    f"{len(duplicates)} duplicados)"
+                )
+                progress("file", key=key, chunks=len(chunk_ids))
+
+        def checkpoint_batch(key, sha256):
+            def on_batch(docs, ids, tokens):
+                lexical_index.add_documents(docs, ids)
+                # O lote só vale como retomável depois de persistido no índice
+                with persist_lock:
+                    unpersisted.append((key, sha256, ids))
+                    due = time.monotonic() - last_persist[0] >= RAG_CHECKPOINT_INTERVAL
+                if due:
+                    persist_batches()
+                progress("batch", chunks=len(ids), tokens=tokens)
+
+            return on_batch
+
+        processed = set()
+        # Arquivos já processados nesta execução que voltam uma vez à fila
+        retried = set()
+
+        def queue_reindex():
+            for key in reindex - retried:
+                if key in processed:
+                    processed.discard(key)
+                    retried.add(key)
+                if key in files:
+                    path = files[key]
+                    logger.info(f"Reprocessando {key}: o chunk original saiu do índice")
+                    pending[key] = (path, os.stat(path), file_sha256(path))
+                    progress("queued", files=1)
+            reindex.clear()
+
+        progress("queued", files=len(pending))
+        queue_reindex()
+        with EmbeddingBatchScheduler(vectorstore) as scheduler:
+            while pending.keys() - processed:
+                keys_by_path = {
+                    path: key
+                    for key, (path, _, _) in pending.items()
+                    if key not in processed
+                }
+                processed.update(keys_by_path.values())
+
+                # Estado dos arquivos cujos segmentos ainda estão chegando
+                loading = {}
+                for path, splits, error, last in iter_split_segments(
+                    list(keys_by_path)
+                ):
+                    key = keys_by_path[path]
+                    if error is not None:
+                        # Lotes já gravados ficam no checkpoint para a próxima vez
+                        loading.pop(key, None)
+                        if deduplicator is not None:
+                            reindex.update(deduplicator.discard(key))
+                        stats["failed"] += 1
+                        progress("failed", key=key)
+                        continue
+
+                    sha256 = pending[key][2]
+                    if key not in loading:
+                        loading[key] = {
+                            "futures": [],
+                            "chunk_ids": [],
+                            "duplicates": [],
+                            "offset": 0,
+                            "resumed": 0,
+                            "committed": checkpoint.committed(key, sha256, chunking),
+                            "on_batch": checkpoint_batch(key, sha256),
+                        }
+                    state = loading[key]
+
+                    # Ids determinísticos: reindexar o mesmo conteúdo não duplica chunks
+                    offset = state["offset"]
+                    chunk_ids = [
+                        f"{sha256[:16]}-{offset + i}" for i in range(len(splits))
+                    ]
+                    state["offset"] += len(splits)
+                    if deduplicator is not None:
+                        # Cópias de outros chunks não gastam embedding nem espaço no índice
+                        splits, chunk_ids, duplicates = deduplicator.filter(
+                            key, splits, chunk_ids
+                        )
+                        state["duplicates"].extend(duplicates)
+                    state["chunk_ids"].extend(chunk_ids)
+
+                    committed = state["committed"]
+                    remaining = [
+                        (doc, chunk_id)
+                        for doc, chunk_id in zip(splits, chunk_ids)
+                        if chunk_id not in committed
+                    ]
+                    state["resumed"] += len(splits) - len(remaining)
+                    if remaining:
+                        docs, ids = zip(*remaining)
+                        state["futures"].extend(
+                            scheduler.submit(
+                                list(docs), list(ids), on_batch=state["on_batch"]
+                            )
+                        )
+
+                    if last:
+                        del loading[key]
+                        if state["resumed"]:
+                            logger.info(
+                                f"Retomando {key}: {state['resumed']} chunks já gravados"
+                            )
+                            progress("resumed", key=key, chunks=state["resumed"])
+                        in_flight[key] = (
+                            state["futures"],
+                            state["chunk_ids"],
+                            state["duplicates"],
+                        )
+                    commit_finished()
+
+                commit_finished(wait=True)
+                queue_reindex()
+
+        stats["dead_letters"] = len(scheduler.dead_letters)
+        backfilled = ensure_lexical_index(vectorstore, lexical_index)
+        lexical_index.close()
+        if deduplicator is not None:
+            deduplicator.close()
+
+        if (
+            stats["added"]
+            or stats["updated"]
+            or stats["removed"]
+            or stats["moved"]
+            or backfilled
+        ):
+            manifest.version += 1
+        manifest.collection = collection_name
+        persist_batches()
+        manifest.save()
+        if checkpoint.files:
+            # Arquivos com falha guardam os lotes já gravados para a próxima vez
+            checkpoint.save()
+        else:
+            checkpoint.remove()
+
+    logger.info(f"Sincronização do índice v{manifest.version} concluída: {stats}")
+    return stats
+
+
+def _index_key():
+    return _read_active_collection(), get_index_version()
+
+
+def reopen_vectorstore():
+    """Abre de novo o índice persistido para enxergar a ingestão de outro processo"""
+    if RAG_VECTOR_BACKEND != "faiss":
+        # O Chroma mantém o índice em memória por diretório; sem descartar o
+        # cache, um novo cliente reaproveitaria o índice antigo. Handles já
+        # abertos continuam válidos para as buscas em andamento.
+        SharedSystemClient.clear_system_cache()
+    return load_vectorstore()
+
+
+def _processed_target(name):
+    """Caminho livre em processed/ para o arquivo, sem sobrescrever outro"""
+    processed_dir = os.path.join(RAG_FILES_DIR, "processed")
+    stem, extension = os.path.splitext(name)
+    target = os.path.join(processed_dir, name)
+    suffix = 1
+    while os.path.exists(target):
+        target = os.path.join(processed_dir, f"{stem}_{suffix}{extension}")
+        suffix += 1
+    return target
+
+
+def archive_indexed_files():
+    """Move para RAG_FILES_DIR/processed os arquivos novos que já foram indexados.
+
+    O manifesto e o registro de duplicados passam a apontar para o novo
+    caminho, então os arquivos movidos não são reprocessados. Arquivos com
+    falha na indexação ficam onde estão. Retorna as chaves antigas movidas.
+    """
+    collection_name = _read_active_collection()
+    moved = []
+
+    with ingestion_lock():
+        manifest = IndexManifest.load(
+            _manifest_path(collection_name), collection=collection_name
+        )
+        deduplicator = open_deduplicator(collection_name)
+        os.makedirs(os.path.join(RAG_FILES_DIR, "processed"), exist_ok=True)
+
+        for key, path in list_rag_files().items():
+            if os.path.dirname(key) or not manifest.is_unchanged(key, os.stat(path)):
+                continue
+
+            target = _processed_target(key)
+            # os.replace preserva tamanho e mtime: o manifesto continua válido
+            os.replace(path, target)
+            new_key = os.path.relpath(target, RAG_FILES_DIR)
+            manifest.files[new_key] = manifest.remove(key)
+            if deduplicator is not None:
+                deduplicator.rename_file(key, new_key)
+            moved.append(key)
+            logger.info(f"Arquivo indexado movido: {key} -> {new_key}")
+
+        if moved:
+            manifest.save()
+        if deduplicator is not None:
+            deduplicator.close()
+
+    return moved
+
+
+def _store_has_index():
+    try:
+        entries = set(os.listdir(VECTOR_STORE_PATH))
+    except FileNotFoundError:
+        return False
+    return bool(entries - {INGESTION_LOCK_FILE})
+
+
+def create_snapshot(archive_path):
+    """Grava um snapshot do índice atual num único arquivo.
+
+    Segura o lock da ingestão durante a cópia, então o snapshot nunca pega
+    uma ingestão pela metade. Retorna o snapshot.json gravado.
+    """
+    with ingestion_lock():
+        collection_name = _read_active_collection()
+        if os.path.exists(_checkpoint_path(collection_name)):
+            raise SnapshotError(
+                "Há uma ingestão incompleta: rode o ingest_rag antes do snapshot"
+            )
+        vectorstore = open_vectorstore(collection_name)
+        persist_vectorstore(vectorstore)
+        chunks = count_chunks(vectorstore)
+        if not chunks:
+            raise SnapshotError("Índice vazio: rode o ingest_rag antes do snapshot")
+
+        return export_snapshot(
+            VECTOR_STORE_PATH,
+            archive_path,
+            {
+                "collection": collection_name,
+                "backend": RAG_VECTOR_BACKEND,
+                "embedding": read_embedding_info(collection_name),
+                "index_version": get_index_version(),
+                "chunks": chunks,
+            },
+            exclude={INGESTION_LOCK_FILE, CHECKPOINT_FILE, CHECKPOINT_DIR},
+        )
+
+
+def restore_vectorstore_snapshot(archive_path, force=False):
+    """Restaura um snapshot no VECTOR_STORE_PATH.
+
+    Sem force, só restaura num diretório sem índice. O manifesto e o ponteiro
+    da coleção ativa são os últimos arquivos trocados, então os workers em
+    execução só recarregam o índice quando ele já está completo.
+    """
+    snapshot_info = read_snapshot_info(archive_path)
+    if snapshot_info.get("backend") != RAG_VECTOR_BACKEND:
+        raise SnapshotError(
+            f"Snapshot do backend {snapshot_info.get('backend')}, mas "
+            f"RAG_VECTOR_BACKEND={RAG_VECTOR_BACKEND}"
+        )
+
+    with ingestion_lock():
+        if not force and _store_has_index():
+            raise SnapshotError(
+                f"{VECTOR_STORE_PATH} já tem um índice; use --force para substituí-lo"
+            )
+        # Checkpoints do índice anterior não valem para o restaurado
+        shutil.rmtree(
+            os.path.join(VECTOR_STORE_PATH, CHECKPOINT_DIR), ignore_errors=True
+        )
+        try:
+            os.remove(os.path.join(VECTOR_STORE_PATH, CHECKPOINT_FILE))
+        except FileNotFoundError:
+            pass
+        manifest_file = os.path.join(
+            MANIFEST_DIR, f"{snapshot_info.get('collection')}.json"
+        )
+        snapshot_info = restore_snapshot(
+            archive_path,
+            VECTOR_STORE_PATH,
+            last=(MANIFEST_FILE, manifest_file, ACTIVE_COLLECTION_FILE),
+        )
+
+    logger.info(
+        f"Snapshot {archive_path} restaurado: coleção {snapshot_info['collection']} "
+        f"v{snapshot_info['index_version']}, {snapshot_info['chunks']} chunks"
+    )
+    return snapshot_info
+
+
+def verify_vectorstore_snapshot(checksum=False):
+    """Confere os arquivos do índice restaurado contra o snapshot.json.
+
+    Retorna a lista de problemas; vazia se confere ou se o índice já foi
+    alterado por uma ingestão depois da restauração.
+    """
+    try:
+        with open(
+            os.path.join(VECTOR_STORE_PATH, SNAPSHOT_INFO_FILE), encoding="utf-8"
+        ) as f:
+            snapshot_info = json.load(f)
+    except FileNotFoundError:
+        return []
+
+    if snapshot_info.get("index_version") != get_index_version():
+        return []
+    return verify_files(VECTOR_STORE_PATH, snapshot_info, checksum=checksum)
+
+
+def prepare_snapshot():
+    """Restaura RAG_SNAPSHOT_PATH num diretório vazio e confere o índice restaurado.
+
+    Conferir tamanhos (ou checksums, com RAG_SNAPSHOT_VERIFY=checksum) é
+    bem mais barato que uma busca de teste e não chama a API de embeddings.
+    Um índice corrompido é restaurado de novo do snapshot, se configurado.
+    """
+    if RAG_SNAPSHOT_PATH and not _store_has_index():
+        try:
+            restore_vectorstore_snapshot(RAG_SNAPSHOT_PATH)
+        except SnapshotError as e:
+            # Outro worker pode ter restaurado enquanto este esperava o lock
+            if _store_has_index():
+                logger.info(f"Snapshot já restaurado por outro processo: {e}")
+            else:
+                logger.error(f"Erro ao restaurar snapshot {RAG_SNAPSHOT_PATH}: {e}")
+                return
+
+    if RAG_SNAPSHOT_VERIFY == "off":
+        return
+    problems = verify_vectorstore_snapshot(checksum=RAG_SNAPSHOT_VERIFY == "checksum")
+    if not problems:
+        return
+
+    logger.error(f"Índice não confere com o snapshot: {'; '.join(problems[:5])}")
+    if RAG_SNAPSHOT_PATH:
+        try:
+            restore_vectorstore_snapshot(RAG_SNAPSHOT_PATH, force=True)
+        except SnapshotError as e:
+            logger.error(f"Erro ao restaurar snapshot {RAG_SNAPSHOT_PATH}: {e}")
+
+
+def get_vectorstore():
+    """Retorna o vectorstore compartilhado pelo processo.
+
+    Carrega o índice na primeira chamada e o reabre quando a coleção ativa
+    ou a versão do manifesto mudam, ou seja, quando outro processo (o
+    ingest_rag ou o watch_rag) publica uma nova versão do índice.
+    """
+    global _vectorstore, _vectorstore_key
+
+    key = _index_key()
+    vectorstore = _vectorstore
+    if vectorstore is not None and _vectorstore_key == key:
+        return vectorstore
+
+    with _vectorstore_lock:
+        if _vectorstore is None:
+            _vectorstore = load_vectorstore()
+        elif _vectorstore_key != key:
+            logger.info(
+                f"Nova versão do índice publicada ({key[0]} v{key[1]}), "
+                "recarregando vectorstore"
+            )
+            _vectorstore = reopen_vectorstore()
+        _vectorstore_key = key
+        return _vectorstore
+
+
+def _reload_lexical_index(key):
+    """Monta o índice léxico da nova versão e o troca pelo atual"""
+    global _lexical_index, _lexical_index_key, _lexical_index_loading
+
+    try:
+        lexical_index = open_lexical_index(key[0])
+    except Exception as e:
+        logger.error(f"Erro ao recarregar o índice léxico ({key[0]} v{key[1]}): {e}")
+        with _lexical_index_lock:
+            _lexical_index_loading = None
+        return
+
+    with _lexical_index_lock:
+        previous, _lexical_index = _lexical_index, lexical_index
+        _lexical_index_key = key
+        _lexical_index_loading = None
+    logger.info(f"Índice léxico recarregado ({key[0]} v{key[1]})")
+    if previous is not None:
+        previous.close()
+
+
+def get_lexical_index():
+    """Retorna o índice léxico do processo, recarregado quando o índice muda.
+
+    A chave é a coleção ativa mais a versão do manifesto, então workers
+    enxergam a ingestão feita por outro processo. Montar as postings lê
+    todos os chunks do SQLite, por isso a recarga roda numa thread: as
+    buscas seguem com a versão anterior até a nova ficar pronta. Só a
+    primeira carga (feita no aquecimento) é síncrona.
+    """
+    global _lexical_index, _lexical_index_key, _lexical_index_loading
+
+    # Garante que o preenchimento do índice léxico já rodou neste processo
+    get_vectorstore()
+    key = _index_key()
+
+    lexical_index = _lexical_index
+    if lexical_index is not None and _lexical_index_key == key:
+        return lexical_index
+
+    with _lexical_index_lock:
+        if _lexical_index is None:
+            _lexical_index = open_lexical_index(key[0])
+            _lexical_index_key = key
+        elif _lexical_index_key != key and _lexical_index_loading != key:
+            _lexical_index_loading = key
+            threading.Thread(
+                target=_reload_lexical_index,
+                args=(key,),
+                name="lexical-index-reload",
+                daemon=True,
+            ).start()
+        return _lexical_index
+
+
+def set_vectorstore(vectorstore):
+    """Troca o vectorstore compartilhado e retorna o anterior"""
+    global _vectorstore, _vectorstore_key
+
+    with _vectorstore_lock:
+        previous, _vectorstore = _vectorstore, vectorstore
+        _vectorstore_key = _index_key()
+    return previous
+
+
+def warm_up_vectorstore():
+    """Carrega o vectorstore na inicialização do worker, antes da primeira pergunta"""
+    if not RAG_WARM_UP:
+        return None
+
+    start_time = time.time()
+    try:
+        vectorstore = get_vectorstore()
+        # O índice léxico também: a primeira busca não paga a montagem
+        get_lexical_index()
+        logger.info(f"Vectorstore aquecido em {time.time() - start_time:.2f}s")
+        return vectorstore
+    except Exception as e:
+        # Falha no aquecimento não derruba o worker: a primeira busca tenta de novo
+        logger.error(f"Erro ao aquecer vectorstore: {e}")
+        return None
+
+
+def rebuild_vectorstore(progress=None):
+    """Reconstrói o índice numa coleção nova e troca o vectorstore compartilhado.
+
+    Todos os arquivos são carregados, divididos e indexados de novo com a
+    configuração atual (metadados, chunking, quantização e embeddings).
+    """
+    previous_collection = _read_active_collection()
+    collection_name = f"{RAG_COLLECTION_NAME}_{int(time.time())}"
+
+    # Interrompida, a coleção nova nunca é publicada e sai na próxima
+    # reconstrução junto com as substituídas
+    _write_retired_collections([*_read_retired_collections(), collection_name])
+    # O manifesto é da coleção nova: a ativa segue descrita pelo dela até a
+    # troca do ponteiro. A versão continua crescendo, já que entra na chave
+    # do cache das buscas.
+    with ingestion_lock():
+        IndexManifest(
+            _manifest_path(collection_name),
+            collection=collection_name,
+            version=get_index_version() + 1,
+        ).save()
+
+    logger.info(f"Reconstruindo vectorstore na coleção {collection_name}...")
+    vectorstore = build_vectorstore(collection_name, progress=progress)
+    # Publica o manifesto e a coleção juntos: o ponteiro é a única troca
+    _write_active_collection(collection_name)
+    set_vectorstore(vectorstore)
+
+    # A coleção substituída só é apagada na próxima reconstrução: buscas em
+    # andamento, neste processo ou nos que ainda não reabriram o índice,
+    # terminam com o handle antigo. As da reconstrução anterior já saíram
+    # de uso e são apagadas agora.
+    for retired in _read_retired_collections():
+        if retired not in (collection_name, previous_collection):
+            _drop_collection(retired)
+    _write_retired_collections(
+        [previous_collection] if previous_collection != collection_name else []
+    )
     return vectorstore
+
+
+def _drop_collection(collection_name):
+    """Apaga a coleção e os índices que a acompanham"""
+    logger.info(f"Removendo coleção antiga {collection_name}")
+    try:
+        open_vectorstore(collection_name).delete_collection()
+    except Exception as e:
+        logger.warning(f"Erro ao remover coleção antiga {collection_name}: {e}")
+
+    for path in (
+        _lexical_index_path(collection_name),
+        _deduplicator_path(collection_name),
+        _embedding_info_path(collection_name),
+        _manifest_path(collection_name),
+        _checkpoint_path(collection_name),
+    ):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -14,3 +14,15 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_asgi_application()
+
+# O processo web só busca no vectorstore quando também roda o worker da fila
+from chatbot.config import CHATBOT_INLINE_WORKER  # noqa: E402
+from chatbot.vectorstore import warm_up_vectorstore  # noqa: E402
+
+if CHATBOT_INLINE_WORKER:
+    warm_up_vectorstore()
+
+# Com CHATBOT_INLINE_WORKER, o próprio processo web consome a fila de jobs
+from chatbot.message_buffer import with_chatbot_worker  # noqa: E402
+
+application = with_chatbot_worker(application)
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+# O processo web só busca no vectorstore quando também roda o worker da fila
+from chatbot.config import CHATBOT_INLINE_WORKER  # noqa: E402
+from chatbot.vectorstore import warm_up_vectorstore  # noqa: E402
+
+if CHATBOT_INLINE_WORKER:
+    warm_up_vectorstore()